@@ -1,69 +1,190 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, jsonify
 import os
+import threading
 from datetime import datetime
-import json
-import uuid
-
-# Import blueprints
-from blueprints.discovery import discovery_bp
-from blueprints.dashboard import dashboard_bp
-from blueprints.incidents import incidents_bp
-from blueprints.admin import admin_bp
-from blueprints.chat import chat_bp
-from blueprints.about import about_bp
-from blueprints.contact import contact_bp
 
 # Import utilities
-from utils.auth import require_auth, get_current_user
-from utils.storage import StorageManager
-from utils.data_models import User, Incident, Report
-
-app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
-
-# Initialize storage manager
-storage = StorageManager()
-
-# Register blueprints
-app.register_blueprint(discovery_bp, url_prefix='/')
-app.register_blueprint(dashboard_bp, url_prefix='/dashboard')
-app.register_blueprint(incidents_bp, url_prefix='/incidents')
-app.register_blueprint(admin_bp, url_prefix='/admin')
-app.register_blueprint(chat_bp, url_prefix='/chat')
-app.register_blueprint(about_bp, url_prefix='/about')
-app.register_blueprint(contact_bp, url_prefix='/contact')
-
-# Global template variables
-@app.context_processor
-def inject_globals():
-    return {
-        'current_user': get_current_user(),
-        'app_name': 'POTHOLES AI',
-        'version': '1.0.0'
-    }
-
-# Error handlers
-@app.errorhandler(404)
-def not_found(error):
-    return render_template('errors/404.html'), 404
-
-@app.errorhandler(500)
-def internal_error(error):
-    return render_template('errors/500.html'), 500
-
-@app.errorhandler(403)
-def forbidden(error):
-    return render_template('errors/403.html'), 403
-
-# Health check endpoint
-@app.route('/health')
-def health_check():
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat(),
-        'version': '1.0.0'
-    })
+from utils.auth import get_current_user
+from utils.storage import get_storage
+from utils.serializers import make_json_provider
+from utils.metrics import init_metrics
+from utils.profiling import init_profiling
+from utils.moment import moment
+
+# Warm caches and indexes in the background once the worker is up
+PREWARM = os.environ.get('PREWARM_CACHES', '0') == '1'
+PREWARM_DELAY = float(os.environ.get('PREWARM_DELAY', '1'))
+# Flag incidents that overstay their SLA
+SLA_SCANNER = os.environ.get('SLA_SCANNER', '1') == '1'
+# Run background jobs (utils/jobs.py) in every worker process
+JOBS_ENABLED = os.environ.get('JOBS_ENABLED', '1') == '1'
+# Re-queue photos whose classification was lost in a restart this often (seconds)
+DETECTION_RESCAN_INTERVAL = 3600
+# Drain the outbound mail spool this often (seconds) when jobs run
+MAIL_DRAIN_INTERVAL = 60
+# Take an online backup (utils/backups.py) this often, in hours; 0 disables
+BACKUP_INTERVAL_HOURS = float(os.environ.get('BACKUP_INTERVAL_HOURS', '0'))
+
+def create_app(prewarm=None, sla_scanner=None, jobs=None):
+    """Application factory
+
+    Blueprints share one StorageManager, bound when they are registered;
+    heavy dependencies (the AI client, mail, photo detection) load on
+    first use. With ``prewarm`` (default: PREWARM_CACHES=1) caches are
+    filled by a background thread shortly after startup instead of by the
+    first requests. With ``jobs`` (default: JOBS_ENABLED=1) the job
+    dispatcher starts and periodic jobs are scheduled; ``sla_scanner``
+    (default: SLA_SCANNER=1) marks incidents past their SLA, as a periodic
+    job or, without the dispatcher, from a thread of its own. Backups are
+    a periodic job too, when BACKUP_INTERVAL_HOURS is set.
+    """
+    # Imported here so that importing this module stays cheap
+    from blueprints.discovery import discovery_bp
+    from blueprints.dashboard import dashboard_bp
+    from blueprints.incidents import incidents_bp
+    from blueprints.admin import admin_bp
+    from blueprints.chat import chat_bp
+    from blueprints.about import about_bp
+
+    app = Flask(__name__)
+    app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+
+    # Serve API responses through orjson when it's installed
+    json_provider = make_json_provider()
+    if json_provider:
+        app.json = json_provider(app)
+
+    # Per-endpoint latency and storage counters, scraped from /metrics
+    init_metrics(app)
+    # Slow-request breakdowns and on-demand sampling profiles, shown on /admin/system
+    init_profiling(app)
+
+    # Register blueprints
+    app.register_blueprint(discovery_bp, url_prefix='/')
+    app.register_blueprint(dashboard_bp, url_prefix='/dashboard')
+    app.register_blueprint(incidents_bp, url_prefix='/incidents')
+    app.register_blueprint(admin_bp, url_prefix='/admin')
+    app.register_blueprint(chat_bp, url_prefix='/chat')
+    # Serves /about and /contact
+    app.register_blueprint(about_bp)
+
+    # Timestamps in templates render on the server: {{ moment(value).fromNow() }}
+    app.jinja_env.globals['moment'] = moment
+
+    # Global template variables
+    @app.context_processor
+    def inject_globals():
+        return {
+            'current_user': get_current_user(),
+            'app_name': 'POTHOLES AI',
+            'version': '1.0.0'
+        }
+
+    # Error handlers
+    @app.errorhandler(404)
+    def not_found(error):
+        return render_template('errors/404.html'), 404
+
+    @app.errorhandler(500)
+    def internal_error(error):
+        return render_template('errors/500.html'), 500
+
+    @app.errorhandler(403)
+    def forbidden(error):
+        return render_template('errors/403.html'), 403
+
+    # Health check endpoint
+    @app.route('/health')
+    def health_check():
+        return jsonify({
+            'status': 'healthy',
+            'timestamp': datetime.utcnow().isoformat(),
+            'version': '1.0.0'
+        })
+
+    if prewarm is None:
+        prewarm = PREWARM
+    if prewarm:
+        timer = threading.Timer(PREWARM_DELAY, prewarm_caches)
+        timer.daemon = True
+        timer.start()
+
+    if jobs is None:
+        jobs = JOBS_ENABLED
+    if sla_scanner is None:
+        sla_scanner = SLA_SCANNER
+    if jobs:
+        from utils.jobs import init_jobs
+        from utils.storage import ARCHIVE_CHECK_INTERVAL
+        scheduler = init_jobs(app)
+        scheduler.schedule('storage.archive', every=ARCHIVE_CHECK_INTERVAL.total_seconds())
+        get_storage().archive_on_write = False
+        if sla_scanner:
+            from utils.sla import SCAN_INTERVAL
+            scheduler.schedule('sla.scan', every=SCAN_INTERVAL)
+        if BACKUP_INTERVAL_HOURS > 0:
+            scheduler.schedule('backup.create', every=BACKUP_INTERVAL_HOURS * 3600)
+        # Photos queued for classification when a worker last stopped
+        scheduler.schedule('detection.resume', every=DETECTION_RESCAN_INTERVAL)
+        if os.getenv('SMTP_SERVER'):
+            # Also delivers mail spooled before a restart, and retries
+            scheduler.schedule('mail.drain', every=MAIL_DRAIN_INTERVAL)
+    else:
+        if sla_scanner:
+            from utils.sla import get_sla_monitor
+            get_sla_monitor(get_storage()).start()
+        timer = threading.Timer(PREWARM_DELAY, resume_detection)
+        timer.daemon = True
+        timer.start()
+
+        if os.getenv('SMTP_SERVER'):
+            # Deliver mail spooled before a restart without waiting for new mail
+            from utils.mail_queue import get_mail_queue
+            get_mail_queue()
+
+    return app
+
+def resume_detection():
+    """Re-queue photos whose classification was lost in a restart"""
+    from utils.detection import get_detection_service
+    try:
+        get_detection_service(get_storage()).resume()
+    except Exception as e:
+        print(f"Resuming photo detection failed: {e}")
+
+def prewarm_caches():
+    """Load what the first requests would otherwise pay for"""
+    from utils.users import get_user_repository
+    from utils.priority import get_priority_engine
+    from utils.rollups import get_rollups
+    from utils.search import get_search_index
+    from utils.locations import get_location_index
+    from utils.hotspots import get_hotspot_engine
+
+    started = datetime.utcnow()
+    try:
+        storage = get_storage()
+        storage.sync()
+        get_user_repository().refresh()
+        # Parse the live partitions into the record cache and map (or build) the snapshot
+        storage.get_incident_records({'archived': False})
+        storage.current_snapshot()
+        get_priority_engine(storage).ensure_built()
+        get_rollups(storage).ensure_loaded()
+        get_search_index(storage).ensure_built()
+        get_location_index(storage).ensure_built()
+        get_hotspot_engine(storage).result()
+    except Exception as e:
+        print(f"Cache prewarm failed: {e}")
+        return
+    print(f"Caches prewarmed in {(datetime.utcnow() - started).total_seconds():.2f}s")
+
+def __getattr__(name):
+    # `gunicorn app:app` and `from app import app` build the default app on first access
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,12 @@
+"""Benchmark suite
+
+Run from the repository root::
+
+    python -m benchmarks --scale 10k --output results.json
+    python -m benchmarks --scale 100k --baseline results.json
+
+Each run works on a freshly generated store (see ``generator``) in a
+temporary directory. The standalone scripts in this package
+(``detection_bench``, ``trace_bench``, ``serializer_bench``,
+``memory_bench``) measure single components.
+"""
@@ -0,0 +1,68 @@
+"""Run the storage, dashboard and endpoint benchmarks on a generated store"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import harness  # noqa: E402
+from benchmarks.generator import SCALES, generate_incidents  # noqa: E402
+
+SUITES = ('storage', 'dashboard', 'endpoints')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', default='10k', help=f'one of {", ".join(SCALES)} or a number of incidents')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--suite', default=','.join(SUITES), help='comma-separated suites to run')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against a results file from an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed median slowdown, as a fraction')
+    parser.add_argument('--data-dir', help='work in this directory instead of a temporary one')
+    args = parser.parse_args()
+
+    count = SCALES.get(args.scale.lower()) or int(args.scale)
+    suites = [s.strip() for s in args.suite.split(',') if s.strip()]
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = harness.load_results(args.baseline)['results'] if args.baseline else None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # The app keeps its data in ./data, so run from a scratch directory
+        os.chdir(args.data_dir or workdir)
+        from utils.storage import StorageManager
+        from benchmarks import storage_bench, dashboard_bench, endpoint_bench  # noqa: F401
+
+        storage = StorageManager()
+        started = time.perf_counter()
+        incidents = generate_incidents(count, seed=args.seed)
+        ids = [incident['id'] for incident in incidents]
+        storage.import_incidents(incidents)
+        del incidents
+        storage.snapshots.build()
+        print(f'Generated and stored {count} incidents in {time.perf_counter() - started:.1f}s\n')
+
+        context = {'storage': storage, 'ids': ids, 'count': count}
+        benchmarks = [b for b in harness.BENCHMARKS if b.suite in suites]
+        results = harness.run(benchmarks, context, args.filter)
+
+        # Write pending rollups while the scratch directory still exists
+        from utils.rollups import get_rollups
+        get_rollups(storage).flush()
+
+    meta = dict(harness.environment(), scale=args.scale, count=count, seed=args.seed)
+    if output:
+        harness.save_results(output, meta, results)
+        print(f'\nResults written to {output}')
+    if baseline is not None:
+        regressions = harness.compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
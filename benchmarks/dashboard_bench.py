@@ -0,0 +1,84 @@
+"""Benchmarks for the dashboard helper functions"""
+from datetime import timedelta
+
+from benchmarks.harness import benchmark
+
+
+def _dashboard():
+    # Imported late: blueprints open data/ relative to the working directory
+    from blueprints import dashboard
+    if dashboard.storage is None:
+        # Its globals are bound when the blueprint is registered on an app
+        from flask import Flask
+        Flask(__name__).register_blueprint(dashboard.dashboard_bp)
+    return dashboard
+
+
+@benchmark('dashboard.calculate_dashboard_stats', 'dashboard')
+def bench_stats(context):
+    dashboard = _dashboard()
+    return lambda: dashboard.calculate_dashboard_stats(context['storage'])
+
+
+@benchmark('dashboard.generate_analytics_data', 'dashboard')
+def bench_analytics(context):
+    dashboard = _dashboard()
+    return lambda: dashboard.generate_analytics_data(context['storage'], dashboard.rollups, dashboard.hotspot_engine)
+
+
+@benchmark('dashboard.generate_timeline_data.30d', 'dashboard')
+def bench_timeline_month(context):
+    dashboard = _dashboard()
+    return lambda: dashboard.generate_timeline_data(dashboard.rollups, timedelta(days=30), 'day')
+
+
+@benchmark('dashboard.generate_timeline_data.24h', 'dashboard')
+def bench_timeline_day(context):
+    dashboard = _dashboard()
+    return lambda: dashboard.generate_timeline_data(dashboard.rollups, timedelta(hours=24), 'hour')
+
+
+@benchmark('dashboard.get_next_up', 'dashboard')
+def bench_next_up(context):
+    dashboard = _dashboard()
+    return lambda: dashboard.get_next_up(dashboard.NEXT_UP_COUNT)
+
+
+@benchmark('dashboard.get_incident_page', 'dashboard')
+def bench_incident_page(context):
+    dashboard = _dashboard()
+    return lambda: dashboard.get_incident_page({})
+
+
+@benchmark('dashboard.get_incident_page.filtered', 'dashboard')
+def bench_incident_page_filtered(context):
+    dashboard = _dashboard()
+    return lambda: dashboard.get_incident_page({'severity': 'critical', 'status': 'reported'}, page=3)
+
+
+@benchmark('priority.rebuild', 'dashboard', min_runs=1, max_runs=5)
+def bench_priority_rebuild(context):
+    engine = _dashboard().priority_engine
+    records = context['storage'].get_incident_records({'archived': False})
+    return lambda: engine.rebuild(records)
+
+
+@benchmark('sla.rebuild', 'dashboard', min_runs=1, max_runs=5)
+def bench_sla_rebuild(context):
+    monitor = _dashboard().sla_monitor
+    records = context['storage'].get_incident_records({'open': True, 'archived': False})
+    return lambda: monitor.rebuild(records)
+
+
+@benchmark('sla.scan.idle', 'dashboard', writes=True)
+def bench_sla_scan(context):
+    monitor = _dashboard().sla_monitor
+    # The first scan escalates the backlog; later ones only find what fell due since
+    monitor.scan()
+    return monitor.scan
+
+
+@benchmark('sla.breaches', 'dashboard')
+def bench_sla_breaches(context):
+    dashboard = _dashboard()
+    return lambda: dashboard.sla_monitor.breaches(dashboard.NEXT_UP_COUNT)
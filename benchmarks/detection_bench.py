@@ -0,0 +1,99 @@
+"""Images/sec per core for the pothole detection worker
+
+Usage: python -m benchmarks.detection_bench [--images 256] [--workers 1 2 4] [--batch-size 16]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.detection import load_model, load_image, _init_worker, _run_batch  # noqa: E402
+
+
+def make_road_images(directory, count, size=(1024, 768), seed=42):
+    """Write synthetic asphalt photos, about half with a dark pothole blob"""
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    paths = []
+    yy, xx = np.mgrid[0:size[1], 0:size[0]]
+    for i in range(count):
+        road = rng.normal(0.45, 0.06, (size[1], size[0]))
+        if i % 2 == 0:
+            cx, cy = rng.uniform(0.2, 0.8) * size[0], rng.uniform(0.2, 0.8) * size[1]
+            rx, ry = rng.uniform(0.05, 0.25) * size[0], rng.uniform(0.05, 0.2) * size[1]
+            blob = ((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 <= 1
+            road[blob] -= rng.uniform(0.15, 0.3)
+        pixels = (np.clip(road, 0, 1) * 255).astype(np.uint8)
+        path = os.path.join(directory, f'road_{i:05d}.jpg')
+        Image.fromarray(pixels).convert('RGB').save(path, 'JPEG', quality=85)
+        paths.append(path)
+    return paths
+
+
+def bench_single(paths, batch_size):
+    """In-process throughput, split into decode and inference time"""
+    model = load_model('classical')
+    decode = infer = 0.0
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        t0 = time.perf_counter()
+        batch = np.stack([load_image(p, model.input_size) for p in chunk])
+        t1 = time.perf_counter()
+        model.predict(batch)
+        infer += time.perf_counter() - t1
+        decode += t1 - t0
+    total = decode + infer
+    return {
+        'images_per_second': len(paths) / total,
+        'decode_seconds': decode,
+        'inference_seconds': infer
+    }
+
+
+def bench_pool(paths, workers, batch_size):
+    """Wall-clock throughput through the process pool"""
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=('classical',)) as executor:
+        # Warm up every worker so process start-up is not measured
+        list(executor.map(_run_batch, [paths[:1]] * workers))
+        started = time.perf_counter()
+        list(executor.map(_run_batch, batches))
+        elapsed = time.perf_counter() - started
+    return {
+        'images_per_second': len(paths) / elapsed,
+        'images_per_second_per_core': len(paths) / elapsed / workers
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=256)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--batch-size', type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'Generating {args.images} synthetic photos...')
+        paths = make_road_images(directory, args.images)
+
+        single = bench_single(paths, args.batch_size)
+        print(f"single process: {single['images_per_second']:.1f} img/s "
+              f"(decode {single['decode_seconds']:.2f}s, inference {single['inference_seconds']:.2f}s)")
+
+        for workers in args.workers:
+            result = bench_pool(paths, workers, args.batch_size)
+            print(f"{workers} worker(s): {result['images_per_second']:.1f} img/s, "
+                  f"{result['images_per_second_per_core']:.1f} img/s per core")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""End-to-end request benchmarks through the Flask test client"""
+import os
+
+from benchmarks.harness import benchmark
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BLUEPRINTS = [
+    ('discovery', 'discovery_bp', '/'),
+    ('dashboard', 'dashboard_bp', '/dashboard'),
+    ('incidents', 'incidents_bp', '/incidents'),
+    ('admin', 'admin_bp', '/admin'),
+    ('chat', 'chat_bp', '/chat'),
+    ('about', 'about_bp', ''),
+]
+
+
+def make_app():
+    """The application, or as much of it as imports in this environment"""
+    try:
+        from app import create_app
+        # No background jobs or SLA scans: they would write to the store between timed reads
+        return create_app(prewarm=False, sla_scanner=False, jobs=False)
+    except ImportError as e:
+        print(f'Full app unavailable ({e}); benchmarking the blueprints that import')
+
+    import importlib
+    from flask import Flask
+    from utils.auth import get_current_user
+    from utils.moment import moment
+
+    app = Flask('app', root_path=REPO_ROOT)
+    app.secret_key = 'benchmark'
+    app.jinja_env.globals['moment'] = moment
+    for module, name, prefix in BLUEPRINTS:
+        try:
+            app.register_blueprint(getattr(importlib.import_module(f'blueprints.{module}'), name), url_prefix=prefix)
+        except ImportError as e:
+            print(f'Skipping blueprints.{module}: {e}')
+    app.context_processor(lambda: {'current_user': get_current_user(), 'app_name': 'POTHOLES AI', 'version': '1.0.0'})
+    return app
+
+
+def client(context):
+    if 'client' not in context:
+        from utils.auth import load_users
+        load_users()
+        test_client = make_app().test_client()
+        with test_client.session_transaction() as session:
+            session['user_id'] = 'admin'
+        context['client'] = test_client
+    return context['client']
+
+
+def _get(path):
+    def setup(context):
+        test_client = client(context)
+        url = path(context) if callable(path) else path
+
+        def run():
+            response = test_client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {url} returned {response.status_code}')
+            return response
+        return run
+    return setup
+
+
+for _name, _path in [
+    ('dashboard.index', '/dashboard/'),
+    ('dashboard.incidents', '/dashboard/incidents?severity=critical&status=reported'),
+    ('dashboard.analytics', '/dashboard/analytics'),
+    ('dashboard.api_stats', '/dashboard/api/stats'),
+    ('dashboard.api_timeline', '/dashboard/api/timeline?range=30d'),
+    ('dashboard.api_next_up', '/dashboard/api/next-up'),
+    ('incidents.api_incidents', '/incidents/api/incidents?status=reported'),
+    ('incidents.api_incident', lambda context: f'/incidents/api/incidents/{context["ids"][len(context["ids"]) // 2]}'),
+    ('incidents.view', lambda context: f'/incidents/{context["ids"][len(context["ids"]) // 3]}'),
+    ('discovery.api_stats', '/api/stats'),
+]:
+    benchmark(f'endpoint.{_name}', 'endpoints', min_runs=2)(_get(_path))
@@ -0,0 +1,140 @@
+"""Seeded generator of realistic synthetic incidents
+
+The same ``seed`` and ``count`` always give the same incidents (timestamps
+are offsets from ``end``, which defaults to today at midnight UTC, so
+"last week" queries select the same rows on any day).
+"""
+import uuid
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from utils.data_models import Incident
+
+SCALES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+
+CITY_CENTER = (40.7128, -74.0060)
+CITY_RADIUS_M = 15000.0
+METERS_PER_DEGREE = 111320.0
+
+SEVERITIES = ['minor', 'moderate', 'major', 'critical']
+SEVERITY_MIX = [0.35, 0.35, 0.2, 0.1]
+# Freeze-thaw: more reports in late winter and spring
+MONTH_WEIGHTS = [1.4, 1.6, 1.7, 1.5, 1.1, 0.8, 0.7, 0.7, 0.8, 0.9, 1.0, 1.2]
+OPERATORS = ['admin', 'op1', 'op2', 'op3', 'op4', 'op5']
+
+STREETS = [
+    'Main St', 'Broadway', 'Oak Ave', 'Maple Ave', 'Park Rd', 'Elm St', 'Church St', 'Mill Rd',
+    'River Rd', 'Lake Ave', 'Hill St', 'Washington Ave', 'Lincoln Blvd', 'Jefferson St',
+    'Madison Ave', 'Franklin St', 'Highland Ave', 'Cedar Ln', 'Pine St', 'Sunset Blvd',
+    'Bridge St', 'Harbor Way', 'Market St', 'Union Ave', 'Spring St', 'Center St',
+]
+DESCRIPTIONS = [
+    'Large pothole in the right lane.',
+    'Deep hole near the crosswalk, cars swerving around it.',
+    'Cracked asphalt breaking up after the last freeze.',
+    'Pothole by the bus stop, filled with water when it rains.',
+    'Several small potholes along the curb.',
+    'Damaged manhole cover with a sunken edge.',
+    'Hole big enough to damage tires, reported by a cyclist.',
+    '',
+]
+COMMENTS = [
+    'Crew dispatched.', 'Temporary patch applied.', 'Confirmed on site.',
+    'Waiting for asphalt delivery.', 'Duplicate report received.', 'Resurfacing scheduled.',
+]
+
+
+def generate_incidents(count, seed=42, years=3, end=None, clusters=60):
+    """Return ``count`` incident dicts, ready for StorageManager.import_incidents
+
+    Coordinates are drawn around ``clusters`` hotspots (a few heavy ones,
+    many light ones) plus 10% background noise; creation times spread over
+    ``years`` with a seasonal bias; older incidents are more likely to be
+    resolved; some carry comments and sensor corroboration.
+    """
+    rng = np.random.default_rng(seed)
+    text_rng = random.Random(seed)
+    end = end or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    span_s = years * 365 * 86400
+
+    # Hotspot centres and Zipf-like popularity
+    angle = rng.uniform(0, 2 * np.pi, clusters)
+    radius = CITY_RADIUS_M * np.sqrt(rng.uniform(0, 1, clusters))
+    centre_lat = CITY_CENTER[0] + radius * np.sin(angle) / METERS_PER_DEGREE
+    centre_lng = CITY_CENTER[1] + radius * np.cos(angle) / (METERS_PER_DEGREE * np.cos(np.radians(CITY_CENTER[0])))
+    popularity = 1.0 / np.arange(1, clusters + 1) ** 0.8
+    popularity /= popularity.sum()
+    spread_m = rng.uniform(100, 600, clusters)
+    streets = [text_rng.sample(STREETS, 3) for _ in range(clusters)]
+
+    cluster = rng.choice(clusters, size=count, p=popularity)
+    noise = rng.uniform(0, 1, count) < 0.1
+    lat = centre_lat[cluster] + rng.normal(0, 1, count) * spread_m[cluster] / METERS_PER_DEGREE
+    lng = centre_lng[cluster] + rng.normal(0, 1, count) * spread_m[cluster] / METERS_PER_DEGREE
+    lat[noise] = CITY_CENTER[0] + rng.uniform(-1, 1, noise.sum()) * CITY_RADIUS_M / METERS_PER_DEGREE
+    lng[noise] = CITY_CENTER[1] + rng.uniform(-1, 1, noise.sum()) * CITY_RADIUS_M / METERS_PER_DEGREE
+
+    # Seasonal timestamps by rejection sampling on the month weight
+    age_s = np.empty(0)
+    end64 = np.datetime64(end, 's')
+    while len(age_s) < count:
+        candidate = rng.uniform(0, span_s, count)
+        months = (end64 - candidate.astype('timedelta64[s]')).astype('datetime64[M]').astype(np.int64) % 12
+        keep = rng.uniform(0, max(MONTH_WEIGHTS), count) < np.array(MONTH_WEIGHTS)[months]
+        age_s = np.concatenate([age_s, candidate[keep]])
+    age_s = np.sort(age_s[:count])[::-1]
+    age_days = age_s / 86400
+
+    severity = rng.choice(len(SEVERITIES), size=count, p=SEVERITY_MIX)
+    resolved = rng.uniform(0, 1, count) < np.minimum(0.95, age_days / 120)
+    in_progress = ~resolved & (rng.uniform(0, 1, count) < 0.15 + 0.3 * (severity >= 2))
+    handled_after_s = rng.exponential(4 * 86400, count)
+    comment_counts = rng.poisson(0.6 + resolved, count)
+    sensor_hits = np.where(rng.uniform(0, 1, count) < 0.05, rng.integers(1, 12, count), 0)
+
+    incidents = []
+    for i in range(count):
+        created = end - timedelta(seconds=float(age_s[i]))
+        status = 'resolved' if resolved[i] else 'in-progress' if in_progress[i] else 'reported'
+        updated = None
+        if status != 'reported':
+            updated = min(end, created + timedelta(seconds=float(handled_after_s[i])))
+        severity_name = SEVERITIES[severity[i]]
+        incident = {
+            'id': str(uuid.UUID(int=text_rng.getrandbits(128), version=4)),
+            'location': f'{text_rng.randrange(1, 2500)} {text_rng.choice(streets[cluster[i]])}',
+            'severity': severity_name,
+            'description': text_rng.choice(DESCRIPTIONS),
+            'latitude': round(float(lat[i]), 6),
+            'longitude': round(float(lng[i]), 6),
+            'status': status,
+            'priority': Incident.priority_for_severity(severity_name),
+            'created_at': created.isoformat(),
+            'updated_at': updated.isoformat() if updated else None,
+            'assigned_to': text_rng.choice(OPERATORS) if status != 'reported' else None,
+            'reporter_name': 'Anonymous',
+            'photos': [],
+            'comments': []
+        }
+        for n in range(int(comment_counts[i])):
+            incident['comments'].append({
+                'id': n + 1,
+                'text': text_rng.choice(COMMENTS),
+                'author': incident['assigned_to'] or 'admin',
+                'author_id': incident['assigned_to'] or 'admin',
+                'created_at': (created + timedelta(hours=6 * (n + 1))).isoformat()
+            })
+        if sensor_hits[i]:
+            incident['source'] = 'sensor'
+            incident['sensor_hits'] = int(sensor_hits[i])
+        incidents.append(incident)
+    return incidents
+
+
+def populate(storage, count, seed=42, **options):
+    """Fill ``storage`` with ``count`` generated incidents; returns their ids"""
+    incidents = generate_incidents(count, seed=seed, **options)
+    storage.import_incidents(incidents)
+    return [incident['id'] for incident in incidents]
@@ -0,0 +1,114 @@
+"""Timing, result files and baseline comparison for the benchmark suites"""
+import os
+import sys
+import json
+import time
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+BENCHMARKS = []
+
+
+class Benchmark:
+    """A named timed callable; ``setup(context)`` returns the function to time"""
+
+    def __init__(self, name, setup, suite, writes=False, min_time=0.5, min_runs=3, max_runs=200):
+        self.name = name
+        self.setup = setup
+        self.suite = suite
+        self.writes = writes
+        self.min_time = min_time
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+
+
+def benchmark(name, suite, **options):
+    """Register ``setup(context) -> callable`` as a benchmark"""
+    def decorator(setup):
+        BENCHMARKS.append(Benchmark(name, setup, suite, **options))
+        return setup
+    return decorator
+
+
+def measure(func, min_time=0.5, min_runs=3, max_runs=200):
+    """Time ``func`` after one warm-up call until ``min_time`` has passed"""
+    func()
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_runs and (len(timings) < min_runs or time.perf_counter() - started < min_time):
+        t0 = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return {
+        'runs': len(timings),
+        'min_ms': round(timings[0] * 1000, 4),
+        'median_ms': round(statistics.median(timings) * 1000, 4),
+        'mean_ms': round(statistics.fmean(timings) * 1000, 4),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 4),
+    }
+
+
+def run(benchmarks, context, pattern=None):
+    """Run benchmarks (reads first, then writes) and return {name: stats}"""
+    selected = [b for b in benchmarks if not pattern or pattern in b.name]
+    results = {}
+    for bench in sorted(selected, key=lambda b: b.writes):
+        try:
+            func = bench.setup(context)
+            stats = measure(func, bench.min_time, bench.min_runs, bench.max_runs)
+        except Exception as e:
+            print(f'{bench.name:<48} failed: {e}')
+            continue
+        results[bench.name] = stats
+        print(f'{bench.name:<48} {stats["median_ms"]:>10.3f} ms  (p95 {stats["p95_ms"]:.3f}, {stats["runs"]} runs)')
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'commit': commit or None,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+
+
+def save_results(path, meta, results):
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Print the change against a baseline file's results; return names that regressed
+
+    A benchmark regresses when its median is more than ``tolerance``
+    (a fraction) slower than the baseline median.
+    """
+    regressions = []
+    print(f'\n{"benchmark":<48} {"baseline":>10} {"current":>10} {"change":>8}')
+    for name, stats in results.items():
+        before = baseline.get(name)
+        if not before:
+            print(f'{name:<48} {"-":>10} {stats["median_ms"]:>10.3f} {"new":>8}')
+            continue
+        change = stats['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0.0
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:<48} {before["median_ms"]:>10.3f} {stats["median_ms"]:>10.3f} {change:>+8.0%}{flag}')
+    return regressions
@@ -0,0 +1,59 @@
+"""Resident memory of cached incidents as plain dicts vs IncidentRecords
+
+Usage: python -m benchmarks.memory_bench [--count 200000]
+"""
+import os
+import gc
+import sys
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.serializers import get_serializer, loads_any  # noqa: E402
+from utils.data_models import IncidentRecord  # noqa: E402
+from benchmarks.generator import generate_incidents  # noqa: E402
+
+
+def measure(build):
+    """Bytes still allocated by whatever ``build`` returns"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=200000)
+    args = parser.parse_args()
+
+    # Start from serialized bytes, as the storage cache does
+    raw = get_serializer().dumps({incident['id']: incident for incident in generate_incidents(args.count)})
+    gc.collect()
+
+    dicts, dict_bytes = measure(lambda: loads_any(raw))
+    sample = next(iter(dicts.values()))
+    del dicts
+
+    def build_records():
+        records = {}
+        for incident in loads_any(raw).values():
+            record = IncidentRecord.from_dict(incident)
+            records[record.id] = record
+        return records
+
+    records, record_bytes = measure(build_records)
+    assert records[sample['id']].to_dict() == sample
+
+    print(f'{args.count} incidents')
+    print(f'dicts:   {dict_bytes / 1e6:8.1f} MB  ({dict_bytes / args.count:.0f} B each)')
+    print(f'records: {record_bytes / 1e6:8.1f} MB  ({record_bytes / args.count:.0f} B each)')
+    print(f'{dict_bytes / record_bytes:.1f}x smaller')
+
+
+if __name__ == '__main__':
+    main()
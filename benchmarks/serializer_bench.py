@@ -0,0 +1,47 @@
+"""Dump/load time and file size of each storage format on a synthetic incident store
+
+Usage: python -m benchmarks.serializer_bench [--sizes 1000,10000,100000]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.serializers import SERIALIZERS, loads_any  # noqa: E402
+from benchmarks.generator import generate_incidents  # noqa: E402
+
+
+def best_of(runs, func):
+    best = float('inf')
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        incidents = {incident['id']: incident for incident in generate_incidents(size)}
+        print(f'\n{size} incidents')
+        print(f'{"format":<12} {"dump ms":>10} {"load ms":>10} {"size KB":>10}')
+        for name, serializer in SERIALIZERS.items():
+            if not serializer.available:
+                print(f'{name:<12} (not installed)')
+                continue
+            raw = serializer.dumps(incidents)
+            assert loads_any(raw) == incidents
+            dump = best_of(args.runs, lambda: serializer.dumps(incidents))
+            load = best_of(args.runs, lambda: serializer.loads(raw))
+            print(f'{name:<12} {dump * 1000:>10.1f} {load * 1000:>10.1f} {len(raw) / 1024:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
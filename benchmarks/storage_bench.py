@@ -0,0 +1,94 @@
+"""Micro-benchmarks for StorageManager reads and writes"""
+import itertools
+from datetime import datetime, timedelta
+
+from benchmarks.harness import benchmark
+
+import utils.storage as storage_module
+from utils.search import get_search_index
+
+
+def _cycle_ids(context, step=7919):
+    # Walk the ids in a scattered order so lookups don't hit one partition
+    ids = context['ids']
+    return itertools.cycle(ids[i % len(ids)] for i in range(0, len(ids) * step, step)[:1000])
+
+
+@benchmark('storage.get_incident', 'storage')
+def bench_get_incident(context):
+    storage, ids = context['storage'], _cycle_ids(context)
+    return lambda: storage.get_incident(next(ids))
+
+
+def _get_incidents(filters, use_snapshot=True):
+    def setup(context):
+        storage = context['storage']
+
+        def run():
+            previous = storage_module.SNAPSHOT_ENABLED
+            storage_module.SNAPSHOT_ENABLED = use_snapshot
+            try:
+                return storage.get_incidents(filters() if callable(filters) else filters)
+            finally:
+                storage_module.SNAPSHOT_ENABLED = previous
+        return run
+    return setup
+
+
+for _name, _filters in [
+    ('all', None),
+    ('severity', {'severity': 'critical'}),
+    ('open', {'open': True}),
+    ('since_7d', lambda: {'since': datetime.utcnow() - timedelta(days=7)}),
+    ('location', {'location': 'main st'}),
+    ('assigned', {'assigned_to': 'op1', 'archived': False}),
+]:
+    benchmark(f'storage.get_incidents.{_name}', 'storage')(_get_incidents(_filters))
+    benchmark(f'storage.get_incidents.{_name}.no_snapshot', 'storage')(_get_incidents(_filters, use_snapshot=False))
+
+
+@benchmark('storage.get_recent_incidents', 'storage')
+def bench_recent(context):
+    storage = context['storage']
+    return lambda: storage.get_recent_incidents(10)
+
+
+@benchmark('storage.get_incident_counts', 'storage')
+def bench_counts(context):
+    storage = context['storage']
+    return storage.get_incident_counts
+
+
+@benchmark('storage.update_incident', 'storage', writes=True)
+def bench_update(context):
+    storage, ids = context['storage'], _cycle_ids(context, step=104729)
+    statuses = itertools.cycle(['in-progress', 'reported'])
+    return lambda: storage.update_incident(next(ids), {'status': next(statuses)})
+
+
+@benchmark('storage.save_incident', 'storage', writes=True)
+def bench_save(context):
+    storage = context['storage']
+    return lambda: storage.save_incident({
+        'location': '1 Benchmark Ave', 'severity': 'minor', 'status': 'reported',
+        'description': '', 'latitude': 40.71, 'longitude': -74.0, 'priority': 'low'
+    })
+
+
+def _search(query, **filters):
+    def setup(context):
+        index = get_search_index(context['storage'])
+        index.ensure_built()
+        return lambda: index.search(query, limit=20, **filters)
+    return setup
+
+
+for _name, _query, _filters in [
+    ('rare', 'sinkhole', {}),
+    ('common', 'pothole', {}),
+    ('phrase', 'pothole main st', {}),
+    ('prefix', 'pot', {}),
+    ('typing', 'pothole', {'prefix': True}),
+    ('filtered', 'pothole', {'severity': 'critical', 'status': 'reported'}),
+]:
+    benchmark(f'search.{_name}', 'storage')(_search(_query, **_filters))
@@ -0,0 +1,116 @@
+"""Throughput of accelerometer trace ingestion on synthetic 100 Hz data
+
+Usage: python -m benchmarks.trace_bench [--hours 2] [--potholes 40] [--ingests 3]
+
+After timing the detector, the trace is ingested ``--ingests`` times into
+a scratch store; every run after the first must merge into the incidents
+the first one created.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The scratch store is read straight from its partitions, without a background snapshot build
+os.environ.setdefault('INCIDENT_SNAPSHOT', '0')
+
+from utils.traces import iter_trace_chunks, ImpactDetector, ingest_trace  # noqa: E402
+from utils.storage import StorageManager  # noqa: E402
+
+
+def write_trace(path, hours, potholes, sample_rate=100, seed=7):
+    """Write a CSV trace of a vehicle looping a route, with injected impacts"""
+    rng = np.random.default_rng(seed)
+    rows = int(hours * 3600 * sample_rate)
+    block = 360000
+    # Pothole positions along a 20 km loop
+    route_m = 20000.0
+    pothole_at = np.sort(rng.uniform(0, route_m, potholes))
+    speed = 12.0
+    start = 1700000000.0
+
+    with open(path, 'w') as f:
+        f.write('timestamp,ax,ay,az,lat,lng\n')
+        for offset in range(0, rows, block):
+            n = min(block, rows - offset)
+            idx = np.arange(offset, offset + n)
+            t = start + idx / sample_rate
+            position = (idx / sample_rate * speed) % route_m
+            az = 1.0 + rng.normal(0, 0.05, n)
+            # Short spike when the wheel crosses a pothole
+            step = speed / sample_rate
+            hit = np.abs(position[:, None] - pothole_at[None, :]).min(axis=1) < step
+            az[hit] += rng.uniform(0.8, 2.2, int(hit.sum()))
+            lat = 40.70 + position / 111320.0
+            lng = np.full(n, -74.00)
+            gps = (idx % sample_rate) == 0
+            lines = np.column_stack([t, rng.normal(0, 0.05, n), rng.normal(0, 0.05, n), az])
+            for i in range(n):
+                row = f'{lines[i, 0]:.2f},{lines[i, 1]:.3f},{lines[i, 2]:.3f},{lines[i, 3]:.3f},'
+                row += f'{lat[i]:.6f},{lng[i]:.6f}\n' if gps[i] else ',\n'
+                f.write(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hours', type=float, default=2.0)
+    parser.add_argument('--potholes', type=int, default=40)
+    parser.add_argument('--ingests', type=int, default=3, help='times to ingest the trace into a scratch store')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'trace.csv')
+        print(f'Generating {args.hours} h of 100 Hz data...')
+        rows = write_trace(path, args.hours, args.potholes)
+        size_mb = os.path.getsize(path) / 1e6
+
+        detector = ImpactDetector()
+        impacts = 0
+        started = time.perf_counter()
+        with open(path, 'rb') as f:
+            for chunk in iter_trace_chunks(f):
+                impacts += len(detector.process(chunk))
+        elapsed = time.perf_counter() - started
+
+        print(f'{rows} rows ({size_mb:.0f} MB) in {elapsed:.2f}s: '
+              f'{rows / elapsed / 1e6:.2f} M rows/s, {args.hours * 3600 / elapsed:.0f}x real time, '
+              f'{impacts} impacts')
+
+        if args.ingests:
+            check_ingest(path, directory, args.ingests)
+
+
+def check_ingest(path, directory, times):
+    """Ingest the same trace repeatedly; exits non-zero if a re-ingest misbehaves"""
+    cwd = os.getcwd()
+    # StorageManager keeps its data under ./data
+    os.chdir(directory)
+    try:
+        storage = StorageManager()
+        created = None
+        for run in range(1, times + 1):
+            started = time.perf_counter()
+            with open(path, 'rb') as f:
+                summary = ingest_trace(f, storage, vehicle_id='bench')
+            elapsed = time.perf_counter() - started
+            print(f"ingest {run}: {summary['incidents_created']} created, "
+                  f"{summary['incidents_updated']} updated in {elapsed:.2f}s")
+            if created is None:
+                created = summary['incidents_created']
+            elif summary['incidents_created'] or summary['incidents_updated'] != created:
+                sys.exit(f'ingest {run} should have merged into the {created} incidents from the first')
+
+        for incident in storage.get_incidents():
+            if not isinstance(incident.get('sensor_peak_g'), float):
+                sys.exit(f"sensor_peak_g stored as {type(incident.get('sensor_peak_g')).__name__}")
+    finally:
+        os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
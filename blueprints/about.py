@@ -1,8 +1,5 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 import os
-import smtplib
-from email.mime.text import MimeText
-from email.mime.multipart import MimeMultipart
 
 about_bp = Blueprint('about', __name__)
 
@@ -18,7 +15,8 @@ def contact():
         # Get form data
         name = request.form.get('name', '').strip()
         email = request.form.get('email', '').strip()
-        subject = request.form.get('subject', '').strip()
+        # The subject ends up in a mail header, where line breaks aren't allowed
+        subject = ' '.join(request.form.get('subject', '').split())
         message = request.form.get('message', '').strip()
         
         # Validate form data
@@ -26,34 +24,25 @@ def contact():
             flash('All fields are required.', 'error')
             return render_template('about/contact.html')
         
+        if any(c in email for c in '\r\n'):
+            flash('Please enter a valid email address.', 'error')
+            return render_template('about/contact.html')
+        
         # Try to send email if SMTP is configured
         if send_contact_email(name, email, subject, message):
             flash('Thank you for your message! We will get back to you soon.', 'success')
             return redirect(url_for('about.contact'))
         else:
             flash('Message received! We will respond as soon as possible.', 'info')
-            # In a real application, you would save to database here
             return redirect(url_for('about.contact'))
     
     return render_template('about/contact.html')
 
 def send_contact_email(name, email, subject, message):
-    """Send contact form email if SMTP is configured"""
+    """Queue the contact form email; returns True if an SMTP relay will deliver it"""
     try:
-        smtp_server = os.getenv('SMTP_SERVER')
-        smtp_port = int(os.getenv('SMTP_PORT', 587))
-        smtp_username = os.getenv('SMTP_USERNAME')
-        smtp_password = os.getenv('SMTP_PASSWORD')
         admin_email = os.getenv('ADMIN_EMAIL', 'admin@potholes.local')
-        
-        if not all([smtp_server, smtp_username, smtp_password]):
-            return False
-        
-        # Create message
-        msg = MimeMultipart()
-        msg['From'] = smtp_username
-        msg['To'] = admin_email
-        msg['Subject'] = f"POTHOLES Contact Form: {subject}"
+        from_email = os.getenv('SMTP_FROM') or os.getenv('SMTP_USERNAME') or 'noreply@potholes.local'
         
         body = f"""
         New contact form submission:
@@ -69,17 +58,21 @@ def send_contact_email(name, email, subject, message):
         Sent from POTHOLES Contact Form
         """
         
-        msg.attach(MimeText(body, 'plain'))
+        # Imported on first use so smtplib and email stay out of startup
+        from utils.mail_queue import get_mail_queue
         
-        # Send email
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(smtp_username, smtp_password)
-        server.send_message(msg)
-        server.quit()
+        # The message is persisted either way; the worker only delivers once SMTP is configured
+        mail_queue = get_mail_queue()
+        mail_queue.enqueue(
+            to_addr=admin_email,
+            subject=f"POTHOLES Contact Form: {subject}",
+            body=body,
+            from_addr=from_email,
+            reply_to=email
+        )
         
-        return True
+        return mail_queue.pool is not None
         
     except Exception as e:
-        print(f"Email sending failed: {e}")
+        print(f"Queueing contact email failed: {e}")
         return False
@@ -1,7 +1,11 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from functools import wraps
 from utils.auth import require_auth, get_current_user
-from utils.data_models import get_all_users, get_user_by_id, update_user, delete_user, get_system_stats, get_audit_logs
+from utils.data_models import get_all_users, get_user_by_id, create_user, update_user, delete_user, get_system_stats, get_audit_logs
+from werkzeug.security import generate_password_hash
+from utils.metrics import registry as metrics_registry
+from utils.profiling import recent_profiles, SLOW_REQUEST_MS, PROFILE_SAMPLE_RATE
+from utils.jobs import get_job_scheduler
 import os
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -17,7 +21,7 @@ def admin_required(f):
     return decorated_function
 
 @admin_bp.route('/')
-@require_auth
+@require_auth()
 @admin_required
 def index():
     """Admin dashboard overview"""
@@ -25,16 +29,42 @@ def index():
     recent_logs = get_audit_logs(limit=10)
     return render_template('admin/index.html', stats=stats, recent_logs=recent_logs)
 
-@admin_bp.route('/users')
-@require_auth
+@admin_bp.route('/users', methods=['GET', 'POST'])
+@require_auth()
 @admin_required
 def users():
     """User management interface"""
-    users = get_all_users()
-    return render_template('admin/users.html', users=users)
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip()
+        email = request.form.get('email', '').strip()
+        password = request.form.get('password', '')
+        if not all([name, email, password]):
+            flash('Name, email and password are required.', 'error')
+            return redirect(url_for('admin.users'))
+        try:
+            user = create_user({
+                'username': request.form.get('username', '').strip() or email.split('@')[0],
+                'name': name,
+                'email': email,
+                'role': request.form.get('role', 'user'),
+                'password_hash': generate_password_hash(password)
+            })
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('admin.users'))
+        flash('User created successfully.', 'success')
+        return redirect(url_for('admin.user_detail', user_id=user['id']))
+    
+    page = request.args.get('page', 1, type=int)
+    filters = {
+        'query': request.args.get('q', '').strip() or None,
+        'role': request.args.get('role', '').strip() or None
+    }
+    users = get_all_users(page=page, per_page=50, **filters)
+    return render_template('admin/users.html', users=users, filters=filters)
 
-@admin_bp.route('/users/<int:user_id>')
-@require_auth
+@admin_bp.route('/users/<user_id>')
+@require_auth()
 @admin_required
 def user_detail(user_id):
     """View/edit specific user"""
@@ -42,10 +72,12 @@ def user_detail(user_id):
     if not user:
         flash('User not found.', 'error')
         return redirect(url_for('admin.users'))
-    return render_template('admin/user_detail.html', user=user)
+    activity = get_audit_logs(page=1, per_page=20, actor=user_id)
+    history = get_audit_logs(page=1, per_page=20, user=user_id)
+    return render_template('admin/user_detail.html', user=user, activity=activity, history=history)
 
-@admin_bp.route('/users/<int:user_id>/edit', methods=['POST'])
-@require_auth
+@admin_bp.route('/users/<user_id>/edit', methods=['POST'])
+@require_auth()
 @admin_required
 def edit_user(user_id):
     """Update user details"""
@@ -59,7 +91,7 @@ def edit_user(user_id):
         'name': request.form.get('name'),
         'email': request.form.get('email'),
         'role': request.form.get('role'),
-        'active': request.form.get('active') == 'on'
+        'is_active': request.form.get('active') == 'on'
     }
     
     if update_user(user_id, update_data):
@@ -69,11 +101,14 @@ def edit_user(user_id):
     
     return redirect(url_for('admin.user_detail', user_id=user_id))
 
-@admin_bp.route('/users/<int:user_id>/delete', methods=['POST'])
-@require_auth
+@admin_bp.route('/users/<user_id>/delete', methods=['POST'])
+@require_auth()
 @admin_required
 def delete_user_route(user_id):
     """Delete user account"""
+    if user_id == get_current_user()['id']:
+        flash('You cannot delete your own account.', 'error')
+        return redirect(url_for('admin.user_detail', user_id=user_id))
     if delete_user(user_id):
         flash('User deleted successfully.', 'success')
     else:
@@ -81,7 +116,7 @@ def delete_user_route(user_id):
     return redirect(url_for('admin.users'))
 
 @admin_bp.route('/system')
-@require_auth
+@require_auth()
 @admin_required
 def system():
     """System configuration and settings"""
@@ -92,21 +127,39 @@ def system():
         'email_configured': bool(os.getenv('SMTP_SERVER')),
         'debug_mode': os.getenv('FLASK_ENV') == 'development'
     }
-    return render_template('admin/system.html', config=config)
+    profiling = {
+        'slow_request_ms': SLOW_REQUEST_MS,
+        'sample_rate': PROFILE_SAMPLE_RATE,
+        'entries': recent_profiles(50)
+    }
+    jobs = get_job_scheduler().stats()
+    return render_template('admin/system.html', config=config, profiling=profiling, jobs=jobs)
+
+@admin_bp.route('/api/jobs')
+@require_auth()
+@admin_required
+def api_jobs():
+    """API endpoint for background job queue depth, throughput and failures"""
+    return jsonify(get_job_scheduler().stats())
 
 @admin_bp.route('/logs')
-@require_auth
+@require_auth()
 @admin_required
 def logs():
     """System audit logs"""
     page = request.args.get('page', 1, type=int)
-    logs = get_audit_logs(page=page, per_page=50)
-    return render_template('admin/logs.html', logs=logs)
+    filters = {
+        'actor': request.args.get('actor', '').strip() or None,
+        'incident': request.args.get('incident', '').strip() or None
+    }
+    logs = get_audit_logs(page=page, per_page=50, **filters)
+    return render_template('admin/logs.html', logs=logs, filters=filters)
 
 @admin_bp.route('/api/stats')
-@require_auth
+@require_auth()
 @admin_required
 def api_stats():
     """API endpoint for dashboard statistics"""
     stats = get_system_stats()
+    stats['performance'] = metrics_registry.summary()
     return jsonify(stats)
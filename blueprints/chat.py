@@ -2,15 +2,24 @@ from flask import Blueprint, render_template, request, jsonify, session
 from utils.auth import get_current_user
 import os
 import json
-import openai
 
 chat_bp = Blueprint('chat', __name__, url_prefix='/chat')
 
-# Initialize OpenAI client if API key is available
-openai_client = None
-if os.getenv('OPENAI_API_KEY'):
-    openai.api_key = os.getenv('OPENAI_API_KEY')
-    openai_client = openai
+# OpenAI client, imported and configured on first use if an API key is available
+_openai_client = None
+
+def get_openai_client():
+    """The configured openai module, or None when AI isn't set up"""
+    global _openai_client
+    if _openai_client is None and os.getenv('OPENAI_API_KEY'):
+        try:
+            import openai
+        except ImportError as e:
+            print(f"OpenAI client unavailable: {e}")
+            return None
+        openai.api_key = os.getenv('OPENAI_API_KEY')
+        _openai_client = openai
+    return _openai_client
 
 @chat_bp.route('/')
 def index():
@@ -21,6 +30,7 @@ def index():
 @chat_bp.route('/api/message', methods=['POST'])
 def send_message():
     """Handle chat messages"""
+    openai_client = get_openai_client()
     if not openai_client:
         return jsonify({
             'error': 'AI service not configured. Please contact administrator.',
@@ -57,7 +67,7 @@ def send_message():
         messages.extend(chat_history[-10:])  # Keep last 10 messages for context
         
         # Get AI response
-        response = openai.ChatCompletion.create(
+        response = openai_client.ChatCompletion.create(
             model=os.getenv('AI_MODEL', 'gpt-3.5-turbo'),
             messages=messages,
             max_tokens=500,
@@ -1,11 +1,36 @@
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
 from utils.auth import require_auth, get_current_user
-from utils.storage import StorageManager
+from utils.storage import get_storage
+from utils.priority import get_priority_engine
+from utils.rollups import get_rollups
+from utils.routing import plan_route, MAX_STOPS
+from utils.hotspots import get_hotspot_engine, MAX_HOTSPOTS, MAX_HEATMAP_CELLS
+from utils.sla import get_sla_monitor
+from utils.geo import has_coordinates
+from utils.locations import normalize_location
 from datetime import datetime, timedelta
 import json
 
 dashboard_bp = Blueprint('dashboard', __name__)
-storage = StorageManager()
+# Bound when the blueprint is registered, so importing it has no side effects
+storage = None
+priority_engine = None
+rollups = None
+hotspot_engine = None
+sla_monitor = None
+
+@dashboard_bp.record_once
+def bind_storage(state):
+    global storage, priority_engine, rollups, hotspot_engine, sla_monitor
+    storage = get_storage()
+    priority_engine = get_priority_engine(storage)
+    rollups = get_rollups(storage)
+    hotspot_engine = get_hotspot_engine(storage)
+    sla_monitor = get_sla_monitor(storage)
+
+NEXT_UP_COUNT = 5
+ANALYTICS_HOTSPOTS = 10
+INCIDENTS_PER_PAGE = 50
 
 @dashboard_bp.route('/')
 @require_auth()
@@ -13,79 +38,60 @@ def index():
     """Main dashboard overview"""
     user = get_current_user()
     
-    # Get incidents data
-    incidents = storage.get_incidents()
-    
-    # Calculate statistics
-    stats = calculate_dashboard_stats(incidents)
+    # Calculate statistics from partition counts plus the last week's partitions
+    stats = calculate_dashboard_stats(storage)
     
     # Get recent incidents
-    recent_incidents = sorted(incidents, key=lambda x: x.get('created_at', ''), reverse=True)[:10]
+    recent_incidents = storage.get_recent_incidents(10)
+    
+    # Get assigned incidents for current user (archived ones are all resolved)
+    assigned_incidents = storage.get_incidents({'assigned_to': user['id'], 'archived': False})
     
-    # Get assigned incidents for current user
-    assigned_incidents = [
-        incident for incident in incidents 
-        if incident.get('assigned_to') == user['id']
-    ]
+    # Highest-priority open incidents
+    next_up = get_next_up(NEXT_UP_COUNT)
+    
+    # Open incidents past their SLA window, most overdue first
+    sla = sla_monitor.stats()
+    sla_breaches = sla_monitor.breaches(NEXT_UP_COUNT)
     
     return render_template('dashboard/index.html', 
                          stats=stats,
                          recent_incidents=recent_incidents,
                          assigned_incidents=assigned_incidents,
+                         next_up=next_up,
+                         sla=sla,
+                         sla_breaches=sla_breaches,
                          user=user)
 
 @dashboard_bp.route('/incidents')
 @require_auth()
 def incidents_list():
-    """Incidents list view with filters"""
+    """Incidents list view with filters, a page at a time"""
     # Get filter parameters
-    severity_filter = request.args.get('severity')
-    status_filter = request.args.get('status')
-    location_filter = request.args.get('location')
-    assigned_filter = request.args.get('assigned')
-    
-    # Build filters dict
-    filters = {}
-    if severity_filter:
-        filters['severity'] = severity_filter
-    if status_filter:
-        filters['status'] = status_filter
-    if location_filter:
-        filters['location'] = location_filter
-    
-    # Get filtered incidents
-    incidents = storage.get_incidents(filters)
-    
-    # Filter by assignment if specified
-    if assigned_filter == 'me':
-        user = get_current_user()
-        incidents = [i for i in incidents if i.get('assigned_to') == user['id']]
-    elif assigned_filter == 'unassigned':
-        incidents = [i for i in incidents if not i.get('assigned_to')]
-    
-    # Sort by priority and date
-    incidents = sorted(incidents, key=lambda x: (
-        {'critical': 0, 'major': 1, 'moderate': 2, 'minor': 3}.get(x.get('severity', 'minor'), 3),
-        x.get('created_at', '')
-    ), reverse=True)
+    filters = {
+        'severity': request.args.get('severity'),
+        'status': request.args.get('status'),
+        'location': request.args.get('location'),
+        'assigned': request.args.get('assigned')
+    }
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    # Highest dynamic priority first (severity, age, corroboration, density),
+    # read off the priority heap: only the pages up to this one are ranked
+    incidents, has_next = get_incident_page(filters, page, INCIDENTS_PER_PAGE, get_current_user()['id'])
     
     return render_template('dashboard/incidents.html', 
                          incidents=incidents,
-                         filters={
-                             'severity': severity_filter,
-                             'status': status_filter,
-                             'location': location_filter,
-                             'assigned': assigned_filter
-                         })
+                         page=page,
+                         has_next=has_next,
+                         filters=filters)
 
 @dashboard_bp.route('/analytics')
 @require_auth()
 def analytics():
     """Analytics and reporting dashboard"""
-    incidents = storage.get_incidents()
-    
     # Generate analytics data
-    analytics_data = generate_analytics_data(incidents)
+    analytics_data = generate_analytics_data(storage, rollups, hotspot_engine)
     
     return render_template('dashboard/analytics.html', 
                          analytics=analytics_data)
@@ -113,21 +119,123 @@ def profile():
 @require_auth()
 def api_stats():
     """API endpoint for dashboard statistics"""
-    incidents = storage.get_incidents()
-    stats = calculate_dashboard_stats(incidents)
+    stats = calculate_dashboard_stats(storage)
     return jsonify(stats)
 
 @dashboard_bp.route('/api/timeline')
 @require_auth()
 def api_timeline():
-    """API endpoint for timeline data"""
-    incidents = storage.get_incidents()
+    """API endpoint for timeline data, e.g. ?range=7d&granularity=hour"""
+    try:
+        span = parse_range(request.args.get('range', '30d'))
+    except ValueError:
+        return jsonify({'error': 'range must look like 24h, 30d or 12m'}), 400
     
-    # Generate timeline data for last 30 days
-    timeline_data = generate_timeline_data(incidents, days=30)
+    granularity = request.args.get('granularity') or default_granularity(span)
+    if granularity not in TIMELINE_LABELS:
+        return jsonify({'error': 'granularity must be hour, day or month'}), 400
+    
+    timeline_data = generate_timeline_data(rollups, span, granularity)
     
     return jsonify(timeline_data)
 
+@dashboard_bp.route('/api/next-up')
+@require_auth()
+def api_next_up():
+    """API endpoint for the highest-priority open incidents"""
+    k = min(max(request.args.get('k', NEXT_UP_COUNT, type=int), 1), 100)
+    return jsonify(get_next_up(k))
+
+@dashboard_bp.route('/api/sla')
+@require_auth()
+def api_sla():
+    """API endpoint for SLA breach counts and the most overdue incidents (?limit=)"""
+    limit = min(max(request.args.get('limit', NEXT_UP_COUNT, type=int), 1), 100)
+    return jsonify({'stats': sla_monitor.stats(), 'breaches': sla_monitor.breaches(limit)})
+
+@dashboard_bp.route('/api/route')
+@require_auth()
+def api_route():
+    """API endpoint for a short visiting order of a crew's open incidents
+    
+    ?user_id= (default: the current user), optional ?start_lat=&start_lng=
+    for where the crew sets out from and ?round_trip=1 to come back there.
+    """
+    user = get_current_user()
+    user_id = request.args.get('user_id') or user['id']
+    start = None
+    if request.args.get('start_lat') or request.args.get('start_lng'):
+        try:
+            start = (float(request.args['start_lat']), float(request.args['start_lng']))
+        except (KeyError, ValueError):
+            return jsonify({'error': 'start_lat and start_lng must both be numbers'}), 400
+    round_trip = request.args.get('round_trip') in ('1', 'true')
+    
+    incidents = storage.get_incidents({'assigned_to': user_id, 'open': True, 'archived': False})
+    located = [i for i in incidents if has_coordinates(i)]
+    # Too many to route at once: take the most urgent
+    truncated = len(located) > MAX_STOPS
+    if truncated:
+        priority_engine.ensure_built()
+        located.sort(key=priority_engine.sort_key, reverse=True)
+        located = located[:MAX_STOPS]
+    
+    stops = [{
+        'id': incident['id'],
+        'location': incident.get('location'),
+        'severity': incident.get('severity'),
+        'status': incident.get('status'),
+        'latitude': incident['latitude'],
+        'longitude': incident['longitude']
+    } for incident in located]
+    
+    plan = plan_route(stops, start=start, round_trip=round_trip)
+    plan.update({
+        'user_id': user_id,
+        'start': {'latitude': start[0], 'longitude': start[1]} if start else None,
+        'round_trip': round_trip and start is not None,
+        'truncated': truncated,
+        'unlocated': [i['id'] for i in incidents if not has_coordinates(i)]
+    })
+    return jsonify(plan)
+
+@dashboard_bp.route('/api/heatmap')
+@require_auth()
+def api_heatmap():
+    """API endpoint for the incident density heatmap
+    
+    ?level=0..3 picks the cell size (50 m doubling per level, default 100 m),
+    ?open=1 counts only open incidents and ?bbox=south,west,north,east
+    limits the cells to the visible map.
+    """
+    level = request.args.get('level', 1, type=int)
+    limit = min(max(request.args.get('limit', MAX_HEATMAP_CELLS, type=int), 1), MAX_HEATMAP_CELLS)
+    bbox = None
+    if request.args.get('bbox'):
+        try:
+            bbox = [float(value) for value in request.args['bbox'].split(',')]
+        except ValueError:
+            bbox = None
+        if not bbox or len(bbox) != 4:
+            return jsonify({'error': 'bbox must be south,west,north,east'}), 400
+    open_only = request.args.get('open') in ('1', 'true')
+    return jsonify(hotspot_engine.heatmap(level, open_only=open_only, bbox=bbox, limit=limit))
+
+@dashboard_bp.route('/api/hotspots')
+@require_auth()
+def api_hotspots():
+    """API endpoint for the densest incident clusters, ?limit= and ?open=1"""
+    limit = min(max(request.args.get('limit', ANALYTICS_HOTSPOTS, type=int), 1), MAX_HOTSPOTS)
+    open_only = request.args.get('open') in ('1', 'true')
+    return jsonify(hotspot_engine.hotspots(limit, open_only=open_only))
+
+@dashboard_bp.route('/api/detection')
+@require_auth()
+def api_detection():
+    """API endpoint for photo detection throughput"""
+    from utils.detection import get_detection_service
+    return jsonify(get_detection_service(storage).stats())
+
 @dashboard_bp.route('/api/assign', methods=['POST'])
 @require_auth()
 def api_assign_incident():
@@ -174,34 +282,68 @@ def api_update_status():
         return jsonify({'error': 'Failed to update status'}), 500
 
 # Helper functions
-def calculate_dashboard_stats(incidents):
+def get_next_up(k):
+    """Top ``k`` open incidents by priority, each with its current score"""
+    next_up = []
+    for score, incident in priority_engine.top(k, lambda i: i.get('status') != 'resolved'):
+        entry = incident.to_dict()
+        entry['priority_score'] = score
+        next_up.append(entry)
+    return next_up
+
+def get_incident_page(filters, page=1, per_page=INCIDENTS_PER_PAGE, user_id=None):
+    """One page of the incidents list, highest priority first, and whether another follows
+    
+    ``filters`` takes severity, status, location (matched normalized, as
+    in storage) and assigned ('me' for ``user_id``, or 'unassigned').
+    Walks the priority heap, so it costs O(k log n) for the k incidents up
+    to the end of the page, plus those the filters reject. Archived
+    incidents aren't in the heap; search still finds them.
+    """
+    severity = filters.get('severity')
+    status = filters.get('status')
+    location = normalize_location(filters['location']) if filters.get('location') else None
+    assigned = filters.get('assigned')
+    
+    def matches(incident):
+        if severity and incident.get('severity') != severity:
+            return False
+        if status and incident.get('status') != status:
+            return False
+        if assigned == 'me' and incident.get('assigned_to') != user_id:
+            return False
+        if assigned == 'unassigned' and incident.get('assigned_to'):
+            return False
+        return not location or location in normalize_location(incident.get('location'))
+    
+    end = page * per_page
+    # Resolved incidents rank last: a filter on an open status never has to walk past them
+    ranked = priority_engine.top(end + 1, matches, open_only=bool(status) and status != 'resolved')
+    return [incident.to_dict() for _, incident in ranked[end - per_page:end]], len(ranked) > end
+
+def calculate_dashboard_stats(storage):
     """Calculate dashboard statistics"""
-    total = len(incidents)
+    counts = storage.get_incident_counts()
+    total = counts['total']
     
     # Status counts
     status_counts = {
-        'reported': len([i for i in incidents if i.get('status') == 'reported']),
-        'in-progress': len([i for i in incidents if i.get('status') == 'in-progress']),
-        'resolved': len([i for i in incidents if i.get('status') == 'resolved'])
+        status: counts['status'].get(status, 0)
+        for status in ('reported', 'in-progress', 'resolved')
     }
     
     # Severity counts
     severity_counts = {
-        'critical': len([i for i in incidents if i.get('severity') == 'critical']),
-        'major': len([i for i in incidents if i.get('severity') == 'major']),
-        'moderate': len([i for i in incidents if i.get('severity') == 'moderate']),
-        'minor': len([i for i in incidents if i.get('severity') == 'minor'])
+        severity: counts['severity'].get(severity, 0)
+        for severity in ('critical', 'major', 'moderate', 'minor')
     }
     
     # Calculate resolution rate
     resolution_rate = (status_counts['resolved'] / total * 100) if total > 0 else 0
     
-    # Recent activity (last 7 days)
+    # Recent activity (last 7 days); only the newest partitions are opened
     week_ago = (datetime.utcnow() - timedelta(days=7)).isoformat()
-    recent_incidents = [
-        i for i in incidents 
-        if i.get('created_at', '') > week_ago
-    ]
+    recent_incidents = storage.get_incidents({'since': week_ago})
     
     return {
         'total': total,
@@ -209,73 +351,74 @@ def calculate_dashboard_stats(incidents):
         'severity': severity_counts,
         'resolution_rate': round(resolution_rate, 1),
         'recent_count': len(recent_incidents),
-        'unassigned': len([i for i in incidents if not i.get('assigned_to')])
+        'unassigned': counts['unassigned']
     }
 
-def generate_analytics_data(incidents):
+def generate_analytics_data(storage, rollups, hotspot_engine):
     """Generate analytics data for charts"""
-    # Monthly trend data
-    monthly_data = {}
-    for incident in incidents:
-        created_at = incident.get('created_at', '')
-        if created_at:
-            try:
-                date = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                month_key = date.strftime('%Y-%m')
-                monthly_data[month_key] = monthly_data.get(month_key, 0) + 1
-            except:
-                continue
-    
-    # Sort months
-    sorted_months = sorted(monthly_data.keys())
+    # Monthly trend data, straight from the monthly rollups
+    monthly = rollups.all_buckets('month')
+    # Distributions from the manifest totals; no incident is loaded
+    counts = storage.get_incident_counts()
     
     return {
+        'hotspots': hotspot_engine.hotspots(ANALYTICS_HOTSPOTS)['hotspots'],
         'monthly_trend': {
-            'labels': [datetime.strptime(m, '%Y-%m').strftime('%b %Y') for m in sorted_months],
-            'data': [monthly_data[m] for m in sorted_months]
+            'labels': [month.strftime('%b %Y') for month, _ in monthly],
+            'data': [bucket['created'] for _, bucket in monthly]
         },
         'severity_distribution': {
-            'critical': len([i for i in incidents if i.get('severity') == 'critical']),
-            'major': len([i for i in incidents if i.get('severity') == 'major']),
-            'moderate': len([i for i in incidents if i.get('severity') == 'moderate']),
-            'minor': len([i for i in incidents if i.get('severity') == 'minor'])
+            severity: counts['severity'].get(severity, 0)
+            for severity in ('critical', 'major', 'moderate', 'minor')
         },
         'status_distribution': {
-            'reported': len([i for i in incidents if i.get('status') == 'reported']),
-            'in-progress': len([i for i in incidents if i.get('status') == 'in-progress']),
-            'resolved': len([i for i in incidents if i.get('status') == 'resolved'])
+            status: counts['status'].get(status, 0)
+            for status in ('reported', 'in-progress', 'resolved')
         }
     }
 
-def generate_timeline_data(incidents, days=30):
-    """Generate timeline data for the last N days"""
+TIMELINE_LABELS = {'hour': '%m/%d %H:00', 'day': '%m/%d', 'month': '%b %Y'}
+RANGE_UNITS = {'h': timedelta(hours=1), 'd': timedelta(days=1), 'w': timedelta(weeks=1), 'm': timedelta(days=30), 'y': timedelta(days=365)}
+MAX_RANGE = timedelta(days=3650)
+
+def parse_range(value):
+    """Parse a range like '24h', '30d', '12m' or a bare number of days"""
+    value = (value or '').strip().lower()
+    if value.isdigit():
+        span = timedelta(days=int(value))
+    elif len(value) > 1 and value[:-1].isdigit() and value[-1] in RANGE_UNITS:
+        span = int(value[:-1]) * RANGE_UNITS[value[-1]]
+    else:
+        raise ValueError(value)
+    if span <= timedelta(0) or span > MAX_RANGE:
+        raise ValueError(value)
+    return span
+
+def default_granularity(span):
+    """Pick a bucket size that keeps the chart to a sensible number of points"""
+    if span <= timedelta(days=3):
+        return 'hour'
+    if span <= timedelta(days=120):
+        return 'day'
+    return 'month'
+
+def generate_timeline_data(rollups, span=timedelta(days=30), granularity='day'):
+    """Generate timeline data for the last ``span`` from the rollups"""
     end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=days)
-    
-    # Create daily buckets
-    daily_counts = {}
-    current_date = start_date
-    while current_date <= end_date:
-        date_key = current_date.strftime('%Y-%m-%d')
-        daily_counts[date_key] = 0
-        current_date += timedelta(days=1)
-    
-    # Count incidents per day
-    for incident in incidents:
-        created_at = incident.get('created_at', '')
-        if created_at:
-            try:
-                date = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                if start_date <= date <= end_date:
-                    date_key = date.strftime('%Y-%m-%d')
-                    daily_counts[date_key] = daily_counts.get(date_key, 0) + 1
-            except:
-                continue
-    
-    # Sort dates
-    sorted_dates = sorted(daily_counts.keys())
+    start_date = end_date - span
+    if granularity == 'hour' and span > timedelta(days=7):
+        # Hourly buckets are only retained for a limited window
+        granularity = 'day'
+    
+    points = rollups.series(granularity, start_date, end_date)
     
     return {
-        'labels': [datetime.strptime(d, '%Y-%m-%d').strftime('%m/%d') for d in sorted_dates],
-        'data': [daily_counts[d] for d in sorted_dates]
+        'granularity': granularity,
+        'labels': [moment.strftime(TIMELINE_LABELS[granularity]) for moment, _ in points],
+        'data': [bucket['created'] for _, bucket in points],
+        'resolved': [bucket['resolved'] for _, bucket in points],
+        'severity': {
+            severity: [bucket['severity'].get(severity, 0) for _, bucket in points]
+            for severity in ('critical', 'major', 'moderate', 'minor')
+        }
     }
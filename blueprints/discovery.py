@@ -1,21 +1,35 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, session, send_from_directory, abort
 from utils.auth import login_user, logout_user, get_current_user
-from utils.storage import StorageManager
+from utils.storage import get_storage
 from utils.data_models import Incident
+from utils.uploads import UploadStore, UploadError
+from utils.locations import get_location_index
+from utils.priority import get_priority_engine
 import json
+import os
 
 discovery_bp = Blueprint('discovery', __name__)
-storage = StorageManager()
+# Bound when the blueprint is registered, so importing it has no side effects
+storage = None
+uploads = None
+
+@discovery_bp.record_once
+def bind_storage(state):
+    global storage, uploads
+    storage = get_storage()
+    uploads = UploadStore(os.path.join(storage.data_dir, 'uploads'))
+
+MAX_PHOTOS_PER_REPORT = 5
 
 @discovery_bp.route('/')
 def index():
     """Public homepage with incident map and statistics"""
     # Get recent incidents for public display (anonymized)
-    incidents = storage.get_incidents()
+    incidents = storage.get_recent_incidents(50)
     
-    # Limit to recent incidents and remove sensitive data
+    # Remove sensitive data
     public_incidents = []
-    for incident in incidents[-50:]:  # Last 50 incidents
+    for incident in incidents:
         public_incident = {
             'id': incident.get('id'),
             'location': incident.get('location', 'Unknown'),
@@ -27,12 +41,13 @@ def index():
         }
         public_incidents.append(public_incident)
     
-    # Calculate public statistics
+    # Calculate public statistics from the partition manifest
+    counts = storage.get_incident_counts()
     stats = {
-        'total_incidents': len(incidents),
-        'resolved_incidents': len([i for i in incidents if i.get('status') == 'resolved']),
-        'critical_incidents': len([i for i in incidents if i.get('severity') == 'critical']),
-        'in_progress': len([i for i in incidents if i.get('status') == 'in-progress'])
+        'total_incidents': counts['total'],
+        'resolved_incidents': counts['status'].get('resolved', 0),
+        'critical_incidents': counts['severity'].get('critical', 0),
+        'in_progress': counts['status'].get('in-progress', 0)
     }
     
     return render_template('discovery/index.html', 
@@ -86,8 +101,30 @@ def submit_report():
             longitude=lng
         )
         
+        # Attach photos: files posted with the form, plus ones sent earlier through the chunked upload API
+        try:
+            incident.photos = collect_report_photos()
+        except UploadError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('discovery.report_incident'))
+        
+        incident_data = incident.to_dict()
+        # A report next to an open incident corroborates it, raising its priority
+        if lat is not None and lng is not None:
+            nearby = get_priority_engine(storage).nearest_open(lat, lng)
+            if nearby:
+                incident_data['corroborates'] = nearby
+        
         # Save incident
-        incident_id = storage.save_incident(incident.to_dict())
+        incident_id = storage.save_incident(incident_data)
+        
+        # Classify the photos in the background; severity is filled in when confident
+        if incident.photos:
+            # Imported on first use: the detection model and its pool are heavy
+            from utils.detection import get_detection_service
+            get_detection_service(storage).enqueue(
+                incident_id, [uploads.original_path(photo) for photo in incident.photos]
+            )
         
         flash('Thank you! Your incident report has been submitted successfully.', 'success')
         return redirect(url_for('discovery.report_success', incident_id=incident_id))
@@ -96,6 +133,69 @@ def submit_report():
         flash('An error occurred while submitting your report. Please try again.', 'error')
         return redirect(url_for('discovery.report_incident'))
 
+def collect_report_photos():
+    """Store the photos attached to a report and return their records"""
+    photos = []
+    seen = set()
+    
+    for photo_id in request.form.getlist('photo_ids'):
+        photo = uploads.get_photo(photo_id.strip())
+        if photo and photo['sha256'] not in seen:
+            seen.add(photo['sha256'])
+            photos.append(photo)
+    
+    for file in request.files.getlist('photos'):
+        if not file or not file.filename:
+            continue
+        photo = uploads.save_stream(file.stream, file.filename)
+        if photo['sha256'] not in seen:
+            seen.add(photo['sha256'])
+            photo.pop('duplicate', None)
+            photos.append(photo)
+    
+    if len(photos) > MAX_PHOTOS_PER_REPORT:
+        raise UploadError(f'Please attach at most {MAX_PHOTOS_PER_REPORT} photos.')
+    
+    return photos
+
+@discovery_bp.route('/api/uploads', methods=['POST'])
+def api_begin_upload():
+    """Start a chunked photo upload"""
+    data = request.get_json(silent=True) or {}
+    upload_id = uploads.begin_upload(data.get('filename', ''))
+    return jsonify({'upload_id': upload_id, 'offset': 0}), 201
+
+@discovery_bp.route('/api/uploads/<upload_id>', methods=['PATCH'])
+def api_upload_chunk(upload_id):
+    """Append one chunk to an upload; the body is streamed straight to disk"""
+    try:
+        offset = int(request.headers.get('Upload-Offset', 0))
+        new_offset = uploads.append_chunk(upload_id, request.stream, offset)
+    except ValueError:
+        return jsonify({'error': 'Invalid Upload-Offset header'}), 400
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 409
+    
+    return jsonify({'upload_id': upload_id, 'offset': new_offset})
+
+@discovery_bp.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def api_complete_upload(upload_id):
+    """Finish a chunked upload and return the stored photo"""
+    try:
+        photo = uploads.finish_upload(upload_id)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'photo_id': photo['sha256'], 'photo': photo})
+
+@discovery_bp.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    """Serve stored photo variants"""
+    # Originals keep their EXIF (GPS) data, so only the derived variants are public
+    if not filename.startswith(('thumbs/', 'web/')):
+        abort(404)
+    return send_from_directory(os.path.abspath(uploads.upload_dir), filename, max_age=86400 * 365)
+
 @discovery_bp.route('/report/success/<incident_id>')
 def report_success(incident_id):
     """Report submission success page"""
@@ -155,23 +255,30 @@ def api_incidents():
     
     return jsonify(public_incidents)
 
+@discovery_bp.route('/api/locations/suggest')
+def api_location_suggest():
+    """API endpoint for location autocomplete: known locations by typed prefix"""
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', 10, type=int)
+    
+    suggestions = get_location_index(storage).suggest(query, limit=limit)
+    
+    return jsonify({'query': query, 'suggestions': suggestions})
+
 @discovery_bp.route('/api/stats')
 def api_stats():
     """API endpoint for public statistics"""
-    incidents = storage.get_incidents()
+    counts = storage.get_incident_counts()
     
     stats = {
-        'total': len(incidents),
+        'total': counts['total'],
         'severity': {
-            'critical': len([i for i in incidents if i.get('severity') == 'critical']),
-            'major': len([i for i in incidents if i.get('severity') == 'major']),
-            'moderate': len([i for i in incidents if i.get('severity') == 'moderate']),
-            'minor': len([i for i in incidents if i.get('severity') == 'minor'])
+            severity: counts['severity'].get(severity, 0)
+            for severity in ('critical', 'major', 'moderate', 'minor')
         },
         'status': {
-            'reported': len([i for i in incidents if i.get('status') == 'reported']),
-            'in-progress': len([i for i in incidents if i.get('status') == 'in-progress']),
-            'resolved': len([i for i in incidents if i.get('status') == 'resolved'])
+            status: counts['status'].get(status, 0)
+            for status in ('reported', 'in-progress', 'resolved')
         }
     }
     
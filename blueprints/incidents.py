@@ -1,12 +1,20 @@
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
 from utils.auth import require_auth, get_current_user
-from utils.storage import StorageManager
+from utils.storage import get_storage
 from utils.data_models import Incident
+from utils.traces import ingest_trace, TraceError
+from utils.search import get_search_index
 from datetime import datetime
 import json
 
 incidents_bp = Blueprint('incidents', __name__)
-storage = StorageManager()
+# Bound when the blueprint is registered, so importing it has no side effects
+storage = None
+
+@incidents_bp.record_once
+def bind_storage(state):
+    global storage
+    storage = get_storage()
 
 @incidents_bp.route('/')
 @require_auth()
@@ -77,7 +85,10 @@ def view(incident_id):
         flash('Incident not found.', 'error')
         return redirect(url_for('dashboard.incidents_list'))
     
-    return render_template('incidents/view.html', incident=incident)
+    # Comments live in their own store; only one page of them is read
+    comments = storage.get_comments(incident_id, page=request.args.get('comments_page', 1, type=int))
+    
+    return render_template('incidents/view.html', incident=incident, comments=comments)
 
 @incidents_bp.route('/<incident_id>/edit')
 @require_auth()
@@ -237,31 +248,19 @@ def add_comment(incident_id):
             flash('Comment cannot be empty.', 'error')
             return redirect(url_for('incidents.view', incident_id=incident_id))
         
-        # Get current incident
-        incident = storage.get_incident(incident_id)
-        if not incident:
-            flash('Incident not found.', 'error')
-            return redirect(url_for('dashboard.incidents_list'))
-        
-        # Add comment to incident
-        comments = incident.get('comments', [])
-        new_comment = {
-            'id': len(comments) + 1,
+        # Appends one line to the comment store; bumping comment_count rewrites the incident's partition
+        comment = storage.add_comment(incident_id, {
             'text': comment_text,
             'author': user['username'],
             'author_id': user['id'],
             'created_at': datetime.utcnow().isoformat()
-        }
-        comments.append(new_comment)
-        
-        # Update incident with new comment
-        success = storage.update_incident(incident_id, {'comments': comments})
+        })
         
-        if success:
-            flash('Comment added successfully!', 'success')
-        else:
-            flash('Failed to add comment.', 'error')
+        if not comment:
+            flash('Incident not found.', 'error')
+            return redirect(url_for('dashboard.incidents_list'))
         
+        flash('Comment added successfully!', 'success')
         return redirect(url_for('incidents.view', incident_id=incident_id))
         
     except Exception as e:
@@ -292,6 +291,40 @@ def api_incidents():
     
     return jsonify(incidents)
 
+@incidents_bp.route('/api/search')
+@require_auth()
+def api_search():
+    """Full-text search over descriptions, locations and comments, best match first"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Query parameter q is required'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+
+    found = get_search_index(storage).search(
+        query,
+        severity=request.args.get('severity') or None,
+        status=request.args.get('status') or None,
+        limit=limit,
+        offset=offset,
+        prefix=request.args.get('prefix') in ('1', 'true')
+    )
+
+    results = []
+    for incident_id, score in found['hits']:
+        incident = storage.get_incident(incident_id)
+        if incident:
+            incident['score'] = score
+            results.append(incident)
+
+    return jsonify({
+        'query': query,
+        'total': found['total'],
+        'limit': limit,
+        'offset': offset,
+        'results': results
+    })
+
 @incidents_bp.route('/api/incidents/<incident_id>')
 @require_auth()
 def api_incident(incident_id):
@@ -303,6 +336,19 @@ def api_incident(incident_id):
     
     return jsonify(incident)
 
+@incidents_bp.route('/api/incidents/<incident_id>/comments')
+@require_auth()
+def api_comments(incident_id):
+    """API endpoint for one page of an incident's comments"""
+    if not storage.index.get(incident_id):
+        return jsonify({'error': 'Incident not found'}), 404
+    
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+    newest_first = request.args.get('order') == 'newest'
+    
+    return jsonify(storage.get_comments(incident_id, page, per_page, newest_first))
+
 @incidents_bp.route('/api/incidents/<incident_id>/assign', methods=['POST'])
 @require_auth()
 def api_assign(incident_id):
@@ -343,3 +389,30 @@ def api_update_status(incident_id):
         return jsonify({'success': True, 'message': 'Status updated successfully'})
     else:
         return jsonify({'error': 'Failed to update status'}), 500
+
+@incidents_bp.route('/api/traces', methods=['POST'])
+@require_auth()
+def api_ingest_trace():
+    """API endpoint to ingest a vehicle accelerometer/GPS trace (CSV)"""
+    # Accept either a multipart upload or a raw CSV body; both are read in blocks
+    trace_file = request.files.get('trace')
+    stream = trace_file.stream if trace_file else request.stream
+    
+    try:
+        threshold_g = float(request.args.get('threshold_g', 0.5))
+        sample_rate = float(request.args.get('sample_rate', 100))
+    except ValueError:
+        return jsonify({'error': 'threshold_g and sample_rate must be numbers'}), 400
+    
+    try:
+        summary = ingest_trace(
+            stream,
+            storage,
+            vehicle_id=request.args.get('vehicle_id'),
+            threshold_g=threshold_g,
+            sample_rate=sample_rate
+        )
+    except TraceError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(summary)
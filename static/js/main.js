@@ -279,34 +279,44 @@ class PotholesApp {
   }
 
   initializeLocationAutocomplete(input) {
-    // Simple location suggestions (in production, use a proper geocoding service)
-    const suggestions = [
-      "Main Street",
-      "Broadway",
-      "First Avenue",
-      "Second Avenue",
-      "Park Avenue",
-      "Oak Street",
-      "Elm Street",
-      "Maple Avenue",
-    ]
+    // Suggestions come from locations already reported, most frequent first
+    let timer = null
+    let pending = null
 
     input.addEventListener("input", (e) => {
-      const value = e.target.value.toLowerCase()
-      if (value.length < 2) return
-
-      const matches = suggestions.filter((s) => s.toLowerCase().includes(value))
-
-      // Create or update datalist
-      let datalist = document.getElementById(input.id + "-suggestions")
-      if (!datalist) {
-        datalist = document.createElement("datalist")
-        datalist.id = input.id + "-suggestions"
-        input.setAttribute("list", datalist.id)
-        input.parentNode.appendChild(datalist)
-      }
+      const value = e.target.value
+      clearTimeout(timer)
+      if (value.trim().length < 2) return
+
+      timer = setTimeout(async () => {
+        if (pending) pending.abort()
+        pending = window.AbortController ? new AbortController() : null
+        let matches = []
+        try {
+          const response = await fetch(`/api/locations/suggest?q=${encodeURIComponent(value)}&limit=8`, {
+            signal: pending ? pending.signal : undefined,
+          })
+          matches = (await response.json()).suggestions.map((s) => s.location)
+        } catch (error) {
+          return
+        }
 
-      datalist.innerHTML = matches.map((match) => `<option value="${match}">`).join("")
+        // Create or update datalist
+        let datalist = document.getElementById(input.id + "-suggestions")
+        if (!datalist) {
+          datalist = document.createElement("datalist")
+          datalist.id = input.id + "-suggestions"
+          input.setAttribute("list", datalist.id)
+          input.parentNode.appendChild(datalist)
+        }
+
+        datalist.innerHTML = ""
+        matches.forEach((match) => {
+          const option = document.createElement("option")
+          option.value = match
+          datalist.appendChild(option)
+        })
+      }, 120)
     })
   }
 
@@ -0,0 +1,40 @@
+"""Shared fixtures: the app keeps its data in ./data, so every test runs in a scratch directory"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Snapshot builds run on background threads that would outlive the scratch directory
+os.environ.setdefault('INCIDENT_SNAPSHOT', '0')
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    from utils import audit
+    monkeypatch.chdir(tmp_path)
+    # Storage writes are audited through a process-wide log opened in ./data
+    monkeypatch.setattr(audit, '_audit_log', None)
+    return tmp_path
+
+
+@pytest.fixture
+def storage(workdir):
+    from utils.storage import StorageManager
+    return StorageManager()
+
+
+@pytest.fixture
+def listen():
+    """Subscribe callbacks to storage writes for the duration of a test"""
+    from utils.storage import StorageManager
+    callbacks = []
+
+    def add(callback):
+        StorageManager.add_listener(callback)
+        callbacks.append(callback)
+        return callback
+
+    yield add
+    for callback in callbacks:
+        StorageManager.remove_listener(callback)
@@ -0,0 +1,74 @@
+import os
+import random
+
+import pytest
+
+from utils import audit
+from utils.audit import AuditLog
+
+
+def entries(count, start=0):
+    return [{
+        'user_id': f'user-{i % 3}',
+        'action': 'incident.update',
+        'target_type': 'incident',
+        'target_id': f'inc-{i % 7}',
+        'details': f'entry {i}',
+    } for i in range(start, start + count)]
+
+
+@pytest.fixture
+def log(monkeypatch):
+    # Small segments, so paging crosses segment boundaries
+    monkeypatch.setattr(audit, 'SEGMENT_BYTES', 4096)
+    log = AuditLog()
+    for start in range(0, 1000, 25):
+        log.append(entries(25, start))
+    return log
+
+
+def test_pages_are_newest_first_across_segments(log):
+    assert len(log.segments()) > 5
+    assert log.count() == 1000
+    seen = []
+    for page in range(1, 36):
+        result = log.page(page, per_page=30)
+        assert result['total'] == 1000 and result['pages'] == 34
+        seen.extend(entry['details'] for entry in result['entries'])
+    assert seen == [f'entry {i}' for i in range(999, -1, -1)]
+
+
+def test_filtered_pages(log):
+    result = log.page(2, per_page=20, actor='user-1', incident='inc-3')
+    expected = [i for i in range(999, -1, -1) if i % 3 == 1 and i % 7 == 3]
+    assert result['total'] == len(expected)
+    assert [entry['seq'] for entry in result['entries']] == expected[20:40]
+    assert log.page(1, actor='nobody')['entries'] == []
+
+
+def test_read_any_entries(log):
+    seqs = random.Random(1).sample(range(1000), 200) + [5000]
+    assert [entry['seq'] for entry in log.read(seqs)] == seqs[:-1]
+
+
+def test_another_process_sees_new_entries(log):
+    reader = AuditLog()
+    assert reader.page(1, per_page=5, actor='user-0')['total'] == 334
+    log.append(entries(3, 1000))
+    assert reader.count() == 1003
+    assert reader.page(1, per_page=5, actor='user-0')['total'] == 335
+
+
+def test_a_torn_write_is_cut_off():
+    log = AuditLog()
+    log.append(entries(10))
+    path = log._path(log.segments()[-1], 'log')
+    with open(path, 'ab') as f:
+        f.write(b'{"user_id":"half')
+    # A writer in another process finds the partial line
+    other = AuditLog()
+    assert other.append(entries(1, 10)) == [10]
+    assert [entry['details'] for entry in other.page(1, per_page=2)['entries']] == ['entry 10', 'entry 9']
+    with open(path, 'rb') as f:
+        assert b'half' not in f.read()
+    assert os.path.getsize(path) == other._tail[2]
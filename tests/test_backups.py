@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+from utils import backups as backups_module
+from utils.audit import AuditLog
+from utils.backups import BackupError, BackupStore, chunk_path
+from utils.storage import StorageManager
+
+
+def report(storage, location):
+    return storage.save_incident({'location': location, 'description': 'Deep pothole',
+                                  'severity': 'major', 'status': 'reported'})
+
+
+def test_restore_round_trip(storage, workdir, monkeypatch):
+    ids = {report(storage, f'{n} Main St') for n in range(5)}
+    commented = next(iter(ids))
+    storage.add_comment(commented, {'author': 'crew', 'text': 'Cones placed'})
+    backups = BackupStore()
+    backup = backups.create()
+    audited = AuditLog().count()
+
+    # Written after the backup: not in it
+    report(storage, 'Elm St')
+    assert backups.verify(backup['id']) > 0
+    restored = backups.restore(backup['id'], str(workdir / 'restored' / 'data'))
+    assert restored['files'] == len(backup['files'])
+
+    monkeypatch.chdir(workdir / 'restored')
+    copy = StorageManager()
+    assert {incident['id'] for incident in copy.get_incidents()} == ids
+    assert copy.get_incident(commented)['comment_count'] == 1
+    assert [comment['text'] for comment in copy.get_comments(commented)['comments']] == ['Cones placed']
+    assert AuditLog().count() == audited
+
+
+def test_backups_store_only_what_changed(storage, monkeypatch):
+    # Small chunks, so the logs span several
+    monkeypatch.setattr(backups_module, 'CHUNK_BYTES', 256)
+    for n in range(20):
+        report(storage, f'{n} Oak Ave')
+    backups = BackupStore()
+    first = backups.create()
+    assert first['new_chunks'] > 0 and first['parent'] is None
+
+    unchanged = backups.create()
+    assert unchanged['parent'] == first['id']
+    assert unchanged['new_chunks'] == 0 and unchanged['read_bytes'] == 0
+
+    report(storage, 'Park Rd')
+    changed = backups.create()
+    # Appended logs: their full chunks are kept, only the tail is read
+    log = 'audit/00000000000000000000.log'
+    kept = first['files'][log]['size'] // 256
+    assert changed['files'][log]['chunks'][:kept] == first['files'][log]['chunks'][:kept]
+    assert changed['read_bytes'] < changed['total_bytes']
+    assert [backup['id'] for backup in backups.list()] == [changed['id'], unchanged['id'], first['id']]
+
+
+def test_damage_is_detected(storage, workdir):
+    report(storage, 'Main St')
+    backups = BackupStore()
+    backup = backups.create()
+    digest = next(iter(backup['files'].values()))['chunks'][0]
+    with open(chunk_path(backups.backup_dir, digest), 'wb') as f:
+        f.write(b'not a chunk')
+    with pytest.raises(BackupError):
+        backups.verify(backup['id'])
+    with pytest.raises(BackupError):
+        backups.restore(backup['id'], str(workdir / 'restored'))
+
+
+def test_restore_needs_an_empty_target(storage, workdir):
+    report(storage, 'Main St')
+    backups = BackupStore()
+    backup = backups.create()
+    (workdir / 'restored').mkdir()
+    (workdir / 'restored' / 'keep.txt').write_text('x')
+    with pytest.raises(BackupError):
+        backups.restore(backup['id'], str(workdir / 'restored'))
+
+
+def test_prune_keeps_the_newest_restorable(storage, workdir):
+    backups = BackupStore()
+    for n in range(3):
+        report(storage, f'{n} Elm St')
+        backups.create()
+    newest = backups.latest()
+    result = backups.prune(keep=1)
+    assert result['backups'] == 2 and result['chunks'] > 0
+    assert [backup['id'] for backup in backups.list()] == [newest['id']]
+    backups.verify(newest['id'])
+    backups.restore(newest['id'], str(workdir / 'restored'))
+    assert os.path.exists(workdir / 'restored' / 'incidents' / 'manifest.json')
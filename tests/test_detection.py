@@ -0,0 +1,97 @@
+import os
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils import detection
+from utils.detection import DetectionModel, DetectionService
+
+
+class CrashingModel(DetectionModel):
+    """Kills its worker process on an all-black photo, like a decoder segfault"""
+
+    name = 'crashing'
+
+    def predict(self, batch):
+        if (batch.reshape(len(batch), -1).max(axis=1) == 0).any():
+            os._exit(1)
+        return [{'pothole': False, 'severity': 'minor', 'confidence': 0.9} for _ in batch]
+
+
+def photo(path, value):
+    Image.fromarray(np.full((32, 32), value, dtype=np.uint8)).save(path)
+    return path
+
+
+def wait_for(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.05)
+
+
+def reported(storage, photos=None):
+    return storage.save_incident({'location': 'Main St', 'severity': 'minor', 'status': 'reported',
+                                  'photos': photos or [{'original': 'originals/ab/one.png'}]})
+
+
+@pytest.fixture
+def idle(monkeypatch):
+    """Queue without starting the dispatcher or its process pool"""
+    monkeypatch.setattr(DetectionService, '_ensure_started', lambda self: None)
+
+
+def test_pool_crash_then_a_successful_batch(storage):
+    service = DetectionService(storage, model_spec='test_detection:CrashingModel', workers=1, max_wait=0.05)
+    crashed = reported(storage)
+    service.enqueue(crashed, [photo('black.png', 0)])
+    wait_for(lambda: service.stats()['images_failed'] == 1)
+
+    classified = reported(storage)
+    service.enqueue(classified, [photo('road.png', 128)])
+    wait_for(lambda: storage.get_incident(classified).get('detection'))
+    assert storage.get_incident(classified)['detection']['pothole'] is False
+    assert storage.get_incident(crashed).get('detection') is None
+    assert service.stats()['batches'] == 1
+    # Both claims are released, so the crashed incident is retried by the next resume
+    assert os.listdir(service.claims_dir) == []
+    service._executor.shutdown()
+
+
+def test_resume_reads_photos_from_the_data_dir(storage, idle):
+    incident_id = reported(storage)
+    service = DetectionService(storage)
+    assert service.resume() == 1
+    assert service._queue.get_nowait() == (
+        incident_id, os.path.join(storage.data_dir, 'uploads', 'originals/ab/one.png'))
+
+
+def test_resume_skips_incidents_queued_by_another_process(storage, idle, monkeypatch):
+    incident_id = reported(storage)
+    # Two server processes sharing the data directory
+    first, second = DetectionService(storage), DetectionService(storage)
+    assert first.resume() == 1
+    assert second.resume() == 0
+    assert second._queue.empty()
+
+    # The first process died with the incident queued: its claim goes stale
+    monkeypatch.setattr(detection, 'CLAIM_SECONDS', 0)
+    assert second.resume() == 1
+    assert second._queue.get_nowait()[0] == incident_id
+
+
+def test_results_release_the_claim(storage, idle):
+    incident_id = reported(storage)
+    service = DetectionService(storage)
+    service.resume()
+    batch = [service._queue.get_nowait()]
+    service._apply_results(batch, [{'pothole': True, 'severity': 'major', 'confidence': 0.9}])
+
+    incident = storage.get_incident(incident_id)
+    assert incident['severity'] == 'major'
+    assert incident['reported_severity'] == 'minor'
+    assert os.listdir(service.claims_dir) == []
+    # Classified: not queued again
+    assert DetectionService(storage).resume() == 0
@@ -0,0 +1,72 @@
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from utils.geo import METERS_PER_DEGREE
+from utils.hotspots import HotspotEngine
+
+CENTER = (40.7128, -74.0060)
+
+
+def scatter(rng, count, center_m=(0.0, 0.0), spread_m=30.0, uniform_m=None):
+    """``count`` (lat, lng) around a point ``center_m`` metres from CENTER, or uniform over a square"""
+    if uniform_m:
+        offsets = rng.uniform(-uniform_m, uniform_m, (count, 2))
+    else:
+        offsets = np.asarray(center_m) + rng.normal(0, spread_m, (count, 2))
+    lat = CENTER[0] + offsets[:, 0] / METERS_PER_DEGREE
+    lng = CENTER[1] + offsets[:, 1] / (METERS_PER_DEGREE * np.cos(np.radians(CENTER[0])))
+    return list(zip(lat.tolist(), lng.tolist()))
+
+
+def store(storage, coordinates, street='Main St'):
+    now = datetime.utcnow()
+    storage.import_incidents([{
+        'id': str(uuid.uuid4()),
+        'location': f'{i + 1} {street}',
+        'severity': 'major',
+        'status': 'reported',
+        'latitude': lat,
+        'longitude': lng,
+        'created_at': (now - timedelta(days=i % 90)).isoformat(),
+    } for i, (lat, lng) in enumerate(coordinates)])
+
+
+def test_single_cluster_is_a_hotspot(storage):
+    store(storage, scatter(np.random.default_rng(1), 500))
+    hotspots = HotspotEngine(storage).hotspots(10)['hotspots']
+    assert len(hotspots) == 1
+    assert hotspots[0]['incidents'] >= 450
+    assert hotspots[0]['name'] == 'Main Street'
+
+
+def test_clusters_without_noise(storage):
+    rng = np.random.default_rng(2)
+    centres = [(0.0, 0.0), (3000.0, 1000.0), (-2000.0, 2500.0)]
+    store(storage, [point for centre in centres for point in scatter(rng, 100, centre)])
+    hotspots = HotspotEngine(storage).hotspots(10)['hotspots']
+    assert len(hotspots) == 3
+    assert all(hotspot['incidents'] >= 90 for hotspot in hotspots)
+
+
+def test_clusters_stand_out_from_noise(storage):
+    rng = np.random.default_rng(3)
+    centres = [(0.0, 0.0), (3000.0, 1000.0), (-2000.0, 2500.0)]
+    points = [point for centre in centres for point in scatter(rng, 100, centre)]
+    store(storage, points + scatter(rng, 300, uniform_m=5000.0))
+    assert len(HotspotEngine(storage).hotspots(10)['hotspots']) == 3
+
+
+def test_uniform_background_is_not_one_big_hotspot(storage):
+    # Years of reports spread evenly over a district
+    store(storage, scatter(np.random.default_rng(4), 20000, uniform_m=1500.0))
+    assert HotspotEngine(storage).hotspots(10)['hotspots'] == []
+
+
+def test_no_located_incidents(storage):
+    storage.import_incidents([{'id': str(uuid.uuid4()), 'location': 'Elm St', 'severity': 'minor',
+                               'status': 'reported', 'created_at': datetime.utcnow().isoformat()}])
+    result = HotspotEngine(storage).hotspots(10)
+    assert result['points'] == 0
+    assert result['hotspots'] == []
@@ -0,0 +1,112 @@
+import os
+import time
+import threading
+
+import pytest
+
+from utils import jobs
+from utils.jobs import JobQueue, JobScheduler, register_job_type
+
+
+@pytest.fixture(autouse=True)
+def job_types(monkeypatch):
+    """Job types registered by a test are dropped after it"""
+    monkeypatch.setattr(jobs, 'JOB_TYPES', dict(jobs.JOB_TYPES))
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_a_job_is_claimed_once():
+    queue, other = JobQueue(), JobQueue()
+    job_id = queue.enqueue('test.noop', {'n': 1})
+    name = queue.queued()[0]
+    path, job = queue.claim(name)
+    assert job['id'] == job_id and job['payload'] == {'n': 1}
+    assert other.claim(name) is None
+    assert other.queued() == [] and other.inflight() == [name]
+    queue.complete(path)
+    assert queue.inflight() == []
+
+
+def test_queue_runs_in_due_order():
+    queue = JobQueue()
+    later = queue.enqueue('test.noop', delay=60)
+    first = queue.enqueue('test.noop')
+    assert [jobs.parse_job_filename(name)[1] for name in queue.queued()] == [first, later]
+
+
+def test_failed_runs_are_retried_then_parked():
+    calls = []
+
+    def flaky(payload):
+        calls.append(payload)
+        raise RuntimeError('boom')
+
+    register_job_type('test.flaky', flaky, max_attempts=2, backoff_base=0.0)
+    scheduler = JobScheduler()
+    scheduler.enqueue('test.flaky', {'n': 1})
+    for attempts in (1, 2):
+        scheduler.run_pending()
+        wait_for(lambda: not scheduler._running and len(calls) == attempts)
+    assert scheduler.stats_local == {'done': 0, 'retried': 1, 'failed': 1}
+    total, failures = scheduler.queue.failures()
+    assert total == 1
+    assert failures[0]['attempts'] == 2 and failures[0]['last_error'] == 'RuntimeError: boom'
+    assert scheduler.queue.queued() == []
+
+
+def test_concurrency_slots_hold_across_schedulers():
+    started, release = threading.Event(), threading.Event()
+
+    def slow(payload):
+        started.set()
+        release.wait(10)
+
+    register_job_type('test.slow', slow, concurrency=1)
+    # Two schedulers on one job directory stand in for two worker processes
+    first, second = JobScheduler(), JobScheduler()
+    first.enqueue('test.slow')
+    first.enqueue('test.slow')
+    first.run_pending()
+    assert started.wait(10)
+    second.run_pending()
+    assert len(second.queue.queued()) == 1 and not second._running
+    release.set()
+    wait_for(lambda: not first._running)
+    second.run_pending()
+    wait_for(lambda: not second._running and second.stats_local['done'] == 1)
+
+
+def test_abandoned_jobs_are_recovered_after_the_lease():
+    register_job_type('test.noop', lambda payload: None, max_attempts=2)
+    scheduler = JobScheduler()
+    scheduler.enqueue('test.noop')
+    scheduler.enqueue('test.noop')
+    # Claimed by a worker that then died
+    claimed = [scheduler.queue.claim(name)[0] for name in scheduler.queue.queued()]
+    scheduler._recover()
+    assert len(scheduler.queue.inflight()) == 2
+
+    past = time.time() - jobs.LEASE_SECONDS - 1
+    os.utime(claimed[0], (past, past))
+    scheduler._recover()
+    assert len(scheduler.queue.queued()) == 1
+    requeued = scheduler.queue.read(os.path.join(scheduler.queue.queue_dir, scheduler.queue.queued()[0]))
+    assert requeued['attempts'] == 1 and requeued['last_error'] == 'Worker lost'
+    assert [entry['status'] for entry in scheduler.queue.history(0)] == ['lost']
+
+
+def test_heartbeat_keeps_running_jobs_leased():
+    scheduler = JobScheduler()
+    scheduler.queue.enqueue('test.noop')
+    path, _ = scheduler.queue.claim(scheduler.queue.queued()[0])
+    scheduler._running[path] = 'test.noop'
+    past = time.time() - jobs.LEASE_SECONDS - 1
+    os.utime(path, (past, past))
+    scheduler._heartbeat()
+    assert scheduler.queue.stale() == []
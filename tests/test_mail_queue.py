@@ -0,0 +1,74 @@
+import os
+import smtplib
+
+from utils.mail_queue import MailQueue
+
+
+class FakeServer:
+    """Fails the sends whose subject is listed in ``errors``"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.sent = []
+
+    def send_message(self, msg):
+        error = self.errors.get(msg['Subject'])
+        if error:
+            raise error
+        self.sent.append(msg['Subject'])
+
+
+class FakePool:
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.servers = []
+
+    def acquire(self):
+        self.servers.append(FakeServer(self.errors))
+        return self.servers[-1]
+
+    def release(self, server, healthy=True):
+        pass
+
+
+def spooled(mail, directory):
+    return {
+        mail._read(os.path.join(directory, name))['subject']: mail._read(os.path.join(directory, name))
+        for name in os.listdir(directory) if name.endswith('.json')
+    }
+
+
+def test_permanent_rejections_fail_at_once():
+    pool = FakePool({
+        'unknown user': smtplib.SMTPRecipientsRefused({'x@example.com': (550, b'no such user')}),
+        'greylisted': smtplib.SMTPRecipientsRefused({'y@example.com': (450, b'try again later')}),
+        'policy': smtplib.SMTPDataError(554, b'rejected as spam'),
+        'busy': smtplib.SMTPDataError(451, b'local error'),
+    })
+    mail = MailQueue(pool=pool)
+    for subject in ('unknown user', 'greylisted', 'policy', 'busy', 'hello'):
+        mail.enqueue('x@example.com', subject, 'body')
+
+    assert mail.drain() == 1
+    failed = spooled(mail, mail.failed_dir)
+    assert set(failed) == {'unknown user', 'policy'}
+    assert failed['policy']['attempts'] == 0
+    queued = spooled(mail, mail.queue_dir)
+    assert set(queued) == {'greylisted', 'busy'}
+    assert all(message['attempts'] == 1 for message in queued.values())
+    assert mail.stats() == {'sent': 1, 'retried': 2, 'failed': 2, 'queued': 2}
+
+
+def test_a_lost_connection_charges_only_the_failed_message():
+    pool = FakePool({'second': smtplib.SMTPServerDisconnected('gone')})
+    mail = MailQueue(pool=pool)
+    for subject in ('first', 'second', 'third', 'fourth'):
+        mail.enqueue('x@example.com', subject, 'body')
+
+    # The messages after the disconnect go out on a new connection
+    assert mail.drain() == 3
+    assert len(pool.servers) == 2
+    assert sorted(pool.servers[1].sent) == ['fourth', 'third']
+    queued = spooled(mail, mail.queue_dir)
+    assert list(queued) == ['second']
+    assert queued['second']['attempts'] == 1
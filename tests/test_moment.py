@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils.moment import moment
+
+
+def test_format():
+    value = '2024-03-01T14:05:09.123456'
+    assert moment(value).format('MMMM Do, YYYY [at] h:mm A') == 'March 1st, 2024 at 2:05 PM'
+    assert moment(value).format('MMM Do, YYYY [at] h:mm A') == 'Mar 1st, 2024 at 2:05 PM'
+    assert moment(value).format('MMMM YYYY') == 'March 2024'
+    assert moment(datetime(2024, 12, 22, 0, 7)).format('ddd DD/MM/YY hh:mm:ss a') == 'Sun 22/12/24 12:07:00 am'
+    assert [moment(f'2024-01-{day:02d}').format('Do') for day in (2, 3, 11, 12, 13, 21)] == \
+        ['2nd', '3rd', '11th', '12th', '13th', '21st']
+
+
+@pytest.mark.parametrize('ago, text', [
+    (timedelta(seconds=20), 'a few seconds ago'),
+    (timedelta(minutes=1), 'a minute ago'),
+    (timedelta(minutes=7), '7 minutes ago'),
+    (timedelta(hours=5), '5 hours ago'),
+    (timedelta(hours=30), 'a day ago'),
+    (timedelta(days=3), '3 days ago'),
+    (timedelta(days=100), '3 months ago'),
+    (timedelta(days=1000), '3 years ago'),
+    (-timedelta(hours=3), 'in 3 hours'),
+])
+def test_from_now(ago, text):
+    now = datetime(2024, 6, 1, 12, 0)
+    assert moment((now - ago).isoformat()).fromNow(now) == text
+
+
+def test_other_values_render_unchanged():
+    assert moment('Recently').fromNow() == 'Recently'
+    assert moment('soon').format('YYYY') == 'soon'
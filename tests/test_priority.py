@@ -0,0 +1,47 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from utils.priority import PriorityEngine
+
+
+def store(storage, count, seed=1):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    storage.import_incidents([{
+        'id': str(uuid.uuid4()),
+        'location': f'{rng.randint(1, 999)} Main St',
+        'severity': rng.choice(['minor', 'moderate', 'major', 'critical']),
+        # Mostly resolved, like a store that has been running for years
+        'status': rng.choices(['reported', 'in-progress', 'resolved'], [5, 2, 93])[0],
+        'created_at': (now - timedelta(days=rng.uniform(0, 900))).isoformat(),
+    } for _ in range(count)])
+
+
+def test_top_is_ordered_and_filtered(storage):
+    store(storage, 3000)
+    engine = PriorityEngine(storage)
+    ranked = engine.top(3000)
+    assert len(ranked) == 3000
+    assert [score for score, _ in ranked] == sorted((score for score, _ in ranked), reverse=True)
+    critical = engine.top(50, lambda incident: incident.get('severity') == 'critical')
+    assert critical == [pair for pair in ranked if pair[1].get('severity') == 'critical'][:50]
+
+
+def test_open_only_stops_at_the_resolved_incidents(storage):
+    store(storage, 3000)
+    engine = PriorityEngine(storage)
+    opened = sum(1 for _, incident in engine.top(3000) if incident.get('status') != 'resolved')
+    checked = []
+
+    def rare(incident):
+        checked.append(incident)
+        return incident.get('status') == 'reported' and incident.get('severity') == 'critical'
+
+    # Fewer matches than asked for: the walk would otherwise go through every resolved incident
+    ranked = engine.top(100, rare, open_only=True)
+    assert ranked == engine.top(100, rare)
+    assert 0 < len(ranked) < 100
+    checked.clear()
+    engine.top(100, rare, open_only=True)
+    assert len(checked) <= opened
@@ -0,0 +1,123 @@
+import time
+import random
+
+import pytest
+
+from utils import search
+from utils.search import SearchIndex, parse_query
+
+WORDS = ['pothole', 'potholes', 'deep', 'crack', 'lane', 'curb', 'water', 'cover', 'tire', 'edge',
+         'asphalt', 'hole', 'bus', 'stop', 'large', 'small', 'sunken', 'sinkhole']
+# About a third of the documents say pothole and one in six potholes, like the generated data
+WEIGHTS = [8, 3, 6, 6, 6, 6, 4, 4, 4, 4, 4, 4, 3, 3, 3, 3, 2, 0.01]
+STREETS = ['Main St', 'Oak Ave', 'Elm St', 'Park Rd', 'Broadway']
+
+
+def corpus(count, seed=1):
+    rng = random.Random(seed)
+    return [{
+        'id': f'inc-{i}',
+        'description': ' '.join(rng.choices(WORDS, WEIGHTS, k=rng.randint(2, 8))),
+        'location': f'{rng.randint(1, 999)} {rng.choice(STREETS)}',
+        'severity': rng.choice(['minor', 'moderate', 'major', 'critical']),
+        'status': rng.choice(['reported', 'in-progress', 'resolved']),
+    } for i in range(count)]
+
+
+def built_index(storage, incidents):
+    index = SearchIndex(storage)
+    index.rebuild(incidents)
+    return index
+
+
+def reference(index, query, monkeypatch, **options):
+    """The same search, forced down the postings-intersection path"""
+    with monkeypatch.context() as patch:
+        patch.setattr(search, 'BITMAP_QUERY_FRACTION', float('inf'))
+        return index.search(query, **options)
+
+
+def test_parse_query_only_expands_the_last_word_when_typing():
+    assert parse_query('deep pothole') == [('deep', False), ('pothole', None)]
+    assert parse_query('deep pothole', prefix=True) == [('deep', False), ('pothole', True)]
+    assert parse_query('pot* lane') == [('pot', True), ('lane', None)]
+    # A trailing stopword is dropped unless it is being typed
+    assert parse_query('pothole on') == [('pothole', False)]
+    assert parse_query('pothole on', prefix=True) == [('pothole', False), ('on', True)]
+
+
+def test_whole_words_match_exactly_unless_typing(storage):
+    index = built_index(storage, [
+        {'id': 'one', 'description': 'pothole'},
+        {'id': 'many', 'description': 'potholes'},
+    ])
+    assert [hit for hit, _ in index.search('pothole')['hits']] == ['one']
+    assert {hit for hit, _ in index.search('pothole', prefix=True)['hits']} == {'one', 'many'}
+    # Not a term: the last word is expanded anyway
+    assert {hit for hit, _ in index.search('pot')['hits']} == {'one', 'many'}
+
+
+@pytest.mark.parametrize('exhaustive', [search.EXHAUSTIVE_MAX_DOCS, 0])
+@pytest.mark.parametrize('query', ['pothole', 'pot', 'potholes', 'pothole main st', 'deep pothole', 'cover', 'st'])
+def test_common_queries_match_the_intersection_path(storage, monkeypatch, query, exhaustive):
+    # With no exhaustive limit, common queries take the top-k paths
+    monkeypatch.setattr(search, 'EXHAUSTIVE_MAX_DOCS', exhaustive)
+    incidents = corpus(20000)
+    index = built_index(storage, incidents)
+    # Edits and deletes land in the delta segment
+    for incident in incidents[:500]:
+        edited = dict(incident, description=incident['description'] + ' pothole', status='resolved')
+        index.on_change('update', incident['id'], edited, incident)
+    for incident in incidents[500:700]:
+        index.on_change('delete', incident['id'], None, incident)
+
+    for options in ({}, {'status': 'resolved'}, {'severity': 'critical,major'}, {'offset': 40}, {'prefix': True}):
+        assert index.search(query, **options) == reference(index, query, monkeypatch, **options)
+
+
+def test_pages_of_tied_hits_do_not_overlap(storage):
+    index = built_index(storage, [{'id': f'inc-{i}', 'description': 'pothole'} for i in range(5000)])
+    seen = []
+    for offset in range(0, 200, 20):
+        seen.extend(hit for hit, _ in index.search('pothole', limit=20, offset=offset)['hits'])
+    # Equal scores: newest first
+    assert seen == [f'inc-{i}' for i in range(4999, 4799, -1)]
+
+
+def test_follows_storage_writes(storage, listen):
+    index = SearchIndex(storage)
+    listen(index.on_change)
+    incident_id = storage.save_incident({'description': 'Sinkhole by the school', 'location': 'Elm St',
+                                         'severity': 'major', 'status': 'reported'})
+    assert index.search('sinkhole')['hits'][0][0] == incident_id
+
+    storage.update_incident(incident_id, {'description': 'Crater by the school'})
+    assert index.search('sinkhole')['total'] == 0
+    assert index.search('crater', status='reported')['total'] == 1
+
+    storage.delete_incident(incident_id)
+    assert index.search('crater')['total'] == 0
+
+
+def test_common_term_latency(storage, monkeypatch):
+    index = built_index(storage, corpus(200000))
+    for query, options in [('pothole', {}), ('pot', {}), ('pothole', {'prefix': True}), ('pothole deep', {})]:
+        index.search(query, **options)
+        best = _best_time(index, query, options)
+        assert best < 0.01, f'{query!r} {options} took {best * 1000:.1f} ms'
+
+    # A whole word is not expanded, and its best hits are found without scoring every match
+    best = _best_time(index, 'pothole', {})
+    with monkeypatch.context() as patch:
+        patch.setattr(search, 'EXHAUSTIVE_MAX_DOCS', float('inf'))
+        exhaustive = _best_time(index, 'pothole', {})
+    assert best < exhaustive / 4
+
+
+def _best_time(index, query, options, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        index.search(query, **options)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
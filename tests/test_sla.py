@@ -0,0 +1,65 @@
+import uuid
+from datetime import datetime, timedelta
+
+from utils.sla import HOUR_US, SLAMonitor, now_us
+
+
+def incident(hours_ago, severity='critical', status='reported', **fields):
+    created = datetime.utcnow() - timedelta(hours=hours_ago)
+    return dict({
+        'id': str(uuid.uuid4()),
+        'location': 'Main St',
+        'severity': severity,
+        'status': status,
+        'created_at': created.isoformat(),
+        'status_changed_at': created.isoformat(),
+    }, **fields)
+
+
+def monitor(storage, listen, incidents):
+    storage.import_incidents(incidents)
+    sla = SLAMonitor(storage)
+    listen(sla.on_change)
+    return sla
+
+
+def test_scan_escalates_only_what_is_due(storage, listen):
+    # Critical reported: 24 hours to a breach, 48 to an escalation
+    fresh, late, later, minor = incident(2), incident(30), incident(50), incident(30, 'minor')
+    sla = monitor(storage, listen, [fresh, late, later, minor, incident(100, status='resolved')])
+    assert sla.stats()['tracked'] == 4
+
+    assert set(sla.scan()) == {late['id'], later['id']}
+    assert storage.get_incident(late['id'])['sla_level'] == 1
+    assert storage.get_incident(later['id'])['sla_level'] == 2
+    assert storage.get_incident(fresh['id']).get('sla_level') is None
+    assert storage.get_incident(minor['id']).get('sla_level') is None
+
+    # Levels are absolute: scanning again changes nothing
+    assert sla.scan() == []
+    # The breached incident is due again when its second window ends
+    assert abs(sla.next_due_us() - (now_us() + 18 * HOUR_US)) < 60 * 1000000
+    assert sla.scan(now_us() + 19 * HOUR_US) == [late['id']]
+
+    breaches = sla.breaches()
+    assert [breach['id'] for breach in breaches] == [later['id'], late['id']]
+    assert [breach['sla_state'] for breach in breaches] == ['escalated', 'escalated']
+
+
+def test_a_status_change_restarts_the_clock(storage, listen):
+    late = incident(30)
+    sla = monitor(storage, listen, [late])
+    storage.update_incident(late['id'], {'status': 'in-progress'})
+    # 72 hours in progress for a critical incident
+    assert sla.scan() == []
+    assert sla.scan(now_us() + 73 * HOUR_US) == [late['id']]
+
+
+def test_resolving_stops_tracking(storage, listen):
+    late = incident(30)
+    sla = monitor(storage, listen, [late])
+    assert sla.scan() == [late['id']]
+    storage.update_incident(late['id'], {'status': 'resolved'})
+    assert sla.stats()['tracked'] == 0
+    assert sla.breaches() == []
+    assert sla.scan(now_us() + 1000 * HOUR_US) == []
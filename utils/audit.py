@@ -0,0 +1,355 @@
+import os
+import json
+import bisect
+import struct
+import threading
+from datetime import datetime
+
+from flask import has_request_context
+
+from utils.coherence import WriterLock
+
+AUDIT_DIR = os.path.join('data', 'audit')
+# A new segment is started once the current one reaches this size
+SEGMENT_BYTES = 4 * 1024 * 1024
+# One sparse index point per this many entries
+INDEX_INTERVAL = 64
+INDEX_RECORD = struct.Struct('<IQ')
+# Longest field value kept in an entry's ``changes``
+MAX_VALUE_CHARS = 200
+# Fields whose old/new values aren't worth keeping; only that they changed
+SUMMARIZED_FIELDS = ('comments', 'photos')
+
+
+class AuditLog:
+    """Append-only audit trail in numbered segments with sparse offset indexes
+
+    Entries are JSON lines with a global sequence number ``seq``. Segment
+    ``<base>.log`` holds the entries from ``seq == base`` on, and
+    ``<base>.idx`` records the byte offset of every ``INDEX_INTERVAL``-th
+    entry, so any entry (and so any page) is reached with one seek and a
+    short scan. ``keys.log`` maps actors, incidents and users to the
+    sequence numbers that mention them, for filtered reads. Appends from
+    all worker processes are serialized by a WriterLock.
+    """
+
+    def __init__(self, directory=AUDIT_DIR):
+        self.directory = directory
+        self.lock = None
+        self._keys = {}
+        self._keys_offset = 0
+        self._keys_inode = None
+        self._tail = None
+        self._read_lock = threading.Lock()
+
+    def _ensure_directory(self):
+        if self.lock is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.lock = WriterLock(os.path.join(self.directory, 'write.lock'))
+
+    def _path(self, base, suffix):
+        return os.path.join(self.directory, f'{base:020d}.{suffix}')
+
+    def segments(self):
+        """Sorted base sequence numbers of the segments on disk"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-4]) for name in names if name.endswith('.log') and name[:-4].isdigit())
+
+    def _index_points(self, base):
+        """``[(entry number in segment, byte offset), ...]`` from a segment's sparse index"""
+        try:
+            with open(self._path(base, 'idx'), 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return []
+        usable = len(raw) - len(raw) % INDEX_RECORD.size
+        return [INDEX_RECORD.unpack_from(raw, i) for i in range(0, usable, INDEX_RECORD.size)]
+
+    def _seek_point(self, base, number):
+        """Nearest indexed (entry number, offset) at or before ``number`` in a segment"""
+        points = self._index_points(base)
+        i = bisect.bisect_right(points, (number, float('inf'))) - 1
+        return points[i] if i >= 0 else (0, 0)
+
+    def _scan_tail(self):
+        """(base, next seq, segment size) of the newest segment; call with the lock held
+
+        A line cut short by a crashed writer is truncated away so the next
+        append starts on a line boundary.
+        """
+        bases = self.segments()
+        if not bases:
+            return 0, 0, 0
+        base = bases[-1]
+        path = self._path(base, 'log')
+        size = os.path.getsize(path)
+        if self._tail and self._tail[0] == base and self._tail[2] == size:
+            return self._tail
+        number, offset = self._seek_point(base, float('inf'))
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            os.truncate(path, offset + end)
+            size = offset + end
+        self._tail = (base, base + number + data.count(b'\n', 0, end), size)
+        return self._tail
+
+    def append(self, entries):
+        """Append entries (dicts); returns their sequence numbers"""
+        if not entries:
+            return []
+        self._ensure_directory()
+        seqs = []
+        with self.lock:
+            base, seq, size = self._scan_tail()
+            if size >= SEGMENT_BYTES or not os.path.exists(self._path(base, 'log')):
+                base, size = seq, 0
+            lines = []
+            points = []
+            keys = []
+            offset = size
+            for entry in entries:
+                entry['seq'] = seq
+                line = json.dumps(entry, separators=(',', ':'), default=str).encode() + b'\n'
+                if (seq - base) % INDEX_INTERVAL == 0:
+                    points.append(INDEX_RECORD.pack(seq - base, offset))
+                keys.extend(f'{key}\t{seq}\n' for key in entry_keys(entry))
+                lines.append(line)
+                seqs.append(seq)
+                offset += len(line)
+                seq += 1
+            with open(self._path(base, 'log'), 'ab') as f:
+                f.write(b''.join(lines))
+            if points:
+                with open(self._path(base, 'idx'), 'ab') as f:
+                    f.write(b''.join(points))
+            if keys:
+                with open(os.path.join(self.directory, 'keys.log'), 'a') as f:
+                    f.write(''.join(keys))
+            self._tail = (base, seq, offset)
+        return seqs
+
+    def count(self):
+        """Total number of entries ever appended"""
+        bases = self.segments()
+        if not bases:
+            return 0
+        base = bases[-1]
+        number, offset = self._seek_point(base, float('inf'))
+        try:
+            with open(self._path(base, 'log'), 'rb') as f:
+                f.seek(offset)
+                return base + number + f.read().count(b'\n')
+        except FileNotFoundError:
+            return 0
+
+    def read(self, seqs):
+        """Entries for the given sequence numbers, in the order given (missing ones skipped)"""
+        bases = self.segments()
+        found = {}
+        wanted = sorted(set(seqs))
+        i = 0
+        while i < len(wanted):
+            segment = bisect.bisect_right(bases, wanted[i]) - 1
+            if segment < 0:
+                i += 1
+                continue
+            base = bases[segment]
+            limit = bases[segment + 1] if segment + 1 < len(bases) else float('inf')
+            number, offset = self._seek_point(base, wanted[i] - base)
+            seq = base + number
+            exhausted = True
+            # Scan forward from the index point, collecting wanted entries
+            # until the next one is far enough ahead to be worth a new seek
+            with open(self._path(base, 'log'), 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    if seq == wanted[i]:
+                        try:
+                            found[seq] = json.loads(line)
+                        except ValueError:
+                            pass
+                        i += 1
+                        if i == len(wanted) or wanted[i] >= limit or wanted[i] - seq > INDEX_INTERVAL:
+                            exhausted = False
+                            break
+                    seq += 1
+            if exhausted:
+                # Past the end of this segment: the rest of its range doesn't exist
+                while i < len(wanted) and wanted[i] < limit:
+                    i += 1
+        return [found[seq] for seq in seqs if seq in found]
+
+    def _refresh_keys(self):
+        """Read lines appended to keys.log since the last look"""
+        path = os.path.join(self.directory, 'keys.log')
+        with self._read_lock:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self._keys, self._keys_offset, self._keys_inode = {}, 0, None
+                return
+            if stat.st_ino != self._keys_inode or stat.st_size < self._keys_offset:
+                self._keys, self._keys_offset, self._keys_inode = {}, 0, stat.st_ino
+            if stat.st_size == self._keys_offset:
+                return
+            with open(path, 'rb') as f:
+                f.seek(self._keys_offset)
+                data = f.read()
+            end = data.rfind(b'\n') + 1
+            for line in data[:end].decode().splitlines():
+                key, _, seq = line.rpartition('\t')
+                if key:
+                    self._keys.setdefault(key, []).append(int(seq))
+            self._keys_offset += end
+
+    def seqs_for(self, key):
+        """Sequence numbers of the entries indexed under ``key`` (e.g. ``actor:admin``), oldest first"""
+        self._refresh_keys()
+        return list(self._keys.get(key, ()))
+
+    def page(self, page=1, per_page=50, actor=None, incident=None, user=None):
+        """One page of entries, newest first, optionally for one actor, incident or user"""
+        page = max(1, page)
+        keys = [f'{kind}:{value}' for kind, value in (('actor', actor), ('incident', incident), ('user', user)) if value]
+        if keys:
+            matching = None
+            for key in keys:
+                seqs = set(self.seqs_for(key))
+                matching = seqs if matching is None else matching & seqs
+            matching = sorted(matching, reverse=True)
+            total = len(matching)
+            seqs = matching[(page - 1) * per_page:page * per_page]
+        else:
+            total = self.count()
+            newest = total - (page - 1) * per_page - 1
+            seqs = list(range(newest, max(-1, newest - per_page), -1))
+        return {
+            'entries': self.read(seqs),
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': max(1, -(-total // per_page))
+        }
+
+    def recent(self, limit=10):
+        return self.page(1, limit)['entries']
+
+
+def entry_keys(entry):
+    keys = []
+    if entry.get('user_id'):
+        keys.append(f"actor:{entry['user_id']}")
+    if entry.get('target_type') in ('incident', 'user') and entry.get('target_id'):
+        keys.append(f"{entry['target_type']}:{entry['target_id']}")
+    return keys
+
+
+def current_actor():
+    """(user id, display name) of whoever is making the current request"""
+    if not has_request_context():
+        return SYSTEM
+    # Imported here: utils.auth reads the user store
+    from utils.auth import get_current_user
+    user = get_current_user()
+    if not user:
+        return None, 'Anonymous'
+    return user.get('id'), user.get('name') or user.get('username') or user.get('id')
+
+
+def clip(value):
+    if isinstance(value, str) and len(value) > MAX_VALUE_CHARS:
+        return value[:MAX_VALUE_CHARS] + '...'
+    return value
+
+
+def describe_incident_change(event, incident_id, incident, previous):
+    """(action, details, changes) for one incident write"""
+    if event == 'create':
+        return 'incident.create', f"Reported at {incident.get('location') or 'unknown location'}", None
+    if event == 'delete':
+        return 'incident.delete', f"Deleted (was at {(previous or {}).get('location') or 'unknown location'})", None
+
+    previous = previous or {}
+    changes = {}
+    for key in set(incident) | set(previous):
+        if key == 'updated_at' or incident.get(key) == previous.get(key):
+            continue
+        if key in SUMMARIZED_FIELDS:
+            changes[key] = [len(previous.get(key) or []), len(incident.get(key) or [])]
+        else:
+            changes[key] = [clip(previous.get(key)), clip(incident.get(key))]
+
+    if 'status' in changes:
+        action = 'incident.status'
+        details = f"Status {changes['status'][0]} -> {changes['status'][1]}"
+    elif 'assigned_to' in changes:
+        action = 'incident.assign'
+        details = f"Assigned to {changes['assigned_to'][1] or 'nobody'}"
+    elif set(changes) in ({'comments'}, {'comment_count'}):
+        action = 'incident.comment'
+        before, after = next(iter(changes.values()))
+        details = 'Comment added' if (after or 0) > (before or 0) else 'Comments changed'
+    else:
+        action = 'incident.update'
+        details = f"Updated {', '.join(sorted(changes)) or 'nothing'}"
+    return action, details, changes or None
+
+
+def make_entry(action, target_type, target_id, details, changes=None, actor=None):
+    user_id, user_name = actor or current_actor()
+    entry = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'user_id': user_id,
+        'user_name': user_name,
+        'action': action,
+        'target_type': target_type,
+        'target_id': target_id,
+        'details': details
+    }
+    if changes:
+        entry['changes'] = changes
+    return entry
+
+
+SYSTEM = (None, 'System')
+
+_audit_log = None
+_audit_lock = threading.Lock()
+
+
+def get_audit_log():
+    """Get the process-wide audit log"""
+    global _audit_log
+    with _audit_lock:
+        if _audit_log is None:
+            _audit_log = AuditLog()
+        return _audit_log
+
+
+def record(action, target_type=None, target_id=None, details='', changes=None, actor=None):
+    """Append one audit entry, by default attributed to the current user; never raises"""
+    try:
+        get_audit_log().append([make_entry(action, target_type, target_id, details, changes, actor)])
+    except Exception as e:
+        print(f"Audit log write failed: {e}")
+
+
+def record_incident_changes(changes):
+    """Audit ``[(event, incident_id, incident, previous), ...]`` from one storage write; never raises"""
+    try:
+        actor = current_actor()
+        entries = []
+        for event, incident_id, incident, previous in changes:
+            action, details, diff = describe_incident_change(event, incident_id, incident, previous)
+            entries.append(make_entry(action, 'incident', incident_id, details, diff, actor))
+        get_audit_log().append(entries)
+    except Exception as e:
+        print(f"Audit log write failed: {e}")
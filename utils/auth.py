@@ -1,62 +1,39 @@
 from functools import wraps
 from flask import session, request, jsonify, redirect, url_for, flash
-import os
-import json
-from datetime import datetime
-
-# Mock user data - in production, this would be a database
-USERS_FILE = 'data/users.json'
+from werkzeug.security import check_password_hash
+from utils.users import get_user_repository
 
 def load_users():
-    """Load users from JSON file"""
-    if not os.path.exists(USERS_FILE):
-        os.makedirs(os.path.dirname(USERS_FILE), exist_ok=True)
-        # Create default admin user
-        default_users = {
-            'admin': {
-                'id': 'admin',
-                'username': 'admin',
-                'email': 'admin@potholes.ai',
-                'password_hash': 'pbkdf2:sha256:260000$salt$hash',  # password: admin123
-                'role': 'admin',
-                'created_at': datetime.utcnow().isoformat(),
-                'is_active': True
-            }
-        }
-        save_users(default_users)
-        return default_users
-    
-    try:
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    except:
-        return {}
+    """All users as ``{id: user}``; prefer get_user_repository() lookups"""
+    return get_user_repository().all()
 
 def save_users(users):
-    """Save users to JSON file"""
-    os.makedirs(os.path.dirname(USERS_FILE), exist_ok=True)
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+    """Save users (``{id: user}``), writing only the ones that changed"""
+    get_user_repository().put_many(users.values())
 
 def get_current_user():
     """Get current logged-in user"""
     if 'user_id' not in session:
         return None
     
-    users = load_users()
-    return users.get(session['user_id'])
+    return get_user_repository().get(session['user_id'])
+
+def check_password(user, password):
+    try:
+        return bool(user.get('password_hash')) and check_password_hash(user['password_hash'], password)
+    except (ValueError, TypeError):
+        return False
 
 def login_user(username, password):
     """Authenticate and login user"""
-    users = load_users()
+    user = get_user_repository().find_by_login(username)
+    if not user or not user.get('is_active', True):
+        return None
     
-    for user_id, user in users.items():
-        if user['username'] == username or user['email'] == username:
-            # In production, use proper password hashing
-            if password == 'admin123' and user['username'] == 'admin':
-                session['user_id'] = user_id
-                return user
-            # Add proper password verification here
+    # In production, use proper password hashing
+    if (password == 'admin123' and user['username'] == 'admin') or check_password(user, password):
+        session['user_id'] = user['id']
+        return user
     
     return None
 
@@ -0,0 +1,399 @@
+"""Online, incremental backups of the data directory
+
+    python -m utils.backups create
+    python -m utils.backups list
+    python -m utils.backups verify <backup id>
+    python -m utils.backups restore <backup id> <empty directory>
+    python -m utils.backups prune --keep 14
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import zlib
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from utils.coherence import WriterLock
+from utils.profiling import span
+
+DATA_DIR = 'data'
+# Chunks and manifests (default: <data dir>/backups); staging always lives
+# under the data directory, since hard links can't cross filesystems
+BACKUP_DIR = os.environ.get('BACKUP_DIR')
+# Files are stored as content-addressed chunks of this size, so unchanged
+# files and the unchanged start of a grown log cost nothing in a new backup
+CHUNK_BYTES = 1024 * 1024
+COMPRESS_LEVEL = 1
+KEEP_BACKUPS = int(os.environ.get('BACKUP_KEEP', '14'))
+RESTORE_THREADS = 4
+
+# What is backed up, one group per write lock. Derived files (the mmap'd
+# snapshot, change feed, version counter, rollups, search indexes) are
+# rebuilt after a restore and left out.
+STORES = (
+    ('incidents', 'incidents', (('incidents', ('.json', 'index.log')), ('comments', ('.log',)))),
+    ('users', 'users', (('users', ('users.log',)),)),
+    ('audit', 'audit', (('audit', ('.log', '.idx')),)),
+)
+
+
+class BackupError(Exception):
+    """Raised when a backup can't be taken, found or restored"""
+    pass
+
+
+_store_locks = {}
+_store_locks_lock = threading.Lock()
+
+
+def store_lock(path):
+    """A WriterLock of our own on a store's ``write.lock``
+
+    Its descriptor is separate from the store's, and ``flock`` excludes
+    other descriptors even in this process, so writers here wait too.
+    """
+    with _store_locks_lock:
+        if path not in _store_locks:
+            _store_locks[path] = WriterLock(path)
+        return _store_locks[path]
+
+
+def chunk_path(backup_dir, digest):
+    return os.path.join(backup_dir, 'objects', digest[:2], digest)
+
+
+class BackupStore:
+    """Point-in-time backups taken while the app keeps writing
+
+    A backup takes each store's write lock (the same ``write.lock`` its
+    writers ``flock``) only long enough to hard-link its files into a
+    staging directory and note their sizes; that is a few milliseconds, a
+    pause no longer than one incident write. Files rewritten by rename
+    (partitions, the manifest, compacted logs) stay frozen in the link;
+    append-only logs (index, comments, users, audit) keep growing, so only
+    the noted length is read. Hashing and compressing happen afterwards
+    with no lock held.
+
+    Every file is stored as zlib-compressed, SHA-256-addressed chunks under
+    ``objects/``; ``manifests/<id>.json`` lists each file's chunks, so any
+    one manifest restores on its own while a new backup only writes chunks
+    that changed.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, backup_dir=None):
+        self.data_dir = data_dir
+        self.backup_dir = backup_dir or BACKUP_DIR or os.path.join(data_dir, 'backups')
+        self.staging_dir = os.path.join(data_dir, 'backups', '.staging')
+        self.manifest_dir = os.path.join(self.backup_dir, 'manifests')
+        for path in (self.staging_dir, self.manifest_dir, os.path.join(self.backup_dir, 'objects')):
+            os.makedirs(path, exist_ok=True)
+
+    # Taking a backup
+
+    def create(self, full=False):
+        """Take a backup; returns its manifest
+
+        Unchanged files (same inode, size and mtime as in the previous
+        backup) and the already-stored start of grown logs are not read
+        again unless ``full``.
+        """
+        with self._exclusive():
+            started = time.perf_counter()
+            # Ids sort in the order taken, even within one second (older ids lack the microseconds)
+            backup_id = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f') + '-' + uuid.uuid4().hex[:6]
+            stage = os.path.join(self.staging_dir, backup_id)
+            previous = None if full else self.latest()
+            try:
+                with span('backup.stage'):
+                    staged, lock_ms = self._stage(stage)
+                stats = {'new_chunks': 0, 'new_bytes': 0, 'read_bytes': 0}
+                files = {}
+                with span('backup.store'):
+                    for relpath, (path, size, stat) in sorted(staged.items()):
+                        before = (previous or {}).get('files', {}).get(relpath)
+                        files[relpath] = self._store_file(path, size, stat, before, stats)
+            finally:
+                shutil.rmtree(stage, ignore_errors=True)
+
+            manifest = {
+                'id': backup_id,
+                'created_at': datetime.utcnow().isoformat(),
+                'parent': previous['id'] if previous else None,
+                'files': files,
+                'total_bytes': sum(entry['size'] for entry in files.values()),
+                'new_bytes': stats['new_bytes'],
+                'new_chunks': stats['new_chunks'],
+                'read_bytes': stats['read_bytes'],
+                'lock_ms': lock_ms,
+                'seconds': round(time.perf_counter() - started, 3)
+            }
+            self._write_json(os.path.join(self.manifest_dir, f'{backup_id}.json'), manifest)
+            return manifest
+
+    def _stage(self, stage):
+        """Hard-link every store's files into ``stage``; ``({relpath: (path, size, stat)}, lock ms per store)``"""
+        staged = {}
+        lock_ms = {}
+        for name, lock_dir, groups in STORES:
+            lock_path = os.path.join(self.data_dir, lock_dir, 'write.lock')
+            if not os.path.isdir(os.path.dirname(lock_path)):
+                continue
+            with store_lock(lock_path):
+                locked = time.perf_counter()
+                for subdir, suffixes in groups:
+                    source = os.path.join(self.data_dir, subdir)
+                    try:
+                        names = os.listdir(source)
+                    except FileNotFoundError:
+                        continue
+                    os.makedirs(os.path.join(stage, subdir), exist_ok=True)
+                    for filename in names:
+                        if not filename.endswith(suffixes):
+                            continue
+                        relpath = f'{subdir}/{filename}'
+                        target = os.path.join(stage, subdir, filename)
+                        try:
+                            os.link(os.path.join(source, filename), target)
+                        except FileNotFoundError:
+                            continue
+                        except OSError:
+                            # No hard links here (another filesystem); copy while still locked
+                            shutil.copy2(os.path.join(source, filename), target)
+                        stat = os.stat(target)
+                        staged[relpath] = (target, stat.st_size, stat)
+                lock_ms[name] = round((time.perf_counter() - locked) * 1000, 2)
+        return staged, lock_ms
+
+    def _store_file(self, path, size, stat, before, stats):
+        """Chunk one staged file into the object store; returns its manifest entry"""
+        entry = {'size': size, 'inode': stat.st_ino, 'mtime_ns': stat.st_mtime_ns}
+        if before and before.get('inode') == stat.st_ino and before['size'] == size \
+                and before.get('mtime_ns') == stat.st_mtime_ns and self._has_chunks(before['chunks']):
+            entry['chunks'] = before['chunks']
+            return entry
+
+        chunks = []
+        offset = 0
+        with open(path, 'rb') as f:
+            if before and before.get('inode') == stat.st_ino and size >= before['size']:
+                # Same file, appended to: its full chunks are already stored
+                kept = before['size'] // CHUNK_BYTES
+                if kept and self._has_chunks(before['chunks'][:kept]):
+                    f.seek((kept - 1) * CHUNK_BYTES)
+                    last = f.read(CHUNK_BYTES)
+                    stats['read_bytes'] += len(last)
+                    # Unless the inode was reused by a different file
+                    if hashlib.sha256(last).hexdigest() == before['chunks'][kept - 1]:
+                        chunks = list(before['chunks'][:kept])
+                        offset = kept * CHUNK_BYTES
+            f.seek(offset)
+            while offset < size:
+                data = f.read(min(CHUNK_BYTES, size - offset))
+                if not data:
+                    raise BackupError(f'{path} shrank while being backed up')
+                offset += len(data)
+                stats['read_bytes'] += len(data)
+                chunks.append(self._put_chunk(data, stats))
+        entry['chunks'] = chunks
+        return entry
+
+    def _put_chunk(self, data, stats):
+        digest = hashlib.sha256(data).hexdigest()
+        path = chunk_path(self.backup_dir, digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(data, COMPRESS_LEVEL))
+            os.replace(tmp_path, path)
+            stats['new_chunks'] += 1
+            stats['new_bytes'] += len(data)
+        return digest
+
+    def _has_chunks(self, digests):
+        return all(os.path.exists(chunk_path(self.backup_dir, digest)) for digest in digests)
+
+    # Reading backups
+
+    def list(self):
+        """Manifests without their file lists, newest first"""
+        backups = []
+        for name in sorted(os.listdir(self.manifest_dir), reverse=True):
+            if name.endswith('.json'):
+                manifest = self.load(name[:-5])
+                manifest['files'] = len(manifest['files'])
+                backups.append(manifest)
+        return backups
+
+    def latest(self):
+        names = sorted(name for name in os.listdir(self.manifest_dir) if name.endswith('.json'))
+        return self.load(names[-1][:-5]) if names else None
+
+    def load(self, backup_id):
+        path = os.path.join(self.manifest_dir, f'{os.path.basename(backup_id)}.json')
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise BackupError(f'No readable backup {backup_id!r}')
+
+    def _read_chunk(self, digest):
+        try:
+            with open(chunk_path(self.backup_dir, digest), 'rb') as f:
+                data = zlib.decompress(f.read())
+        except (OSError, zlib.error) as e:
+            raise BackupError(f'Chunk {digest} is missing or damaged: {e}')
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise BackupError(f'Chunk {digest} does not match its hash')
+        return data
+
+    def verify(self, backup_id):
+        """Read back every chunk of a backup; returns the number of bytes checked"""
+        manifest = self.load(backup_id)
+        checked = 0
+        for digest in {digest for entry in manifest['files'].values() for digest in entry['chunks']}:
+            checked += len(self._read_chunk(digest))
+        return checked
+
+    # Restoring
+
+    def restore(self, backup_id, target_dir):
+        """Rebuild a backup's files into ``target_dir``, which must be empty or new
+
+        Point the app at the result (or swap it in for ``data/``) while the
+        app is stopped; caches, the snapshot and rollups rebuild on start.
+        """
+        manifest = self.load(backup_id)
+        if os.path.isdir(target_dir) and os.listdir(target_dir):
+            raise BackupError(f'{target_dir} is not empty')
+        started = time.perf_counter()
+
+        def restore_file(item):
+            relpath, entry = item
+            path = os.path.join(target_dir, *relpath.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                for digest in entry['chunks']:
+                    f.write(self._read_chunk(digest))
+            if os.path.getsize(tmp_path) != entry['size']:
+                raise BackupError(f'{relpath} restored to the wrong size')
+            os.replace(tmp_path, path)
+            return entry['size']
+
+        with span('backup.restore'), ThreadPoolExecutor(max_workers=RESTORE_THREADS) as pool:
+            # zlib and file I/O release the GIL, so files restore in parallel
+            restored = sum(pool.map(restore_file, manifest['files'].items()))
+        return {'id': backup_id, 'files': len(manifest['files']), 'bytes': restored,
+                'seconds': round(time.perf_counter() - started, 3)}
+
+    # Retention
+
+    def prune(self, keep=KEEP_BACKUPS):
+        """Delete all but the newest ``keep`` backups and the chunks only they used"""
+        with self._exclusive():
+            names = sorted(name for name in os.listdir(self.manifest_dir) if name.endswith('.json'))
+            doomed = names[:-keep] if keep > 0 else names
+            for name in doomed:
+                os.remove(os.path.join(self.manifest_dir, name))
+            live = set()
+            for name in names[len(doomed):]:
+                for entry in self.load(name[:-5])['files'].values():
+                    live.update(entry['chunks'])
+            removed = 0
+            objects = os.path.join(self.backup_dir, 'objects')
+            for prefix in os.listdir(objects):
+                for digest in os.listdir(os.path.join(objects, prefix)):
+                    if digest not in live:
+                        os.remove(os.path.join(objects, prefix, digest))
+                        removed += 1
+            return {'backups': len(doomed), 'chunks': removed}
+
+    # Helpers
+
+    def _exclusive(self):
+        """Only one backup or prune at a time, across processes"""
+        return BackupLock(os.path.join(self.backup_dir, 'backup.lock'))
+
+    def _write_json(self, path, data):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+
+class BackupLock:
+    """Non-blocking ``flock``: a second backup fails fast instead of queueing"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(self._fd)
+                raise BackupError('Another backup is running')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        os.close(self._fd)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Online backups of the data directory')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--backup-dir')
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create', help='take a backup now')
+    create.add_argument('--full', action='store_true', help='re-read every file instead of trusting unchanged ones')
+    commands.add_parser('list', help='list backups, newest first')
+    verify = commands.add_parser('verify', help='read back and hash-check every chunk of a backup')
+    verify.add_argument('backup_id')
+    restore = commands.add_parser('restore', help='rebuild a backup into an empty directory')
+    restore.add_argument('backup_id')
+    restore.add_argument('target_dir')
+    prune = commands.add_parser('prune', help='drop old backups and unused chunks')
+    prune.add_argument('--keep', type=int, default=KEEP_BACKUPS)
+    args = parser.parse_args(argv)
+
+    store = BackupStore(args.data_dir, args.backup_dir)
+    try:
+        if args.command == 'create':
+            manifest = store.create(full=args.full)
+            print(f"{manifest['id']}: {len(manifest['files'])} files, {manifest['total_bytes']} bytes, "
+                  f"{manifest['new_bytes']} new, locks held {manifest['lock_ms']} ms, {manifest['seconds']} s")
+        elif args.command == 'list':
+            for manifest in store.list():
+                print(f"{manifest['id']}  {manifest['created_at'][:19]}  {manifest['files']} files  "
+                      f"{manifest['total_bytes']} bytes  {manifest['new_bytes']} new")
+        elif args.command == 'verify':
+            print(f'{store.verify(args.backup_id)} bytes verified')
+        elif args.command == 'restore':
+            result = store.restore(args.backup_id, args.target_dir)
+            print(f"Restored {result['files']} files ({result['bytes']} bytes) in {result['seconds']} s")
+        elif args.command == 'prune':
+            result = store.prune(args.keep)
+            print(f"Removed {result['backups']} backups and {result['chunks']} chunks")
+    except BackupError as e:
+        print(f'Backup failed: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
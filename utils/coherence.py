@@ -0,0 +1,221 @@
+import os
+import json
+import mmap
+import time
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from utils.metrics import record_storage, LOCK_WAIT_SECONDS
+
+# The feed is restarted once it grows past this; processes that fall that
+# far behind rebuild their caches instead of replaying
+FEED_MAX_BYTES = 8 * 1024 * 1024
+# Bulky fields left out of feed entries; no cache keyed on the feed needs them
+FEED_EXCLUDE = ('comments', 'photos')
+
+
+class WriterLock:
+    """Reentrant lock that admits one writer thread across all processes
+
+    Threads in a process queue on an RLock; the first level of nesting also
+    takes an exclusive ``flock`` on ``path``, which is what keeps other
+    worker processes out. Readers never take it. Without ``fcntl`` (Windows)
+    it only serializes threads in this process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        self._pid = None
+
+    def acquire(self):
+        started = time.perf_counter()
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._lock_file()
+            except Exception:
+                self._thread_lock.release()
+                raise
+            record_storage(LOCK_WAIT_SECONDS, time.perf_counter() - started)
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._unlock_file()
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def _lock_file(self):
+        if fcntl is None:
+            return
+        if self._fd is None or self._pid != os.getpid():
+            # A descriptor inherited over fork shares its lock with the parent
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _unlock_file(self):
+        if fcntl is not None and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class VersionCounter:
+    """A 64-bit counter in a small memory-mapped file
+
+    Every process maps the same page, so checking for news costs one
+    memory read. Only writers holding the WriterLock change it.
+    """
+
+    SIZE = 8
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        if not os.path.exists(path) or os.path.getsize(path) < self.SIZE:
+            with open(path, 'ab') as f:
+                f.truncate(self.SIZE)
+
+    def _mapping(self):
+        if self._map is None:
+            with open(self.path, 'r+b') as f:
+                self._map = mmap.mmap(f.fileno(), self.SIZE)
+        return self._map
+
+    def value(self):
+        return struct.unpack_from('<Q', self._mapping(), 0)[0]
+
+    def set(self, value):
+        struct.pack_into('<Q', self._mapping(), 0, value)
+
+
+def project(incident):
+    if incident is None:
+        return None
+    if hasattr(incident, 'to_dict'):
+        incident = incident.to_dict()
+    return {key: value for key, value in incident.items() if key not in FEED_EXCLUDE}
+
+
+class ChangeFeed:
+    """Incident writes shared between worker processes
+
+    Writers append one JSON line per change to ``changes.log`` and then
+    advance the mmap'd version counter, all under the WriterLock. Other
+    processes compare the counter with the last sequence number they saw
+    and, only when it moved, read the new lines and replay them into their
+    caches, so a write in one worker is visible in the others on their
+    very next read.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, 'changes.log')
+        self.lock = WriterLock(os.path.join(directory, 'write.lock'))
+        self.counter = VersionCounter(os.path.join(directory, 'version'))
+        self._poll_lock = threading.Lock()
+        self._offset, self._inode = self._end_of_log()
+        # A new process builds its caches from disk, so it starts caught up
+        self.seen = self.counter.value()
+
+    def version(self):
+        return self.counter.value()
+
+    def publish(self, changes):
+        """Record ``[(event, incident_id, incident, previous), ...]``; hold the lock and poll first"""
+        if not changes:
+            return
+        seq = self.counter.value()
+        pid = os.getpid()
+        lines = []
+        for event, incident_id, incident, previous in changes:
+            seq += 1
+            lines.append(json.dumps({
+                'seq': seq, 'pid': pid, 'event': event, 'id': incident_id,
+                'incident': project(incident), 'previous': project(previous)
+            }, default=str) + '\n')
+
+        with open(self.path, 'a') as f:
+            f.write(''.join(lines))
+            size = f.tell()
+        if size > FEED_MAX_BYTES:
+            self._restart(seq)
+        self.counter.set(seq)
+        self.seen = seq
+
+    def poll(self):
+        """Changes written by other processes since the last poll
+
+        Returns a list of entry dicts, or None if entries were lost to a
+        feed restart and caches must be rebuilt from disk.
+        """
+        if self.counter.value() == self.seen:
+            return []
+        with self._poll_lock:
+            missed = False
+            entries = []
+            for line in self._read_new_lines():
+                if line.startswith('#base '):
+                    if self.seen < int(line.split()[1]):
+                        missed = True
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry['seq'] <= self.seen:
+                    continue
+                if entry['seq'] != self.seen + 1:
+                    missed = True
+                self.seen = entry['seq']
+                if entry['pid'] != os.getpid():
+                    entries.append(entry)
+            if missed:
+                self.seen = max(self.seen, self.counter.value())
+                return None
+            return entries
+
+    def _read_new_lines(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._offset, self._inode = 0, stat.st_ino
+        if stat.st_size == self._offset:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Ignore a trailing partial line from an append in progress
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        return data[:end].decode().splitlines()
+
+    def _restart(self, seq):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(f'#base {seq}\n')
+        os.replace(tmp_path, self.path)
+
+    def _end_of_log(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0, None
+        return stat.st_size, stat.st_ino
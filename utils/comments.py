@@ -0,0 +1,165 @@
+import os
+import json
+import zlib
+import threading
+
+# Comments are spread over this many append-only shard files by incident id
+SHARDS = 256
+COMMENTS_PER_PAGE = 50
+# Marks a line that drops every earlier comment of an incident
+TOMBSTONE = '-'
+
+
+def shard_of(incident_id):
+    return zlib.crc32(str(incident_id).encode()) % SHARDS
+
+
+class CommentStore:
+    """Incident comments in append-only shard logs, separate from the incidents
+
+    ``<directory>/<shard>.log`` holds ``<incident id>\\t<comment JSON>``
+    lines for the incidents hashed to that shard, so adding a comment
+    appends one line and reading an incident's comments opens one small
+    shard. Each process keeps a per-shard ``{incident id: [offset, ...]}``
+    map, read incrementally like the incident index. Writes must hold the
+    storage write lock; StorageManager does that and keeps each incident's
+    ``comment_count`` in step.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # shard -> [offsets by incident id, bytes read, file inode]
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def _path(self, shard):
+        return os.path.join(self.directory, f'{shard:02x}.log')
+
+    def _offsets(self, shard):
+        """``{incident_id: [byte offset, ...]}`` for one shard, refreshed from disk"""
+        path = self._path(shard)
+        with self._lock:
+            state = self._shards.get(shard)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self._shards.pop(shard, None)
+                return {}
+            if state is None or stat.st_ino != state[2] or stat.st_size < state[1]:
+                state = self._shards[shard] = [{}, 0, stat.st_ino]
+            if stat.st_size > state[1]:
+                with open(path, 'rb') as f:
+                    f.seek(state[1])
+                    data = f.read()
+                # Ignore a trailing partial line from a concurrent append
+                end = data.rfind(b'\n') + 1
+                offsets = state[0]
+                position = state[1]
+                for line in data[:end].splitlines(keepends=True):
+                    incident_id, _, body = line.partition(b'\t')
+                    incident_id = incident_id.decode()
+                    if body.rstrip(b'\n') == TOMBSTONE.encode():
+                        offsets.pop(incident_id, None)
+                    elif body:
+                        offsets.setdefault(incident_id, []).append(position)
+                    position += len(line)
+                state[1] += end
+            return state[0]
+
+    def _read(self, shard, offsets):
+        comments = []
+        with open(self._path(shard), 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                try:
+                    comments.append(json.loads(f.readline().partition(b'\t')[2]))
+                except ValueError:
+                    continue
+        return comments
+
+    # Reads
+
+    def count(self, incident_id):
+        return len(self._offsets(shard_of(incident_id)).get(incident_id, ()))
+
+    def list(self, incident_id):
+        """Every comment of one incident, oldest first"""
+        shard = shard_of(incident_id)
+        offsets = self._offsets(shard).get(incident_id)
+        return self._read(shard, offsets) if offsets else []
+
+    def page(self, incident_id, page=1, per_page=COMMENTS_PER_PAGE, newest_first=False):
+        """One page of an incident's comments; only that page's lines are read"""
+        page = max(1, page)
+        shard = shard_of(incident_id)
+        offsets = list(self._offsets(shard).get(incident_id, ()))
+        if newest_first:
+            offsets.reverse()
+        selected = offsets[(page - 1) * per_page:page * per_page]
+        return {
+            'comments': self._read(shard, selected) if selected else [],
+            'page': page,
+            'per_page': per_page,
+            'total': len(offsets),
+            'pages': max(1, -(-len(offsets) // per_page))
+        }
+
+    def texts(self):
+        """``{incident_id: [comment text, ...]}`` for every incident, read shard by shard"""
+        texts = {}
+        for shard in range(SHARDS):
+            try:
+                with open(self._path(shard), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            for line in data[:data.rfind(b'\n') + 1].splitlines():
+                incident_id, _, body = line.partition(b'\t')
+                incident_id = incident_id.decode()
+                if body == TOMBSTONE.encode():
+                    texts.pop(incident_id, None)
+                    continue
+                try:
+                    text = json.loads(body).get('text')
+                except (ValueError, AttributeError):
+                    continue
+                texts.setdefault(incident_id, []).append(str(text or ''))
+        return texts
+
+    # Writes (callers hold the storage write lock)
+
+    def append(self, comments_by_id):
+        """Append ``{incident_id: [comment, ...]}``; returns the new count per incident
+
+        Comments without an ``id`` are numbered after the incident's existing ones.
+        """
+        by_shard = {}
+        for incident_id, comments in comments_by_id.items():
+            by_shard.setdefault(shard_of(incident_id), []).append((incident_id, comments))
+        counts = {}
+        for shard, members in by_shard.items():
+            existing = self._offsets(shard)
+            lines = []
+            for incident_id, comments in members:
+                count = len(existing.get(incident_id, ()))
+                for comment in comments:
+                    count += 1
+                    comment.setdefault('id', count)
+                    lines.append(f'{incident_id}\t{json.dumps(comment, separators=(",", ":"), default=str)}\n')
+                counts[incident_id] = count
+            with open(self._path(shard), 'a') as f:
+                f.write(''.join(lines))
+        return counts
+
+    def delete(self, incident_ids):
+        """Drop every comment of the given incidents"""
+        by_shard = {}
+        for incident_id in incident_ids:
+            by_shard.setdefault(shard_of(incident_id), []).append(incident_id)
+        for shard, members in by_shard.items():
+            existing = self._offsets(shard)
+            lines = [f'{incident_id}\t{TOMBSTONE}\n' for incident_id in members if incident_id in existing]
+            if lines:
+                with open(self._path(shard), 'a') as f:
+                    f.write(''.join(lines))
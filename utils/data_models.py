@@ -1,9 +1,19 @@
-from datetime import datetime
+import os
+import sys
+from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 
+from utils.serializers import SERIALIZERS, loads_any
+from utils.audit import get_audit_log
+from utils.users import get_user_repository
+
+EPOCH = datetime(1970, 1, 1)
+
 class User:
     """User data model"""
     
+    __slots__ = ('id', 'username', 'email', 'role', 'created_at', 'is_active')
+    
     def __init__(self, user_id: str, username: str, email: str, role: str = 'operator'):
         self.id = user_id
         self.username = username
@@ -25,6 +35,9 @@ class User:
 class Incident:
     """Incident data model"""
     
+    __slots__ = ('id', 'location', 'severity', 'description', 'latitude', 'longitude', 'status',
+                 'created_at', 'updated_at', 'assigned_to', 'photos', 'priority')
+    
     def __init__(self, location: str, severity: str, description: str = '', 
                  latitude: float = None, longitude: float = None):
         self.id = None  # Set by storage manager
@@ -37,17 +50,23 @@ class Incident:
         self.created_at = datetime.utcnow()
         self.updated_at = datetime.utcnow()
         self.assigned_to = None
+        self.photos = []
         self.priority = self._calculate_priority()
     
     def _calculate_priority(self) -> str:
         """Calculate priority based on severity"""
+        return self.priority_for_severity(self.severity)
+    
+    @staticmethod
+    def priority_for_severity(severity: str) -> str:
+        """Map a severity to its priority label"""
         severity_priority = {
             'critical': 'high',
             'major': 'high',
             'moderate': 'medium',
             'minor': 'low'
         }
-        return severity_priority.get(self.severity, 'medium')
+        return severity_priority.get(severity, 'medium')
     
     def to_dict(self) -> Dict:
         return {
@@ -61,12 +80,15 @@ class Incident:
             'priority': self.priority,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
-            'assigned_to': self.assigned_to
+            'assigned_to': self.assigned_to,
+            'photos': self.photos
         }
 
 class Report:
     """Report data model"""
     
+    __slots__ = ('id', 'title', 'type', 'data', 'created_at', 'generated_by')
+    
     def __init__(self, title: str, report_type: str, data: Dict):
         self.id = None
         self.title = title
@@ -84,3 +106,269 @@ class Report:
             'created_at': self.created_at.isoformat(),
             'generated_by': self.generated_by
         }
+
+def to_epoch_us(value):
+    """ISO timestamp to integer microseconds since the epoch, or None
+    
+    Only returns an int when it converts back to exactly the same string,
+    so records never rewrite timestamps they were given.
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.tzinfo is not None or moment.isoformat() != value:
+        return None
+    delta = moment - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def from_epoch_us(value):
+    """Inverse of to_epoch_us; strings that couldn't be converted pass through"""
+    if value is None or isinstance(value, str):
+        return value
+    seconds, micros = divmod(value, 1000000)
+    days, seconds = divmod(seconds, 86400)
+    return (EPOCH + timedelta(days=days, seconds=seconds, microseconds=micros)).isoformat()
+
+class IncidentRecord:
+    """Compact read-only form of a stored incident, for in-memory caches
+    
+    Fields are slots rather than a per-incident dict; severity, status,
+    priority, assignee and other short strings are interned so a million
+    records share a handful of copies; timestamps are epoch-microsecond
+    ints. Any other keys are kept as a flat ``(key, value, ...)`` tuple in
+    ``extra``, with nested lists and dicts (comments, photos, detection
+    results) packed to bytes until read; empty photo/comment lists are
+    just a bit in ``_empty``.
+    Supports ``get``/``[]`` like the dict it came from; call ``to_dict``
+    to get a real dict at the API boundary.
+    """
+    
+    __slots__ = ('id', 'location', 'description', 'severity', 'status', 'priority',
+                 'latitude', 'longitude', 'assigned_to', '_created', '_updated', '_empty', 'extra')
+    
+    FIELDS = ('id', 'location', 'description', 'severity', 'status', 'priority',
+              'latitude', 'longitude', 'assigned_to')
+    INTERNED = ('severity', 'status', 'priority', 'assigned_to')
+    EMPTY_LISTS = ('photos', 'comments')
+    KNOWN = frozenset(FIELDS + ('created_at', 'updated_at'))
+    # Extra string values up to this length are interned (reporter names, sources, vehicle ids)
+    INTERN_MAX_LENGTH = 32
+    PACKER = SERIALIZERS['orjson'] if SERIALIZERS['orjson'].available else SERIALIZERS['json']
+    
+    @classmethod
+    def from_dict(cls, incident: Dict) -> 'IncidentRecord':
+        record = cls.__new__(cls)
+        get = incident.get
+        for field in cls.FIELDS:
+            setattr(record, field, get(field))
+        for field in cls.INTERNED:
+            value = getattr(record, field)
+            if isinstance(value, str):
+                setattr(record, field, sys.intern(value))
+        for slot, key in (('_created', 'created_at'), ('_updated', 'updated_at')):
+            value = get(key)
+            epoch = to_epoch_us(value)
+            setattr(record, slot, value if epoch is None else epoch)
+        
+        empty = 0
+        extra = []
+        for key, value in incident.items():
+            if key in cls.KNOWN:
+                continue
+            if value == [] and key in cls.EMPTY_LISTS:
+                empty |= 1 << cls.EMPTY_LISTS.index(key)
+                continue
+            if isinstance(value, str) and len(value) <= cls.INTERN_MAX_LENGTH:
+                value = sys.intern(value)
+            elif isinstance(value, (list, dict)):
+                # Incidents come from JSON, so bytes can only mean a packed value
+                # (copied, since orjson returns bytes with a spare 1 KiB buffer)
+                value = memoryview(cls.PACKER.dumps(value)).tobytes()
+            extra.append(sys.intern(key))
+            extra.append(value)
+        record._empty = empty
+        record.extra = tuple(extra) if extra else None
+        return record
+    
+    @property
+    def created_at(self) -> Optional[str]:
+        return from_epoch_us(self._created)
+    
+    @property
+    def updated_at(self) -> Optional[str]:
+        return from_epoch_us(self._updated)
+    
+    @property
+    def created_us(self) -> Optional[int]:
+        """Creation time in epoch microseconds (None if missing or unparseable)"""
+        return self._created if isinstance(self._created, int) else None
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        if key == 'created_at':
+            return self.created_at
+        if key == 'updated_at':
+            return self.updated_at
+        extra = self.extra
+        if extra:
+            for i in range(0, len(extra), 2):
+                if extra[i] == key:
+                    value = extra[i + 1]
+                    return loads_any(value) if isinstance(value, bytes) else value
+        if key in self.EMPTY_LISTS and self._empty & (1 << self.EMPTY_LISTS.index(key)):
+            return []
+        raise KeyError(key)
+    
+    def __getattr__(self, name):
+        # Only reached for names that aren't slots, e.g. ``incident.photos`` in templates
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+    
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+    
+    def to_dict(self) -> Dict:
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data['created_at'] = self.created_at
+        data['updated_at'] = self.updated_at
+        for bit, key in enumerate(self.EMPTY_LISTS):
+            if self._empty & (1 << bit):
+                data[key] = []
+        if self.extra:
+            for key, value in zip(self.extra[::2], self.extra[1::2]):
+                data[key] = loads_any(value) if isinstance(value, bytes) else value
+        return data
+
+# Admin console
+
+STARTED_AT = datetime.utcnow()
+# Walking data/ is not free, so its size is remembered this long (seconds)
+DISK_USAGE_TTL = 60
+_disk_usage = (None, 0)
+
+def _audit_entry(entry: Dict) -> Dict:
+    try:
+        entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        entry['timestamp'] = None
+    return entry
+
+def get_audit_logs(page: int = 1, per_page: int = 50, limit: Optional[int] = None,
+                   actor: Optional[str] = None, incident: Optional[str] = None, user: Optional[str] = None):
+    """Audit log entries, newest first, with ``timestamp`` as a datetime
+    
+    With ``limit``, a list of the newest entries; otherwise one page as
+    ``{'entries', 'page', 'per_page', 'total', 'pages'}``, optionally only
+    for one actor, incident or user.
+    """
+    log = get_audit_log()
+    if limit is not None:
+        return [_audit_entry(entry) for entry in log.recent(limit)]
+    result = log.page(page, per_page, actor=actor, incident=incident, user=user)
+    result['entries'] = [_audit_entry(entry) for entry in result['entries']]
+    return result
+
+def directory_size(path: str) -> int:
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += directory_size(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            continue
+    return total
+
+def format_bytes(size: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+def format_duration(seconds: float) -> str:
+    minutes, _ = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f'{days}d {hours}h'
+    if hours:
+        return f'{hours}h {minutes}m'
+    return f'{minutes}m'
+
+def get_system_stats() -> Dict:
+    """Headline numbers for the admin console"""
+    global _disk_usage
+    # Imported here: utils.storage imports this module
+    from utils.storage import get_storage
+    
+    storage = get_storage()
+    counts = storage.get_incident_counts()
+    users = get_user_repository()
+    
+    checked_at, used = _disk_usage
+    if checked_at is None or (datetime.utcnow() - checked_at).total_seconds() > DISK_USAGE_TTL:
+        used = directory_size(storage.data_dir)
+        _disk_usage = (datetime.utcnow(), used)
+    
+    return {
+        'total_users': users.count(),
+        'total_incidents': counts['total'],
+        'active_incidents': counts['total'] - counts['status'].get('resolved', 0),
+        'incidents_by_status': counts['status'],
+        'uptime': format_duration((datetime.utcnow() - STARTED_AT).total_seconds()),
+        'storage_used': format_bytes(used),
+        'audit_entries': get_audit_log().count()
+    }
+
+# User administration
+
+def get_all_users(page: Optional[int] = None, per_page: int = 50, query: Optional[str] = None,
+                  role: Optional[str] = None):
+    """Users in username order
+    
+    With ``page``, one page as ``{'users', 'page', 'per_page', 'total',
+    'pages', 'roles'}``, optionally narrowed by a username/email/name
+    prefix ``query`` and ``role``; without it, a list of every user.
+    """
+    repository = get_user_repository()
+    if page is None:
+        return [repository.get(user_id) for user_id in repository.search_ids(query, role)]
+    return repository.page(page, per_page, query=query, role=role)
+
+def get_user_by_id(user_id: str) -> Optional[Dict]:
+    return get_user_repository().get(user_id)
+
+def create_user(data: Dict) -> Dict:
+    """Add a user; raises ValueError if the username or email is taken"""
+    return get_user_repository().create(data)
+
+def update_user(user_id: str, data: Dict) -> bool:
+    """Update the given fields of a user (``None`` values are left alone)"""
+    updates = {key: value for key, value in data.items() if value is not None}
+    try:
+        return get_user_repository().update(user_id, updates) is not None
+    except ValueError as e:
+        print(f"User update failed: {e}")
+        return False
+
+def delete_user(user_id: str) -> bool:
+    return get_user_repository().delete(user_id)
@@ -0,0 +1,426 @@
+import os
+import time
+import uuid
+import queue
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from utils.data_models import Incident
+
+INPUT_SIZE = (128, 128)
+SEVERITY_ORDER = ['minor', 'moderate', 'major', 'critical']
+# Queued incidents are claimed with a file under <data dir>/detection/claims so
+# other server processes don't queue them again; a claim older than this
+# belongs to a process that died and may be taken over
+CLAIM_SECONDS = 30 * 60
+
+
+def load_image(path, size=INPUT_SIZE):
+    """Decode an image into a float32 grayscale array of ``size``"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        # Let the JPEG decoder downscale while decoding instead of after
+        image.draft('L', (size[0] * 2, size[1] * 2))
+        image = image.convert('L').resize(size)
+        return np.asarray(image, dtype=np.float32) / 255.0
+
+
+class DetectionModel:
+    """Interface for pothole classifiers
+
+    ``predict`` receives a batch as a (N, H, W) float32 array in [0, 1]
+    and returns one dict per image with ``pothole``, ``severity`` and
+    ``confidence`` keys.
+    """
+
+    name = 'base'
+    input_size = INPUT_SIZE
+
+    def load(self):
+        """Load weights; called once in each worker process"""
+        pass
+
+    def predict(self, batch):
+        raise NotImplementedError
+
+
+class ClassicalCVModel(DetectionModel):
+    """Lightweight baseline: dark, textured blobs against the road surface
+
+    A pothole shows up as a region noticeably darker than the surrounding
+    asphalt with strong edges around it. The whole batch is scored with
+    array operations, so there is no per-pixel Python work.
+    """
+
+    name = 'classical'
+
+    def __init__(self, dark_sigma=1.0, min_area=0.02):
+        self.dark_sigma = dark_sigma
+        self.min_area = min_area
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        n = batch.shape[0]
+        flat = batch.reshape(n, -1)
+
+        # Per-image contrast normalisation
+        mean = flat.mean(axis=1)
+        std = flat.std(axis=1) + 1e-6
+        normalized = (batch - mean[:, None, None]) / std[:, None, None]
+
+        # 3x3 box blur to suppress gravel texture before thresholding
+        padded = np.pad(normalized, ((0, 0), (1, 1), (1, 1)), mode='edge')
+        blurred = sum(
+            padded[:, dy:dy + batch.shape[1], dx:dx + batch.shape[2]]
+            for dy in range(3) for dx in range(3)
+        ) / 9.0
+
+        dark = blurred < -self.dark_sigma
+        dark_fraction = dark.reshape(n, -1).mean(axis=1)
+
+        # Edge strength inside the dark region relative to the whole image
+        gy = np.abs(np.diff(normalized, axis=1))[:, :, :-1]
+        gx = np.abs(np.diff(normalized, axis=2))[:, :-1, :]
+        gradient = gx + gy
+        dark_edges = (gradient * dark[:, :-1, :-1]).reshape(n, -1).sum(axis=1)
+        edge_ratio = dark_edges / (gradient.reshape(n, -1).sum(axis=1) + 1e-6)
+
+        # Depth cue: how much darker the blob is than the road
+        darkness = np.where(
+            dark.any(axis=(1, 2)),
+            -(normalized * dark).reshape(n, -1).sum(axis=1) / np.maximum(dark.reshape(n, -1).sum(axis=1), 1),
+            0.0
+        )
+
+        score = 6.0 * (dark_fraction - self.min_area) + 2.0 * edge_ratio + 0.8 * (darkness - 1.5)
+        confidence = 1.0 / (1.0 + np.exp(-score))
+
+        severity_index = np.digitize(dark_fraction, [0.05, 0.12, 0.25])
+
+        return [
+            {
+                'pothole': bool(confidence[i] >= 0.5),
+                'severity': SEVERITY_ORDER[int(severity_index[i])],
+                'confidence': round(float(confidence[i]), 3)
+            }
+            for i in range(n)
+        ]
+
+
+MODELS = {
+    'classical': ClassicalCVModel,
+}
+
+
+def load_model(spec=None):
+    """Build a model from a registry name or a ``module:Class`` path"""
+    spec = spec or os.getenv('DETECTION_MODEL', 'classical')
+    if spec in MODELS:
+        model = MODELS[spec]()
+    else:
+        module_name, _, class_name = spec.partition(':')
+        model = getattr(importlib.import_module(module_name), class_name)()
+    model.load()
+    return model
+
+
+# Process pool worker state
+_worker_model = None
+
+
+def _init_worker(spec):
+    global _worker_model
+    _worker_model = load_model(spec)
+
+
+def _run_batch(paths):
+    """Score a micro-batch inside a worker process"""
+    started = time.perf_counter()
+    images = []
+    ok = []
+    for path in paths:
+        try:
+            images.append(load_image(path, _worker_model.input_size))
+            ok.append(True)
+        except Exception:
+            ok.append(False)
+
+    predictions = iter(_worker_model.predict(np.stack(images)) if images else [])
+    results = [next(predictions) if loaded else None for loaded in ok]
+    return results, time.perf_counter() - started
+
+
+class DetectionService:
+    """Queues uploaded photos and classifies them in micro-batches
+
+    A dispatcher thread collects up to ``batch_size`` photos (or whatever
+    arrived within ``max_wait`` seconds) and hands each batch to a process
+    pool, keeping inference off both the request thread and the GIL.
+
+    The queue lives in memory; the incidents are the durable record. Every
+    classified incident gets a ``detection`` result, negative ones included,
+    so ``resume`` can re-queue incidents with photos but no result after a
+    restart. Queued incidents are claimed on disk, so ``resume`` in one
+    server process skips incidents another process is still classifying.
+    """
+
+    def __init__(self, storage, model_spec=None, workers=None, batch_size=16,
+                 max_wait=0.5, min_confidence=0.6):
+        self.storage = storage
+        self.model_spec = model_spec or os.getenv('DETECTION_MODEL', 'classical')
+        self.workers = workers or int(os.getenv('DETECTION_WORKERS', 1))
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.min_confidence = min_confidence
+        self.upload_dir = os.path.join(storage.data_dir, 'uploads')
+        self.claims_dir = os.path.join(storage.data_dir, 'detection', 'claims')
+
+        self._queue = queue.Queue()
+        # Incident ids with photos queued or being classified in this process
+        self._pending = set()
+        self._executor = None
+        self._dispatcher = None
+        self._in_flight = threading.Semaphore(self.workers * 2)
+        self._lock = threading.Lock()
+        self._metrics = {
+            'images_queued': 0,
+            'images_processed': 0,
+            'images_failed': 0,
+            'batches': 0,
+            'inference_seconds': 0.0,
+            'incidents_updated': 0
+        }
+
+    def enqueue(self, incident_id, photo_paths):
+        """Queue an incident's photos for classification
+
+        Returns False, queueing nothing, if another process has them queued.
+        """
+        if not photo_paths or not self._claim(incident_id):
+            return False
+        self._ensure_started()
+        with self._lock:
+            self._pending.add(incident_id)
+            self._metrics['images_queued'] += len(photo_paths)
+        for path in photo_paths:
+            self._queue.put((incident_id, path))
+        return True
+
+    def resume(self):
+        """Queue incidents whose photos were never classified; returns how many"""
+        resumed = 0
+        for incident in self.storage.get_incident_records({'archived': False}):
+            photos = incident.get('photos')
+            if not photos or incident.get('detection') or incident['id'] in self._pending:
+                continue
+            paths = [os.path.join(self.upload_dir, photo['original']) for photo in photos]
+            if self.enqueue(incident['id'], paths):
+                resumed += 1
+        return resumed
+
+    def stats(self):
+        """Throughput and queue metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+        seconds = metrics['inference_seconds']
+        metrics['queue_depth'] = self._queue.qsize()
+        metrics['workers'] = self.workers
+        metrics['model'] = self.model_spec
+        # inference_seconds is summed across workers, so this is the per-core rate
+        per_core = metrics['images_processed'] / seconds if seconds else 0.0
+        metrics['images_per_second_per_core'] = round(per_core, 2)
+        metrics['images_per_second'] = round(per_core * self.workers, 2)
+        return metrics
+
+    def _claim(self, incident_id):
+        """Claim an incident for this process; False if another process holds a live claim"""
+        path = os.path.join(self.claims_dir, incident_id)
+        os.makedirs(self.claims_dir, exist_ok=True)
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                pass
+            try:
+                if time.time() - os.stat(path).st_mtime < CLAIM_SECONDS:
+                    return False
+                # Abandoned; of several processes taking it over, only one wins the rename
+                stale = f'{path}.{uuid.uuid4().hex}'
+                os.rename(path, stale)
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+        return False
+
+    def _release(self, incident_ids):
+        for incident_id in incident_ids:
+            try:
+                os.remove(os.path.join(self.claims_dir, incident_id))
+            except FileNotFoundError:
+                pass
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._dispatcher and self._dispatcher.is_alive():
+                return
+            self._dispatcher = threading.Thread(target=self._dispatch, name='detection', daemon=True)
+            self._dispatcher.start()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.model_spec,)
+                )
+            return self._executor
+
+    def _discard_executor(self, executor):
+        """Drop a pool a worker died in (a crashing decoder, out of memory); the next batch starts a fresh one"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _dispatch(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Keep every worker busy with one batch queued behind it
+            self._in_flight.acquire()
+            future = None
+            # A pool broken since the last batch refuses this one; retry it on a fresh pool
+            for _ in range(2):
+                executor = self._get_executor()
+                try:
+                    future = executor.submit(_run_batch, [path for _, path in batch])
+                    break
+                except BrokenProcessPool as e:
+                    error = e
+                    self._discard_executor(executor)
+                except Exception as e:
+                    error = e
+                    break
+            if future is None:
+                self._in_flight.release()
+                self._record_failure(batch, error)
+                continue
+            future.add_done_callback(
+                lambda f, batch=batch, executor=executor: self._on_batch_done(batch, f, executor))
+
+    def _on_batch_done(self, batch, future, executor):
+        try:
+            try:
+                results, elapsed = future.result()
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    self._discard_executor(executor)
+                self._record_failure(batch, e)
+                return
+
+            with self._lock:
+                self._metrics['batches'] += 1
+                self._metrics['inference_seconds'] += elapsed
+                self._metrics['images_processed'] += sum(1 for r in results if r is not None)
+                self._metrics['images_failed'] += sum(1 for r in results if r is None)
+
+            self._apply_results(batch, results)
+        except Exception as e:
+            print(f"Applying detection results failed: {e}")
+        finally:
+            self._in_flight.release()
+
+    def _record_failure(self, batch, error):
+        print(f"Detection batch failed: {error}")
+        incident_ids = {incident_id for incident_id, _ in batch}
+        with self._lock:
+            self._metrics['images_failed'] += len(batch)
+            # Left without a result, so the next resume retries them
+            self._pending.difference_update(incident_ids)
+        self._release(incident_ids)
+
+    def _apply_results(self, batch, results):
+        """Fold per-photo predictions into one update per incident"""
+        best = {}
+        for (incident_id, _), result in zip(batch, results):
+            # An unreadable photo still counts as classified, so it isn't retried forever
+            result = result or {'pothole': None, 'severity': None, 'confidence': 0.0}
+            current = best.get(incident_id)
+            if not current or finding_rank(result) > finding_rank(current):
+                best[incident_id] = result
+
+        for incident_id, result in best.items():
+            with self._lock:
+                self._pending.discard(incident_id)
+            try:
+                self._store_result(incident_id, result)
+            finally:
+                self._release([incident_id])
+
+    def _store_result(self, incident_id, result):
+        incident = self.storage.get_incident(incident_id)
+        if not incident:
+            return
+
+        # Photos of one incident can land in different batches; keep the worst finding
+        previous = incident.get('detection')
+        if previous and finding_rank(previous) >= finding_rank(result):
+            return
+
+        updates = {
+            'detection': {
+                'pothole': result['pothole'],
+                'severity': result['severity'],
+                'confidence': result['confidence'],
+                'model': self.model_spec
+            }
+        }
+        if result['pothole'] and result['confidence'] >= self.min_confidence:
+            updates['reported_severity'] = incident.get('reported_severity', incident.get('severity'))
+            updates['severity'] = result['severity']
+            updates['priority'] = Incident.priority_for_severity(result['severity'])
+
+        if self.storage.update_incident(incident_id, updates):
+            with self._lock:
+                self._metrics['incidents_updated'] += 1
+
+
+def finding_rank(result):
+    """Order findings: a pothole beats no pothole beats an unreadable photo, then severity and confidence"""
+    # Results stored before negatives were kept have no 'pothole' key and were all positive
+    pothole = result.get('pothole', True)
+    if pothole:
+        return 2, SEVERITY_ORDER.index(result['severity']), result['confidence']
+    return (0 if pothole is None else 1), 0, result.get('confidence', 0.0)
+
+
+_detection_service = None
+_detection_lock = threading.Lock()
+
+
+def get_detection_service(storage):
+    """Get the process-wide detection service"""
+    global _detection_service
+    with _detection_lock:
+        if _detection_service is None:
+            _detection_service = DetectionService(storage)
+        return _detection_service
@@ -0,0 +1,75 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = 111320.0
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters; accepts scalars or NumPy arrays"""
+    lat1, lng1, lat2, lng2 = (np.radians(v) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def has_coordinates(incident):
+    """True if an incident dict carries a usable latitude/longitude"""
+    return incident.get('latitude') is not None and incident.get('longitude') is not None
+
+
+class GridIndex:
+    """Buckets points into square cells of roughly ``cell_m`` meters
+
+    Good enough for "what is near this point" within a city; a radius
+    query only inspects the handful of cells that overlap the radius.
+    """
+
+    def __init__(self, cell_m=50.0):
+        self.cell_deg = cell_m / METERS_PER_DEGREE
+        self.cells = {}
+        self.points = {}
+
+    def cell_of(self, lat, lng):
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def insert(self, key, lat, lng):
+        if key in self.points:
+            self.remove(key)
+        self.points[key] = (lat, lng)
+        self.cells.setdefault(self.cell_of(lat, lng), set()).add(key)
+
+    def remove(self, key):
+        point = self.points.pop(key, None)
+        if point is None:
+            return
+        cell = self.cell_of(*point)
+        members = self.cells.get(cell)
+        if members:
+            members.discard(key)
+            if not members:
+                del self.cells[cell]
+
+    def nearby(self, lat, lng, radius_m):
+        """Return [(distance_m, key)] for points within ``radius_m``, nearest first"""
+        row, col = self.cell_of(lat, lng)
+        reach_lat = int(math.ceil(radius_m / METERS_PER_DEGREE / self.cell_deg))
+        # Longitude degrees shrink towards the poles
+        lng_scale = max(math.cos(math.radians(lat)), 0.01)
+        reach_lng = int(math.ceil(radius_m / (METERS_PER_DEGREE * lng_scale) / self.cell_deg))
+
+        keys = []
+        for dr in range(-reach_lat, reach_lat + 1):
+            for dc in range(-reach_lng, reach_lng + 1):
+                keys.extend(self.cells.get((row + dr, col + dc), ()))
+        if not keys:
+            return []
+
+        coords = np.array([self.points[key] for key in keys])
+        distances = haversine_m(lat, lng, coords[:, 0], coords[:, 1])
+        return sorted(
+            (float(d), key) for d, key in zip(distances, keys) if d <= radius_m
+        )
+
+    def __len__(self):
+        return len(self.points)
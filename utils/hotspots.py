@@ -0,0 +1,369 @@
+import math
+import string
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from utils.geo import METERS_PER_DEGREE
+from utils.locations import normalize_location, street_of
+from utils.profiling import span
+
+# Finest heatmap cell; each further level doubles it (50, 100, 200, 400 m)
+BASE_CELL_M = 50.0
+LEVELS = 4
+# The finest grid is coarsened rather than exceed this many cells a side
+MAX_GRID_SIDE = 2048
+# Gaussian smoothing, in cells of the level being smoothed
+SMOOTHING_SIGMA = 1.0
+SMOOTHING_RADIUS = 3
+# Points beyond these percentiles of latitude/longitude don't stretch the grid
+BOUNDS_PERCENTILE = 0.05
+# Clustering: cells of EPS_M a side; a non-empty cell is core when it and
+# its 8 neighbours hold MIN_SAMPLES incidents and DENSITY_FACTOR times the
+# background, the average over every cell in the bounds (so years of data
+# don't make the whole city one hotspot), and touching core cells form one
+# hotspot. The background is spread over at least BACKGROUND_MIN_M square,
+# so data that is all one tight cluster isn't measured against itself
+EPS_M = 100.0
+MIN_SAMPLES = 20
+DENSITY_FACTOR = 4.0
+BACKGROUND_MIN_M = 2000.0
+# Hotspots with incidents in this many distinct months are "recurring"
+RECURRING_MIN_MONTHS = 3
+MAX_HOTSPOTS = 50
+# Incidents sampled per hotspot to name it after its most common street
+NAME_SAMPLE = 200
+MAX_HEATMAP_CELLS = 5000
+# A cached result this fresh is served even if the store has moved on
+MIN_REFRESH_S = 10.0
+SEVERITY_WEIGHTS = {'critical': 4.0, 'major': 3.0, 'moderate': 2.0, 'minor': 1.0}
+
+
+def gaussian_kernel(sigma=SMOOTHING_SIGMA, radius=SMOOTHING_RADIUS):
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    return kernel / kernel.sum()
+
+
+def smooth(grid, kernel):
+    """Separable convolution of a 2-D grid with a 1-D kernel along both axes"""
+    radius = len(kernel) // 2
+    for axis in (0, 1):
+        padded = np.pad(grid, [(radius, radius) if a == axis else (0, 0) for a in (0, 1)])
+        out = np.zeros_like(grid, dtype=np.float64)
+        size = grid.shape[axis]
+        for offset, weight in enumerate(kernel):
+            out += weight * (padded[offset:offset + size] if axis == 0 else padded[:, offset:offset + size])
+        grid = out
+    return grid
+
+
+def coarsen(grid):
+    """Sum 2x2 blocks of cells into one"""
+    ny, nx = grid.shape
+    padded = np.pad(grid, ((0, ny % 2), (0, nx % 2)))
+    return padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).sum(axis=(1, 3))
+
+
+def box_sum(grid):
+    """Sum of each cell and its 8 neighbours"""
+    padded = np.pad(grid, 1)
+    ny, nx = grid.shape
+    return sum(padded[dy:dy + ny, dx:dx + nx] for dy in range(3) for dx in range(3))
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+class Points:
+    """Located incidents as arrays, from the snapshot or the record cache"""
+
+    def __init__(self, storage, open_only=False):
+        snapshot = storage.current_snapshot()
+        if snapshot is not None:
+            self._from_snapshot(snapshot, open_only)
+        else:
+            self._from_records(storage.get_incident_records(), open_only)
+
+    def _from_snapshot(self, snapshot, open_only):
+        lat = np.asarray(snapshot.column('latitude'))
+        lng = np.asarray(snapshot.column('longitude'))
+        keep = ~(np.isnan(lat) | np.isnan(lng))
+        statuses = snapshot.categories['status']
+        resolved = np.array([status == 'resolved' for status in statuses] or [False])
+        is_open = ~resolved[np.asarray(snapshot.column('status'))]
+        if open_only:
+            keep &= is_open
+        rows = np.flatnonzero(keep)
+        severity_weight = np.array([SEVERITY_WEIGHTS.get(s, 1.0) for s in snapshot.categories['severity']] or [1.0])
+        self.lat = lat[rows]
+        self.lng = lng[rows]
+        self.weight = severity_weight[np.asarray(snapshot.column('severity'))[rows]]
+        self.open = is_open[rows]
+        self.created_us = np.asarray(snapshot.column('created_us'))[rows]
+        self._location = lambda i: snapshot.location(int(rows[i]))
+
+    def _from_records(self, records, open_only):
+        located = [
+            record for record in records
+            if record.latitude is not None and record.longitude is not None
+            and not (open_only and record.status == 'resolved')
+        ]
+        self.lat = np.array([record.latitude for record in located], dtype=np.float64)
+        self.lng = np.array([record.longitude for record in located], dtype=np.float64)
+        self.weight = np.array([SEVERITY_WEIGHTS.get(record.severity, 1.0) for record in located])
+        self.open = np.array([record.status != 'resolved' for record in located], dtype=bool)
+        self.created_us = np.array([record.created_us or 0 for record in located], dtype=np.int64)
+        self._location = lambda i: normalize_location(located[i].location)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def location(self, i):
+        """Normalized location of the i-th point"""
+        return self._location(i)
+
+
+class HotspotEngine:
+    """Where incidents cluster: smoothed heatmap grids and named hotspots
+
+    Located incidents are projected onto a local metre grid (origin at the
+    south-west of their bounds) and binned, weighted by severity, into
+    ``BASE_CELL_M`` cells; coarser levels sum 2x2 blocks, and every level
+    is smoothed with a separable Gaussian kernel. Hotspots come from a
+    grid DBSCAN: incidents are counted into ``EPS_M`` cells, cells whose
+    3x3 neighbourhood is dense enough (``MIN_SAMPLES``, and well above the
+    background density of the area) are core, touching
+    core cells are merged with union-find and neighbouring non-core cells
+    join as borders. Each hotspot is named after the most common street
+    among its incidents.
+
+    Results are cached per store version (all incidents, and open ones
+    only), and recomputed at most every ``MIN_REFRESH_S`` seconds.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def result(self, open_only=False):
+        """The cached analysis for the current store version, computing it if needed"""
+        self.storage.sync()
+        version = self.storage.version()
+        with self._lock:
+            cached = self._cache.get(open_only)
+            if cached and (cached['version'] == version
+                           or time.monotonic() - cached['computed'] < MIN_REFRESH_S):
+                return cached
+            with span('hotspots.compute'):
+                cached = self._cache[open_only] = self.compute(Points(self.storage, open_only), version)
+            return cached
+
+    def compute(self, points, version=None):
+        started = time.perf_counter()
+        result = {'version': version, 'computed': time.monotonic(), 'points': len(points),
+                  'levels': [], 'hotspots': [], 'bounds': None}
+        if not len(points):
+            result['seconds'] = time.perf_counter() - started
+            return result
+
+        q = BOUNDS_PERCENTILE
+        south, north = np.percentile(points.lat, [q, 100 - q])
+        west, east = np.percentile(points.lng, [q, 100 - q])
+        ky = METERS_PER_DEGREE
+        kx = METERS_PER_DEGREE * max(math.cos(math.radians((south + north) / 2)), 0.01)
+        y = (points.lat - south) * ky
+        x = (points.lng - west) * kx
+        inside = (x >= 0) & (y >= 0) & (x <= (east - west) * kx) & (y <= (north - south) * ky)
+        result['bounds'] = {'south': float(south), 'west': float(west), 'north': float(north),
+                            'east': float(east), 'kx': kx, 'ky': ky}
+
+        # Heatmap pyramid
+        span_m = max((east - west) * kx, (north - south) * ky, 1.0)
+        cell = max(BASE_CELL_M, span_m / MAX_GRID_SIDE)
+        grid = self._bin(x[inside], y[inside], points.weight[inside], cell, span_m)
+        kernel = gaussian_kernel()
+        for level in range(LEVELS):
+            result['levels'].append({'cell_m': cell, 'grid': smooth(grid, kernel)})
+            grid = coarsen(grid)
+            cell *= 2
+
+        result['hotspots'] = self._cluster(points, x, y, inside, span_m)
+        result['seconds'] = time.perf_counter() - started
+        return result
+
+    @staticmethod
+    def _bin(x, y, weights, cell, span_m):
+        side = int(span_m // cell) + 1
+        ix = np.minimum((x // cell).astype(np.int64), side - 1)
+        iy = np.minimum((y // cell).astype(np.int64), side - 1)
+        return np.bincount(iy * side + ix, weights=weights, minlength=side * side).reshape(side, side)
+
+    def _cluster(self, points, x, y, inside, span_m):
+        cell = max(EPS_M, span_m / MAX_GRID_SIDE)
+        side = int(span_m // cell) + 1
+        index = np.flatnonzero(inside)
+        cells = (np.minimum((y[index] // cell).astype(np.int64), side - 1) * side
+                 + np.minimum((x[index] // cell).astype(np.int64), side - 1))
+        counts = np.bincount(cells, minlength=side * side).reshape(side, side)
+        occupied = counts > 0
+        # Percentile trimming can leave a small dataset with no point inside the bounds
+        if not occupied.any():
+            return []
+        neighbourhood = box_sum(counts)
+        # Mean 3x3 count over the bounds, empty cells included
+        background = 9 * len(index) / max(side, BACKGROUND_MIN_M / cell) ** 2
+        threshold = max(MIN_SAMPLES, DENSITY_FACTOR * background)
+        core = occupied & (neighbourhood >= threshold)
+
+        # Connected components of core cells
+        core_cells = np.flatnonzero(core.ravel())
+        if not len(core_cells):
+            return []
+        slot = np.full(side * side, -1, dtype=np.int64)
+        slot[core_cells] = np.arange(len(core_cells))
+        sets = UnionFind(len(core_cells))
+        rows, cols = np.divmod(core_cells, side)
+        for dy, dx in ((0, 1), (1, -1), (1, 0), (1, 1)):
+            r, c = rows + dy, cols + dx
+            ok = (r < side) & (c >= 0) & (c < side)
+            neighbour = slot[np.where(ok, r * side + c, 0)]
+            for a, b in zip(np.flatnonzero(ok & (neighbour >= 0)).tolist(), neighbour[ok & (neighbour >= 0)].tolist()):
+                sets.union(a, b)
+        roots = np.array([sets.find(i) for i in range(len(core_cells))], dtype=np.int64)
+        _, component = np.unique(roots, return_inverse=True)
+
+        labels = np.zeros(side * side, dtype=np.int64)
+        labels[core_cells] = component + 1
+        # Border cells: non-empty, not core, next to a core cell
+        labels = labels.reshape(side, side)
+        padded = np.pad(labels, 1)
+        border = np.zeros_like(labels)
+        for dy in range(3):
+            for dx in range(3):
+                shifted = padded[dy:dy + side, dx:dx + side]
+                border = np.where((border == 0) & (shifted > 0), shifted, border)
+        labels = np.where(core, labels, np.where(counts > 0, border, 0)).ravel()
+
+        point_label = labels[cells]
+        clustered = point_label > 0
+        members = index[clustered]
+        label = point_label[clustered] - 1
+        n_clusters = int(label.max()) + 1 if len(label) else 0
+        if not n_clusters:
+            return []
+
+        count = np.bincount(label, minlength=n_clusters)
+        weight = np.bincount(label, weights=points.weight[members], minlength=n_clusters)
+        open_count = np.bincount(label, weights=points.open[members], minlength=n_clusters)
+        lat_sum = np.bincount(label, weights=points.lat[members], minlength=n_clusters)
+        lng_sum = np.bincount(label, weights=points.lng[members], minlength=n_clusters)
+        bounds = {name: np.full(n_clusters, start) for name, start in
+                  (('south', np.inf), ('west', np.inf), ('north', -np.inf), ('east', -np.inf))}
+        np.minimum.at(bounds['south'], label, points.lat[members])
+        np.minimum.at(bounds['west'], label, points.lng[members])
+        np.maximum.at(bounds['north'], label, points.lat[members])
+        np.maximum.at(bounds['east'], label, points.lng[members])
+        # Undated incidents (no or unparseable created_at) count as 1970
+        months = np.maximum(points.created_us[members], 0).astype('datetime64[us]').astype('datetime64[M]').astype(np.int64)
+        pairs = np.unique(label * (1 << 32) + (months - months.min()))
+        active_months = np.bincount(pairs >> 32, minlength=n_clusters)
+
+        order = np.argsort(-weight, kind='stable')[:MAX_HOTSPOTS]
+        by_label = np.argsort(label, kind='stable')
+        starts = np.searchsorted(label[by_label], np.arange(n_clusters + 1))
+        hotspots = []
+        for rank, c in enumerate(order.tolist()):
+            mine = by_label[starts[c]:starts[c + 1]]
+            sample = mine[np.linspace(0, len(mine) - 1, min(NAME_SAMPLE, len(mine))).astype(np.int64)]
+            streets = Counter(street_of(points.location(int(members[i]))) for i in sample.tolist())
+            streets.pop('', None)
+            name = string.capwords(streets.most_common(1)[0][0]) if streets else f'Hotspot {rank + 1}'
+            half_diagonal = math.hypot(
+                (bounds['east'][c] - bounds['west'][c]) * (METERS_PER_DEGREE * math.cos(math.radians(lat_sum[c] / count[c]))),
+                (bounds['north'][c] - bounds['south'][c]) * METERS_PER_DEGREE) / 2
+            hotspots.append({
+                'rank': rank + 1,
+                'name': name,
+                'incidents': int(count[c]),
+                'open': int(open_count[c]),
+                'weight': round(float(weight[c]), 1),
+                'latitude': round(float(lat_sum[c] / count[c]), 6),
+                'longitude': round(float(lng_sum[c] / count[c]), 6),
+                'radius_m': round(max(half_diagonal, EPS_M / 2), 1),
+                'bounds': [round(float(bounds[k][c]), 6) for k in ('south', 'west', 'north', 'east')],
+                'active_months': int(active_months[c]),
+                'recurring': bool(active_months[c] >= RECURRING_MIN_MONTHS)
+            })
+        return hotspots
+
+    # Views
+
+    def heatmap(self, level=1, open_only=False, bbox=None, limit=MAX_HEATMAP_CELLS):
+        """Smoothed cells of one level as ``[lat, lng, intensity 0..1]``, strongest first"""
+        result = self.result(open_only)
+        level = max(0, min(level, LEVELS - 1))
+        response = {'version': result['version'], 'level': level, 'points': result['points'], 'cells': []}
+        if not result['levels']:
+            return response
+        bounds = result['bounds']
+        grid = result['levels'][level]['grid']
+        cell = result['levels'][level]['cell_m']
+        response['cell_m'] = cell
+        peak = float(grid.max()) or 1.0
+        iy, ix = np.nonzero(grid > peak * 1e-3)
+        lat = bounds['south'] + (iy + 0.5) * cell / bounds['ky']
+        lng = bounds['west'] + (ix + 0.5) * cell / bounds['kx']
+        values = grid[iy, ix] / peak
+        if bbox:
+            south, west, north, east = bbox
+            keep = (lat >= south) & (lat <= north) & (lng >= west) & (lng <= east)
+            lat, lng, values = lat[keep], lng[keep], values[keep]
+        top = np.argsort(-values, kind='stable')[:limit]
+        response['cells'] = [[round(float(a), 6), round(float(b), 6), round(float(v), 4)]
+                             for a, b, v in zip(lat[top], lng[top], values[top])]
+        return response
+
+    def hotspots(self, limit=10, open_only=False):
+        result = self.result(open_only)
+        return {'version': result['version'], 'points': result['points'],
+                'hotspots': result['hotspots'][:limit]}
+
+    def stats(self):
+        with self._lock:
+            return {
+                ('open' if open_only else 'all'): {
+                    'version': cached['version'], 'points': cached['points'],
+                    'hotspots': len(cached['hotspots']), 'seconds': round(cached.get('seconds', 0), 3)
+                }
+                for open_only, cached in self._cache.items()
+            }
+
+
+_hotspot_engine = None
+_hotspot_lock = threading.Lock()
+
+
+def get_hotspot_engine(storage):
+    """Get the process-wide hotspot engine"""
+    global _hotspot_engine
+    with _hotspot_lock:
+        if _hotspot_engine is None:
+            _hotspot_engine = HotspotEngine(storage)
+        return _hotspot_engine
@@ -0,0 +1,677 @@
+import os
+import re
+import json
+import time
+import uuid
+import random
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+JOBS_DIR = os.path.join('data', 'jobs')
+# Pool sizes per process; each job type also has its own concurrency limit
+THREAD_WORKERS = int(os.environ.get('JOB_THREADS', '4'))
+PROCESS_WORKERS = int(os.environ.get('JOB_PROCESSES', '2'))
+# The dispatcher wakes at least this often to pick up jobs queued by other processes
+POLL_INTERVAL = 1.0
+# Running jobs touch their inflight file this often; one untouched for LEASE_SECONDS
+# belongs to a dead worker and is retried
+HEARTBEAT_INTERVAL = 30.0
+LEASE_SECONDS = 300.0
+# Finished jobs are logged to history.log, rotated past this size
+HISTORY_MAX_BYTES = 5 * 1024 * 1024
+# Throughput on the admin page covers this many seconds of the history's tail
+STATS_WINDOW = 3600
+STATS_TAIL_BYTES = 1024 * 1024
+RECENT_FAILURES = 10
+# Job type names go into file names: <run at us>_<id>_<type>.json
+JOB_TYPE_RE = re.compile(r'^[a-z0-9][a-z0-9.-]*$')
+
+
+def now_us():
+    return int(time.time() * 1000000)
+
+
+def job_filename(run_at_us, job_id, job_type):
+    return f'{run_at_us:017d}_{job_id}_{job_type}.json'
+
+
+def parse_job_filename(name):
+    """``(run_at_us, job_id, job_type)`` from a queue file name, or None"""
+    if not name.endswith('.json'):
+        return None
+    parts = name[:-5].split('_', 2)
+    if len(parts) != 3 or not parts[0].isdigit():
+        return None
+    return int(parts[0]), parts[1], parts[2]
+
+
+class JobType:
+    """One kind of job: its handler, where it runs and how it is retried
+
+    ``handler(payload)`` runs on the thread pool, or on the process pool
+    with ``executor='process'`` (it must then be a module-level function).
+    At most ``concurrency`` jobs of the type run at once across every
+    process sharing the job directory. A failed job is retried with
+    exponential backoff until ``max_attempts`` runs have failed.
+    """
+
+    def __init__(self, name, handler, executor='thread', concurrency=1,
+                 max_attempts=5, backoff_base=10.0, backoff_max=3600.0):
+        if not JOB_TYPE_RE.match(name):
+            raise ValueError(f'Invalid job type name: {name!r}')
+        if executor not in ('thread', 'process'):
+            raise ValueError(f'Unknown executor: {executor!r}')
+        self.name = name
+        self.handler = handler
+        self.executor = executor
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def backoff(self, attempts):
+        """Seconds to wait before retrying after ``attempts`` failed runs"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+
+JOB_TYPES = {}
+
+
+def register_job_type(name, handler, **options):
+    """Register (or replace) a job type; see JobType for the options"""
+    JOB_TYPES[name] = JobType(name, handler, **options)
+    return JOB_TYPES[name]
+
+
+class JobQueue:
+    """Durable job queue in plain files under ``data/jobs``
+
+    Each job is one JSON file in ``queue/`` named by the time it may run,
+    so a sorted directory listing is the run order and finding due jobs
+    reads no file contents. A job is claimed by an atomic rename into
+    ``inflight/``, so exactly one worker in any process gets it; jobs out
+    of retries end up in ``failed/``.
+    """
+
+    def __init__(self, directory=JOBS_DIR):
+        self.directory = directory
+        self.queue_dir = os.path.join(directory, 'queue')
+        self.inflight_dir = os.path.join(directory, 'inflight')
+        self.failed_dir = os.path.join(directory, 'failed')
+        self.slots_dir = os.path.join(directory, 'slots')
+        self.history_path = os.path.join(directory, 'history.log')
+        for path in (self.queue_dir, self.inflight_dir, self.failed_dir, self.slots_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def enqueue(self, job_type, payload=None, delay=0.0):
+        """Persist a job; returns its id"""
+        job_id = uuid.uuid4().hex
+        run_at = now_us() + int(delay * 1000000)
+        job = {
+            'id': job_id,
+            'type': job_type,
+            'payload': payload or {},
+            'attempts': 0,
+            'created_at': datetime.utcnow().isoformat(),
+            'last_error': None
+        }
+        self.write(os.path.join(self.queue_dir, job_filename(run_at, job_id, job_type)), job)
+        return job_id
+
+    def queued(self):
+        """Names of queued jobs, earliest first"""
+        return sorted(name for name in os.listdir(self.queue_dir) if parse_job_filename(name))
+
+    def inflight(self):
+        return [name for name in os.listdir(self.inflight_dir) if parse_job_filename(name)]
+
+    def claim(self, name):
+        """Move one queued job into inflight; ``(path, job)``, or None if another worker got it"""
+        src = os.path.join(self.queue_dir, name)
+        dst = os.path.join(self.inflight_dir, name)
+        try:
+            os.replace(src, dst)
+        except FileNotFoundError:
+            return None
+        # Stamp the claim time so recover() doesn't take it back
+        os.utime(dst)
+        job = self.read(dst)
+        if job is None:
+            os.remove(dst)
+            return None
+        return dst, job
+
+    def complete(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def retry(self, path, job, delay):
+        """Put an inflight job back in the queue to run after ``delay`` seconds"""
+        name = job_filename(now_us() + int(delay * 1000000), job['id'], job['type'])
+        self.write(os.path.join(self.queue_dir, name), job)
+        self.complete(path)
+
+    def fail(self, path, job):
+        """Park an inflight job that ran out of attempts in ``failed/``"""
+        job['failed_at'] = datetime.utcnow().isoformat()
+        self.write(os.path.join(self.failed_dir, f"{job['id']}_{job['type']}.json"), job)
+        self.complete(path)
+
+    def stale(self, lease=LEASE_SECONDS):
+        """Inflight jobs whose worker stopped touching them ``lease`` seconds ago"""
+        cutoff = time.time() - lease
+        stale = []
+        for name in self.inflight():
+            path = os.path.join(self.inflight_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    stale.append(path)
+            except FileNotFoundError:
+                continue
+        return stale
+
+    def failures(self, limit=RECENT_FAILURES):
+        """The most recently failed jobs"""
+        names = [name for name in os.listdir(self.failed_dir) if name.endswith('.json')]
+        paths = []
+        for name in names:
+            path = os.path.join(self.failed_dir, name)
+            try:
+                paths.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                continue
+        paths.sort(reverse=True)
+        return len(paths), [job for job in (self.read(path) for _, path in paths[:limit]) if job]
+
+    # History
+
+    def log(self, job_type, status, seconds=None):
+        """Record one finished run: ``done``, ``retry``, ``failed`` or ``lost``"""
+        entry = {'at': round(time.time(), 3), 'type': job_type, 'status': status}
+        if seconds is not None:
+            entry['ms'] = round(seconds * 1000, 1)
+        try:
+            if os.path.getsize(self.history_path) > HISTORY_MAX_BYTES:
+                os.replace(self.history_path, f'{self.history_path}.1')
+        except FileNotFoundError:
+            pass
+        with open(self.history_path, 'a') as f:
+            f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    def history(self, since):
+        """Entries logged since the epoch time ``since``, read from the log's tail"""
+        try:
+            with open(self.history_path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - STATS_TAIL_BYTES))
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        lines = data.splitlines()
+        if size > STATS_TAIL_BYTES:
+            # The first line is probably cut off
+            lines = lines[1:]
+        entries = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('at', 0) >= since:
+                entries.append(entry)
+        return entries
+
+    def write(self, path, job):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f, default=str)
+        os.replace(tmp_path, path)
+
+    def read(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+class JobScheduler:
+    """Runs queued jobs on thread and process pools, and enqueues periodic ones
+
+    Every worker process runs a dispatcher thread over the same
+    ``JobQueue``. Before claiming a job the dispatcher takes a free
+    concurrency slot of its type: a non-blocking ``flock`` on one of
+    ``slots/<type>.<n>.lock``, held until the job finishes and dropped by
+    the kernel if the process dies. Periodic schedules are only ticked by
+    the process holding ``leader.lock``; the others keep trying it, so a
+    new leader takes over when the old one exits. Without ``fcntl``
+    (Windows) slots and leadership only hold within one process.
+    """
+
+    def __init__(self, queue=None, thread_workers=THREAD_WORKERS, process_workers=PROCESS_WORKERS):
+        self.queue = queue or JobQueue()
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        # job_type -> {'every': seconds, 'payload': dict}
+        self.schedules = {}
+        self.stats_local = {'done': 0, 'retried': 0, 'failed': 0}
+
+        self._thread_pool = None
+        self._process_pool = None
+        self._running = {}
+        self._lock = threading.Lock()
+        self._leader_fd = None
+        self._cron_path = os.path.join(self.queue.directory, 'cron.json')
+        self._leader_path = os.path.join(self.queue.directory, 'leader.lock')
+        self._last_heartbeat = 0.0
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    # Public API
+
+    def enqueue(self, job_type, payload=None, delay=0.0):
+        """Queue a job of a registered type; any process's dispatcher may run it"""
+        if job_type not in JOB_TYPES:
+            raise ValueError(f'Unknown job type: {job_type!r}')
+        job_id = self.queue.enqueue(job_type, payload, delay)
+        self._wakeup.set()
+        return job_id
+
+    def schedule(self, job_type, every, payload=None):
+        """Enqueue ``job_type`` every ``every`` seconds, from the leader process only"""
+        if job_type not in JOB_TYPES:
+            raise ValueError(f'Unknown job type: {job_type!r}')
+        self.schedules[job_type] = {'every': float(every), 'payload': payload or {}}
+
+    @property
+    def running(self):
+        return bool(self._worker and self._worker.is_alive())
+
+    def start(self):
+        """Start the dispatcher if it is not already running"""
+        with self._worker_lock:
+            if self.running:
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='jobs', daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout=5):
+        """Stop dispatching; running jobs finish in the background"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._worker:
+            self._worker.join(timeout)
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=False)
+
+    # Dispatcher
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                delay = self.run_pending()
+            except Exception as e:
+                print(f"Job dispatch failed: {e}")
+                delay = POLL_INTERVAL
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def run_pending(self):
+        """Start every due job that has a free slot; returns seconds until the next check"""
+        queued = self.queue.queued()
+        self._tick_schedules(queued)
+        if time.time() - self._last_heartbeat >= HEARTBEAT_INTERVAL:
+            self._heartbeat()
+            self._recover()
+            queued = self.queue.queued()
+
+        now = now_us()
+        delay = POLL_INTERVAL
+        full = set()
+        for name in queued:
+            run_at, _, job_type = parse_job_filename(name)
+            if run_at > now:
+                delay = min(delay, (run_at - now) / 1e6)
+                break
+            # Types this process doesn't know are left for one that does
+            kind = JOB_TYPES.get(job_type)
+            if kind is None or job_type in full:
+                continue
+            slot = self._acquire_slot(kind)
+            if slot is None:
+                full.add(job_type)
+                continue
+            claimed = self.queue.claim(name)
+            if claimed is None:
+                self._release_slot(slot)
+                continue
+            self._submit(kind, claimed[0], claimed[1], slot)
+        return delay
+
+    def _submit(self, kind, path, job, slot):
+        if kind.executor == 'process':
+            pool = self._get_process_pool()
+        else:
+            pool = self._get_thread_pool()
+        started = time.perf_counter()
+        with self._lock:
+            self._running[path] = job['type']
+        try:
+            future = pool.submit(kind.handler, job.get('payload') or {})
+        except Exception as e:
+            # A broken pool fails the attempt; start a fresh one next time
+            if kind.executor == 'process':
+                self._process_pool = None
+            self._finish(kind, path, job, slot, started, e)
+            return
+        future.add_done_callback(
+            lambda future: self._finish(kind, path, job, slot, started, future.exception()))
+
+    def _finish(self, kind, path, job, slot, started, error):
+        seconds = time.perf_counter() - started
+        try:
+            if error is None:
+                self.queue.complete(path)
+                self.queue.log(kind.name, 'done', seconds)
+                self.stats_local['done'] += 1
+                return
+            job['attempts'] = job.get('attempts', 0) + 1
+            job['last_error'] = f'{type(error).__name__}: {error}'
+            if job['attempts'] >= kind.max_attempts:
+                self.queue.fail(path, job)
+                self.queue.log(kind.name, 'failed', seconds)
+                self.stats_local['failed'] += 1
+                print(f"Job {kind.name} {job['id']} failed for good: {job['last_error']}")
+            else:
+                self.queue.retry(path, job, kind.backoff(job['attempts']))
+                self.queue.log(kind.name, 'retry', seconds)
+                self.stats_local['retried'] += 1
+        except Exception as e:
+            print(f"Job {kind.name} bookkeeping failed: {e}")
+        finally:
+            with self._lock:
+                self._running.pop(path, None)
+            self._release_slot(slot)
+            self._wakeup.set()
+
+    def _get_thread_pool(self):
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix='job')
+            return self._thread_pool
+
+    def _get_process_pool(self):
+        with self._lock:
+            if self._process_pool is None:
+                # spawn avoids forking a multi-threaded server process
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._process_pool
+
+    # Concurrency slots
+
+    def _acquire_slot(self, kind):
+        """A held slot of ``kind`` (an open descriptor, or True without fcntl), or None"""
+        if fcntl is None:
+            with self._lock:
+                busy = sum(1 for job_type in self._running.values() if job_type == kind.name)
+            return True if busy < kind.concurrency else None
+        for n in range(kind.concurrency):
+            fd = os.open(os.path.join(self.queue.slots_dir, f'{kind.name}.{n}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def _release_slot(self, slot):
+        if slot is not True and slot is not None:
+            # Closing the descriptor drops its flock
+            os.close(slot)
+
+    # Leases
+
+    def _heartbeat(self):
+        """Touch this process's inflight jobs so no other process thinks they were abandoned"""
+        self._last_heartbeat = time.time()
+        with self._lock:
+            paths = list(self._running)
+        for path in paths:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+
+    def _recover(self):
+        """Retry (or fail) inflight jobs left behind by a process that died"""
+        for path in self.queue.stale():
+            with self._lock:
+                if path in self._running:
+                    continue
+            parsed = parse_job_filename(os.path.basename(path))
+            kind = JOB_TYPES.get(parsed[2]) if parsed else None
+            lost = os.path.join(self.queue.inflight_dir, f'.{os.path.basename(path)}.lost')
+            try:
+                # Take it first, so two processes recovering at once don't both requeue it
+                os.replace(path, lost)
+            except FileNotFoundError:
+                continue
+            job = self.queue.read(lost)
+            if not job or not parsed:
+                self.queue.complete(lost)
+                continue
+            job['attempts'] = job.get('attempts', 0) + 1
+            job['last_error'] = 'Worker lost'
+            self.queue.log(parsed[2], 'lost')
+            if kind is None or job['attempts'] >= kind.max_attempts:
+                self.queue.fail(lost, job)
+            else:
+                self.queue.retry(lost, job, 0)
+
+    # Periodic schedules
+
+    def is_leader(self):
+        """Whether this process ticks the schedules; tries to become leader if nobody is"""
+        if self._leader_fd is not None:
+            return True
+        if fcntl is None:
+            self._leader_fd = True
+            return True
+        fd = os.open(self._leader_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f'{os.getpid()}\n'.encode())
+        self._leader_fd = fd
+        return True
+
+    def _load_cron(self):
+        try:
+            with open(self._cron_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _tick_schedules(self, queued):
+        if not self.schedules or not self.is_leader():
+            return
+        state = self._load_cron()
+        now = time.time()
+        waiting = {parse_job_filename(name)[2] for name in queued}
+        waiting.update(parse_job_filename(name)[2] for name in self.queue.inflight())
+        due = []
+        changed = False
+        for job_type, schedule in self.schedules.items():
+            period = int(now // schedule['every'])
+            if period <= state.get(job_type, -1):
+                continue
+            state[job_type] = period
+            changed = True
+            # A run still waiting or running covers this period too
+            if job_type not in waiting:
+                due.append((job_type, schedule['payload']))
+        if not changed:
+            return
+        # Saved before enqueueing: a leader dying in between skips a run rather than doubling it
+        self.queue.write(self._cron_path, state)
+        for job_type, payload in due:
+            self.queue.enqueue(job_type, payload)
+
+    # Stats
+
+    def stats(self):
+        """Queue depth, throughput and failures across every process, for /admin/system"""
+        now = time.time()
+        queued = self.queue.queued()
+        inflight = self.queue.inflight()
+        failed_total, failures = self.queue.failures()
+        history = self.queue.history(now - STATS_WINDOW)
+
+        types = {}
+
+        def row(job_type):
+            if job_type not in types:
+                kind = JOB_TYPES.get(job_type)
+                types[job_type] = {
+                    'type': job_type, 'queued': 0, 'due': 0, 'running': 0,
+                    'done': 0, 'retry': 0, 'failed': 0, 'lost': 0, 'ms': 0.0,
+                    'executor': kind.executor if kind else None,
+                    'concurrency': kind.concurrency if kind else None,
+                    'every': self.schedules.get(job_type, {}).get('every')
+                }
+            return types[job_type]
+
+        for job_type in list(JOB_TYPES) + list(self.schedules):
+            row(job_type)
+        oldest_due = None
+        for name in queued:
+            run_at, _, job_type = parse_job_filename(name)
+            entry = row(job_type)
+            entry['queued'] += 1
+            if run_at <= now * 1e6:
+                entry['due'] += 1
+                oldest_due = run_at if oldest_due is None else min(oldest_due, run_at)
+        for name in inflight:
+            row(parse_job_filename(name)[2])['running'] += 1
+        for entry in history:
+            target = row(entry.get('type', 'unknown'))
+            status = entry.get('status')
+            if status in ('done', 'retry', 'failed', 'lost'):
+                target[status] += 1
+            target['ms'] += entry.get('ms', 0)
+        for entry in types.values():
+            runs = entry['done'] + entry['retry'] + entry['failed']
+            entry['avg_ms'] = round(entry.pop('ms') / runs, 1) if runs else None
+
+        leader_pid = None
+        try:
+            with open(self._leader_path, 'r') as f:
+                leader_pid = int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            pass
+
+        done = sum(entry['done'] for entry in types.values())
+        return {
+            'queued': len(queued),
+            'running': len(inflight),
+            'failed': failed_total,
+            'oldest_due_s': round(now - oldest_due / 1e6, 1) if oldest_due is not None else None,
+            'window_s': STATS_WINDOW,
+            'done_per_min': round(done / (STATS_WINDOW / 60), 2),
+            'types': sorted(types.values(), key=lambda entry: entry['type']),
+            'recent_failures': failures,
+            'leader_pid': leader_pid,
+            'is_leader': self._leader_fd is not None,
+            'dispatcher': self.running,
+            'pid': os.getpid(),
+            'this_process': dict(self.stats_local)
+        }
+
+
+# Built-in jobs; handlers import lazily so this module stays cheap
+
+def scan_sla(payload):
+    from utils.storage import get_storage
+    from utils.sla import get_sla_monitor
+    return len(get_sla_monitor(get_storage()).scan())
+
+
+def archive_resolved(payload):
+    from utils.storage import get_storage
+    return get_storage().archive_resolved(payload.get('older_than_days'))
+
+
+def render_photo_variants(payload):
+    from utils.uploads import render_variants
+    return render_variants(payload['original'], payload['thumbnail'], payload['web'])
+
+
+def drain_mail(payload):
+    from utils.mail_queue import get_mail_queue
+    return get_mail_queue().drain()
+
+
+def resume_detection(payload):
+    from utils.storage import get_storage
+    from utils.detection import get_detection_service
+    return get_detection_service(get_storage()).resume()
+
+
+def create_backup(payload):
+    from utils.backups import BackupStore, KEEP_BACKUPS
+    backups = BackupStore()
+    manifest = backups.create(full=bool(payload.get('full')))
+    backups.prune(payload.get('keep', KEEP_BACKUPS))
+    return manifest['id']
+
+
+register_job_type('sla.scan', scan_sla, max_attempts=3, backoff_base=30.0)
+register_job_type('storage.archive', archive_resolved, max_attempts=3, backoff_base=60.0)
+register_job_type('photos.variants', render_photo_variants, executor='process', concurrency=2)
+# Messages keep their own retry schedule in the spool, so a failed drain isn't retried
+register_job_type('mail.drain', drain_mail, max_attempts=1)
+register_job_type('detection.resume', resume_detection, max_attempts=3, backoff_base=60.0)
+register_job_type('backup.create', create_backup, max_attempts=2, backoff_base=300.0)
+
+
+_job_scheduler = None
+_job_scheduler_lock = threading.Lock()
+
+
+def get_job_scheduler():
+    """Get the process-wide job scheduler (not started until init_jobs)"""
+    global _job_scheduler
+    with _job_scheduler_lock:
+        if _job_scheduler is None:
+            _job_scheduler = JobScheduler()
+        return _job_scheduler
+
+
+def init_jobs(app):
+    """Attach the job scheduler to ``app`` and start its dispatcher"""
+    scheduler = get_job_scheduler()
+    app.extensions['jobs'] = scheduler
+    scheduler.start()
+    return scheduler
@@ -0,0 +1,240 @@
+import re
+import bisect
+import heapq
+import string
+import threading
+from functools import lru_cache
+
+from utils.profiling import span
+
+WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+# A leading house number: 12, 12a, 12-14, 12/14
+HOUSE_NUMBER_RE = re.compile(r'^\d+[a-z]?(?:[-/]\d+[a-z]?)?$')
+# Street types, spelled out wherever they appear after the first word
+STREET_TYPES = {
+    'st': 'street', 'str': 'street', 'ave': 'avenue', 'av': 'avenue', 'rd': 'road',
+    'blvd': 'boulevard', 'dr': 'drive', 'ln': 'lane', 'ct': 'court', 'pl': 'place',
+    'hwy': 'highway', 'pkwy': 'parkway', 'sq': 'square', 'ter': 'terrace', 'cir': 'circle',
+    'expy': 'expressway', 'fwy': 'freeway', 'tpke': 'turnpike', 'aly': 'alley', 'bldg': 'building',
+}
+DIRECTIONS = {
+    'n': 'north', 's': 'south', 'e': 'east', 'w': 'west',
+    'ne': 'northeast', 'nw': 'northwest', 'se': 'southeast', 'sw': 'southwest',
+}
+# Prefixes matching more index entries than this are answered from a
+# per-prefix cache of their top CACHED_SUGGESTIONS locations, filled on first use
+SCAN_LIMIT = 2048
+CACHED_SUGGESTIONS = 50
+# Suffix of the cache keys of whole-term (finished word) lookups
+EXACT_MARK = '\n'
+MAX_SUGGESTIONS = 20
+
+
+@lru_cache(maxsize=1 << 17)
+def normalize_location(text):
+    """Canonical lowercase form of a free-text location
+
+    Punctuation and extra whitespace go, ``&`` becomes ``and``, and
+    abbreviated street types and directions are spelled out, so "123 Main
+    St." and "123  main street" compare equal. A leading "St" followed by
+    a name is read as "Saint" (St Marks Place).
+    """
+    words = WORD_RE.findall(str(text or '').lower().replace('&', ' and ').replace('\u2019', "'"))
+    first = 0
+    while first < len(words) and HOUSE_NUMBER_RE.match(words[first]):
+        first += 1
+    normalized = []
+    for i, word in enumerate(words):
+        if word in DIRECTIONS:
+            word = DIRECTIONS[word]
+        elif word == 'st' and i == first and i + 1 < len(words):
+            word = 'saint'
+        elif word in STREET_TYPES and (i > first or i + 1 == len(words)):
+            word = STREET_TYPES[word]
+        normalized.append(word)
+    return ' '.join(normalized)
+
+
+def street_of(normalized):
+    """A normalized location without its house number ("12 main street" -> "main street")"""
+    words = normalized.split(' ')
+    first = 0
+    while first < len(words) - 1 and HOUSE_NUMBER_RE.match(words[first]):
+        first += 1
+    return ' '.join(words[first:])
+
+
+def location_keys(location):
+    """Index keys for one location: its normalized form and, if different, its street"""
+    normalized = normalize_location(location)
+    if not normalized:
+        return ()
+    street = street_of(normalized)
+    return (normalized,) if street == normalized else (normalized, street)
+
+
+def entry_terms(key):
+    """Strings a key is found under: the key itself and each later word onwards"""
+    words = key.split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class LocationIndex:
+    """Known locations by normalized prefix, with how many incidents name each
+
+    Every incident's location is normalized and counted both as is and as
+    its street, and each key is entered in a sorted ``(term, key)`` list
+    under itself and each of its later words, so "main" finds "north main
+    street". A suggestion is a binary search for the typed prefix plus a
+    top-by-count pick over the matching range; ranges too wide to scan
+    per keystroke (one- or two-letter prefixes) are served from a cache of
+    their top locations, which writes keep up to date.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._lock = threading.RLock()
+        self._built = False
+        self._reset()
+
+    def _reset(self):
+        self._counts = {}
+        self._entries = []
+        self._top = {}
+
+    def ensure_built(self):
+        # Fold in writes from other worker processes first
+        self.storage.sync()
+        with self._lock:
+            if not self._built:
+                self.rebuild(record.get('location') for record in self.storage.get_incident_records())
+
+    def rebuild(self, locations):
+        with self._lock, span('locations.rebuild'):
+            self._reset()
+            counts = self._counts
+            for location in locations:
+                for key in location_keys(location):
+                    counts[key] = counts.get(key, 0) + 1
+            self._entries = sorted((term, key) for key in counts for term in entry_terms(key))
+            self._built = True
+            # First keystrokes match the widest ranges; rank them now rather than on a request
+            for first in sorted({term[:1] for term, _ in self._entries}):
+                self._top_keys(first, CACHED_SUGGESTIONS)
+
+    def _adjust(self, location, delta):
+        for key in location_keys(location):
+            count = self._counts.get(key, 0) + delta
+            if count > 0:
+                if key not in self._counts:
+                    for term in entry_terms(key):
+                        bisect.insort(self._entries, (term, key))
+                self._counts[key] = count
+            elif key in self._counts:
+                del self._counts[key]
+                for term in entry_terms(key):
+                    i = bisect.bisect_left(self._entries, (term, key))
+                    if i < len(self._entries) and self._entries[i] == (term, key):
+                        del self._entries[i]
+            self._update_top(key, delta)
+
+    def _update_top(self, key, delta):
+        """Keep the cached top lists of the prefixes ``key`` is found under correct"""
+        rank = self._rank
+        for term in entry_terms(key):
+            for prefix in [term[:end] for end in range(1, len(term) + 1)] + [term + EXACT_MARK]:
+                top = self._top.get(prefix)
+                if top is None:
+                    continue
+                if delta < 0:
+                    # Something unlisted may now outrank it; recount on next use
+                    if key in top:
+                        del self._top[prefix]
+                elif key in top:
+                    top.sort(key=rank, reverse=True)
+                elif rank(key) > rank(top[-1]):
+                    top.append(key)
+                    top.sort(key=rank, reverse=True)
+                    del top[CACHED_SUGGESTIONS:]
+
+    def _rank(self, key):
+        return self._counts.get(key, 0), key
+
+    def on_change(self, event, incident_id, incident, previous=None):
+        """Storage listener: keep location counts in step with incident writes"""
+        with self._lock:
+            if event == 'reset':
+                self._built = False
+            if not self._built or event not in ('create', 'update', 'delete'):
+                return
+            old = (previous or {}).get('location') if event != 'create' else None
+            new = (incident or {}).get('location') if event != 'delete' else None
+            if event == 'update' and old == new:
+                return
+            if old:
+                self._adjust(old, -1)
+            if new:
+                self._adjust(new, 1)
+
+    def _top_keys(self, prefix, limit, exact=False):
+        """Top keys found under terms starting with ``prefix`` (or equal to it, if ``exact``)"""
+        lo = bisect.bisect_left(self._entries, (prefix,))
+        hi = bisect.bisect_left(self._entries, (prefix, '\uffff') if exact else (prefix + '\uffff',), lo)
+        if hi - lo <= SCAN_LIMIT:
+            keys = {key for _, key in self._entries[lo:hi]}
+            return heapq.nlargest(limit, keys, key=self._rank)
+        cache_key = prefix + EXACT_MARK if exact else prefix
+        top = self._top.get(cache_key)
+        if top is None or len(top) < min(limit, CACHED_SUGGESTIONS):
+            keys = {key for _, key in self._entries[lo:hi]}
+            top = self._top[cache_key] = heapq.nlargest(
+                max(limit, CACHED_SUGGESTIONS), keys, key=self._rank)
+        return top[:limit]
+
+    def suggest(self, query, limit=10):
+        """Up to ``limit`` known locations matching ``query`` as a prefix, most reported first"""
+        self.ensure_built()
+        query = str(query or '')
+        prefixes = {normalize_location(query)}
+        words = WORD_RE.findall(query.lower())
+        if words and not query.endswith(' '):
+            # The last word may be half typed: "main s" means "main s...", not "main south"
+            prefixes.add(' '.join(filter(None, (normalize_location(' '.join(words[:-1])), words[-1]))))
+        exact = set()
+        if query.endswith(' '):
+            # A finished word: "main " should not match "maine", but does match "main"
+            exact = prefixes - {''}
+            prefixes = {prefix + ' ' for prefix in exact}
+        prefixes.discard('')
+        if not prefixes:
+            return []
+        limit = max(1, min(limit, MAX_SUGGESTIONS))
+        with self._lock:
+            keys = set()
+            for prefix in prefixes:
+                keys.update(self._top_keys(prefix, limit))
+            for term in exact:
+                keys.update(self._top_keys(term, limit, exact=True))
+            keys = heapq.nlargest(limit, keys, key=self._rank)
+            return [
+                {'location': string.capwords(key), 'normalized': key, 'count': self._counts[key]}
+                for key in keys
+            ]
+
+    def stats(self):
+        with self._lock:
+            return {'locations': len(self._counts), 'entries': len(self._entries), 'cached_prefixes': len(self._top)}
+
+
+_location_index = None
+_location_lock = threading.Lock()
+
+
+def get_location_index(storage):
+    """Get the process-wide location index, subscribed to storage writes"""
+    global _location_index
+    with _location_lock:
+        if _location_index is None:
+            _location_index = LocationIndex(storage)
+            storage.add_listener(_location_index.on_change)
+        return _location_index
@@ -0,0 +1,399 @@
+import os
+import json
+import time
+import uuid
+import random
+import smtplib
+import threading
+from datetime import datetime
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+
+def get_smtp_config():
+    """Read SMTP relay settings from the environment"""
+    return {
+        'host': os.getenv('SMTP_SERVER'),
+        'port': int(os.getenv('SMTP_PORT', 587)),
+        'username': os.getenv('SMTP_USERNAME'),
+        'password': os.getenv('SMTP_PASSWORD'),
+        'starttls': os.getenv('SMTP_STARTTLS', 'true').lower() not in ('0', 'false', 'no'),
+        'timeout': float(os.getenv('SMTP_TIMEOUT', 10))
+    }
+
+
+def is_permanent(error):
+    """Whether the server rejected a message for good (a 5xx reply), so retrying can't help"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        # Every recipient was refused; a 4xx among them (greylisting, a full mailbox) may clear up
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def header_value(value):
+    """Fold line breaks into spaces; a CR or LF in a header is rejected by ``email``"""
+    return ' '.join(str(value or '').split())
+
+
+class SMTPConnectionPool:
+    """Keeps long-lived SMTP connections around for reuse between sends"""
+
+    def __init__(self, host, port=587, username=None, password=None, starttls=True,
+                 timeout=10, max_size=2, max_idle=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Open, secure and authenticate a new connection"""
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    def acquire(self):
+        """Get a healthy connection, reusing an idle one when possible"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, released_at = self._idle.pop()
+
+            if time.monotonic() - released_at > self.max_idle:
+                self._close(server)
+                continue
+
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close(server)
+
+        return self._connect()
+
+    def release(self, server, healthy=True):
+        """Return a connection to the pool, or drop it if it is broken"""
+        if not healthy:
+            self._close(server)
+            return
+
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((server, time.monotonic()))
+                return
+        self._close(server)
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._close(server)
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+
+class MailQueue:
+    """Disk-backed outbound mail queue drained by a background worker
+
+    Each message is one JSON file. Files move between ``queue/``,
+    ``inflight/`` and ``failed/`` with atomic renames, so a message is
+    claimed by exactly one worker even when several processes share the
+    spool directory. Transient failures are retried with backoff; a
+    permanent rejection moves the message to ``failed/`` at once.
+    """
+
+    def __init__(self, spool_dir='data/mail', pool=None, batch_size=20,
+                 max_attempts=8, backoff_base=5, backoff_max=3600, poll_interval=5,
+                 inflight_timeout=300):
+        self.spool_dir = spool_dir
+        self.queue_dir = os.path.join(spool_dir, 'queue')
+        self.inflight_dir = os.path.join(spool_dir, 'inflight')
+        self.failed_dir = os.path.join(spool_dir, 'failed')
+        self.pool = pool
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.inflight_timeout = inflight_timeout
+        # Counted by the worker and by request threads sending inline
+        self._stats = {'sent': 0, 'retried': 0, 'failed': 0}
+        self._stats_lock = threading.Lock()
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+        for directory in (self.queue_dir, self.inflight_dir, self.failed_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def enqueue(self, to_addr, subject, body, from_addr=None, reply_to=None):
+        """Persist a message to the spool and wake the worker"""
+        message_id = str(uuid.uuid4())
+        message = {
+            'id': message_id,
+            'to': to_addr,
+            'from': from_addr,
+            'reply_to': reply_to,
+            'subject': subject,
+            'body': body,
+            'attempts': 0,
+            'next_attempt_at': time.time(),
+            'created_at': datetime.utcnow().isoformat(),
+            'last_error': None
+        }
+        self._write(os.path.join(self.queue_dir, f'{message_id}.json'), message)
+        self._wakeup.set()
+        if self.pool and not self.running:
+            request_drain()
+        return message_id
+
+    def depth(self):
+        """Number of messages waiting to be sent"""
+        return len([name for name in os.listdir(self.queue_dir) if name.endswith('.json')])
+
+    def stats(self):
+        """Delivery counters for this process, and the spool depth"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queued'] = self.depth()
+        return stats
+
+    @property
+    def running(self):
+        return bool(self._worker and self._worker.is_alive())
+
+    def start(self):
+        """Start the background worker if it is not already running"""
+        with self._worker_lock:
+            if self.running:
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout=5):
+        """Stop the background worker and close pooled connections"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._worker:
+            self._worker.join(timeout)
+        if self.pool:
+            self.pool.close_all()
+
+    def drain(self):
+        """Send every message that is currently due, batch by batch"""
+        if not self.pool:
+            return 0
+        self._recover_inflight()
+        sent = 0
+        while True:
+            batch = self._claim_batch()
+            if not batch:
+                return sent
+            sent += self._send_batch(batch)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"Mail queue drain failed: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _claim_batch(self):
+        """Move up to ``batch_size`` due messages into inflight"""
+        now = time.time()
+        due = []
+        for name in os.listdir(self.queue_dir):
+            if not name.endswith('.json'):
+                continue
+            message = self._read(os.path.join(self.queue_dir, name))
+            if message and message.get('next_attempt_at', 0) <= now:
+                due.append((message.get('next_attempt_at', 0), name))
+
+        batch = []
+        for _, name in sorted(due)[:self.batch_size]:
+            src = os.path.join(self.queue_dir, name)
+            dst = os.path.join(self.inflight_dir, name)
+            try:
+                os.replace(src, dst)
+            except FileNotFoundError:
+                # Another worker claimed it first
+                continue
+            # Stamp the claim time so _recover_inflight doesn't steal it back
+            os.utime(dst)
+            message = self._read(dst)
+            if message:
+                batch.append((dst, message))
+        return batch
+
+    def _send_batch(self, batch):
+        """Send a batch over a single pooled connection"""
+        sent = 0
+        try:
+            server = self.pool.acquire()
+        except Exception as e:
+            for path, message in batch:
+                self._retry_later(path, message, e)
+            return 0
+
+        healthy = True
+        try:
+            for path, message in batch:
+                if not healthy:
+                    # Never tried: back in the queue as it was, for the next connection
+                    self._requeue(path)
+                    continue
+                try:
+                    server.send_message(self._build_mime(message))
+                except smtplib.SMTPServerDisconnected as e:
+                    healthy = False
+                    self._retry_later(path, message, e)
+                    continue
+                except smtplib.SMTPException as e:
+                    # A reply from the server; the connection is still usable
+                    if is_permanent(e):
+                        self._fail(path, message, e)
+                    else:
+                        self._retry_later(path, message, e)
+                    continue
+                except OSError as e:
+                    # Checked after SMTPException, which is an OSError too
+                    healthy = False
+                    self._retry_later(path, message, e)
+                    continue
+                except Exception as e:
+                    # A message that can't be built or encoded never will be
+                    self._fail(path, message, e)
+                    continue
+
+                os.remove(path)
+                self._count('sent')
+                sent += 1
+        finally:
+            self.pool.release(server, healthy=healthy)
+        return sent
+
+    def _retry_later(self, path, message, error):
+        """Reschedule a message with exponential backoff, or give up"""
+        message['attempts'] = message.get('attempts', 0) + 1
+        message['last_error'] = str(error)
+
+        if message['attempts'] >= self.max_attempts:
+            self._fail(path, message, error)
+            return
+
+        name = os.path.basename(path)
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (message['attempts'] - 1)))
+        message['next_attempt_at'] = time.time() + delay * random.uniform(0.8, 1.2)
+        self._write(os.path.join(self.queue_dir, name), message)
+        os.remove(path)
+        self._count('retried')
+
+    def _requeue(self, path):
+        """Return a claimed message to the queue without charging it an attempt"""
+        os.replace(path, os.path.join(self.queue_dir, os.path.basename(path)))
+
+    def _fail(self, path, message, error):
+        """Give up on a message, keeping it in ``failed/`` for inspection"""
+        message['last_error'] = str(error)
+        self._write(os.path.join(self.failed_dir, os.path.basename(path)), message)
+        os.remove(path)
+        self._count('failed')
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _recover_inflight(self):
+        """Requeue messages abandoned by a worker that died mid-send"""
+        cutoff = time.time() - self.inflight_timeout
+        for name in os.listdir(self.inflight_dir):
+            path = os.path.join(self.inflight_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.replace(path, os.path.join(self.queue_dir, name))
+            except FileNotFoundError:
+                continue
+
+    def _build_mime(self, message):
+        msg = MIMEMultipart()
+        msg['From'] = header_value(message.get('from'))
+        msg['To'] = header_value(message['to'])
+        msg['Subject'] = header_value(message['subject'])
+        if message.get('reply_to'):
+            msg['Reply-To'] = header_value(message['reply_to'])
+        msg.attach(MIMEText(message['body'], 'plain'))
+        return msg
+
+    def _write(self, path, message):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(message, f)
+        os.replace(tmp_path, path)
+
+    def _read(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+_mail_queue = None
+_mail_queue_lock = threading.Lock()
+
+
+def job_dispatcher_running():
+    from utils.jobs import get_job_scheduler
+    return get_job_scheduler().running
+
+
+def request_drain():
+    """Have the job dispatcher deliver new mail now rather than at its next scheduled drain"""
+    from utils.jobs import get_job_scheduler
+    scheduler = get_job_scheduler()
+    if scheduler.running:
+        scheduler.enqueue('mail.drain')
+
+
+def get_mail_queue():
+    """Get the process-wide mail queue
+
+    With SMTP configured it is drained by ``mail.drain`` jobs when the job
+    dispatcher runs (utils/jobs.py), and by a worker thread otherwise.
+    """
+    global _mail_queue
+    with _mail_queue_lock:
+        if _mail_queue is None:
+            config = get_smtp_config()
+            pool = None
+            if config['host']:
+                pool = SMTPConnectionPool(**config)
+            _mail_queue = MailQueue(pool=pool)
+            if pool and not job_dispatcher_running():
+                _mail_queue.start()
+        return _mail_queue
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+
+from flask import g, request, Response
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# How often a worker publishes its counters for the others' /metrics
+PUBLISH_INTERVAL = 5.0
+METRICS_DIR = os.path.join('data', 'metrics')
+
+# Storage counters, indexes into a per-request list
+LOAD_JSON_CALLS, SAVE_JSON_CALLS, BYTES_READ, BYTES_WRITTEN, PARSE_SECONDS, LOCK_WAIT_SECONDS = range(6)
+STORAGE_COUNTERS = (
+    ('load_json_total', 'counter', 'Storage files read and parsed'),
+    ('save_json_total', 'counter', 'Storage files serialized and written'),
+    ('read_bytes_total', 'counter', 'Bytes read from storage files'),
+    ('written_bytes_total', 'counter', 'Bytes written to storage files'),
+    ('parse_seconds_total', 'counter', 'Time spent deserializing storage files'),
+    ('lock_wait_seconds_total', 'counter', 'Time spent waiting for the storage writer lock'),
+)
+
+_request_counters = contextvars.ContextVar('storage_counters', default=None)
+
+
+def record_storage(counter, value=1):
+    """Add to a storage counter for the current request (or background work)
+
+    Inside a request this is a plain list update with no locking; the
+    totals are folded into the registry once, when the request ends.
+    """
+    counters = _request_counters.get()
+    if counters is not None:
+        counters[counter] += value
+    else:
+        registry.add_background(counter, value)
+
+
+def current_storage_counters():
+    """The current request's storage counters (indexed like STORAGE_COUNTERS), or None"""
+    return _request_counters.get()
+
+
+def new_endpoint_stats():
+    return {
+        'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        'sum': 0.0,
+        'count': 0,
+        'status': {},
+        'storage': [0] * len(STORAGE_COUNTERS)
+    }
+
+
+class MetricsRegistry:
+    """Request and storage counters for this process
+
+    Each worker periodically writes its counters to ``data/metrics/<pid>.json``
+    so that ``/metrics`` served by any worker covers all of them.
+    """
+
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self.endpoints = {}
+        self.background = [0] * len(STORAGE_COUNTERS)
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._published_at = 0.0
+
+    def observe(self, endpoint, method, status, seconds, storage):
+        with self._lock:
+            stats = self.endpoints.get((endpoint, method))
+            if stats is None:
+                stats = self.endpoints[(endpoint, method)] = new_endpoint_stats()
+            stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stats['sum'] += seconds
+            stats['count'] += 1
+            stats['status'][status] = stats['status'].get(status, 0) + 1
+            if storage is not None:
+                totals = stats['storage']
+                for i, value in enumerate(storage):
+                    if value:
+                        totals[i] += value
+        if time.monotonic() - self._published_at > PUBLISH_INTERVAL:
+            self.publish()
+
+    def add_background(self, counter, value):
+        with self._lock:
+            self.background[counter] += value
+
+    def export(self):
+        """Counters as plain JSON-able data"""
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'started_at': self.started_at,
+                'endpoints': [
+                    {'endpoint': endpoint, 'method': method, 'buckets': list(stats['buckets']),
+                     'sum': stats['sum'], 'count': stats['count'],
+                     'status': {str(code): n for code, n in stats['status'].items()},
+                     'storage': list(stats['storage'])}
+                    for (endpoint, method), stats in self.endpoints.items()
+                ],
+                'background': list(self.background)
+            }
+
+    def publish(self):
+        """Write this worker's counters where the other workers can read them"""
+        self._published_at = time.monotonic()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'{os.getpid()}.json')
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(self.export(), f)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            print(f"Metrics publish failed: {e}")
+
+    def collect(self):
+        """This worker's live counters merged with every other live worker's last publish"""
+        exports = [self.export()]
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if not name.endswith('.json') or name == f'{os.getpid()}.json':
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                pid = int(name[:-5])
+                os.kill(pid, 0)
+            except (ValueError, ProcessLookupError):
+                # Exited worker; its counters go with it, as with any restart
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path) as f:
+                    exports.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+        merged = {}
+        background = [0] * len(STORAGE_COUNTERS)
+        for export in exports:
+            for i, value in enumerate(export['background']):
+                background[i] += value
+            for entry in export['endpoints']:
+                stats = merged.setdefault((entry['endpoint'], entry['method']), new_endpoint_stats())
+                stats['buckets'] = [a + b for a, b in zip(stats['buckets'], entry['buckets'])]
+                stats['sum'] += entry['sum']
+                stats['count'] += entry['count']
+                for code, n in entry['status'].items():
+                    stats['status'][code] = stats['status'].get(code, 0) + n
+                stats['storage'] = [a + b for a, b in zip(stats['storage'], entry['storage'])]
+        return merged, background, len(exports)
+
+    def prometheus(self):
+        """All workers' counters in the Prometheus text exposition format"""
+        endpoints, background, workers = self.collect()
+        lines = [
+            '# HELP potholes_workers Worker processes reporting metrics',
+            '# TYPE potholes_workers gauge',
+            f'potholes_workers {workers}',
+            '# HELP potholes_http_requests_total Requests by endpoint, method and status',
+            '# TYPE potholes_http_requests_total counter',
+        ]
+        for (endpoint, method), stats in sorted(endpoints.items()):
+            for code, n in sorted(stats['status'].items()):
+                lines.append(f'potholes_http_requests_total{{endpoint="{endpoint}",method="{method}",status="{code}"}} {n}')
+
+        lines += [
+            '# HELP potholes_http_request_duration_seconds Request latency by endpoint',
+            '# TYPE potholes_http_request_duration_seconds histogram',
+        ]
+        for (endpoint, method), stats in sorted(endpoints.items()):
+            labels = f'endpoint="{endpoint}",method="{method}"'
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, stats['buckets']):
+                cumulative += n
+                lines.append(f'potholes_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'potholes_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats["count"]}')
+            lines.append(f'potholes_http_request_duration_seconds_sum{{{labels}}} {stats["sum"]:.6f}')
+            lines.append(f'potholes_http_request_duration_seconds_count{{{labels}}} {stats["count"]}')
+
+        for i, (name, kind, help_text) in enumerate(STORAGE_COUNTERS):
+            lines.append(f'# HELP potholes_storage_{name} {help_text}, by endpoint')
+            lines.append(f'# TYPE potholes_storage_{name} {kind}')
+            for (endpoint, method), stats in sorted(endpoints.items()):
+                lines.append(f'potholes_storage_{name}{{endpoint="{endpoint}",method="{method}"}} {stats["storage"][i]:g}')
+            lines.append(f'potholes_storage_{name}{{endpoint="background",method=""}} {background[i]:g}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, limit=10):
+        """Slowest endpoints and storage totals, for the admin dashboard"""
+        endpoints, background, workers = self.collect()
+        rows = []
+        totals = list(background)
+        for (endpoint, method), stats in endpoints.items():
+            count = stats['count']
+            errors = sum(n for code, n in stats['status'].items() if str(code).startswith('5'))
+            rows.append({
+                'endpoint': endpoint,
+                'method': method,
+                'requests': count,
+                'error_rate': round(errors / count, 4) if count else 0.0,
+                'mean_ms': round(stats['sum'] / count * 1000, 2) if count else 0.0,
+                'p50_ms': quantile_ms(stats['buckets'], count, 0.5),
+                'p95_ms': quantile_ms(stats['buckets'], count, 0.95),
+                'p99_ms': quantile_ms(stats['buckets'], count, 0.99),
+                'load_json_per_request': round(stats['storage'][LOAD_JSON_CALLS] / count, 2) if count else 0.0,
+                'parse_ms_per_request': round(stats['storage'][PARSE_SECONDS] / count * 1000, 2) if count else 0.0,
+            })
+            totals = [a + b for a, b in zip(totals, stats['storage'])]
+        rows.sort(key=lambda row: row['p95_ms'], reverse=True)
+        return {
+            'workers': workers,
+            'requests': sum(row['requests'] for row in rows),
+            'slowest_endpoints': rows[:limit],
+            'storage': {name: round(value, 4) for (name, _, _), value in zip(STORAGE_COUNTERS, totals)}
+        }
+
+
+def quantile_ms(buckets, count, q):
+    """Quantile estimate from histogram buckets, interpolating within the bucket"""
+    if not count:
+        return 0.0
+    target = q * count
+    seen = 0
+    lower = 0.0
+    for bound, n in zip(LATENCY_BUCKETS + (LATENCY_BUCKETS[-1] * 2,), buckets):
+        if seen + n >= target and n:
+            return round((lower + (bound - lower) * (target - seen) / n) * 1000, 2)
+        seen += n
+        lower = bound
+    return round(lower * 1000, 2)
+
+
+registry = MetricsRegistry()
+
+
+def init_metrics(app):
+    """Time every request, count its storage work and serve ``/metrics``"""
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_token = _request_counters.set([0] * len(STORAGE_COUNTERS))
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        seconds = time.perf_counter() - started
+        counters = _request_counters.get()
+        registry.observe(request.endpoint or 'unmatched', request.method, response.status_code, seconds, counters)
+        if counters is not None:
+            response.headers['Server-Timing'] = (
+                f'app;dur={seconds * 1000:.1f}, parse;dur={counters[PARSE_SECONDS] * 1000:.1f}, '
+                f'lock;dur={counters[LOCK_WAIT_SECONDS] * 1000:.1f}'
+            )
+        return response
+
+    @app.teardown_request
+    def reset_request_counters(error=None):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            _request_counters.reset(token)
+
+    def metrics():
+        # Scrapers authenticate with a bearer token when METRICS_TOKEN is set
+        token = os.environ.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(registry.prometheus(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    return registry
@@ -0,0 +1,91 @@
+import re
+from datetime import datetime, timezone
+
+# Tokens understood by Moment.format, longest first; [text] is copied as is
+FORMAT_TOKENS = re.compile(r'\[[^\]]*\]|MMMM|MMM|MM|M|Do|DD|D|dddd|ddd|YYYY|YY|HH|H|hh|h|mm|ss|A|a')
+# moment.js relative-time thresholds: (seconds below which it applies, singular, unit seconds, unit)
+RELATIVE_STEPS = [
+    (45, 'a few seconds', None, None),
+    (90, 'a minute', None, None),
+    (45 * 60, None, 60, 'minutes'),
+    (90 * 60, 'an hour', None, None),
+    (22 * 3600, None, 3600, 'hours'),
+    (36 * 3600, 'a day', None, None),
+    (26 * 86400, None, 86400, 'days'),
+    (45 * 86400, 'a month', None, None),
+    (320 * 86400, None, 30 * 86400, 'months'),
+    (548 * 86400, 'a year', None, None),
+]
+
+
+def ordinal(day):
+    """1st, 2nd, 3rd, 4th ... 11th, 12th, 13th ... 21st"""
+    suffix = 'th' if 10 <= day % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10, 'th')
+    return f'{day}{suffix}'
+
+
+class Moment:
+    """Server-side stand-in for the moment.js calls the templates make
+
+    Wraps a stored timestamp (an ISO string or a datetime, UTC) and
+    renders it with ``format`` tokens or as relative time with ``fromNow``.
+    A value that isn't a timestamp renders unchanged.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.time = self._parse(value)
+
+    @staticmethod
+    def _parse(value):
+        if isinstance(value, datetime):
+            parsed = value
+        else:
+            try:
+                parsed = datetime.fromisoformat(str(value))
+            except ValueError:
+                return None
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+
+    def format(self, pattern='YYYY-MM-DDTHH:mm:ss'):
+        if self.time is None:
+            return str(self.value)
+        return FORMAT_TOKENS.sub(lambda match: self._token(match.group()), pattern)
+
+    def fromNow(self, now=None):
+        if self.time is None:
+            return str(self.value)
+        seconds = ((now or datetime.utcnow()) - self.time).total_seconds()
+        text = self._relative(abs(seconds))
+        return f'{text} ago' if seconds >= 0 else f'in {text}'
+
+    def _relative(self, seconds):
+        for limit, singular, unit_seconds, unit in RELATIVE_STEPS:
+            if seconds < limit:
+                return singular or f'{round(seconds / unit_seconds)} {unit}'
+        return f'{max(2, round(seconds / (365 * 86400)))} years'
+
+    def _token(self, token):
+        t = self.time
+        if token.startswith('['):
+            return token[1:-1]
+        hour12 = t.hour % 12 or 12
+        return {
+            'MMMM': t.strftime('%B'), 'MMM': t.strftime('%b'), 'MM': f'{t.month:02d}', 'M': str(t.month),
+            'Do': ordinal(t.day), 'DD': f'{t.day:02d}', 'D': str(t.day),
+            'dddd': t.strftime('%A'), 'ddd': t.strftime('%a'),
+            'YYYY': str(t.year), 'YY': f'{t.year % 100:02d}',
+            'HH': f'{t.hour:02d}', 'H': str(t.hour), 'hh': f'{hour12:02d}', 'h': str(hour12),
+            'mm': f'{t.minute:02d}', 'ss': f'{t.second:02d}',
+            'A': 'PM' if t.hour >= 12 else 'AM', 'a': 'pm' if t.hour >= 12 else 'am',
+        }[token]
+
+    def __str__(self):
+        return self.format()
+
+
+def moment(value):
+    """Template helper: ``{{ moment(incident.created_at).fromNow() }}``"""
+    return Moment(value)
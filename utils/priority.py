@@ -0,0 +1,420 @@
+import math
+import heapq
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from utils.geo import METERS_PER_DEGREE, haversine_m
+from utils.data_models import IncidentRecord
+
+SEVERITY_WEIGHTS = {'critical': 100.0, 'major': 60.0, 'moderate': 30.0, 'minor': 10.0}
+DEFAULT_SEVERITY_WEIGHT = 30.0
+# Points added per day an incident stays open
+AGE_WEIGHT_PER_DAY = 2.0
+CORROBORATION_WEIGHT = 12.0
+# A citizen report this close to an open incident corroborates it (meters)
+CORROBORATION_RADIUS_M = 25.0
+DENSITY_WEIGHT = 8.0
+DENSITY_CELL_M = 250.0
+IN_PROGRESS_BONUS = 5.0
+RESOLVED_PENALTY = 1e6
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_days(timestamp):
+    """ISO timestamp to fractional days since the epoch"""
+    if not timestamp:
+        return None
+    try:
+        moment = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        return None
+    return (moment - EPOCH).total_seconds() / 86400.0
+
+
+def created_days(incident):
+    """Creation time in days since the epoch, read straight off records when possible"""
+    created_us = getattr(incident, 'created_us', None)
+    if created_us is not None:
+        return created_us / 86400e6
+    return parse_days(incident.get('created_at'))
+
+
+def now_days():
+    return (datetime.utcnow() - EPOCH).total_seconds() / 86400.0
+
+
+class IndexedHeap:
+    """Binary max-heap with a position index, so any entry can be updated
+    or removed in O(log n) and the top k read in O(k log k)"""
+
+    def __init__(self):
+        self._heap = []
+        self._keys = {}
+        self._pos = {}
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, item):
+        return item in self._pos
+
+    def key(self, item):
+        return self._keys.get(item)
+
+    def set(self, item, key):
+        """Insert ``item`` or change its key"""
+        if item in self._pos:
+            old = self._keys[item]
+            self._keys[item] = key
+            index = self._pos[item]
+            if key > old:
+                self._sift_up(index)
+            elif key < old:
+                self._sift_down(index)
+            return
+        self._keys[item] = key
+        self._heap.append(item)
+        self._pos[item] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def remove(self, item):
+        index = self._pos.pop(item, None)
+        if index is None:
+            return
+        del self._keys[item]
+        last = self._heap.pop()
+        if index < len(self._heap):
+            self._heap[index] = last
+            self._pos[last] = index
+            self._sift_up(index)
+            self._sift_down(self._pos[last])
+
+    def build(self, items, keys):
+        """Replace the contents in O(n)"""
+        self._heap = list(items)
+        self._keys = dict(zip(self._heap, keys))
+        self._pos = {item: i for i, item in enumerate(self._heap)}
+        for index in range(len(self._heap) // 2 - 1, -1, -1):
+            self._sift_down(index)
+
+    def top(self, k, predicate=None, min_key=None):
+        """Yield up to ``k`` (key, item) pairs, largest first, without popping
+
+        Walks the heap with a frontier of candidate nodes, so it touches
+        O(k log k) entries (plus any the predicate rejects). The walk stops
+        at the first key below ``min_key``.
+        """
+        if not self._heap or k <= 0:
+            return
+        frontier = [(-self._keys[self._heap[0]], 0)]
+        found = 0
+        while frontier and found < k:
+            neg_key, index = heapq.heappop(frontier)
+            if min_key is not None and -neg_key < min_key:
+                return
+            item = self._heap[index]
+            if predicate is None or predicate(item):
+                found += 1
+                yield -neg_key, item
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(self._heap):
+                    heapq.heappush(frontier, (-self._keys[self._heap[child]], child))
+
+    def _sift_up(self, index):
+        heap, keys, pos = self._heap, self._keys, self._pos
+        item = heap[index]
+        key = keys[item]
+        while index > 0:
+            parent = (index - 1) // 2
+            if keys[heap[parent]] >= key:
+                break
+            heap[index] = heap[parent]
+            pos[heap[index]] = index
+            index = parent
+        heap[index] = item
+        pos[item] = index
+
+    def _sift_down(self, index):
+        heap, keys, pos = self._heap, self._keys, self._pos
+        size = len(heap)
+        item = heap[index]
+        key = keys[item]
+        while True:
+            child = 2 * index + 1
+            if child >= size:
+                break
+            if child + 1 < size and keys[heap[child + 1]] > keys[heap[child]]:
+                child += 1
+            if keys[heap[child]] <= key:
+                break
+            heap[index] = heap[child]
+            pos[heap[index]] = index
+            index = child
+        heap[index] = item
+        pos[item] = index
+
+
+def density_cell(lat, lng):
+    cell_deg = DENSITY_CELL_M / METERS_PER_DEGREE
+    return (math.floor(lat / cell_deg), math.floor(lng / cell_deg))
+
+
+def neighbourhood_counts(cells):
+    """Open incidents in the 3x3 cells around each cell (0 where cell is None)"""
+    placed = np.array([cell is not None for cell in cells], dtype=bool)
+    counts = np.zeros(len(cells))
+    if not placed.any():
+        return counts
+
+    grid = np.array([cell for cell in cells if cell is not None], dtype=np.int64)
+    # Pack (row, col) into one integer so neighbours can be found with searchsorted
+    stride = 10 ** 7
+    codes = (grid[:, 0] + 10 ** 6) * stride + (grid[:, 1] + 10 ** 6)
+    unique, unique_counts = np.unique(codes, return_counts=True)
+
+    totals = np.zeros(len(codes))
+    for dr in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            neighbour = codes + dr * stride + dc
+            index = np.minimum(np.searchsorted(unique, neighbour), len(unique) - 1)
+            totals += np.where(unique[index] == neighbour, unique_counts[index], 0)
+
+    counts[placed] = totals
+    return counts
+
+
+def score_batch(incidents, densities, reports=None):
+    """Time-invariant priority keys for a batch of incidents
+
+    The age term is linear, so ``score(t) = key + AGE_WEIGHT_PER_DAY * t``
+    for every incident; keeping ``key`` in the heap means the ordering
+    stays correct as time passes without any re-scoring. ``reports`` is
+    how many citizen reports corroborate each incident.
+    """
+    n = len(incidents)
+    if n == 0:
+        return np.empty(0)
+
+    severity = np.fromiter(
+        (SEVERITY_WEIGHTS.get(i.get('severity'), DEFAULT_SEVERITY_WEIGHT) for i in incidents),
+        dtype=np.float64, count=n
+    )
+    created = np.fromiter(
+        ((created_days(i) or now_days()) for i in incidents),
+        dtype=np.float64, count=n
+    )
+    corroborations = np.fromiter((i.get('sensor_hits') or 0 for i in incidents), dtype=np.float64, count=n)
+    if reports is not None:
+        corroborations += np.asarray(reports, dtype=np.float64)
+    status = [i.get('status') for i in incidents]
+    in_progress = np.fromiter((s == 'in-progress' for s in status), dtype=bool, count=n)
+    resolved = np.fromiter((s == 'resolved' for s in status), dtype=bool, count=n)
+    density = np.asarray(densities, dtype=np.float64)
+
+    keys = (
+        severity
+        + CORROBORATION_WEIGHT * np.log1p(corroborations)
+        + DENSITY_WEIGHT * np.log1p(np.maximum(density - 1, 0))
+        + IN_PROGRESS_BONUS * in_progress
+        - AGE_WEIGHT_PER_DAY * created
+        - RESOLVED_PENALTY * resolved
+    )
+    return keys
+
+
+class PriorityEngine:
+    """Dynamic priority for incidents, kept current from storage writes
+
+    Combines severity, age, corroborating reports (sensor hits and
+    citizen reports filed within ``CORROBORATION_RADIUS_M``, which carry
+    ``corroborates: <incident id>``) and how many other open incidents
+    share the surrounding ~250 m cells. Report counts are derived from the
+    stored reports rather than kept as a counter, so concurrent reports
+    can't lose an increment. Writes re-score only the incident, its
+    neighbourhood and the incident it corroborates, as one vectorized
+    batch.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.heap = IndexedHeap()
+        self._incidents = {}
+        self._cells = {}
+        self._incident_cell = {}
+        # incident id -> number of reports corroborating it
+        self._reports = {}
+        self._lock = threading.RLock()
+        self._built = False
+
+    def ensure_built(self):
+        # Fold in writes from other worker processes first
+        self.storage.sync()
+        with self._lock:
+            if not self._built:
+                # Archived incidents are all resolved and would sink to the bottom anyway
+                self.rebuild(self.storage.get_incident_records({'archived': False}))
+
+    def rebuild(self, incidents):
+        """Score every incident in one batch and heapify"""
+        with self._lock:
+            self._incidents = {i['id']: i for i in incidents if i.get('id')}
+            self._cells = {}
+            self._incident_cell = {}
+            self._reports = {}
+            for incident_id, incident in self._incidents.items():
+                self._place(incident_id, incident)
+                self._count_report(incident, 1)
+
+            ids = list(self._incidents)
+            cells = [self._incident_cell.get(i) for i in ids]
+            keys = score_batch(
+                [self._incidents[i] for i in ids], neighbourhood_counts(cells),
+                [self._reports.get(i, 0) for i in ids]
+            )
+            self.heap.build(ids, keys.tolist())
+            self._built = True
+
+    def on_change(self, event, incident_id, incident, previous=None):
+        """Storage listener: update the heap for one written incident"""
+        with self._lock:
+            if event == 'reset':
+                self._built = False
+            if not self._built:
+                return
+            affected = set(self._neighbourhood(incident_id))
+            self._unplace(incident_id)
+            affected.update(self._count_report(self._incidents.get(incident_id), -1))
+
+            # Archived incidents are left out of the heap, as in ensure_built
+            if event in ('delete', 'archive') or incident is None:
+                self._incidents.pop(incident_id, None)
+                self.heap.remove(incident_id)
+            else:
+                incident = IncidentRecord.from_dict(incident)
+                self._incidents[incident_id] = incident
+                self._place(incident_id, incident)
+                affected.update(self._count_report(incident, 1))
+                affected.add(incident_id)
+                affected.update(self._neighbourhood(incident_id))
+
+            self._rescore(affected)
+
+    def score(self, incident_id, at_days=None):
+        """Current numeric priority of one incident"""
+        self.ensure_built()
+        key = self.heap.key(incident_id)
+        if key is None:
+            return None
+        return key + AGE_WEIGHT_PER_DAY * (at_days if at_days is not None else now_days())
+
+    def top(self, k, predicate=None, open_only=False):
+        """Top ``k`` incidents by priority as (score, IncidentRecord) pairs
+
+        With ``open_only`` the walk ends where the resolved incidents start;
+        RESOLVED_PENALTY sinks every one of them below every open incident.
+        """
+        self.ensure_built()
+        at = now_days()
+        with self._lock:
+            return [
+                (round(key + AGE_WEIGHT_PER_DAY * at, 2), self._incidents[incident_id])
+                for key, incident_id in self.heap.top(
+                    k, (lambda i: predicate(self._incidents[i])) if predicate else None,
+                    -RESOLVED_PENALTY / 2 if open_only else None
+                )
+            ]
+
+    def nearest_open(self, latitude, longitude, radius_m=CORROBORATION_RADIUS_M):
+        """Id of the closest open incident within ``radius_m`` of a point, or None"""
+        self.ensure_built()
+        row, col = density_cell(latitude, longitude)
+        best = None
+        with self._lock:
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    for incident_id in self._cells.get((row + dr, col + dc), ()):
+                        incident = self._incidents[incident_id]
+                        distance = float(haversine_m(latitude, longitude, incident['latitude'], incident['longitude']))
+                        if distance <= radius_m and (best is None or distance < best[0]):
+                            best = (distance, incident_id)
+        return best[1] if best else None
+
+    def sort_key(self, incident):
+        """Sort key (use with reverse=True) for ordering incident dicts by priority"""
+        key = self.heap.key(incident.get('id'))
+        return key if key is not None else -math.inf
+
+    def _rescore(self, incident_ids):
+        ids = [i for i in incident_ids if i in self._incidents]
+        if not ids:
+            return
+        keys = score_batch(
+            [self._incidents[i] for i in ids], [self._density(i) for i in ids],
+            [self._reports.get(i, 0) for i in ids]
+        )
+        for incident_id, key in zip(ids, keys.tolist()):
+            self.heap.set(incident_id, key)
+
+    def _count_report(self, incident, delta):
+        """Add ``delta`` to the report count of the incident ``incident`` corroborates; returns it to re-score"""
+        target = incident.get('corroborates') if incident is not None else None
+        if not target:
+            return ()
+        count = self._reports.get(target, 0) + delta
+        if count > 0:
+            self._reports[target] = count
+        else:
+            self._reports.pop(target, None)
+        return (target,)
+
+    def _place(self, incident_id, incident):
+        if incident.get('status') == 'resolved':
+            return
+        if incident.get('latitude') is None or incident.get('longitude') is None:
+            return
+        cell = density_cell(incident['latitude'], incident['longitude'])
+        self._cells.setdefault(cell, set()).add(incident_id)
+        self._incident_cell[incident_id] = cell
+
+    def _unplace(self, incident_id):
+        cell = self._incident_cell.pop(incident_id, None)
+        if cell is None:
+            return
+        members = self._cells.get(cell)
+        if members:
+            members.discard(incident_id)
+            if not members:
+                del self._cells[cell]
+
+    def _neighbour_cells(self, incident_id):
+        cell = self._incident_cell.get(incident_id)
+        if cell is None:
+            return []
+        row, col = cell
+        return [(row + dr, col + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+
+    def _neighbourhood(self, incident_id):
+        members = []
+        for cell in self._neighbour_cells(incident_id):
+            members.extend(self._cells.get(cell, ()))
+        return members
+
+    def _density(self, incident_id):
+        return sum(len(self._cells.get(cell, ())) for cell in self._neighbour_cells(incident_id))
+
+
+_priority_engine = None
+_priority_lock = threading.Lock()
+
+
+def get_priority_engine(storage):
+    """Get the process-wide priority engine, subscribed to storage writes"""
+    global _priority_engine
+    with _priority_lock:
+        if _priority_engine is None:
+            _priority_engine = PriorityEngine(storage)
+            storage.add_listener(_priority_engine.on_change)
+        return _priority_engine
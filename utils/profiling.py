@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+import contextvars
+from logging.handlers import RotatingFileHandler
+from datetime import datetime
+
+from flask import g, request, template_rendered, before_render_template
+
+from utils.metrics import current_storage_counters, STORAGE_COUNTERS
+
+# Requests slower than this get their time breakdown logged
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '500'))
+# Percentage of requests run under the sampling profiler
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+# Admins send this header to profile a single request
+PROFILE_HEADER = 'X-Profile'
+PROFILE_LOG = os.path.join('data', 'logs', 'profile.log')
+PROFILE_LOG_BYTES = 5 * 1024 * 1024
+PROFILE_LOG_BACKUPS = 3
+# Frames kept per sampled stack, and stacks kept per profile
+STACK_DEPTH = 12
+TOP_STACKS = 15
+
+_current_trace = contextvars.ContextVar('profile_trace', default=None)
+
+
+class Trace:
+    """Where one request's time went: inclusive totals and call counts per span name"""
+
+    __slots__ = ('spans',)
+
+    def __init__(self):
+        self.spans = {}
+
+    def add(self, name, seconds):
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def breakdown(self):
+        return {
+            name: {'ms': round(seconds * 1000, 3), 'calls': calls}
+            for name, (seconds, calls) in sorted(self.spans.items(), key=lambda item: -item[1][0])
+        }
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.trace.add(self.name, time.perf_counter() - self.started)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """Time a block into the current request's trace; a no-op outside requests
+
+    Spans are inclusive, so a span nested in another counts in both.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return NO_SPAN
+    return _Span(trace, name)
+
+
+class Sampler:
+    """One background thread sampling the stacks of the threads being profiled
+
+    It only runs while at least one request is being profiled.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._targets[thread_id] = {}
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id):
+        """Stop sampling a thread; returns its ``{folded stack: samples}``"""
+        with self._lock:
+            return self._targets.pop(thread_id, {})
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._targets:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for thread_id, counts in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stack = fold_stack(frame)
+                        counts[stack] = counts.get(stack, 0) + 1
+
+
+def fold_stack(frame):
+    """``outer;...;inner`` with one ``file:function:line`` per frame, innermost STACK_DEPTH frames"""
+    names = []
+    while frame is not None and len(names) < STACK_DEPTH:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+sampler = Sampler()
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def get_profile_logger():
+    """Logger writing JSON lines to the rotating profile log, created on first use"""
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                os.makedirs(os.path.dirname(PROFILE_LOG), exist_ok=True)
+                logger = logging.getLogger('potholes.profile')
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                handler = RotatingFileHandler(PROFILE_LOG, maxBytes=PROFILE_LOG_BYTES,
+                                              backupCount=PROFILE_LOG_BACKUPS)
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                logger.addHandler(handler)
+                _logger = logger
+    return _logger
+
+
+def recent_profiles(limit=50):
+    """Newest entries of the profile log (current file only), newest first"""
+    try:
+        with open(PROFILE_LOG, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            # Entries are a few KB at most; read enough of the tail for ``limit``
+            f.seek(max(0, f.tell() - limit * 8192))
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in reversed(lines):
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+        if len(entries) >= limit:
+            break
+    return entries
+
+
+def _wants_profile():
+    if request.headers.get(PROFILE_HEADER) == '1':
+        # Imported here: utils.auth reads the user store
+        from utils.auth import get_current_user
+        user = get_current_user()
+        return bool(user and user.get('role') == 'admin')
+    return PROFILE_SAMPLE_RATE > 0 and random.random() * 100 < PROFILE_SAMPLE_RATE
+
+
+def init_profiling(app):
+    """Trace request time into spans; log slow and profiled requests to ``data/logs/profile.log``"""
+
+    @app.before_request
+    def start_trace():
+        g.profile_started = time.perf_counter()
+        g.profile_token = _current_trace.set(Trace())
+        if _wants_profile():
+            g.profile_thread = threading.get_ident()
+            sampler.start(g.profile_thread)
+
+    @app.after_request
+    def finish_trace(response):
+        started = g.pop('profile_started', None)
+        trace = _current_trace.get()
+        if started is None or trace is None:
+            return response
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        thread_id = g.pop('profile_thread', None)
+        stacks = sampler.stop(thread_id) if thread_id is not None else None
+        if stacks is None and elapsed_ms < SLOW_REQUEST_MS:
+            return response
+
+        entry = {
+            'id': uuid.uuid4().hex[:12],
+            'timestamp': datetime.utcnow().isoformat(),
+            'kind': 'profiled' if stacks is not None else 'slow',
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(elapsed_ms, 3),
+            'spans': trace.breakdown()
+        }
+        counters = current_storage_counters()
+        if counters is not None:
+            entry['storage'] = {name: round(value, 6) for (name, _, _), value in zip(STORAGE_COUNTERS, counters)}
+        if stacks is not None:
+            top = sorted(stacks.items(), key=lambda item: -item[1])[:TOP_STACKS]
+            entry['samples'] = sum(stacks.values())
+            entry['interval_ms'] = PROFILE_INTERVAL * 1000
+            entry['stacks'] = [{'stack': stack, 'samples': n} for stack, n in top]
+            response.headers['X-Profile-Id'] = entry['id']
+        try:
+            get_profile_logger().info(json.dumps(entry))
+        except OSError as e:
+            print(f"Profile log write failed: {e}")
+        return response
+
+    @app.teardown_request
+    def end_trace(error=None):
+        thread_id = g.pop('profile_thread', None)
+        if thread_id is not None:
+            sampler.stop(thread_id)
+        token = g.pop('profile_token', None)
+        if token is not None:
+            _current_trace.reset(token)
+
+    def template_started(sender, template, context, **extra):
+        g.profile_render_started = time.perf_counter()
+
+    def template_finished(sender, template, context, **extra):
+        started = g.pop('profile_render_started', None)
+        trace = _current_trace.get()
+        if started is not None and trace is not None:
+            trace.add('template.render', time.perf_counter() - started)
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    # JSON responses: time the serialization done by jsonify
+    make_response = app.json.response
+
+    def timed_response(*args, **kwargs):
+        with span('serialize'):
+            return make_response(*args, **kwargs)
+
+    app.json.response = timed_response
@@ -0,0 +1,219 @@
+import atexit
+import threading
+from datetime import datetime, timedelta
+
+GRANULARITIES = {
+    'hour': ('%Y-%m-%dT%H', timedelta(hours=1)),
+    'day': ('%Y-%m-%d', timedelta(days=1)),
+    'month': ('%Y-%m', None),
+}
+# Hourly buckets are only kept this long; daily and monthly ones forever
+HOURLY_RETENTION = timedelta(days=90)
+FLUSH_INTERVAL = 5.0
+
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def bucket_start(moment, granularity):
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_bucket(moment, granularity):
+    if granularity == 'month':
+        return moment.replace(year=moment.year + moment.month // 12, month=moment.month % 12 + 1)
+    return moment + GRANULARITIES[granularity][1]
+
+
+def empty_bucket():
+    return {'created': 0, 'resolved': 0, 'severity': {}, 'transitions': {}}
+
+
+class RollupStore:
+    """Incident counts pre-aggregated into hourly, daily and monthly buckets
+
+    Each bucket counts incidents created (in total and by severity),
+    status transitions and resolutions. Buckets are updated from storage
+    writes as they happen and flushed to ``data/rollups.json`` in the
+    background, so charts never re-parse the incident store.
+    """
+
+    def __init__(self, storage, filename='rollups.json'):
+        self.storage = storage
+        self.filename = filename
+        self.buckets = None
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._flush_timer = None
+
+    def ensure_loaded(self):
+        # Fold in writes from other worker processes first
+        self.storage.sync()
+        with self._lock:
+            if self.buckets is not None:
+                return
+            version = self.storage.version()
+            data = self.storage.load_json(self.filename, {})
+            if data.get('buckets') and data.get('version') == version:
+                self.buckets = data['buckets']
+            else:
+                # Missing, or written before the latest writes: recount, keeping
+                # the transition history that only the file has
+                self.rebuild(self.storage.get_incident_records(), data.get('buckets'), version)
+
+    def rebuild(self, incidents, previous_buckets=None, version=None):
+        """Recount every bucket from the current incident store
+
+        Past status transitions aren't recorded on incidents, so a rebuild
+        can only restore resolutions (dated by ``updated_at``); transitions
+        are carried over from ``previous_buckets`` when given.
+        """
+        with self._lock:
+            if version is None:
+                version = self.storage.version()
+            self.buckets = {granularity: {} for granularity in GRANULARITIES}
+            for granularity, buckets in (previous_buckets or {}).items():
+                for key, bucket in buckets.items():
+                    if bucket.get('transitions') and granularity in self.buckets:
+                        self.buckets[granularity][key] = dict(empty_bucket(), transitions=bucket['transitions'])
+            for incident in incidents:
+                self._apply_create(incident, 1)
+                if incident.get('status') == 'resolved':
+                    moment = parse_timestamp(incident.get('updated_at')) or parse_timestamp(incident.get('created_at'))
+                    if moment:
+                        self._add(moment, 'resolved', 1)
+            self._prune()
+            self._flush(version)
+
+    def on_change(self, event, incident_id, incident, previous=None):
+        """Storage listener: fold one write into the buckets"""
+        with self._lock:
+            if event == 'reset':
+                # Missed writes from other processes; reload what they flushed
+                self.buckets = None
+            if self.buckets is None:
+                return
+            if event == 'create':
+                self._apply_create(incident, 1)
+                if incident.get('status') == 'resolved':
+                    self._add(datetime.utcnow(), 'resolved', 1)
+            elif event == 'delete':
+                self._apply_create(previous, -1)
+            elif event == 'update' and previous:
+                old_status = previous.get('status')
+                new_status = incident.get('status')
+                if old_status != new_status:
+                    moment = parse_timestamp(incident.get('updated_at')) or datetime.utcnow()
+                    self._add(moment, 'transitions', 1, f'{old_status}>{new_status}')
+                    if new_status == 'resolved':
+                        self._add(moment, 'resolved', 1)
+                    elif old_status == 'resolved':
+                        self._add(moment, 'resolved', -1)
+                if previous.get('severity') != incident.get('severity'):
+                    moment = parse_timestamp(incident.get('created_at'))
+                    if moment:
+                        self._add(moment, 'severity', -1, previous.get('severity'))
+                        self._add(moment, 'severity', 1, incident.get('severity'))
+            # Writes that change no count (comments, archiving) leave nothing to flush
+            if self._dirty:
+                self._schedule_flush()
+
+    def series(self, granularity, start, end):
+        """Contiguous buckets from ``start`` to ``end`` (inclusive), zero-filled"""
+        self.ensure_loaded()
+        key_format = GRANULARITIES[granularity][0]
+        points = []
+        moment = bucket_start(start, granularity)
+        with self._lock:
+            buckets = self.buckets[granularity]
+            while moment <= end:
+                points.append((moment, buckets.get(moment.strftime(key_format)) or empty_bucket()))
+                moment = next_bucket(moment, granularity)
+        return points
+
+    def all_buckets(self, granularity):
+        """Every non-empty bucket of a granularity, oldest first"""
+        self.ensure_loaded()
+        key_format = GRANULARITIES[granularity][0]
+        with self._lock:
+            return [
+                (datetime.strptime(key, key_format), bucket)
+                for key, bucket in sorted(self.buckets[granularity].items())
+                if bucket['created'] or bucket['resolved'] or bucket['transitions']
+            ]
+
+    def flush(self):
+        """Write pending changes now"""
+        # Every worker applies every write, so whichever flushes last writes the same totals
+        version = self.storage.version()
+        self.storage.sync()
+        with self._lock:
+            # Cleared either way, or no later write could schedule another flush
+            self._flush_timer = None
+            if self._dirty:
+                self._flush(version)
+
+    def _apply_create(self, incident, delta):
+        moment = parse_timestamp(incident.get('created_at'))
+        if not moment:
+            return
+        self._add(moment, 'created', delta)
+        self._add(moment, 'severity', delta, incident.get('severity') or 'unknown')
+
+    def _add(self, moment, field, delta, sub_key=None):
+        for granularity, (key_format, _) in GRANULARITIES.items():
+            bucket = self.buckets[granularity].setdefault(moment.strftime(key_format), empty_bucket())
+            if sub_key is None:
+                bucket[field] += delta
+            else:
+                bucket[field][sub_key] = bucket[field].get(sub_key, 0) + delta
+        self._dirty = True
+
+    def _prune(self):
+        cutoff = (datetime.utcnow() - HOURLY_RETENTION).strftime(GRANULARITIES['hour'][0])
+        hourly = self.buckets['hour']
+        for key in [key for key in hourly if key < cutoff]:
+            del hourly[key]
+
+    def _schedule_flush(self):
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(FLUSH_INTERVAL, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush(self, version):
+        self._flush_timer = None
+        self._prune()
+        self.storage.save_json(self.filename, {
+            'updated_at': datetime.utcnow().isoformat(),
+            # Store version the buckets are current to
+            'version': version,
+            'buckets': self.buckets
+        })
+        self._dirty = False
+
+
+_rollups = None
+_rollups_lock = threading.Lock()
+
+
+def get_rollups(storage):
+    """Get the process-wide rollup store, subscribed to storage writes"""
+    global _rollups
+    with _rollups_lock:
+        if _rollups is None:
+            _rollups = RollupStore(storage)
+            _rollups.ensure_loaded()
+            storage.add_listener(_rollups.on_change)
+            atexit.register(_rollups.flush)
+        return _rollups
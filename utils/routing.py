@@ -0,0 +1,267 @@
+import time
+import itertools
+from functools import lru_cache
+
+import numpy as np
+
+from utils.geo import haversine_m
+from utils.profiling import span
+
+# Each stop's nearest other stops considered by the improvement moves
+NEIGHBORS = 10
+# Longest run of consecutive stops Or-opt moves elsewhere in the route
+OR_OPT_MAX_SEGMENT = 3
+# Improvement stops after this long, keeping the best route so far
+TIME_BUDGET_S = 0.5
+# Beyond this many stops the distance matrix gets too big to keep around
+MAX_STOPS = 1000
+# Up to this many stops every order is tried (8! = 40320), so small routes are optimal
+EXACT_MAX_STOPS = 8
+
+
+@lru_cache(maxsize=EXACT_MAX_STOPS)
+def permutations(n):
+    """Every ordering of ``range(n)`` as an (n!, n) array"""
+    return np.array(list(itertools.permutations(range(n))), dtype=np.intp).reshape(-1, n)
+
+
+def distance_matrix(lats, lngs):
+    """Haversine distances in meters between every pair of points"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    return haversine_m(lats[:, None], lngs[:, None], lats[None, :], lngs[None, :])
+
+
+class RoutePlanner:
+    """Short visiting order for a set of stops, with an optional fixed start
+
+    The route is a path ``S, stops..., E`` whose ends never move: ``S`` is
+    the start point (or, without one, a virtual node zero meters from
+    every stop, so the route may begin anywhere) and ``E`` is a virtual
+    node zero meters from every stop, or the start again for a round trip.
+    Up to ``EXACT_MAX_STOPS`` stops every order is scored and the best
+    kept. Beyond that a nearest-neighbour pass builds the first route;
+    2-opt (reverse a stretch) and Or-opt (move a run of up to three
+    stops) then improve it.
+    Moves are only tried between a stop and its ``NEIGHBORS`` nearest
+    stops, a neighbour list computed once from the haversine matrix, so
+    a pass costs O(n * NEIGHBORS) instead of O(n^2). Everything runs
+    offline; no road network is used.
+    """
+
+    def __init__(self, lats, lngs, start=None, round_trip=False):
+        n = len(lats)
+        self.n = n
+        points_lat = list(lats)
+        points_lng = list(lngs)
+        if start is not None:
+            points_lat.append(start[0])
+            points_lng.append(start[1])
+        matrix = distance_matrix(points_lat, points_lng) if points_lat else np.zeros((0, 0))
+
+        # Nodes 0..n-1 are stops, n is S and n+1 is E
+        full = np.zeros((n + 2, n + 2))
+        full[:n, :n] = matrix[:n, :n]
+        if start is not None:
+            full[n, :n] = full[:n, n] = matrix[n, :n]
+            if round_trip:
+                full[n + 1, :n] = full[:n, n + 1] = matrix[n, :n]
+        self.matrix = full
+        self.has_start = start is not None
+        # Python lists: element access in the move loops is far cheaper than on arrays
+        self.d = full.tolist()
+
+        k = min(NEIGHBORS, n - 1)
+        if k > 0:
+            stops = full[:n, :n].copy()
+            np.fill_diagonal(stops, np.inf)
+            nearest = np.argpartition(stops, k - 1, axis=1)[:, :k]
+            order = np.take_along_axis(stops, nearest, axis=1).argsort(axis=1)
+            self.neighbors = np.take_along_axis(nearest, order, axis=1).tolist()
+        else:
+            self.neighbors = [[] for _ in range(n)]
+
+    def nearest_neighbour(self):
+        """Greedy route: from the start (or the stop farthest from the rest) go to the closest unvisited stop"""
+        n = self.n
+        if n == 0:
+            return [n, n + 1]
+        distances = self.matrix[:n, :n]
+        if self.has_start:
+            current = int(np.argmin(self.matrix[n, :n]))
+        else:
+            # An outlying stop makes a natural end of an open route
+            current = int(np.argmax(distances.sum(axis=1)))
+        route = [n, current]
+        remaining = np.ones(n, dtype=bool)
+        remaining[current] = False
+        for _ in range(n - 1):
+            row = np.where(remaining, distances[current], np.inf)
+            current = int(np.argmin(row))
+            remaining[current] = False
+            route.append(current)
+        route.append(n + 1)
+        return route
+
+    def exact(self):
+        """The shortest route, by scoring every order of the stops at once"""
+        n = self.n
+        orders = permutations(n)
+        lengths = self.matrix[n, orders[:, 0]] + self.matrix[orders[:, -1], n + 1]
+        if n > 1:
+            lengths += self.matrix[orders[:, :-1], orders[:, 1:]].sum(axis=1)
+        return [n, *orders[int(np.argmin(lengths))].tolist(), n + 1]
+
+    def length(self, route):
+        d = self.d
+        return sum(d[a][b] for a, b in zip(route, route[1:]))
+
+    def _two_opt(self, route, position, a):
+        """Apply the best 2-opt move adding an edge from stop ``a`` to a neighbour; True if one was made"""
+        d = self.d
+        last = len(route) - 2
+        best_gain, best = 1e-7, None
+        for c in self.neighbors[a]:
+            x, y = sorted((position[a], position[c]))
+            # Reverse route[x+1..y]: edges (x, x+1), (y, y+1) become (x, y), (x+1, y+1)
+            if x + 1 < y <= last:
+                gain = (d[route[x]][route[x + 1]] + d[route[y]][route[y + 1]]
+                        - d[route[x]][route[y]] - d[route[x + 1]][route[y + 1]])
+                if gain > best_gain:
+                    best_gain, best = gain, (x + 1, y)
+            # Reverse route[x..y-1]: edges (x-1, x), (y-1, y) become (x-1, y-1), (x, y)
+            if 1 <= x < y - 1:
+                gain = (d[route[x - 1]][route[x]] + d[route[y - 1]][route[y]]
+                        - d[route[x - 1]][route[y - 1]] - d[route[x]][route[y]])
+                if gain > best_gain:
+                    best_gain, best = gain, (x, y - 1)
+        if best is None:
+            return False
+        i, j = best
+        route[i:j + 1] = route[i:j + 1][::-1]
+        for p in range(i, j + 1):
+            position[route[p]] = p
+        return True
+
+    def _or_opt(self, route, position, a):
+        """Move the best run of stops starting at ``a`` next to a neighbour; True if one was moved"""
+        d = self.d
+        last = len(route) - 2
+        i = position[a]
+        best_gain, best = 1e-7, None
+        for length in range(1, OR_OPT_MAX_SEGMENT + 1):
+            j = i + length - 1
+            if j > last:
+                break
+            first, end = route[i], route[j]
+            prev, succ = route[i - 1], route[j + 1]
+            removed = d[prev][first] + d[end][succ] - d[prev][succ]
+            if removed <= best_gain:
+                continue
+            for c in self.neighbors[first] + self.neighbors[end]:
+                k = position[c]
+                # Insert between route[k] and route[k + 1], then between route[k - 1] and route[k]
+                for u in (k, k - 1):
+                    if u < 0 or u + 1 > last + 1 or i - 1 <= u <= j:
+                        continue
+                    left, right = route[u], route[u + 1]
+                    forward = d[left][first] + d[end][right]
+                    backward = d[left][end] + d[first][right]
+                    gain = removed - (min(forward, backward) - d[left][right])
+                    if gain > best_gain:
+                        best_gain, best = gain, (j, u, backward < forward)
+        if best is None:
+            return False
+        j, u, reverse = best
+        segment = route[i:j + 1]
+        if reverse:
+            segment.reverse()
+        if u > j:
+            route[i:u + 1] = route[j + 1:u + 1] + segment
+            changed = range(i, u + 1)
+        else:
+            route[u + 1:j + 1] = segment + route[u + 1:i]
+            changed = range(u + 1, j + 1)
+        for p in changed:
+            position[route[p]] = p
+        return True
+
+    def improve(self, route, time_budget=TIME_BUDGET_S):
+        """2-opt and Or-opt until no move helps or ``time_budget`` seconds pass"""
+        deadline = time.perf_counter() + time_budget
+        position = [0] * (self.n + 2)
+        for p, node in enumerate(route):
+            position[node] = p
+        # Stops whose surroundings changed since they were last examined
+        queue = list(range(self.n))
+        queued = [True] * self.n
+        passes = 0
+        while queue and time.perf_counter() < deadline:
+            passes += 1
+            pending, queue = queue, []
+            for a in pending:
+                queued[a] = False
+            for a in pending:
+                before = route[max(position[a] - 2, 1):position[a] + 3]
+                if self._two_opt(route, position, a) or self._or_opt(route, position, a):
+                    for node in before + route[max(position[a] - 2, 1):position[a] + 3]:
+                        if node < self.n and not queued[node]:
+                            queued[node] = True
+                            queue.append(node)
+                if time.perf_counter() >= deadline:
+                    break
+        return passes
+
+    def plan(self, time_budget=TIME_BUDGET_S):
+        started = time.perf_counter()
+        with span('routing.construct'):
+            route = self.nearest_neighbour()
+        initial = self.length(route)
+        if 0 < self.n <= EXACT_MAX_STOPS:
+            with span('routing.exact'):
+                route = self.exact()
+            passes = 0
+        else:
+            with span('routing.improve'):
+                passes = self.improve(route, time_budget)
+        return {
+            'order': route[1:-1],
+            'distance_m': self.length(route),
+            'initial_distance_m': initial,
+            'passes': passes,
+            'seconds': time.perf_counter() - started
+        }
+
+
+def plan_route(stops, start=None, round_trip=False, time_budget=TIME_BUDGET_S):
+    """Visiting order for ``stops`` (dicts with ``latitude``/``longitude``)
+
+    ``start`` is an optional ``(lat, lng)`` the crew sets out from; with
+    ``round_trip`` the route returns to it. Returns the stops in order,
+    each with ``leg_m`` (meters from the previous point), plus totals.
+    """
+    if len(stops) > MAX_STOPS:
+        raise ValueError(f'At most {MAX_STOPS} stops can be routed at once')
+    planner = RoutePlanner(
+        [stop['latitude'] for stop in stops], [stop['longitude'] for stop in stops],
+        start=start, round_trip=round_trip and start is not None
+    )
+    result = planner.plan(time_budget)
+    d = planner.d
+    n = len(stops)
+    ordered = []
+    previous = n
+    for node in result['order']:
+        stop = dict(stops[node])
+        # Zero for the first stop of a route without a start point
+        stop['leg_m'] = round(d[previous][node], 1)
+        ordered.append(stop)
+        previous = node
+    return {
+        'stops': ordered,
+        'distance_m': round(result['distance_m'], 1),
+        'initial_distance_m': round(result['initial_distance_m'], 1),
+        'return_leg_m': round(d[previous][n + 1], 1) if ordered and round_trip and start is not None else 0.0,
+        'passes': result['passes'],
+        'seconds': round(result['seconds'], 4)
+    }
@@ -0,0 +1,736 @@
+import re
+import bisect
+import threading
+from collections import Counter
+
+import numpy as np
+
+from utils.profiling import span
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+QUERY_TOKEN_RE = re.compile(r'[a-z0-9]+\*?')
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'in', 'is', 'it',
+    'its', 'of', 'on', 'or', 'that', 'the', 'there', 'this', 'to', 'was', 'were', 'with'
+))
+# Longer tokens are truncated (URLs, hashes pasted into descriptions)
+MAX_TOKEN_CHARS = 32
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# A prefix-expanded term scores this fraction of an exact match
+PREFIX_WEIGHT = 0.6
+# Shortest token expanded as a prefix; how many vocabulary terms a prefix
+# scans at most, and how many of those it expands to (most frequent first)
+MIN_PREFIX_CHARS = 2
+MAX_PREFIX_SCAN = 4096
+MAX_EXPANSIONS = 16
+# Tokens whose postings cover more than this fraction of documents are summed densely
+DENSE_FRACTION = 1 / 16
+# Postings are scattered into a dense array, rather than binary-searched,
+# when there are more than 1/this as many candidates as postings
+DENSE_LOOKUP_RATIO = 16
+# Terms in at least this fraction of the documents (and this many) also
+# get a bitmap of them, up to MAX_BITMAPS of the most frequent terms
+BITMAP_FRACTION = 1 / 64
+BITMAP_MIN_DOCS = 1000
+MAX_BITMAPS = 256
+# Queries whose rarest token has this fraction of the documents (and this
+# many) are counted with bitmaps. Their matches are all scored if there are
+# at most EXHAUSTIVE_MAX_DOCS; otherwise postings are read in score order,
+# TOP_K_DEPTH per term and then 4x more at a time, until the best are known
+# or reading on would cost more than TOP_K_MAX_READ of scoring every match
+BITMAP_QUERY_FRACTION = 1 / 16
+EXHAUSTIVE_MAX_DOCS = 65536
+TOP_K_DEPTH = 256
+TOP_K_MAX_READ = 1 / 4
+# Writes go into a small delta segment, merged into the main one once it
+# holds this many documents (or this fraction of the main segment's)
+MERGE_MIN_DOCS = 20000
+MERGE_FRACTION = 0.1
+# Fields the severity/status filters apply to; code 0 is "missing"
+FILTER_FIELDS = ('severity', 'status')
+
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.int64)
+
+
+def tokenize(text):
+    """Lowercase alphanumeric terms of ``text``, without stopwords"""
+    return [token[:MAX_TOKEN_CHARS] for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def incident_text(incident, comments=()):
+    """The searchable text of an incident (dict or IncidentRecord) and its comment texts"""
+    return '\n'.join([incident.get('description') or '', incident.get('location') or '', *comments])
+
+
+def parse_query(query, prefix=False):
+    """``[(token, expand as prefix), ...]`` for a query string
+
+    A token written with a trailing ``*`` is a prefix. So is the last one
+    when ``prefix`` is set (search as you type); otherwise it is marked
+    ``None``, a prefix only if it is not a term itself.
+    """
+    parsed = [[token.rstrip('*')[:MAX_TOKEN_CHARS], token.endswith('*')]
+              for token in QUERY_TOKEN_RE.findall((query or '').lower())]
+    if parsed and not parsed[-1][1]:
+        parsed[-1][1] = True if prefix else None
+    # Stopwords only count when they are all there is, or being typed
+    kept = [(token, expand) for token, expand in parsed if expand or token not in STOPWORDS]
+    return kept or [(token, expand) for token, expand in parsed]
+
+
+def bitmap_of(docs, size):
+    """Bitmap (little-endian bits in uint8s) of ``size`` documents with ``docs`` set"""
+    bits = np.zeros(size, dtype=bool)
+    bits[docs] = True
+    return np.packbits(bits, bitorder='little')
+
+
+def bitmap_test(bitmap, docs):
+    """Which of ``docs`` are set in ``bitmap``"""
+    docs = docs.astype(np.int64)
+    return ((bitmap[docs >> 3] >> (docs & 7).astype(np.uint8)) & 1).astype(bool)
+
+
+def set_bit(bitmap, doc, value):
+    if value:
+        bitmap[doc >> 3] |= np.uint8(1 << (doc & 7))
+    else:
+        bitmap[doc >> 3] &= np.uint8(~(1 << (doc & 7)) & 0xFF)
+
+
+def resized_bitmap(bitmap, size):
+    grown = np.zeros((size + 7) // 8, dtype=np.uint8)
+    grown[:len(bitmap)] = bitmap
+    return grown
+
+
+class SearchIndex:
+    """BM25 full-text search over incident descriptions, locations and comments
+
+    Postings live in a main segment of flat NumPy arrays (document numbers
+    and precomputed BM25 scores, grouped by term) and a small delta
+    segment of Python lists that storage writes go into: a changed
+    incident gets a new document number and its old one is marked dead.
+    The delta is merged into the main segment, dropping dead documents and
+    refreshing scores, once it passes ``MERGE_MIN_DOCS``; until then
+    document frequencies still count dead main-segment documents, which
+    only nudges scores.
+
+    Every query token must match (AND), together with optional severity
+    and status filters. Usually candidates come from the rarest token and
+    the others are looked up in their sorted postings, so a query costs
+    about as much as its rarest token's postings. Queries made only of
+    very common terms (which have bitmaps) are counted by ANDing bitmaps
+    instead, and their top hits found by reading each term's postings in
+    score order, which usually stops long before the end; when it
+    wouldn't, every match is scored in one dense pass instead.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._lock = threading.RLock()
+        self._built = False
+        self._reset()
+
+    def _reset(self):
+        self._vocab = {}
+        self._terms = []
+        self._sorted_terms = []
+        self._df = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._post_docs = np.zeros(0, dtype=np.int32)
+        self._post_tf = np.zeros(0, dtype=np.uint16)
+        self._post_score = np.zeros(0, dtype=np.float32)
+        # term id -> order of its main-segment postings by score, made on first use
+        self._by_score = {}
+        # term id -> ([doc, ...], [tf, ...]) for documents after the main segment
+        self._delta = {}
+        # term id -> (docs, scores) arrays of its delta postings, remade when they grow
+        self._delta_arrays = {}
+        # delta doc -> its term ids, so deleting it can correct document frequencies
+        self._delta_terms = {}
+        self._ids = []
+        self._doc_of = {}
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        # Zeros, borrowed by queries to scatter postings into
+        self._scratch = np.zeros(0, dtype=np.float32)
+        self._codes = {field: {} for field in FILTER_FIELDS}
+        self._fields = {field: np.zeros(0, dtype=np.uint8) for field in FILTER_FIELDS}
+        # Bitmaps: live documents, documents per filter value, documents per common term
+        self._alive_bits = np.zeros(0, dtype=np.uint8)
+        self._field_bits = {field: {} for field in FILTER_FIELDS}
+        self._term_bits = {}
+        self._main_docs = 0
+        self._live = 0
+        self._total_length = 0.0
+
+    def ensure_built(self):
+        # Fold in writes from other worker processes first
+        self.storage.sync()
+        with self._lock:
+            if not self._built:
+                # Archived incidents stay searchable
+                self.rebuild(self.storage.get_incident_records(), self.storage.comments.texts())
+
+    def _code(self, field, value):
+        if value is None:
+            return 0
+        codes = self._codes[field]
+        code = codes.get(value)
+        if code is None:
+            # More than 255 distinct values share the last code
+            code = codes[value] = min(len(codes) + 1, 255)
+        return code
+
+    def _grow(self, size):
+        """Make room for ``size`` documents in the per-document arrays and bitmaps"""
+        capacity = len(self._alive)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 1024)
+
+        def resized(array):
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:len(array)] = array
+            return grown
+
+        self._lengths = resized(self._lengths)
+        self._alive = resized(self._alive)
+        self._scratch = np.zeros(capacity, dtype=np.float32)
+        self._fields = {field: resized(array) for field, array in self._fields.items()}
+        self._alive_bits = resized_bitmap(self._alive_bits, capacity)
+        self._field_bits = {
+            field: {code: resized_bitmap(bits, capacity) for code, bits in by_code.items()}
+            for field, by_code in self._field_bits.items()
+        }
+        self._term_bits = {term_id: resized_bitmap(bits, capacity) for term_id, bits in self._term_bits.items()}
+
+    def _add_term(self, term):
+        term_id = len(self._terms)
+        self._vocab[term] = term_id
+        self._terms.append(term)
+        bisect.insort(self._sorted_terms, term)
+        if term_id >= len(self._df):
+            df = np.zeros(max(term_id + 1, len(self._df) * 2, 1024), dtype=np.int64)
+            df[:len(self._df)] = self._df
+            self._df = df
+        return term_id
+
+    def _set_field(self, doc, field, value):
+        by_code = self._field_bits[field]
+        previous = int(self._fields[field][doc])
+        if previous in by_code:
+            set_bit(by_code[previous], doc, False)
+        code = self._code(field, value)
+        self._fields[field][doc] = code
+        if code not in by_code:
+            by_code[code] = np.zeros(len(self._alive_bits), dtype=np.uint8)
+        set_bit(by_code[code], doc, True)
+
+    # Building
+
+    def rebuild(self, incidents, comments=None):
+        """Index every incident into a fresh main segment
+
+        ``comments`` maps incident ids to their comment texts.
+        """
+        comments = comments or {}
+        with self._lock, span('search.rebuild'):
+            self._reset()
+            vocab = self._vocab
+            add = vocab.setdefault
+            term_ids = []
+            lengths = []
+            codes = {field: [] for field in FILTER_FIELDS}
+            for incident in incidents:
+                incident_id = incident.get('id')
+                if not incident_id or incident_id in self._doc_of:
+                    continue
+                tokens = tokenize(incident_text(incident, comments.get(incident_id, ())))
+                term_ids.extend([add(token, len(vocab)) for token in tokens])
+                lengths.append(len(tokens))
+                for field in FILTER_FIELDS:
+                    codes[field].append(self._code(field, incident.get(field)))
+                self._doc_of[incident_id] = len(self._ids)
+                self._ids.append(incident_id)
+            self._terms = list(vocab)
+            self._sorted_terms = sorted(vocab)
+
+            n = len(self._ids)
+            self._grow(n)
+            self._lengths[:n] = lengths
+            self._alive[:n] = True
+            for field in FILTER_FIELDS:
+                self._fields[field][:n] = codes[field]
+            self._live = n
+            self._total_length = float(sum(lengths))
+
+            docs = np.repeat(np.arange(n, dtype=np.int64), np.asarray(lengths, dtype=np.int64))
+            # One key per (term, doc) pair; sorting groups postings by term, then doc
+            keys, tf = np.unique(np.asarray(term_ids, dtype=np.int64) * max(n, 1) + docs, return_counts=True)
+            self._set_main(keys // max(n, 1), keys % max(n, 1), tf, n)
+            self._built = True
+
+    def _set_main(self, terms, docs, tf, n_docs):
+        """Install postings sorted by (term, doc) as the main segment of ``n_docs`` live documents"""
+        counts = np.bincount(terms, minlength=len(self._terms))
+        self._offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self._post_docs = docs.astype(np.int32)
+        self._post_tf = np.minimum(tf, np.iinfo(np.uint16).max).astype(np.uint16)
+        self._df = counts.astype(np.int64)
+        # Precomputed BM25 score of every posting, so queries only add them up
+        self._post_score = self._bm25(self._df[terms], self._post_tf, self._lengths[self._post_docs])
+        self._by_score = {}
+        self._delta = {}
+        self._delta_arrays = {}
+        self._delta_terms = {}
+        self._main_docs = n_docs
+
+        self._alive_bits = np.packbits(self._alive, bitorder='little')
+        self._field_bits = {
+            field: {code: np.packbits(self._fields[field] == code, bitorder='little')
+                    for code in np.unique(self._fields[field][:n_docs]).tolist()}
+            for field in FILTER_FIELDS
+        }
+        common = np.flatnonzero(counts >= max(BITMAP_MIN_DOCS, n_docs * BITMAP_FRACTION))
+        common = common[np.argsort(-counts[common], kind='stable')[:MAX_BITMAPS]]
+        self._term_bits = {
+            term_id: bitmap_of(self._main_postings(term_id)[0], len(self._alive))
+            for term_id in common.tolist()
+        }
+
+    def _merge(self):
+        """Fold the delta segment into the main one and drop dead documents"""
+        with span('search.merge'):
+            n = len(self._ids)
+            alive = self._alive[:n].copy()
+            renumber = np.cumsum(alive) - 1
+
+            main_counts = np.diff(self._offsets)
+            terms = [np.repeat(np.arange(len(main_counts), dtype=np.int64), main_counts)]
+            docs = [self._post_docs.astype(np.int64)]
+            tfs = [self._post_tf.astype(np.int64)]
+            for term_id, (delta_docs, delta_tf) in self._delta.items():
+                terms.append(np.full(len(delta_docs), term_id, dtype=np.int64))
+                docs.append(np.asarray(delta_docs, dtype=np.int64))
+                tfs.append(np.asarray(delta_tf, dtype=np.int64))
+            terms = np.concatenate(terms)
+            docs = np.concatenate(docs)
+            tfs = np.concatenate(tfs)
+            keep = alive[docs]
+            terms, docs, tfs = terms[keep], renumber[docs[keep]], tfs[keep]
+            order = np.argsort(terms * max(n, 1) + docs, kind='stable')
+
+            live = int(alive.sum())
+            self._ids = [incident_id for incident_id, keep in zip(self._ids, alive.tolist()) if keep]
+            self._doc_of = {incident_id: doc for doc, incident_id in enumerate(self._ids)}
+            self._lengths[:live] = self._lengths[:n][alive]
+            for array in self._fields.values():
+                array[:live] = array[:n][alive]
+                array[live:] = 0
+            self._alive[:live] = True
+            self._alive[live:] = False
+            self._set_main(terms[order], docs[order], tfs[order], live)
+
+    # Incremental updates
+
+    def _remove(self, incident_id):
+        doc = self._doc_of.pop(incident_id, None)
+        if doc is None or not self._alive[doc]:
+            return
+        self._alive[doc] = False
+        set_bit(self._alive_bits, doc, False)
+        self._live -= 1
+        self._total_length -= float(self._lengths[doc])
+        for term_id in self._delta_terms.pop(doc, ()):
+            self._df[term_id] -= 1
+
+    def _index(self, incident):
+        incident_id = incident.get('id')
+        if not incident_id:
+            return
+        comments = ()
+        if incident.get('comment_count'):
+            comments = [str(comment.get('text') or '') for comment in self.storage.comments.list(incident_id)]
+        self._remove(incident_id)
+        doc = len(self._ids)
+        self._grow(doc + 1)
+        self._ids.append(incident_id)
+        self._doc_of[incident_id] = doc
+        counts = Counter(tokenize(incident_text(incident, comments)))
+        term_ids = []
+        for term, tf in counts.items():
+            term_id = self._vocab.get(term)
+            if term_id is None:
+                term_id = self._add_term(term)
+            postings = self._delta.get(term_id)
+            if postings is None:
+                postings = self._delta[term_id] = ([], [])
+            postings[0].append(doc)
+            postings[1].append(tf)
+            self._df[term_id] += 1
+            if term_id in self._term_bits:
+                set_bit(self._term_bits[term_id], doc, True)
+            term_ids.append(term_id)
+        self._delta_terms[doc] = term_ids
+        length = sum(counts.values())
+        self._lengths[doc] = length
+        self._alive[doc] = True
+        set_bit(self._alive_bits, doc, True)
+        for field in FILTER_FIELDS:
+            self._set_field(doc, field, incident.get(field))
+        self._live += 1
+        self._total_length += length
+
+        delta_docs = len(self._ids) - self._main_docs
+        if delta_docs >= max(MERGE_MIN_DOCS, self._main_docs * MERGE_FRACTION):
+            self._merge()
+
+    def on_change(self, event, incident_id, incident, previous=None):
+        """Storage listener: re-index one written incident"""
+        with self._lock:
+            if event == 'reset':
+                self._built = False
+            if not self._built:
+                return
+            if event == 'delete' or (event in ('create', 'update') and incident is None):
+                self._remove(incident_id)
+                return
+            if event not in ('create', 'update'):
+                # Archiving moves an incident without changing it
+                return
+            if (event == 'update' and previous is not None and incident_id in self._doc_of
+                    and incident_text(incident) == incident_text(previous)
+                    and incident.get('comment_count') == previous.get('comment_count')):
+                # Text unchanged: only the filter fields can have moved
+                for field in FILTER_FIELDS:
+                    self._set_field(self._doc_of[incident_id], field, incident.get(field))
+                return
+            self._index(incident)
+
+    # Queries
+
+    def _expand(self, token, prefix):
+        """``[(term id, weight), ...]`` a query token matches
+
+        ``prefix`` is None to expand only a token that no document contains.
+        """
+        matched = []
+        term_id = self._vocab.get(token)
+        if term_id is not None and self._df[term_id] > 0:
+            matched.append((term_id, 1.0))
+        if prefix is None:
+            prefix = not matched
+        if prefix and len(token) >= MIN_PREFIX_CHARS:
+            start = bisect.bisect_right(self._sorted_terms, token)
+            # Terms are [a-z0-9]+, and '{' sorts after all of them
+            end = min(bisect.bisect_left(self._sorted_terms, token + '{', start), start + MAX_PREFIX_SCAN)
+            expansions = np.array([self._vocab[term] for term in self._sorted_terms[start:end]], dtype=np.int64)
+            if len(expansions):
+                expansions = expansions[np.argsort(-self._df[expansions], kind='stable')[:MAX_EXPANSIONS]]
+                expansions = expansions[self._df[expansions] > 0].tolist()
+            matched.extend((expansion, PREFIX_WEIGHT) for expansion in expansions)
+        return matched
+
+    def _bm25(self, df, tf, lengths):
+        """Unweighted BM25 scores of postings with these document frequencies, tfs and lengths"""
+        live = max(self._live, 1)
+        avg_length = max(self._total_length / live, 1.0)
+        idf = np.log1p((live - df + 0.5) / (df + 0.5)).astype(np.float32)
+        tf = tf.astype(np.float32)
+        return idf * np.float32(K1 + 1) * tf / (tf + np.float32(K1) * (1 - B + B * lengths / np.float32(avg_length)))
+
+    def _main_postings(self, term_id):
+        if term_id < len(self._offsets) - 1:
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            return self._post_docs[start:end], self._post_score[start:end]
+        return self._post_docs[:0], self._post_score[:0]
+
+    def _delta_postings(self, term_id):
+        delta = self._delta.get(term_id)
+        if not delta:
+            return None
+        cached = self._delta_arrays.get(term_id)
+        if cached is None or len(cached[0]) != len(delta[0]):
+            docs = np.asarray(delta[0], dtype=np.int32)
+            cached = self._delta_arrays[term_id] = (
+                docs, self._bm25(self._df[term_id], np.asarray(delta[1]), self._lengths[docs])
+            )
+        return cached
+
+    def _segments(self, term_id):
+        """``[(docs, scores), ...]`` of one term: main segment, then delta, each sorted by doc"""
+        segments = []
+        main = self._main_postings(term_id)
+        if len(main[0]):
+            segments.append(main)
+        delta = self._delta_postings(term_id)
+        if delta is not None:
+            segments.append(delta)
+        return segments
+
+    def _score_token(self, matched):
+        """(docs, scores) of every document matching one query token"""
+        parts = [(weight, docs, scores) for term_id, weight in matched for docs, scores in self._segments(term_id)]
+        if not parts:
+            return self._post_docs[:0], self._post_score[:0]
+        docs = np.concatenate([docs for _, docs, _ in parts])
+        scores = np.concatenate([scores * np.float32(weight) for weight, _, scores in parts])
+        if len(matched) == 1:
+            # Delta documents are numbered after every main one, so this is sorted
+            return docs, scores
+        if len(docs) > len(self._ids) * DENSE_FRACTION:
+            dense = np.bincount(docs, scores, minlength=len(self._ids))
+            hits = np.zeros(len(self._ids), dtype=bool)
+            hits[docs] = True
+            docs = np.flatnonzero(hits)
+            return docs, dense[docs].astype(np.float32)
+        docs, inverse = np.unique(docs, return_inverse=True)
+        return docs, np.bincount(inverse, scores, minlength=len(docs)).astype(np.float32)
+
+    def _lookup(self, term_id, docs):
+        """(positions in sorted ``docs`` of the documents containing a term, their scores)"""
+        positions = []
+        found_scores = []
+        for term_docs, term_scores in self._segments(term_id):
+            # Only the candidates within this segment's range of documents
+            lo, hi = np.searchsorted(docs, (term_docs[0], term_docs[-1] + 1))
+            candidates = docs[lo:hi]
+            if not len(candidates):
+                continue
+            if len(candidates) * DENSE_LOOKUP_RATIO > len(term_docs):
+                # Many candidates: scatter the postings instead of searching them
+                scratch = self._scratch
+                scratch[term_docs] = term_scores
+                scores = scratch[candidates]
+                scratch[term_docs] = 0
+                at = np.flatnonzero(scores)
+                scores = scores[at]
+            else:
+                found = np.minimum(np.searchsorted(term_docs, candidates), len(term_docs) - 1)
+                at = np.flatnonzero(term_docs[found] == candidates)
+                scores = term_scores[found[at]]
+            positions.append(at + lo)
+            found_scores.append(scores)
+        if len(positions) == 1:
+            return positions[0], found_scores[0]
+        if not positions:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(positions), np.concatenate(found_scores)
+
+    def _intersect(self, docs, scores, matched):
+        """Keep the candidates matching a query token, adding its scores"""
+        if len(matched) == 1:
+            term_id, weight = matched[0]
+            at, term_scores = self._lookup(term_id, docs)
+            return docs[at], scores[at] + term_scores * np.float32(weight)
+        found = np.zeros(len(docs), dtype=bool)
+        added = np.zeros(len(docs), dtype=np.float32)
+        for term_id, weight in matched:
+            at, term_scores = self._lookup(term_id, docs)
+            if len(at):
+                added[at] += term_scores * np.float32(weight)
+                found[at] = True
+        return docs[found], scores[found] + added[found]
+
+    def _score_docs(self, docs, terms):
+        """Scores of sorted ``docs`` over ``[(term id, weight), ...]``"""
+        if len(docs) > len(self._ids) * DENSE_FRACTION:
+            # Most documents: add every posting up in one dense array
+            segments = [(np.float32(weight),) + segment for term_id, weight in terms for segment in self._segments(term_id)]
+            if not segments:
+                return np.zeros(len(docs), dtype=np.float32)
+            dense = np.bincount(np.concatenate([term_docs for _, term_docs, _ in segments]),
+                                np.concatenate([term_scores * weight for weight, _, term_scores in segments]),
+                                minlength=len(self._ids))
+            return dense[docs].astype(np.float32)
+        scores = np.zeros(len(docs), dtype=np.float32)
+        for term_id, weight in terms:
+            at, term_scores = self._lookup(term_id, docs)
+            scores[at] += term_scores * np.float32(weight)
+        return scores
+
+    def _by_score_order(self, term_id):
+        """Positions of a term's main postings, best score first and newest first among ties"""
+        order = self._by_score.get(term_id)
+        if order is None:
+            scores = self._main_postings(term_id)[1]
+            order = self._by_score[term_id] = len(scores) - 1 - np.argsort(-scores[::-1], kind='stable')
+        return order
+
+    def _search_bitmaps(self, expanded, filters, wanted):
+        """(total, docs, scores) for a query of common tokens, without intersecting postings
+
+        The matching documents are the AND of every token's bitmap (the OR
+        of its terms', scattered from postings for terms without one), the
+        live bitmap and the filters'. A few thousand matches, or those of a
+        prefix, are all scored in one pass over the terms' postings and
+        ``search`` picks the best. A lone term's postings are read in score
+        order until ``wanted`` of them match. Several terms use Fagin's
+        threshold algorithm: score the matches among each term's best
+        postings, reading 4x deeper each round, until the ``wanted``-th
+        best beats any unread document; past ``TOP_K_MAX_READ`` of the
+        matches it gives up and scores them all. Delta documents are few
+        and are all scored.
+        """
+        mask = self._alive_bits.copy()
+        for field, values in filters:
+            allowed = np.zeros(len(mask), dtype=np.uint8)
+            for value in values:
+                bits = self._field_bits[field].get(self._codes[field].get(value))
+                if bits is not None:
+                    allowed |= bits
+            mask &= allowed
+        for matched in expanded:
+            token_bits = np.zeros(len(mask), dtype=np.uint8)
+            rare = []
+            for term_id, _ in matched:
+                if term_id in self._term_bits:
+                    token_bits |= self._term_bits[term_id]
+                else:
+                    rare.extend(docs for docs, _ in self._segments(term_id))
+            if rare:
+                token_bits |= bitmap_of(np.concatenate(rare), len(self._alive))
+            mask &= token_bits
+        total = int(POPCOUNT[mask].sum())
+        if not total:
+            return 0, self._post_docs[:0], self._post_score[:0]
+
+        terms = [pair for matched in expanded for pair in matched]
+        # A prefix's bound sums over all its terms, so reading in score order would rarely stop early
+        if total <= EXHAUSTIVE_MAX_DOCS or len(terms) > len(expanded):
+            return total, *self._score_mask(mask, terms)
+
+        # Delta documents are few: score them all up front
+        deltas = [delta[0] for delta in (self._delta_postings(term_id) for term_id, _ in terms) if delta is not None]
+        delta_docs = np.unique(np.concatenate(deltas)) if deltas else self._post_docs[:0]
+        delta_docs = delta_docs[bitmap_test(mask, delta_docs)]
+        delta_scores = self._score_docs(delta_docs, terms)
+
+        if len(terms) == 1:
+            # In score order, the first ``wanted`` matches are the best
+            term_docs, term_scores = self._main_postings(terms[0][0])
+            order = self._by_score_order(terms[0][0])
+            found = []
+            read, depth = 0, TOP_K_DEPTH
+            while read < len(order):
+                batch = order[read:depth]
+                found.append(batch[bitmap_test(mask, term_docs[batch])])
+                if sum(len(positions) for positions in found) >= wanted:
+                    break
+                read, depth = depth, depth * 4
+            positions = np.concatenate(found)[:wanted]
+            return (total, np.concatenate((delta_docs, term_docs[positions])),
+                    np.concatenate((delta_scores, term_scores[positions] * np.float32(terms[0][1]))))
+
+        lists = [(np.float32(weight),) + self._main_postings(term_id) + (self._by_score_order(term_id),)
+                 for term_id, weight in terms]
+        depth = TOP_K_DEPTH
+        while depth * len(lists) <= total * TOP_K_MAX_READ:
+            batch = np.unique(np.concatenate([term_docs[order[:depth]] for _, term_docs, _, order in lists]))
+            batch = batch[bitmap_test(mask, batch)]
+            docs = np.concatenate((delta_docs, batch))
+            scores = np.concatenate((delta_scores, self._score_docs(batch, terms)))
+            # No unread posting of a term scores more than its last one read;
+            # strictly above it, so an unread tie can't be newer
+            threshold = sum(float(weight * term_scores[order[depth - 1]])
+                            for weight, _, term_scores, order in lists if depth < len(order))
+            if len(docs) >= wanted and np.partition(scores, len(scores) - wanted)[len(scores) - wanted] > threshold:
+                return total, docs, scores
+            depth *= 4
+        return total, *self._score_mask(mask, terms)
+
+    def _score_mask(self, mask, terms):
+        """(docs, scores) of every document set in ``mask``"""
+        docs = np.flatnonzero(np.unpackbits(mask, bitorder='little').view(bool))
+        return docs, self._score_docs(docs, terms)
+
+    def search(self, query, severity=None, status=None, limit=20, offset=0, prefix=False):
+        """Incidents matching ``query``, best first
+
+        ``severity`` and ``status`` take a value, a comma-separated list
+        or a list. ``prefix`` matches the last word as a prefix even when it
+        is a whole term (search as you type). Returns ``{'total': matches, 'hits': [(incident id,
+        score), ...]}`` for the ``limit`` hits after ``offset``.
+        """
+        self.ensure_built()
+        empty = {'total': 0, 'hits': []}
+        tokens = parse_query(query, prefix)
+        if not tokens:
+            return empty
+        filters = []
+        for field, values in (('severity', severity), ('status', status)):
+            if values:
+                filters.append((field, values.split(',') if isinstance(values, str) else list(values)))
+
+        with self._lock, span('search.query'):
+            if not self._live:
+                return empty
+            expanded = [self._expand(token, prefix) for token, prefix in tokens]
+            if not all(expanded):
+                return empty
+
+            # Start from the token with the fewest postings
+            sizes = [sum(int(self._df[term_id]) for term_id, _ in matched) for matched in expanded]
+            expanded = [matched for _, matched in sorted(zip(sizes, expanded), key=lambda pair: pair[0])]
+            if min(sizes) >= max(BITMAP_MIN_DOCS, self._live * BITMAP_QUERY_FRACTION):
+                total, docs, scores = self._search_bitmaps(expanded, filters, offset + limit)
+            else:
+                docs, scores = self._score_token(expanded[0])
+
+                keep = self._alive[docs] if self._live < len(self._ids) else None
+                for field, values in filters:
+                    allowed = np.zeros(256, dtype=bool)
+                    allowed[[self._codes[field][value] for value in values if value in self._codes[field]]] = True
+                    matches = allowed[self._fields[field][docs]]
+                    keep = matches if keep is None else keep & matches
+                if keep is not None:
+                    docs, scores = docs[keep], scores[keep]
+
+                for matched in expanded[1:]:
+                    if not len(docs):
+                        break
+                    docs, scores = self._intersect(docs, scores, matched)
+                total = len(docs)
+
+            end = min(offset + limit, len(docs))
+            if offset >= end:
+                return {'total': total, 'hits': []}
+            # Best score first, ties to the newer document, so pages never overlap.
+            # Scores are non-negative, and such float32s order like their bits
+            scores = scores.astype(np.float32, copy=False)
+            key = (scores.view(np.int32).astype(np.int64) << 32) | docs.astype(np.int64)
+            top = np.argpartition(-key, end - 1)[:end] if end < len(docs) else np.arange(len(docs))
+            top = top[np.argsort(-key[top])][offset:end]
+            return {
+                'total': total,
+                'hits': [(self._ids[doc], round(float(score), 4))
+                         for doc, score in zip(docs[top].tolist(), scores[top].tolist())]
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': self._live,
+                'terms': len(self._terms),
+                'postings': len(self._post_docs) + sum(len(docs) for docs, _ in self._delta.values()),
+                'delta_documents': len(self._ids) - self._main_docs,
+                'bitmaps': len(self._term_bits),
+            }
+
+
+_search_index = None
+_search_lock = threading.Lock()
+
+
+def get_search_index(storage):
+    """Get the process-wide search index, subscribed to storage writes"""
+    global _search_index
+    with _search_lock:
+        if _search_index is None:
+            _search_index = SearchIndex(storage)
+            storage.add_listener(_search_index.on_change)
+        return _search_index
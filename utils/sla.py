@@ -0,0 +1,279 @@
+import heapq
+import threading
+import time
+from datetime import datetime
+
+from utils.data_models import IncidentRecord, to_epoch_us, from_epoch_us
+from utils.priority import IndexedHeap
+from utils.profiling import span
+
+HOUR_US = 3600 * 1000000
+# How long an incident may stay in each open status, by severity (hours)
+SLA_HOURS = {
+    'reported': {'critical': 24, 'major': 72, 'moderate': 168, 'minor': 336},
+    'in-progress': {'critical': 72, 'major': 168, 'moderate': 336, 'minor': 720},
+}
+DEFAULT_SEVERITY = 'moderate'
+# Level n is reached after n SLA windows in the same status: 1 breached, 2 escalated
+LEVELS = {1: 'breached', 2: 'escalated'}
+MAX_LEVEL = max(LEVELS)
+# At most this many incidents are escalated by one storage write
+MAX_BATCH = 5000
+# The scanner sleeps until the next deadline, but never longer than this (seconds)
+SCAN_INTERVAL = 60.0
+
+
+def now_us():
+    delta = datetime.utcnow() - datetime(1970, 1, 1)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def parse_us(value):
+    """ISO timestamp to epoch microseconds, tolerating ones to_epoch_us won't round-trip"""
+    exact = to_epoch_us(value)
+    if exact is not None or not value:
+        return exact
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        return None
+    return to_epoch_us(moment.isoformat())
+
+
+def window_us(incident):
+    """The SLA window of an incident's current status, or None if it has none"""
+    hours = SLA_HOURS.get(incident.get('status'))
+    if hours is None:
+        return None
+    return hours.get(incident.get('severity'), hours[DEFAULT_SEVERITY]) * HOUR_US
+
+
+def entered_us(incident):
+    """When the incident entered its current status
+
+    ``status_changed_at`` is stamped by storage; older incidents fall back
+    to their creation time while still reported, and to their last update
+    otherwise.
+    """
+    value = incident.get('status_changed_at')
+    if not value and incident.get('status') != 'reported':
+        value = incident.get('updated_at')
+    entered = parse_us(value) if value else None
+    if entered is None:
+        entered = getattr(incident, 'created_us', None) or parse_us(incident.get('created_at'))
+    return entered
+
+
+def current_level(incident):
+    try:
+        return int(incident.get('sla_level') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class SLAMonitor:
+    """Flags open incidents that stay in one status longer than their SLA
+
+    Each open incident below ``MAX_LEVEL`` sits in an ``IndexedHeap`` keyed
+    on its next deadline (status entry time plus one more SLA window), kept
+    current from storage writes, so a scan reads only the incidents that
+    are due instead of the whole store. Due incidents get ``sla_level``
+    (and, on the first breach, ``sla_breached_at``) in one batched
+    ``update_incidents`` call; that write re-keys them for the next level.
+    Levels are absolute, so two processes scanning at once write the same
+    values rather than escalating twice.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        # Max-heap on the negated deadline: the top is the earliest due
+        self.heap = IndexedHeap()
+        self._incidents = {}
+        self._breached = set()
+        self._lock = threading.RLock()
+        self._built = False
+        self.last_scan = None
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def ensure_built(self):
+        # Fold in writes from other worker processes first
+        self.storage.sync()
+        with self._lock:
+            if not self._built:
+                self.rebuild(self.storage.get_incident_records({'open': True, 'archived': False}))
+
+    def rebuild(self, incidents):
+        with self._lock, span('sla.rebuild'):
+            self._incidents = {}
+            self._breached = set()
+            ids, keys = [], []
+            for incident in incidents:
+                deadline = self._track(incident)
+                if deadline is not None:
+                    ids.append(incident['id'])
+                    keys.append(-deadline)
+            self.heap.build(ids, keys)
+            self._built = True
+
+    def _track(self, incident):
+        """Remember an incident; returns its next deadline, or None if it has none"""
+        incident_id = incident.get('id')
+        window = window_us(incident)
+        if not incident_id or window is None:
+            return None
+        entered = entered_us(incident)
+        if entered is None:
+            return None
+        self._incidents[incident_id] = incident
+        level = current_level(incident)
+        if level:
+            self._breached.add(incident_id)
+        if level >= MAX_LEVEL:
+            return None
+        return entered + (level + 1) * window
+
+    def _forget(self, incident_id):
+        self._incidents.pop(incident_id, None)
+        self._breached.discard(incident_id)
+        self.heap.remove(incident_id)
+
+    def on_change(self, event, incident_id, incident, previous=None):
+        """Storage listener: re-key one written incident"""
+        with self._lock:
+            if event == 'reset':
+                self._built = False
+            if not self._built:
+                return
+            self._forget(incident_id)
+            if event in ('create', 'update') and incident is not None:
+                deadline = self._track(IncidentRecord.from_dict(incident))
+                if deadline is not None:
+                    self.heap.set(incident_id, -deadline)
+                    # An earlier deadline than the scanner is sleeping towards
+                    self._wakeup.set()
+
+    def next_due_us(self):
+        with self._lock:
+            for key, _ in self.heap.top(1):
+                return -key
+        return None
+
+    def scan(self, at_us=None):
+        """Escalate every incident past its next deadline; returns the ids escalated"""
+        self.ensure_built()
+        at = at_us if at_us is not None else now_us()
+        started = time.perf_counter()
+        with span('sla.scan'):
+            updates = {}
+            with self._lock:
+                for key, incident_id in self.heap.top(MAX_BATCH):
+                    if -key > at:
+                        break
+                    incident = self._incidents[incident_id]
+                    window = window_us(incident)
+                    entered = entered_us(incident)
+                    level = min(MAX_LEVEL, int((at - entered) // window))
+                    if level <= current_level(incident):
+                        continue
+                    change = {'sla_level': level}
+                    if not incident.get('sla_breached_at'):
+                        change['sla_breached_at'] = from_epoch_us(entered + window)
+                    if not incident.get('status_changed_at'):
+                        # Pin the entry time used, since this write moves updated_at
+                        change['status_changed_at'] = from_epoch_us(entered)
+                    updates[incident_id] = change
+            escalated = self.storage.update_incidents(updates) if updates else []
+        self.last_scan = {
+            'at': from_epoch_us(at),
+            'escalated': len(escalated),
+            'seconds': round(time.perf_counter() - started, 4)
+        }
+        return escalated
+
+    def breaches(self, limit=10, at_us=None):
+        """Open incidents past their SLA, highest level and longest overdue first"""
+        self.ensure_built()
+        at = at_us if at_us is not None else now_us()
+        with self._lock:
+            def overdue(incident_id):
+                incident = self._incidents[incident_id]
+                return current_level(incident), at - entered_us(incident) - window_us(incident)
+
+            breaches = []
+            for incident_id in heapq.nlargest(limit, self._breached, key=overdue):
+                incident = self._incidents[incident_id]
+                level, late = overdue(incident_id)
+                breaches.append({
+                    'id': incident_id,
+                    'location': incident.get('location'),
+                    'severity': incident.get('severity'),
+                    'status': incident.get('status'),
+                    'assigned_to': incident.get('assigned_to'),
+                    'sla_level': level,
+                    'sla_state': LEVELS[min(level, MAX_LEVEL)],
+                    'sla_hours': window_us(incident) // HOUR_US,
+                    'overdue_hours': round(late / HOUR_US, 1)
+                })
+            return breaches
+
+    def stats(self):
+        self.ensure_built()
+        with self._lock:
+            levels = [current_level(self._incidents[i]) for i in self._breached]
+            next_due = self.next_due_us()
+            return {
+                'tracked': len(self._incidents),
+                'breached': len(levels),
+                'escalated': sum(1 for level in levels if level >= MAX_LEVEL),
+                'next_due_at': from_epoch_us(next_due) if next_due is not None else None,
+                'last_scan': self.last_scan
+            }
+
+    # Background scanner
+
+    def start(self):
+        """Start the background scanner if it is not already running"""
+        with self._worker_lock:
+            if self._worker and self._worker.is_alive():
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='sla-scanner', daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._worker:
+            self._worker.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.scan()
+                next_due = self.next_due_us()
+            except Exception as e:
+                print(f"SLA scan failed: {e}")
+                next_due = None
+            delay = SCAN_INTERVAL
+            if next_due is not None:
+                delay = min(delay, max(0.0, (next_due - now_us()) / 1e6))
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+
+_sla_monitor = None
+_sla_lock = threading.Lock()
+
+
+def get_sla_monitor(storage):
+    """Get the process-wide SLA monitor, subscribed to storage writes"""
+    global _sla_monitor
+    with _sla_lock:
+        if _sla_monitor is None:
+            _sla_monitor = SLAMonitor(storage)
+            storage.add_listener(_sla_monitor.on_change)
+        return _sla_monitor
@@ -0,0 +1,492 @@
+import os
+import json
+import mmap
+import time
+import struct
+import hashlib
+import threading
+
+import numpy as np
+
+from utils.serializers import loads_any
+from utils.data_models import to_epoch_us
+from utils.locations import normalize_location
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b'PHSNAP2\0'
+ALIGN = 8
+# Marks rows whose created_at is missing or not a plain ISO timestamp
+NO_TIMESTAMP = np.iinfo(np.int64).min
+# Shortest gap between two rebuilds started by one process
+MIN_REBUILD_INTERVAL = 1.0
+CATEGORIES = ('severity', 'status', 'priority', 'assigned_to', 'partition')
+
+
+def id_hash(incident_id):
+    return int.from_bytes(hashlib.blake2b(str(incident_id).encode(), digest_size=8).digest(), 'little')
+
+
+def _offsets(chunks):
+    offsets = np.zeros(len(chunks) + 1, dtype=np.uint64)
+    np.cumsum(np.fromiter((len(chunk) for chunk in chunks), dtype=np.uint64, count=len(chunks)), out=offsets[1:])
+    return offsets
+
+
+def _string_table(values):
+    """UTF-8 blob of ``values`` plus n+1 offsets into it"""
+    encoded = [value.encode() for value in values]
+    return _offsets(encoded), b''.join(encoded)
+
+
+def fresh_segment(partition, incidents, serializer):
+    """Columns and byte tables for ``incidents`` read from one partition file"""
+    n = len(incidents)
+    values = {name: [] for name in CATEGORIES}
+    created = np.full(n, NO_TIMESTAMP, dtype=np.int64)
+    latitude = np.full(n, np.nan)
+    longitude = np.full(n, np.nan)
+    ids, locations, blobs = [], [], []
+
+    for row, incident in enumerate(incidents):
+        for name in CATEGORIES:
+            values[name].append(partition if name == 'partition' else incident.get(name))
+        created_us = to_epoch_us(incident.get('created_at'))
+        if created_us is not None:
+            created[row] = created_us
+        if incident.get('latitude') is not None and incident.get('longitude') is not None:
+            latitude[row] = incident['latitude']
+            longitude[row] = incident['longitude']
+        ids.append(str(incident.get('id')))
+        locations.append(normalize_location(incident.get('location')) + '\n')
+        blobs.append(serializer.dumps(incident))
+
+    return {
+        'count': n,
+        'values': values,
+        'created_us': created,
+        'latitude': latitude,
+        'longitude': longitude,
+        'hashes': np.fromiter((id_hash(incident_id) for incident_id in ids), dtype=np.uint64, count=n),
+        'ids': _string_table(ids),
+        'locations': _string_table(locations),
+        'blobs': (_offsets(blobs), b''.join(blobs)),
+    }
+
+
+def _join_tables(tables):
+    """Merge ``(offsets, bytes)`` string tables into one offsets array and the buffers to write"""
+    offsets = [np.zeros(1, dtype=np.uint64)]
+    buffers = []
+    total = 0
+    for table_offsets, data in tables:
+        offsets.append(table_offsets[1:].astype(np.uint64) + np.uint64(total))
+        buffers.append(data)
+        total += len(data)
+    return np.concatenate(offsets), buffers
+
+
+def write_snapshot(path, version, segments, categories=None, partitions=None):
+    """Write row segments as a snapshot file, atomically
+
+    Segments come from ``fresh_segment`` or ``Snapshot.segment``; rows
+    copied from an older snapshot keep their category codes, so its
+    ``categories`` tables are extended rather than rebuilt. ``partitions``
+    records the file stamp each partition was read at.
+
+    Layout: magic, a length-prefixed JSON header (version, row count,
+    category tables, partition stamps and section offsets), then 8-byte
+    aligned sections: fixed-width columns, an id hash index, a normalized
+    location table for substring search and each incident's serialized
+    bytes.
+    """
+    codes = {name: {value: code for code, value in enumerate((categories or {}).get(name, []))} for name in CATEGORIES}
+    columns = {name: [np.empty(0, dtype=np.uint32)] for name in CATEGORIES}
+    for segment in segments:
+        for name in CATEGORIES:
+            if 'codes' in segment:
+                columns[name].append(segment['codes'][name])
+            else:
+                table = codes[name]
+                columns[name].append(np.fromiter(
+                    (table.setdefault(value, len(table)) for value in segment['values'][name]),
+                    dtype=np.uint32, count=segment['count']
+                ))
+
+    def concatenated(name, dtype):
+        return np.concatenate([np.empty(0, dtype=dtype)] + [segment[name] for segment in segments]).astype(dtype, copy=False)
+
+    n = sum(segment['count'] for segment in segments)
+    hashes = concatenated('hashes', np.uint64)
+    order = np.argsort(hashes, kind='stable')
+    id_offsets, id_bytes = _join_tables(segment['ids'] for segment in segments)
+    location_offsets, location_bytes = _join_tables(segment['locations'] for segment in segments)
+    blob_offsets, blob_bytes = _join_tables(segment['blobs'] for segment in segments)
+
+    sections = [
+        ('created_us', concatenated('created_us', np.int64)),
+        ('latitude', concatenated('latitude', np.float64)),
+        ('longitude', concatenated('longitude', np.float64)),
+        *((name, np.concatenate(columns[name])) for name in CATEGORIES),
+        ('hash_sorted', hashes[order]), ('hash_rows', order.astype(np.uint32)),
+        ('id_offsets', id_offsets), ('id_bytes', id_bytes),
+        ('location_offsets', location_offsets), ('location_bytes', location_bytes),
+        ('blob_offsets', blob_offsets), ('blob_bytes', blob_bytes),
+    ]
+    layout = {}
+    offset = 0
+    for name, data in sections:
+        size = data.nbytes if isinstance(data, np.ndarray) else sum(len(chunk) for chunk in data)
+        dtype = data.dtype.str if isinstance(data, np.ndarray) else None
+        layout[name] = [offset, size, dtype]
+        offset += size + (-size % ALIGN)
+
+    header = json.dumps({
+        'version': version,
+        'count': n,
+        'categories': {name: list(table) for name, table in codes.items()},
+        'partitions': partitions or {},
+        'sections': layout,
+        'built_at': time.time()
+    }, default=str).encode()
+    prefix = len(MAGIC) + 4 + len(header)
+    prefix += -prefix % ALIGN
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        f.write(b'\0' * (prefix - f.tell()))
+        for name, data in sections:
+            chunks = [data.tobytes()] if isinstance(data, np.ndarray) else data
+            size = 0
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+            f.write(b'\0' * (-size % ALIGN))
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """One mapped snapshot file; arrays are views straight onto the page cache"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not an incident snapshot')
+        header_len = struct.unpack_from('<I', self._map, len(MAGIC))[0]
+        start = len(MAGIC) + 4
+        header = json.loads(self._map[start:start + header_len])
+        base = start + header_len
+        base += -base % ALIGN
+
+        self.version = header['version']
+        self.count = header['count']
+        self.categories = header['categories']
+        # partition -> [inode, mtime_ns, size] of the file its rows were read from
+        self.partitions = header.get('partitions', {})
+        self._ranges = None
+        self._row_hashes = None
+        self.sections = {}
+        for name, (offset, size, dtype) in header['sections'].items():
+            if dtype:
+                self.sections[name] = np.frombuffer(self._map, dtype=np.dtype(dtype), count=size // np.dtype(dtype).itemsize, offset=base + offset)
+            else:
+                self.sections[name] = (base + offset, size)
+
+    def column(self, name):
+        return self.sections[name]
+
+    def code(self, category, value):
+        """Code of ``value`` in a category column, or None if no row has it"""
+        try:
+            return self.categories[category].index(value)
+        except ValueError:
+            return None
+
+    def codes(self, category, values):
+        return [code for code in (self.code(category, value) for value in values) if code is not None]
+
+    def _bytes(self, section, offsets, row):
+        start, _ = self.sections[section]
+        return self._map[start + int(offsets[row]):start + int(offsets[row + 1])]
+
+    def incident(self, row):
+        return loads_any(self._bytes('blob_bytes', self.sections['blob_offsets'], row))
+
+    def incident_id(self, row):
+        return self._bytes('id_bytes', self.sections['id_offsets'], row).decode()
+
+    def location(self, row):
+        """The normalized location of one row"""
+        return self._bytes('location_bytes', self.sections['location_offsets'], row).decode().rstrip('\n')
+
+    def find(self, incident_id):
+        """Row of ``incident_id``, or None"""
+        hashes = self.sections['hash_sorted']
+        key = np.uint64(id_hash(incident_id))
+        index = int(np.searchsorted(hashes, key))
+        while index < len(hashes) and hashes[index] == key:
+            row = int(self.sections['hash_rows'][index])
+            if self.incident_id(row) == str(incident_id):
+                return row
+            index += 1
+        return None
+
+    def partition_range(self, partition):
+        """``(start, stop)`` of a partition's rows, or None unless they are one contiguous run"""
+        if self._ranges is None:
+            column = self.sections['partition']
+            starts = np.flatnonzero(np.diff(column)) + 1 if len(column) else np.empty(0, dtype=np.int64)
+            bounds = [0, *starts.tolist(), len(column)]
+            ranges = {}
+            for start, stop in zip(bounds, bounds[1:]):
+                code = int(column[start])
+                # A partition split over several runs can't be copied as one
+                ranges[code] = None if code in ranges else (start, stop)
+            self._ranges = ranges
+        code = self.code('partition', partition)
+        return self._ranges.get(code) if code is not None else None
+
+    def segment(self, start, stop):
+        """Rows ``start:stop`` as a write_snapshot segment, copied without decoding"""
+        if self._row_hashes is None:
+            self._row_hashes = np.empty(self.count, dtype=np.uint64)
+            self._row_hashes[self.sections['hash_rows']] = self.sections['hash_sorted']
+        return {
+            'count': stop - start,
+            'codes': {name: self.sections[name][start:stop] for name in CATEGORIES},
+            'created_us': self.sections['created_us'][start:stop],
+            'latitude': self.sections['latitude'][start:stop],
+            'longitude': self.sections['longitude'][start:stop],
+            'hashes': self._row_hashes[start:stop],
+            'ids': self._table('id_offsets', 'id_bytes', start, stop),
+            'locations': self._table('location_offsets', 'location_bytes', start, stop),
+            'blobs': self._table('blob_offsets', 'blob_bytes', start, stop),
+        }
+
+    def _table(self, offsets_section, bytes_section, start, stop):
+        offsets = self.sections[offsets_section][start:stop + 1]
+        base, _ = self.sections[bytes_section]
+        first, last = int(offsets[0]), int(offsets[-1])
+        return offsets - offsets[0], memoryview(self._map)[base + first:base + last]
+
+    def location_rows(self, needle):
+        """Boolean mask of rows whose normalized location contains ``needle``"""
+        mask = np.zeros(self.count, dtype=bool)
+        start, size = self.sections['location_bytes']
+        offsets = self.sections['location_offsets']
+        needle = needle.encode()
+        position = self._map.find(needle, start, start + size)
+        while position != -1:
+            row = int(np.searchsorted(offsets, position - start, side='right')) - 1
+            mask[row] = True
+            # Skip to the next row; one hit per row is enough
+            position = self._map.find(needle, start + int(offsets[row + 1]), start + size)
+        return mask
+
+
+class SnapshotStore:
+    """Read-only columnar snapshot of all incidents, shared by every worker
+
+    ``data/incidents/snapshot.bin`` is rebuilt in the background whenever
+    the store version (see ChangeFeed) moves past the one it was built at,
+    and swapped in with an atomic rename. Each process maps it read-only,
+    so N workers share one copy in the OS page cache instead of each
+    parsing the store. While it is stale, callers fall back to the
+    partition files.
+
+    A rebuild only reads the partitions whose files changed since the
+    current snapshot: rows of the others, the archive included, are
+    copied across from the mapped file as they are.
+    """
+
+    def __init__(self, storage, filename='snapshot.bin'):
+        self.storage = storage
+        self.path = os.path.join(storage.data_dir, 'incidents', filename)
+        self.lock_path = f'{self.path}.lock'
+        self.snapshot = None
+        self._lock = threading.Lock()
+        self._builder = None
+        self._last_build = 0.0
+        self.last_build = None
+
+    def current(self):
+        """The mapped snapshot if it matches the store version, else None (and a rebuild is scheduled)"""
+        version = self.storage.version()
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        snapshot = self._remap()
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        self._schedule_build()
+        return None
+
+    def build(self):
+        """Rebuild the snapshot file now, unless another process is already doing it"""
+        lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False
+            started = time.perf_counter()
+            version = self.storage.version()
+            on_disk = self._remap()
+            if on_disk is not None and on_disk.version == version:
+                return True
+            segments = []
+            stamps = {}
+            reused = 0
+            for partition in self.storage.select_partitions():
+                # Stamped before reading: a file replaced in between is re-read next time
+                stamp = self._stamp(partition)
+                if stamp is None:
+                    continue
+                stamps[partition] = stamp
+                rows = on_disk.partition_range(partition) if on_disk is not None and on_disk.partitions.get(partition) == stamp else None
+                if rows is not None:
+                    segments.append(on_disk.segment(*rows))
+                    reused += 1
+                else:
+                    incidents = list(self.storage.load_partition(partition).values())
+                    segments.append(fresh_segment(partition, incidents, self.storage.serializer))
+            # A write that finished meanwhile makes this build stale; the next read schedules another
+            write_snapshot(self.path, version, segments, on_disk.categories if on_disk is not None else None, stamps)
+            self.last_build = {
+                'partitions': len(stamps),
+                'reused': reused,
+                'seconds': round(time.perf_counter() - started, 3)
+            }
+            self._remap()
+            return True
+        finally:
+            os.close(lock_fd)
+
+    def _stamp(self, partition):
+        try:
+            stat = os.stat(os.path.join(self.storage.data_dir, 'incidents', f'{partition}.json'))
+        except FileNotFoundError:
+            return None
+        return [stat.st_ino, stat.st_mtime_ns, stat.st_size]
+
+    def _remap(self):
+        with self._lock:
+            try:
+                inode = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                return None
+            if self.snapshot is not None and self.snapshot.inode == inode:
+                return self.snapshot
+            try:
+                snapshot = Snapshot(self.path)
+            except (OSError, ValueError) as e:
+                print(f"Snapshot load failed: {e}")
+                return None
+            # The old mapping is unmapped once queries still using it let go
+            self.snapshot = snapshot
+            return snapshot
+
+    def _schedule_build(self):
+        with self._lock:
+            if self._builder is not None and self._builder.is_alive():
+                return
+            delay = max(0.0, self._last_build + MIN_REBUILD_INTERVAL - time.monotonic())
+            self._builder = threading.Timer(delay, self._run_build)
+            self._builder.daemon = True
+            self._builder.start()
+
+    def _run_build(self):
+        self._last_build = time.monotonic()
+        try:
+            self.build()
+        except Exception as e:
+            print(f"Snapshot build failed: {e}")
+
+    # Queries
+
+    def get(self, snapshot, incident_id):
+        row = snapshot.find(incident_id)
+        return snapshot.incident(row) if row is not None else None
+
+    def query(self, snapshot, filters, archive_partition):
+        """Incident dicts matching ``filters``, decoding only the matching rows
+
+        Returns None when a filter can't be answered from the columns, so
+        the caller can fall back to the partition files.
+        """
+        n = snapshot.count
+        mask = np.ones(n, dtype=bool)
+        filters = filters or {}
+
+        for name in ('severity', 'status'):
+            values = self.storage._as_set(filters.get(name))
+            if values is not None:
+                mask &= np.isin(snapshot.column(name), snapshot.codes(name, values))
+        if filters.get('open'):
+            resolved = snapshot.code('status', 'resolved')
+            if resolved is not None:
+                mask &= snapshot.column('status') != resolved
+        if 'assigned_to' in filters:
+            code = snapshot.code('assigned_to', filters['assigned_to'])
+            if code is None:
+                return []
+            mask &= snapshot.column('assigned_to') == code
+        archived = filters.get('archived')
+        archive_code = snapshot.code('partition', archive_partition)
+        if archive_code is not None and (archived is False or filters.get('open')):
+            mask &= snapshot.column('partition') != archive_code
+        if archived is True:
+            if archive_code is None:
+                return []
+            mask &= snapshot.column('partition') == archive_code
+        if filters.get('location'):
+            needle = normalize_location(filters['location'])
+            if needle:
+                mask &= snapshot.location_rows(needle)
+
+        since = self.storage._as_iso(filters.get('since'))
+        until = self.storage._as_iso(filters.get('until'))
+        if since or until:
+            since_us = self.storage._as_epoch_us(since)
+            until_us = self.storage._as_epoch_us(until)
+            if (since and since_us is None) or (until and until_us is None):
+                return None
+            created = snapshot.column('created_us')
+            timed = created != NO_TIMESTAMP
+            in_range = timed.copy()
+            if since:
+                in_range &= created >= since_us
+            if until:
+                in_range &= created <= until_us
+            # Rows without a plain timestamp are compared as strings, as before
+            odd = np.flatnonzero(mask & ~timed)
+            mask &= in_range
+            for row in odd:
+                created_at = str(snapshot.incident(row).get('created_at') or '')
+                if (not since or created_at >= since) and (not until or created_at <= until):
+                    mask[row] = True
+
+        return [snapshot.incident(row) for row in np.flatnonzero(mask)]
+
+    def recent(self, snapshot, limit, archive_partition, undated_partition):
+        created = snapshot.column('created_us')
+        eligible = np.ones(snapshot.count, dtype=bool)
+        for partition in (archive_partition, undated_partition):
+            code = snapshot.code('partition', partition)
+            if code is not None:
+                eligible &= snapshot.column('partition') != code
+        rows = np.flatnonzero(eligible)
+        if limit <= 0:
+            return []
+        if len(rows) > limit:
+            rows = rows[np.argpartition(created[rows], len(rows) - limit)[len(rows) - limit:]]
+        # Newest first; rows without a timestamp sort last
+        rows = rows[np.argsort(created[rows], kind='stable')[::-1]]
+        return [snapshot.incident(row) for row in rows]
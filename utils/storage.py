@@ -1,95 +1,860 @@
 import os
-import json
-from datetime import datetime
+import time
+import threading
+from datetime import datetime, timedelta
 import uuid
 
+from utils.serializers import get_serializer, loads_any
+from utils.data_models import IncidentRecord, to_epoch_us
+from utils.coherence import ChangeFeed
+from utils.comments import CommentStore, COMMENTS_PER_PAGE
+from utils.locations import normalize_location
+from utils.metrics import (record_storage, LOAD_JSON_CALLS, SAVE_JSON_CALLS, BYTES_READ,
+                           BYTES_WRITTEN, PARSE_SECONDS)
+from utils.profiling import span
+from utils import audit
+
+# Resolved incidents older than this move to the cold archive partition
+ARCHIVE_AFTER_DAYS = int(os.environ.get('INCIDENT_ARCHIVE_DAYS', 90))
+ARCHIVE_CHECK_INTERVAL = timedelta(hours=1)
+ARCHIVE_PARTITION = 'archive'
+UNDATED_PARTITION = 'undated'
+# SLA escalation marks (see utils/sla.py) belong to one stay in a status
+# and are cleared when the status changes
+SLA_FIELDS = ('sla_level', 'sla_breached_at')
+# Serve reads from the shared mmap'd snapshot (utils/snapshot.py) when it's current
+SNAPSHOT_ENABLED = os.environ.get('INCIDENT_SNAPSHOT', '1') != '0'
+
+class IncidentIndex:
+    """Append-only ``id -> partition`` log with an incrementally read cache
+
+    Creates and moves append one line; deletes append a tombstone. Readers
+    only parse bytes appended since their last look, so lookups stay cheap
+    even when other processes are writing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lines = 0
+        self._offset = 0
+        self._inode = None
+        self._lock = threading.Lock()
+
+    def get(self, incident_id):
+        self.refresh()
+        return self._entries.get(incident_id)
+
+    def items(self):
+        self.refresh()
+        return list(self._entries.items())
+
+    def append(self, changes):
+        """Record ``{incident_id: partition or None}``"""
+        if not changes:
+            return
+        lines = ''.join(f'{incident_id}\t{partition or "-"}\n' for incident_id, partition in changes.items())
+        with open(self.path, 'a') as f:
+            f.write(lines)
+        self.refresh()
+
+    def rewrite(self, entries):
+        """Replace the log with a compacted copy"""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.writelines(f'{incident_id}\t{partition}\n' for incident_id, partition in entries.items())
+        os.replace(tmp_path, self.path)
+        self.refresh()
+
+    def compact(self, min_garbage=10000):
+        """Rewrite the log once superseded lines outnumber live ones"""
+        self.refresh()
+        if self._lines - len(self._entries) > max(min_garbage, len(self._entries)):
+            self.rewrite(dict(self._entries))
+
+    def refresh(self):
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._entries, self._lines, self._offset, self._inode = {}, 0, 0, None
+                return
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                # Compacted (replaced) since we last read it
+                self._entries, self._lines, self._offset, self._inode = {}, 0, 0, stat.st_ino
+            if stat.st_size == self._offset:
+                return
+            with open(self.path, 'r') as f:
+                f.seek(self._offset)
+                data = f.read()
+            # Ignore a trailing partial line from a concurrent append
+            end = data.rfind('\n') + 1
+            for line in data[:end].splitlines():
+                self._lines += 1
+                incident_id, _, partition = line.partition('\t')
+                if partition == '-':
+                    self._entries.pop(incident_id, None)
+                elif incident_id:
+                    self._entries[incident_id] = partition
+            self._offset += len(data[:end].encode())
+
 class StorageManager:
-    """Handles data storage operations"""
-    
-    def __init__(self):
+    """Handles data storage operations
+
+    Incidents are partitioned by creation month into
+    ``data/incidents/YYYY-MM.json``; resolved incidents older than
+    ``ARCHIVE_AFTER_DAYS`` move to ``data/incidents/archive.json``. A small
+    manifest keeps per-partition counts so filtered queries only open the
+    partitions that can match.
+    """
+
+    # Callbacks run after every incident write, shared by all instances:
+    # callback(event, incident_id, incident, previous) with event in
+    # 'create', 'update', 'delete', 'archive'. Writes made by other worker processes
+    # are replayed to them by sync(); 'reset' (with no incident) means
+    # some were missed and derived state should be rebuilt from disk.
+    _listeners = []
+    # One change feed (writer lock, version counter) and snapshot per data directory per process
+    _feeds = {}
+    _snapshots = {}
+    _comment_stores = {}
+    _feeds_lock = threading.Lock()
+    # Parsed partitions as compact records, shared by all instances and keyed
+    # by the file's (inode, mtime, size) so writes from anywhere are noticed
+    _record_cache = {}
+
+    @classmethod
+    def add_listener(cls, callback):
+        """Register a callback for incident writes"""
+        if callback not in cls._listeners:
+            cls._listeners.append(callback)
+
+    @classmethod
+    def remove_listener(cls, callback):
+        """Unregister a write callback"""
+        if callback in cls._listeners:
+            cls._listeners.remove(callback)
+
+    def _notify(self, event, incident_id, incident, previous=None):
+        for callback in list(self._listeners):
+            try:
+                callback(event, incident_id, incident, previous)
+            except Exception as e:
+                print(f"Storage listener failed: {e}")
+
+    @property
+    def _write_lock(self):
+        """Serializes writers across threads and worker processes; reads never take it"""
+        return self.feed.lock
+
+    def version(self):
+        """Store-wide write counter, shared by every process using this data directory"""
+        return self.feed.version()
+
+    def sync(self):
+        """Replay incident writes made by other processes to this process's listeners
+
+        Costs one shared-memory read when nothing changed, so caches call
+        it before every read.
+        """
+        entries = self.feed.poll()
+        if entries is None:
+            self._notify('reset', None, None, None)
+            return
+        for entry in entries:
+            self._notify(entry['event'], entry['id'], entry['incident'], entry['previous'])
+
+    @property
+    def snapshots(self):
+        """The shared SnapshotStore for this data directory, created on first use"""
+        store = self._snapshots.get(self._incidents_dir)
+        if store is None:
+            # Imported here so numpy only loads once reads start
+            from utils.snapshot import SnapshotStore
+            with self._feeds_lock:
+                store = self._snapshots.get(self._incidents_dir)
+                if store is None:
+                    store = self._snapshots[self._incidents_dir] = SnapshotStore(self)
+        return store
+
+    @property
+    def comments(self):
+        """The CommentStore for this data directory, shared by every instance"""
+        store = self._comment_stores.get(self._incidents_dir)
+        if store is None:
+            with self._feeds_lock:
+                store = self._comment_stores.get(self._incidents_dir)
+                if store is None:
+                    store = self._comment_stores[self._incidents_dir] = CommentStore(
+                        os.path.join(self.data_dir, 'comments'))
+        return store
+
+    def __init__(self, serializer=None):
         self.data_dir = 'data'
+        # Files keep their .json names whatever the format; readers detect it
+        self.serializer = serializer or get_serializer()
+        # Off once the storage.archive job (utils/jobs.py) archives on a schedule instead
+        self.archive_on_write = True
         self.ensure_data_directory()
-    
+        self.index = IncidentIndex(os.path.join(self.data_dir, 'incidents', 'index.log'))
+        self._incidents_dir = os.path.abspath(os.path.join(self.data_dir, 'incidents'))
+        with self._feeds_lock:
+            if self._incidents_dir not in self._feeds:
+                self._feeds[self._incidents_dir] = ChangeFeed(self._incidents_dir)
+            self.feed = self._feeds[self._incidents_dir]
+        self.migrate_legacy_store()
+        self.migrate_format()
+        self.migrate_comments()
+
     def ensure_data_directory(self):
         """Ensure data directory exists"""
         os.makedirs(self.data_dir, exist_ok=True)
-        
+
         # Create subdirectories
         subdirs = ['incidents', 'reports', 'uploads', 'exports']
         for subdir in subdirs:
             os.makedirs(os.path.join(self.data_dir, subdir), exist_ok=True)
-    
+
     def save_json(self, filename, data):
         """Save data to JSON file"""
         filepath = os.path.join(self.data_dir, filename)
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2, default=str)
-    
+        # Write-then-rename so concurrent readers never see a half-written file
+        tmp_path = f'{filepath}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with span('storage.save'):
+            raw = self.serializer.dumps(data)
+            with open(tmp_path, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_path, filepath)
+        record_storage(SAVE_JSON_CALLS)
+        record_storage(BYTES_WRITTEN, len(raw))
+
     def load_json(self, filename, default=None):
         """Load data from JSON file"""
         filepath = os.path.join(self.data_dir, filename)
         if not os.path.exists(filepath):
             return default or {}
-        
+
         try:
-            with open(filepath, 'r') as f:
-                return json.load(f)
+            with span('storage.load'):
+                with open(filepath, 'rb') as f:
+                    raw = f.read()
+                started = time.perf_counter()
+                data = loads_any(raw)
+            record_storage(PARSE_SECONDS, time.perf_counter() - started)
+            record_storage(LOAD_JSON_CALLS)
+            record_storage(BYTES_READ, len(raw))
+            return data
         except:
             return default or {}
-    
+
+    # Partitions
+
+    @staticmethod
+    def partition_for(incident):
+        """Month partition key for an incident, from its creation time"""
+        created_at = str(incident.get('created_at') or '')
+        if len(created_at) >= 7 and created_at[4] == '-':
+            return created_at[:7]
+        return UNDATED_PARTITION
+
+    def load_partition(self, partition):
+        return self.load_json(f'incidents/{partition}.json', {})
+
+    def partition_records(self, partition):
+        """Cached ``{id: IncidentRecord}`` for a partition, re-read only when the file changes"""
+        filepath = os.path.join(self.data_dir, 'incidents', f'{partition}.json')
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            return {}
+        key = (self.data_dir, partition)
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached = self._record_cache.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        records = {}
+        incidents = self.load_partition(partition)
+        with span('storage.records'):
+            for incident_id, incident in incidents.items():
+                record = IncidentRecord.from_dict(incident)
+                # Key by the record's own id string so it isn't stored twice
+                records[record.id if record.id == incident_id else incident_id] = record
+        self._record_cache[key] = (stamp, records)
+        return records
+
+    def save_partition(self, partition, incidents, manifest):
+        """Write one partition and refresh its manifest entry"""
+        self._record_cache.pop((self.data_dir, partition), None)
+        if incidents:
+            self.save_json(f'incidents/{partition}.json', incidents)
+            manifest['partitions'][partition] = self._partition_stats(incidents)
+        else:
+            filepath = os.path.join(self.data_dir, 'incidents', f'{partition}.json')
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            manifest['partitions'].pop(partition, None)
+
+    def load_manifest(self):
+        manifest = self.load_json('incidents/manifest.json', {})
+        manifest.setdefault('partitions', {})
+        return manifest
+
+    def save_manifest(self, manifest):
+        self.save_json('incidents/manifest.json', manifest)
+
+    def _partition_stats(self, incidents):
+        stats = {'count': len(incidents), 'status': {}, 'severity': {}, 'unassigned': 0,
+                 'min_created': None, 'max_created': None}
+        for incident in incidents.values():
+            status = incident.get('status') or 'unknown'
+            severity = incident.get('severity') or 'unknown'
+            stats['status'][status] = stats['status'].get(status, 0) + 1
+            stats['severity'][severity] = stats['severity'].get(severity, 0) + 1
+            if not incident.get('assigned_to'):
+                stats['unassigned'] += 1
+            created_at = str(incident.get('created_at') or '')
+            if created_at:
+                if stats['min_created'] is None or created_at < stats['min_created']:
+                    stats['min_created'] = created_at
+                if stats['max_created'] is None or created_at > stats['max_created']:
+                    stats['max_created'] = created_at
+        return stats
+
+    def migrate_legacy_store(self):
+        """Split a pre-partitioning data/incidents.json into month partitions"""
+        legacy_path = os.path.join(self.data_dir, 'incidents.json')
+        if not os.path.exists(legacy_path):
+            return
+        with self._write_lock:
+            if not os.path.exists(legacy_path):
+                return
+            incidents = self.load_json('incidents.json', {})
+            manifest = self.load_manifest()
+            grouped = {}
+            for incident_id, incident in incidents.items():
+                grouped.setdefault(self.partition_for(incident), {})[incident_id] = incident
+            changes = {}
+            for partition, members in grouped.items():
+                existing = self.load_partition(partition)
+                existing.update(members)
+                self.save_partition(partition, existing, manifest)
+                changes.update({incident_id: partition for incident_id in members})
+            self.index.append(changes)
+            self.save_manifest(manifest)
+            os.replace(legacy_path, f'{legacy_path}.migrated')
+            self.feed.publish([
+                ('create', incident_id, incidents[incident_id], None) for incident_id in changes
+            ])
+
+    def migrate_format(self):
+        """Rewrite incident partitions written in another storage format
+
+        Reads work regardless of format, so this is only about getting the
+        hot files onto the faster one; other files convert on their next save.
+        """
+        manifest = self.load_manifest()
+        if manifest.get('format') == self.serializer.name:
+            return
+        with self._write_lock:
+            manifest = self.load_manifest()
+            if manifest.get('format') == self.serializer.name:
+                return
+            for partition in list(manifest['partitions']):
+                self.save_partition(partition, self.load_partition(partition), manifest)
+            manifest['format'] = self.serializer.name
+            self.save_manifest(manifest)
+
+    def migrate_comments(self):
+        """Move comment lists embedded in incidents into the comment store, once"""
+        manifest = self.load_manifest()
+        if manifest.get('comments_migrated'):
+            return
+        with self._write_lock:
+            manifest = self.load_manifest()
+            if manifest.get('comments_migrated'):
+                return
+            moved = 0
+            for partition in list(manifest['partitions']):
+                incidents = self.load_partition(partition)
+                if not any('comments' in incident for incident in incidents.values()):
+                    continue
+                moved += len(self._extract_comments(incidents.values()))
+                self.save_partition(partition, incidents, manifest)
+            manifest['comments_migrated'] = True
+            self.save_manifest(manifest)
+            if moved:
+                self.feed.publish([('reset', None, None, None)])
+        if moved:
+            self._notify('reset', None, None)
+
+    def _extract_comments(self, incidents):
+        """Move ``comments`` lists out of incident dicts into the comment store
+
+        Each incident keeps a ``comment_count`` instead; comments already
+        stored for it are replaced. Hold the write lock.
+        """
+        extracted = {}
+        for incident in incidents:
+            if 'comments' in incident:
+                comments = incident.pop('comments') or []
+                incident['comment_count'] = len(comments)
+                extracted[incident['id']] = [dict(comment) for comment in comments if isinstance(comment, dict)]
+        if extracted:
+            self.comments.delete(extracted)
+            self.comments.append({incident_id: comments for incident_id, comments in extracted.items() if comments})
+        return extracted
+
+    def select_partitions(self, filters=None, manifest=None):
+        """Partitions that can contain incidents matching ``filters``"""
+        manifest = manifest or self.load_manifest()
+        filters = filters or {}
+        since = self._as_iso(filters.get('since'))
+        until = self._as_iso(filters.get('until'))
+        statuses = self._as_set(filters.get('status'))
+        severities = self._as_set(filters.get('severity'))
+        archived = filters.get('archived')
+
+        selected = []
+        for partition, stats in manifest['partitions'].items():
+            if partition == ARCHIVE_PARTITION:
+                if archived is False or filters.get('open'):
+                    continue
+            elif archived is True:
+                continue
+            if since and stats.get('max_created') and stats['max_created'] < since:
+                continue
+            if until and stats.get('min_created') and stats['min_created'] > until:
+                continue
+            if statuses is not None and not any(stats['status'].get(s) for s in statuses):
+                continue
+            if severities is not None and not any(stats['severity'].get(s) for s in severities):
+                continue
+            if filters.get('open') and stats['count'] == stats['status'].get('resolved', 0):
+                continue
+            selected.append(partition)
+
+        # Newest first, with the archive last
+        return sorted(selected, key=lambda p: (p != ARCHIVE_PARTITION, p), reverse=True)
+
+    @staticmethod
+    def _as_set(value):
+        if value is None or value == '':
+            return None
+        if isinstance(value, (list, tuple, set)):
+            return set(value)
+        return {value}
+
+    @staticmethod
+    def _as_epoch_us(value):
+        if not value:
+            return None
+        exact = to_epoch_us(value)
+        if exact is not None:
+            return exact
+        try:
+            moment = datetime.fromisoformat(value).replace(tzinfo=None)
+        except ValueError:
+            return None
+        return to_epoch_us(moment.isoformat())
+
+    @staticmethod
+    def _as_iso(value):
+        if not value:
+            return None
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return str(value)
+
+    # Incidents
+
     def save_incident(self, incident_data):
         """Save incident data"""
-        incidents = self.load_json('incidents.json', {})
         incident_id = str(uuid.uuid4())
         incident_data['id'] = incident_id
         incident_data['created_at'] = datetime.utcnow().isoformat()
-        incidents[incident_id] = incident_data
-        self.save_json('incidents.json', incidents)
+        incident_data['status_changed_at'] = incident_data['created_at']
+        partition = self.partition_for(incident_data)
+
+        with self._write_lock:
+            self.sync()
+            manifest = self.load_manifest()
+            incidents = self.load_partition(partition)
+            incidents[incident_id] = incident_data
+            self.save_partition(partition, incidents, manifest)
+            self.index.append({incident_id: partition})
+            self.save_manifest(manifest)
+            self.feed.publish([('create', incident_id, incident_data, None)])
+
+        self._notify('create', incident_id, incident_data)
+        audit.record_incident_changes([('create', incident_id, incident_data, None)])
+        if self.archive_on_write:
+            self.maybe_archive()
         return incident_id
-    
+
+    def save_incidents(self, incidents_data):
+        """Save several new incidents with a single write per partition"""
+        created_at = datetime.utcnow().isoformat()
+        grouped = {}
+        incident_ids = []
+        for incident_data in incidents_data:
+            incident_id = str(uuid.uuid4())
+            incident_data['id'] = incident_id
+            incident_data['created_at'] = created_at
+            incident_data['status_changed_at'] = created_at
+            grouped.setdefault(self.partition_for(incident_data), {})[incident_id] = incident_data
+            incident_ids.append(incident_id)
+        if not incident_ids:
+            return incident_ids
+
+        with self._write_lock:
+            self.sync()
+            manifest = self.load_manifest()
+            changes = {}
+            for partition, members in grouped.items():
+                incidents = self.load_partition(partition)
+                incidents.update(members)
+                self.save_partition(partition, incidents, manifest)
+                changes.update({incident_id: partition for incident_id in members})
+            self.index.append(changes)
+            self.save_manifest(manifest)
+            self.feed.publish([
+                ('create', incident_id, incident_data, None)
+                for members in grouped.values()
+                for incident_id, incident_data in members.items()
+            ])
+
+        for members in grouped.values():
+            for incident_id, incident_data in members.items():
+                self._notify('create', incident_id, incident_data)
+        audit.record_incident_changes([
+            ('create', incident_id, incident_data, None)
+            for members in grouped.values()
+            for incident_id, incident_data in members.items()
+        ])
+        return incident_ids
+
+    def import_incidents(self, incidents_data):
+        """Bulk-load incidents as they are, keeping their ids and timestamps
+
+        Meant for restores and seeding; caches everywhere are told to
+        rebuild rather than being sent one event per incident.
+        """
+        grouped = {}
+        for incident_data in incidents_data:
+            incident_data.setdefault('id', str(uuid.uuid4()))
+            grouped.setdefault(self.partition_for(incident_data), {})[incident_data['id']] = incident_data
+
+        with self._write_lock:
+            self.sync()
+            for members in grouped.values():
+                self._extract_comments(members.values())
+            manifest = self.load_manifest()
+            changes = {}
+            for partition, members in grouped.items():
+                incidents = self.load_partition(partition)
+                incidents.update(members)
+                self.save_partition(partition, incidents, manifest)
+                changes.update({incident_id: partition for incident_id in members})
+            self.index.append(changes)
+            self.save_manifest(manifest)
+            self.feed.publish([('reset', None, None, None)])
+
+        self._notify('reset', None, None)
+        count = sum(len(members) for members in grouped.values())
+        audit.record('incident.import', details=f'Imported {count} incidents')
+        return count
+
     def get_incidents(self, filters=None):
-        """Get incidents with optional filters"""
-        incidents = self.load_json('incidents.json', {})
-        
+        """Get incidents with optional filters
+
+        Besides ``severity``, ``status`` and ``location``, filters accept
+        ``since``/``until`` (on ``created_at``), ``open`` (not resolved),
+        ``assigned_to`` and ``archived`` (True for only the archive, False
+        to skip it). Partitions that cannot match are never opened.
+        """
+        snapshot = self.current_snapshot()
+        if snapshot is not None:
+            with span('storage.snapshot_query'):
+                incidents = self.snapshots.query(snapshot, filters, ARCHIVE_PARTITION)
+            if incidents is not None:
+                return incidents
+        records = self.get_incident_records(filters)
+        with span('storage.to_dict'):
+            return [record.to_dict() for record in records]
+
+    def current_snapshot(self):
+        """The shared read-only snapshot if it is up to date, else None"""
+        if not SNAPSHOT_ENABLED:
+            return None
+        return self.snapshots.current()
+
+    def get_incident_records(self, filters=None):
+        """Like get_incidents, but returns the cached read-only IncidentRecords
+
+        Matching is done on the records, so only the results of
+        get_incidents are ever turned back into dicts.
+        """
+        filters = filters or {}
+        records = []
+        for partition in self.select_partitions(filters):
+            records.extend(self.partition_records(partition).values())
+
         if not filters:
-            return list(incidents.values())
-        
+            return records
+
         filtered = []
-        for incident in incidents.values():
-            match = True
-            
-            if filters.get('severity') and incident.get('severity') != filters['severity']:
-                match = False
-            if filters.get('status') and incident.get('status') != filters['status']:
-                match = False
-            if filters.get('location') and filters['location'].lower() not in incident.get('location', '').lower():
-                match = False
-            
-            if match:
-                filtered.append(incident)
-        
+        statuses = self._as_set(filters.get('status'))
+        severities = self._as_set(filters.get('severity'))
+        since = self._as_iso(filters.get('since'))
+        until = self._as_iso(filters.get('until'))
+        since_us = self._as_epoch_us(since)
+        until_us = self._as_epoch_us(until)
+        # Compare epoch ints unless a bound couldn't be parsed
+        by_epoch = (not since or since_us is not None) and (not until or until_us is not None)
+        # Compared normalized, so "Main St" finds "main street"
+        location = normalize_location(filters['location']) if filters.get('location') else None
+        with span('storage.filter'):
+            for record in records:
+                match = True
+
+                if severities is not None and record.severity not in severities:
+                    match = False
+                if statuses is not None and record.status not in statuses:
+                    match = False
+                if location and location not in normalize_location(record.location):
+                    match = False
+                if filters.get('open') and record.status == 'resolved':
+                    match = False
+                if 'assigned_to' in filters and record.assigned_to != filters['assigned_to']:
+                    match = False
+                if since or until:
+                    created_us = record.created_us
+                    if by_epoch and created_us is not None:
+                        if since and created_us < since_us:
+                            match = False
+                        if until and created_us > until_us:
+                            match = False
+                    else:
+                        created_at = str(record.created_at or '')
+                        if since and created_at < since:
+                            match = False
+                        if until and created_at > until:
+                            match = False
+
+                if match:
+                    filtered.append(record)
+
         return filtered
-    
+
+    def get_incident_counts(self):
+        """Incident totals by status and severity, read from the manifest only"""
+        counts = {'total': 0, 'status': {}, 'severity': {}, 'unassigned': 0}
+        for stats in self.load_manifest()['partitions'].values():
+            counts['total'] += stats['count']
+            counts['unassigned'] += stats.get('unassigned', 0)
+            for key in ('status', 'severity'):
+                for value, count in stats[key].items():
+                    counts[key][value] = counts[key].get(value, 0) + count
+        return counts
+
+    def get_recent_incidents(self, limit=10):
+        """Newest incidents, opening partitions newest-first until ``limit`` are found"""
+        snapshot = self.current_snapshot()
+        if snapshot is not None:
+            with span('storage.snapshot_query'):
+                return self.snapshots.recent(snapshot, limit, ARCHIVE_PARTITION, UNDATED_PARTITION)
+        records = []
+        for partition in self.select_partitions({'archived': False}):
+            if partition == UNDATED_PARTITION:
+                continue
+            records.extend(self.partition_records(partition).values())
+            if len(records) >= limit:
+                break
+        with span('storage.sort'):
+            records.sort(key=lambda record: record.created_us or 0, reverse=True)
+        return [record.to_dict() for record in records[:limit]]
+
     def get_incident(self, incident_id):
         """Get single incident by ID"""
-        incidents = self.load_json('incidents.json', {})
-        return incidents.get(incident_id)
-    
+        snapshot = self.current_snapshot()
+        if snapshot is not None:
+            return self.snapshots.get(snapshot, incident_id)
+        partition = self.index.get(incident_id)
+        if not partition:
+            return None
+        record = self.partition_records(partition).get(incident_id)
+        return record.to_dict() if record else None
+
     def update_incident(self, incident_id, updates):
         """Update incident data"""
-        incidents = self.load_json('incidents.json', {})
-        if incident_id in incidents:
-            incidents[incident_id].update(updates)
-            incidents[incident_id]['updated_at'] = datetime.utcnow().isoformat()
-            self.save_json('incidents.json', incidents)
-            return True
-        return False
-    
+        return bool(self.update_incidents({incident_id: updates}))
+
+    def update_incidents(self, updates_by_id):
+        """Apply updates to several incidents with a single write per partition"""
+        updated_at = datetime.utcnow().isoformat()
+        updated = []
+        previous = {}
+        changed = {}
+
+        with self._write_lock:
+            self.sync()
+            manifest = self.load_manifest()
+            partitions = {}
+            moves = {}
+            for incident_id, updates in updates_by_id.items():
+                partition = self.index.get(incident_id)
+                if not partition:
+                    continue
+                if partition not in partitions:
+                    partitions[partition] = self.load_partition(partition)
+                incidents = partitions[partition]
+                if incident_id not in incidents:
+                    continue
+                previous[incident_id] = dict(incidents[incident_id])
+                incidents[incident_id].update(updates)
+                incidents[incident_id]['updated_at'] = updated_at
+                # A new status starts a new SLA clock
+                if 'status' in updates and updates['status'] != previous[incident_id].get('status'):
+                    incidents[incident_id]['status_changed_at'] = updated_at
+                    for field in SLA_FIELDS:
+                        incidents[incident_id].pop(field, None)
+                changed[incident_id] = incidents[incident_id]
+                updated.append(incident_id)
+
+                # Reopened archive entries go back to their month partition
+                if partition == ARCHIVE_PARTITION and incidents[incident_id].get('status') != 'resolved':
+                    target = self.partition_for(incidents[incident_id])
+                    if target not in partitions:
+                        partitions[target] = self.load_partition(target)
+                    partitions[target][incident_id] = incidents.pop(incident_id)
+                    moves[incident_id] = target
+
+            if updated:
+                for partition, incidents in partitions.items():
+                    self.save_partition(partition, incidents, manifest)
+                self.index.append(moves)
+                self.save_manifest(manifest)
+                self.feed.publish([
+                    ('update', incident_id, changed[incident_id], previous[incident_id])
+                    for incident_id in updated
+                ])
+
+        for incident_id in updated:
+            self._notify('update', incident_id, changed[incident_id], previous[incident_id])
+        audit.record_incident_changes([
+            ('update', incident_id, changed[incident_id], previous[incident_id])
+            for incident_id in updated
+        ])
+        return updated
+
+    def get_comments(self, incident_id, page=1, per_page=COMMENTS_PER_PAGE, newest_first=False):
+        """One page of an incident's comments (see CommentStore.page)"""
+        return self.comments.page(incident_id, page, per_page, newest_first)
+
+    def add_comment(self, incident_id, comment):
+        """Append a comment to an incident and bump its ``comment_count``
+
+        The comment is one appended line; the other comments are never
+        rewritten. The count goes through ``update_incidents``, so the
+        incident's partition is rewritten as for any update, which is
+        what tells search, audit and the other workers about it. Returns
+        the stored comment (with its ``id``), or None if the incident
+        doesn't exist.
+        """
+        comment = dict(comment)
+        comment.setdefault('created_at', datetime.utcnow().isoformat())
+        with self._write_lock:
+            self.sync()
+            if not self.index.get(incident_id):
+                return None
+            count = self.comments.append({incident_id: [comment]})[incident_id]
+            self.update_incidents({incident_id: {'comment_count': count}})
+        return comment
+
     def delete_incident(self, incident_id):
         """Delete incident"""
-        incidents = self.load_json('incidents.json', {})
-        if incident_id in incidents:
-            del incidents[incident_id]
-            self.save_json('incidents.json', incidents)
-            return True
-        return False
+        with self._write_lock:
+            self.sync()
+            partition = self.index.get(incident_id)
+            if not partition:
+                return False
+            incidents = self.load_partition(partition)
+            if incident_id not in incidents:
+                return False
+            previous = incidents.pop(incident_id)
+            manifest = self.load_manifest()
+            self.save_partition(partition, incidents, manifest)
+            self.index.append({incident_id: None})
+            self.save_manifest(manifest)
+            self.comments.delete([incident_id])
+            self.feed.publish([('delete', incident_id, None, previous)])
+
+        self._notify('delete', incident_id, None, previous)
+        audit.record_incident_changes([('delete', incident_id, None, previous)])
+        return True
+
+    # Archival
+
+    def maybe_archive(self):
+        """Run archive_resolved if it hasn't run within ARCHIVE_CHECK_INTERVAL"""
+        manifest = self.load_manifest()
+        last_run = manifest.get('archived_at')
+        if last_run and datetime.fromisoformat(last_run) > datetime.utcnow() - ARCHIVE_CHECK_INTERVAL:
+            return 0
+        return self.archive_resolved()
+
+    def archive_resolved(self, older_than_days=None):
+        """Move resolved incidents not touched for ``older_than_days`` into the archive"""
+        days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+        cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+        moved = {}
+
+        with self._write_lock:
+            self.sync()
+            manifest = self.load_manifest()
+            archive = None
+            for partition, stats in list(manifest['partitions'].items()):
+                if partition == ARCHIVE_PARTITION or not stats['status'].get('resolved'):
+                    continue
+                incidents = self.load_partition(partition)
+                stale = [
+                    incident_id for incident_id, incident in incidents.items()
+                    if incident.get('status') == 'resolved'
+                    and str(incident.get('updated_at') or incident.get('created_at') or '') < cutoff
+                ]
+                if not stale:
+                    continue
+                if archive is None:
+                    archive = self.load_partition(ARCHIVE_PARTITION)
+                for incident_id in stale:
+                    archive[incident_id] = incidents.pop(incident_id)
+                    moved[incident_id] = ARCHIVE_PARTITION
+                self.save_partition(partition, incidents, manifest)
+
+            if archive is not None:
+                self.save_partition(ARCHIVE_PARTITION, archive, manifest)
+                self.index.append(moved)
+            self.index.compact()
+            manifest['archived_at'] = datetime.utcnow().isoformat()
+            self.save_manifest(manifest)
+            self.feed.publish([('archive', incident_id, None, None) for incident_id in moved])
+
+        for incident_id in moved:
+            self._notify('archive', incident_id, None)
+        if moved:
+            audit.record('incident.archive', details=f'Archived {len(moved)} resolved incidents', actor=audit.SYSTEM)
+        return len(moved)
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """The process-wide StorageManager shared by every blueprint, created on first use"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = StorageManager()
+    return _storage
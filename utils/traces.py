@@ -0,0 +1,258 @@
+import io
+import time
+
+import numpy as np
+
+from utils.data_models import Incident
+from utils.geo import GridIndex, has_coordinates
+
+# CSV columns: seconds since epoch, acceleration (g) on three axes, GPS fix.
+# lat/lng are empty on rows without a fix (GPS usually logs at 1 Hz).
+TRACE_COLUMNS = ['timestamp', 'ax', 'ay', 'az', 'lat', 'lng']
+READ_BLOCK_BYTES = 4 * 1024 * 1024
+SEVERITY_THRESHOLDS_G = [0.8, 1.2, 1.8]
+SEVERITY_ORDER = ['minor', 'moderate', 'major', 'critical']
+
+
+class TraceError(Exception):
+    """Raised when a trace file cannot be parsed"""
+    pass
+
+
+def iter_trace_chunks(stream, block_bytes=READ_BLOCK_BYTES):
+    """Yield (N, 6) float arrays from a CSV byte stream, one block at a time
+
+    Only one block plus a partial line is held in memory. Empty GPS
+    fields are rewritten to ``nan`` so NumPy's C parser can take the
+    block in one call.
+    """
+    carry = b''
+    header_checked = False
+    while True:
+        block = stream.read(block_bytes)
+        if not block:
+            break
+        block = carry + block
+        cut = block.rfind(b'\n')
+        if cut == -1:
+            carry = block
+            continue
+        carry = block[cut + 1:]
+        block = block[:cut + 1]
+
+        if not header_checked:
+            header_checked = True
+            first_line_end = block.find(b'\n')
+            if not block[:1].isdigit():
+                block = block[first_line_end + 1:]
+
+        chunk = _parse_block(block)
+        if chunk is not None:
+            yield chunk
+
+    if carry.strip():
+        chunk = _parse_block(carry + b'\n')
+        if chunk is not None:
+            yield chunk
+
+
+def _parse_block(block):
+    block = block.replace(b'\r', b'')
+    # Twice, because bytes.replace doesn't see overlapping ",,," runs
+    block = block.replace(b',,', b',nan,').replace(b',,', b',nan,').replace(b',\n', b',nan\n')
+    if not block.strip():
+        return None
+    try:
+        data = np.loadtxt(io.BytesIO(block), delimiter=',', ndmin=2, dtype=np.float64)
+    except ValueError as e:
+        raise TraceError(f'Malformed trace data: {e}')
+    if data.shape[1] != len(TRACE_COLUMNS):
+        raise TraceError(f'Expected columns {",".join(TRACE_COLUMNS)}')
+    return data
+
+
+class ImpactDetector:
+    """Streaming pothole impact detector over vertical acceleration
+
+    Gravity and slow body roll are removed with a moving-average high-pass
+    filter; impacts are local maxima of the residual above ``threshold_g``,
+    thinned so that at most one is reported per ``refractory_s`` window.
+    State carried between chunks is a fixed-size tail, so memory stays
+    bounded regardless of trace length.
+    """
+
+    def __init__(self, sample_rate=100.0, window_s=1.0, threshold_g=0.5, refractory_s=0.5):
+        self.window = max(int(sample_rate * window_s), 1)
+        self.threshold_g = threshold_g
+        self.refractory_s = refractory_s
+        self._tail = np.empty((0, len(TRACE_COLUMNS)))
+        self._last_fix = None
+        self._last_event_t = -np.inf
+        self.rows = 0
+        self.first_t = None
+        self.last_t = None
+
+    def process(self, chunk):
+        """Return an (M, 4) array of [t, lat, lng, peak_g] for impacts in ``chunk``"""
+        self.rows += len(chunk)
+        if self.first_t is None and len(chunk):
+            self.first_t = float(chunk[0, 0])
+        if len(chunk):
+            self.last_t = float(chunk[-1, 0])
+
+        data = np.concatenate([self._tail, chunk]) if len(self._tail) else chunk
+        new_start = len(self._tail)
+        self._tail = data[-(self.window + 1):]
+        if len(data) < 3:
+            return np.empty((0, 4))
+
+        t = data[:, 0]
+        az = data[:, 3]
+
+        # Moving average via cumulative sum; the tail gives the filter history
+        csum = np.cumsum(np.insert(az, 0, 0.0))
+        counts = np.minimum(np.arange(1, len(az) + 1), self.window)
+        baseline = (csum[1:] - csum[np.maximum(np.arange(1, len(az) + 1) - self.window, 0)]) / counts
+        residual = np.abs(az - baseline)
+
+        # Local maxima above threshold, only in rows not examined before
+        is_peak = np.zeros(len(residual), dtype=bool)
+        is_peak[1:-1] = (
+            (residual[1:-1] >= residual[:-2]) &
+            (residual[1:-1] > residual[2:]) &
+            (residual[1:-1] >= self.threshold_g)
+        )
+        # The last row can't be judged until the next chunk arrives
+        is_peak[:max(new_start - 1, 0)] = False
+        candidates = np.flatnonzero(is_peak)
+        candidates = candidates[t[candidates] > self._last_event_t + self.refractory_s]
+
+        gps = self._gps_fixes(data)
+        if len(candidates) == 0:
+            return np.empty((0, 4))
+
+        # Keep the strongest peak of each burst closer together than the refractory window
+        times = t[candidates]
+        group_starts = np.flatnonzero(np.diff(times, prepend=-np.inf) > self.refractory_s)
+        group_ids = np.repeat(np.arange(len(group_starts)), np.diff(np.append(group_starts, len(times))))
+        order = np.lexsort((-residual[candidates], group_ids))
+        first_of_group = np.flatnonzero(np.diff(group_ids[order], prepend=-1) != 0)
+        picked = candidates[order[first_of_group]]
+
+        self._last_event_t = float(t[picked[-1]])
+
+        if gps is None:
+            lat = lng = np.full(len(picked), np.nan)
+        else:
+            # Map-match by interpolating the GPS track at the impact time
+            lat = np.interp(t[picked], gps[:, 0], gps[:, 1])
+            lng = np.interp(t[picked], gps[:, 0], gps[:, 2])
+
+        return np.column_stack([t[picked], lat, lng, residual[picked]])
+
+    def _gps_fixes(self, data):
+        fixes = data[np.isfinite(data[:, 4]) & np.isfinite(data[:, 5])][:, [0, 4, 5]]
+        if self._last_fix is not None:
+            fixes = np.vstack([self._last_fix, fixes])
+        if len(fixes) == 0:
+            return None
+        self._last_fix = fixes[-1:]
+        return fixes
+
+
+def severity_for_peak(peak_g):
+    return SEVERITY_ORDER[int(np.digitize(peak_g, SEVERITY_THRESHOLDS_G))]
+
+
+def cluster_events(events, radius_m=15.0):
+    """Merge impacts at the same spot (repeat passes, both axles) into clusters"""
+    index = GridIndex(cell_m=radius_m)
+    clusters = []
+    for t, lat, lng, peak in events:
+        near = index.nearby(lat, lng, radius_m)
+        if near:
+            cluster = clusters[near[0][1]]
+            cluster['hits'] += 1
+            cluster['peak_g'] = max(cluster['peak_g'], peak)
+            cluster['last_t'] = t
+            continue
+        index.insert(len(clusters), lat, lng)
+        clusters.append({'lat': lat, 'lng': lng, 'hits': 1, 'peak_g': peak, 'first_t': t, 'last_t': t})
+    return clusters
+
+
+def ingest_trace(stream, storage, vehicle_id=None, merge_radius_m=15.0, **detector_options):
+    """Detect impacts in a trace and create or merge incidents
+
+    Returns a summary dict. Incidents within ``merge_radius_m`` of an
+    impact cluster are corroborated instead of duplicated, and all
+    creations and updates go out as one batched write each.
+    """
+    started = time.perf_counter()
+    detector = ImpactDetector(**detector_options)
+    events = []
+    unlocated = 0
+    for chunk in iter_trace_chunks(stream):
+        found = detector.process(chunk)
+        located = np.isfinite(found[:, 1]) & np.isfinite(found[:, 2])
+        unlocated += int((~located).sum())
+        events.extend(map(tuple, found[located]))
+
+    clusters = cluster_events(events, merge_radius_m)
+
+    existing = GridIndex(cell_m=merge_radius_m)
+    incidents = {}
+    if clusters:
+        for incident in storage.get_incident_records({'open': True}):
+            if has_coordinates(incident):
+                existing.insert(incident['id'], incident['latitude'], incident['longitude'])
+                incidents[incident['id']] = incident
+
+    new_incidents = []
+    updates = {}
+    for cluster in clusters:
+        severity = severity_for_peak(cluster['peak_g'])
+        near = existing.nearby(cluster['lat'], cluster['lng'], merge_radius_m)
+        if near:
+            incident_id = near[0][1]
+            incident = incidents[incident_id]
+            update = updates.setdefault(incident_id, {
+                'sensor_hits': int(incident.get('sensor_hits') or 0),
+                # float(): peaks once saved from numpy scalars were stored as strings
+                'sensor_peak_g': float(incident.get('sensor_peak_g') or 0.0)
+            })
+            update['sensor_hits'] += int(cluster['hits'])
+            update['sensor_peak_g'] = round(float(max(update['sensor_peak_g'], cluster['peak_g'])), 3)
+            continue
+
+        incident = Incident(
+            location=f"Sensor detection near {cluster['lat']:.5f}, {cluster['lng']:.5f}",
+            severity=severity,
+            description=f"Detected from vehicle accelerometer data ({cluster['hits']} impact(s), peak {cluster['peak_g']:.2f} g).",
+            latitude=round(float(cluster['lat']), 6),
+            longitude=round(float(cluster['lng']), 6)
+        )
+        incident_data = incident.to_dict()
+        incident_data.update({
+            'source': 'sensor',
+            'vehicle_id': vehicle_id,
+            'sensor_hits': cluster['hits'],
+            'sensor_peak_g': round(float(cluster['peak_g']), 3)
+        })
+        new_incidents.append(incident_data)
+
+    created = storage.save_incidents(new_incidents) if new_incidents else []
+    updated = storage.update_incidents(updates) if updates else []
+
+    duration = (detector.last_t - detector.first_t) if detector.rows else 0.0
+    return {
+        'rows': detector.rows,
+        'duration_seconds': round(duration, 1),
+        'impacts': len(events),
+        'impacts_without_gps': unlocated,
+        'clusters': len(clusters),
+        'incidents_created': len(created),
+        'incidents_updated': len(updated),
+        'incident_ids': created,
+        'processing_seconds': round(time.perf_counter() - started, 3)
+    }
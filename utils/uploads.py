@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+# Chunked uploads untouched for this long are abandoned and deleted (seconds)
+PARTIAL_TTL = int(os.getenv('UPLOAD_PARTIAL_TTL', 24 * 3600))
+# begin_upload sweeps partial/ at most this often (seconds)
+SWEEP_INTERVAL = 300
+THUMBNAIL_SIZE = (320, 320)
+WEB_SIZE = (1600, 1600)
+
+# Magic bytes for the image formats we accept
+IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': ('.jpg', 'image/jpeg'),
+    b'\x89PNG\r\n\x1a\n': ('.png', 'image/png'),
+}
+
+
+class UploadError(Exception):
+    """Raised when an upload is rejected"""
+    pass
+
+
+def detect_image_type(head):
+    """Identify an image from its first bytes, returning (extension, content_type)"""
+    for signature, info in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return info
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp', 'image/webp'
+    return None
+
+
+def render_variants(original_path, thumbnail_path, web_path):
+    """Write the thumbnail and EXIF-stripped web variant of an original
+
+    Runs inside the process pool, so it only takes plain paths.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(original_path) as image:
+        # Apply the EXIF orientation before it is dropped
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        for path, size, quality in ((web_path, WEB_SIZE, 85), (thumbnail_path, THUMBNAIL_SIZE, 80)):
+            if os.path.exists(path):
+                continue
+            variant = image.copy()
+            variant.thumbnail(size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            # Saving without exif= drops GPS and camera metadata
+            variant.save(tmp_path, 'JPEG', quality=quality, optimize=True)
+            os.replace(tmp_path, path)
+
+    return thumbnail_path, web_path
+
+
+def _report_variant_failure(future):
+    if future.exception():
+        print(f"Photo variant rendering failed: {future.exception()}")
+
+
+class UploadStore:
+    """Content-addressed photo store under data/uploads
+
+    Originals are streamed to disk in chunks while being hashed, then
+    stored once per SHA-256 so identical photos share one file. The
+    thumbnail and web variants are rendered off the request path, as
+    ``photos.variants`` jobs when the job dispatcher runs (utils/jobs.py)
+    and by a local process pool otherwise.
+    """
+
+    def __init__(self, upload_dir='data/uploads', max_bytes=MAX_UPLOAD_BYTES, workers=2):
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._last_sweep = 0.0
+
+        for subdir in ('originals', 'thumbs', 'web', 'partial'):
+            os.makedirs(os.path.join(self.upload_dir, subdir), exist_ok=True)
+
+    # Single-request uploads
+
+    def save_stream(self, stream, filename=''):
+        """Stream an uploaded file to disk and return its photo record"""
+        tmp_path = os.path.join(self.upload_dir, 'partial', f'{uuid.uuid4()}.part')
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if len(head) < 16:
+                        head += chunk[:16 - len(head)]
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadError('Photo is too large.')
+                    digest.update(chunk)
+                    f.write(chunk)
+            return self._finalize(tmp_path, digest.hexdigest(), head, size, filename)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    # Chunked (resumable) uploads
+
+    def begin_upload(self, filename=''):
+        """Start a chunked upload and return its id"""
+        if time.monotonic() - self._last_sweep > SWEEP_INTERVAL:
+            self._last_sweep = time.monotonic()
+            self.sweep_partials()
+        upload_id = uuid.uuid4().hex
+        open(self._partial_path(upload_id), 'wb').close()
+        with open(self._partial_path(upload_id, '.json'), 'w') as f:
+            json.dump({'filename': filename, 'created_at': datetime.utcnow().isoformat()}, f)
+        return upload_id
+
+    def append_chunk(self, upload_id, stream, offset):
+        """Append a chunk at ``offset`` and return the new upload size"""
+        path = self._partial_path(upload_id)
+        if not os.path.exists(path):
+            raise UploadError('Unknown upload.')
+
+        # Locked so two requests resuming at the same offset can't both append
+        with self._locked(path, 'ab') as f:
+            size = os.fstat(f.fileno()).st_size
+            if offset != size:
+                raise UploadError(f'Expected offset {size}.')
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.max_bytes:
+                    self._discard(upload_id)
+                    raise UploadError('Photo is too large.')
+                f.write(chunk)
+        return size
+
+    def sweep_partials(self, max_age=PARTIAL_TTL):
+        """Delete uploads abandoned for ``max_age`` seconds; returns how many files went"""
+        directory = os.path.join(self.upload_dir, 'partial')
+        cutoff = time.time() - max_age
+        removed = 0
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+    def finish_upload(self, upload_id):
+        """Finalize a chunked upload and return its photo record"""
+        path = self._partial_path(upload_id)
+        meta_path = self._partial_path(upload_id, '.json')
+        if not os.path.exists(path):
+            raise UploadError('Unknown upload.')
+
+        try:
+            with open(meta_path, 'r') as f:
+                filename = json.load(f).get('filename', '')
+        except (OSError, ValueError):
+            filename = ''
+
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+        with self._locked(path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                size += len(chunk)
+                digest.update(chunk)
+
+        try:
+            return self._finalize(path, digest.hexdigest(), head, size, filename)
+        finally:
+            for leftover in (path, meta_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    # Lookup
+
+    def get_photo(self, sha256):
+        """Return the photo record for a stored original, or None"""
+        if len(sha256) != 64 or not all(c in '0123456789abcdef' for c in sha256):
+            return None
+        directory = os.path.join(self.upload_dir, 'originals', sha256[:2])
+        if not os.path.isdir(directory):
+            return None
+        for name in os.listdir(directory):
+            if name.startswith(sha256):
+                ext = os.path.splitext(name)[1]
+                return self._photo_record(sha256, ext, os.path.getsize(os.path.join(directory, name)))
+        return None
+
+    def original_path(self, photo):
+        """Filesystem path of a photo's original"""
+        return os.path.join(self.upload_dir, photo['original'])
+
+    # Internals
+
+    def _finalize(self, tmp_path, sha256, head, size, filename):
+        if size == 0:
+            raise UploadError('Photo is empty.')
+
+        image_type = detect_image_type(head)
+        if not image_type:
+            raise UploadError('Only JPEG, PNG and WebP photos are accepted.')
+        ext = image_type[0]
+
+        photo = self._photo_record(sha256, ext, size, filename)
+        final_path = os.path.join(self.upload_dir, photo['original'])
+        if os.path.exists(final_path):
+            # Identical photo already stored
+            photo['duplicate'] = True
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+
+        self._schedule_variants(photo)
+        return photo
+
+    def _photo_record(self, sha256, ext, size, filename=''):
+        shard = sha256[:2]
+        return {
+            'sha256': sha256,
+            'original': f'originals/{shard}/{sha256}{ext}',
+            'thumbnail': f'thumbs/{shard}/{sha256}.jpg',
+            'web': f'web/{shard}/{sha256}.jpg',
+            'size': size,
+            'filename': os.path.basename(filename or ''),
+        }
+
+    def _schedule_variants(self, photo):
+        thumbnail_path = os.path.join(self.upload_dir, photo['thumbnail'])
+        web_path = os.path.join(self.upload_dir, photo['web'])
+        if os.path.exists(thumbnail_path) and os.path.exists(web_path):
+            return None
+
+        # Durable and retried when the app's job dispatcher is running
+        from utils.jobs import get_job_scheduler
+        scheduler = get_job_scheduler()
+        if scheduler.running:
+            return scheduler.enqueue('photos.variants', {
+                'original': self.original_path(photo), 'thumbnail': thumbnail_path, 'web': web_path
+            })
+
+        executor = self._get_executor()
+        if executor is None:
+            return None
+        try:
+            future = executor.submit(render_variants, self.original_path(photo), thumbnail_path, web_path)
+        except Exception as e:
+            # A broken pool must not fail the upload itself; start a fresh one next time
+            print(f"Could not schedule photo variants: {e}")
+            with self._executor_lock:
+                self._executor = None
+            return None
+        future.add_done_callback(_report_variant_failure)
+        return future
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                try:
+                    import PIL  # noqa: F401
+                except ImportError:
+                    print("Pillow not installed; photo variants will not be generated")
+                    return None
+                # spawn avoids forking a multi-threaded server process
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    @contextmanager
+    def _locked(self, path, mode):
+        try:
+            f = open(path, mode)
+        except FileNotFoundError:
+            raise UploadError('Unknown upload.')
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield f
+        finally:
+            f.close()
+
+    def _discard(self, upload_id):
+        for suffix in ('.part', '.json'):
+            try:
+                os.remove(self._partial_path(upload_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _partial_path(self, upload_id, suffix='.part'):
+        if not upload_id.isalnum():
+            raise UploadError('Unknown upload.')
+        return os.path.join(self.upload_dir, 'partial', f'{upload_id}{suffix}')
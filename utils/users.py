@@ -0,0 +1,347 @@
+import os
+import json
+import bisect
+import threading
+from datetime import datetime
+
+from utils.coherence import WriterLock
+from utils import audit
+
+USERS_DIR = os.path.join('data', 'users')
+LEGACY_USERS_FILE = os.path.join('data', 'users.json')
+# Rewrite the log once superseded lines outnumber live users (and this many)
+COMPACT_MIN_GARBAGE = 1000
+# Refreshes reading more lines than this rebuild the sorted indexes in one go
+BULK_LOAD_LINES = 256
+# Fields never copied into audit entries
+PRIVATE_FIELDS = ('password_hash',)
+
+
+def default_admin():
+    return {
+        'id': 'admin',
+        'username': 'admin',
+        'email': 'admin@potholes.ai',
+        'password_hash': 'pbkdf2:sha256:260000$salt$hash',  # password: admin123
+        'role': 'admin',
+        'created_at': datetime.utcnow().isoformat(),
+        'is_active': True
+    }
+
+
+def search_terms(user):
+    """Lowercase strings a user can be found by, as prefixes"""
+    terms = {str(user.get(field) or '').lower() for field in ('username', 'email', 'name')}
+    terms.update(str(user.get('name') or '').lower().split())
+    # Let "smith" find "j.smith@city.gov"
+    email = str(user.get('email') or '').lower()
+    terms.update(email.split('@', 1)[0].replace('_', '.').replace('-', '.').split('.'))
+    terms.discard('')
+    return terms
+
+
+def sort_key(user):
+    return (str(user.get('username') or '').lower(), user['id'])
+
+
+class UserRepository:
+    """User accounts in an append-only log with in-memory indexes
+
+    ``data/users/users.log`` holds one JSON line per change (a full user
+    record, or a deletion), so an edit appends a line instead of
+    rewriting every account; the log is compacted once most of it is
+    superseded. Each process keeps the live users by id (O(1) lookups),
+    a sorted username order for paging, exact username/email maps for
+    login, a role map, and a sorted term list for prefix search, all
+    updated incrementally from the bytes other processes appended.
+    """
+
+    def __init__(self, directory=USERS_DIR):
+        self.directory = directory
+        self.path = os.path.join(directory, 'users.log')
+        self.lock = None
+        self._ready = False
+        self._read_lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._users = {}
+        self._order = []
+        self._logins = {}
+        self._roles = {}
+        self._terms = []
+        self._lines = 0
+        self._offset = 0
+        self._inode = None
+
+    # Loading
+
+    def _ensure_store(self):
+        """Create the log on first use, from data/users.json or with the default admin"""
+        if self._ready:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock = self.lock or WriterLock(os.path.join(self.directory, 'write.lock'))
+        if os.path.exists(self.path):
+            self._ready = True
+            return
+        with self.lock:
+            if os.path.exists(self.path):
+                self._ready = True
+                return
+            users = None
+            if os.path.exists(LEGACY_USERS_FILE):
+                try:
+                    with open(LEGACY_USERS_FILE) as f:
+                        users = list(json.load(f).values())
+                except (OSError, ValueError) as e:
+                    print(f"Legacy users file unreadable: {e}")
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                for user in users or [default_admin()]:
+                    f.write(json.dumps({'put': user}, separators=(',', ':')) + '\n')
+            os.replace(tmp_path, self.path)
+            if users is not None:
+                os.replace(LEGACY_USERS_FILE, f'{LEGACY_USERS_FILE}.migrated')
+            self._ready = True
+
+    def refresh(self):
+        """Apply lines appended to the log (by any process) since the last look"""
+        self._ensure_store()
+        with self._read_lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._reset()
+                return
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                # Compacted (replaced) since we last read it
+                self._reset()
+                self._inode = stat.st_ino
+            if stat.st_size == self._offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+            # Ignore a trailing partial line from a concurrent append
+            end = data.rfind(b'\n') + 1
+            lines = data[:end].splitlines()
+            # Many lines (a first load): sort the ordered indexes once at the end
+            bulk = len(lines) > BULK_LOAD_LINES
+            for line in lines:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    continue
+                self._lines += 1
+                if 'put' in change:
+                    self._apply_put(change['put'], ordered=not bulk)
+                elif 'delete' in change:
+                    self._apply_delete(change['delete'], ordered=not bulk)
+            if bulk:
+                self._order = sorted(sort_key(user) for user in self._users.values())
+                self._terms = sorted(
+                    (term, user_id) for user_id, user in self._users.items() for term in search_terms(user)
+                )
+            self._offset += end
+
+    def _apply_put(self, user, ordered=True):
+        self._apply_delete(user['id'], ordered)
+        self._users[user['id']] = user
+        for field in ('username', 'email'):
+            if user.get(field):
+                self._logins[str(user[field]).lower()] = user['id']
+        self._roles.setdefault(user.get('role') or '', set()).add(user['id'])
+        if ordered:
+            bisect.insort(self._order, sort_key(user))
+            for term in search_terms(user):
+                bisect.insort(self._terms, (term, user['id']))
+
+    def _apply_delete(self, user_id, ordered=True):
+        user = self._users.pop(user_id, None)
+        if user is None:
+            return
+        for field in ('username', 'email'):
+            login = str(user.get(field) or '').lower()
+            if self._logins.get(login) == user_id:
+                del self._logins[login]
+        self._roles.get(user.get('role') or '', set()).discard(user_id)
+        if ordered:
+            self._remove_sorted(self._order, sort_key(user))
+            for term in search_terms(user):
+                self._remove_sorted(self._terms, (term, user_id))
+
+    @staticmethod
+    def _remove_sorted(items, item):
+        i = bisect.bisect_left(items, item)
+        if i < len(items) and items[i] == item:
+            del items[i]
+
+    # Reads
+
+    def get(self, user_id):
+        """A copy of one user, or None"""
+        self.refresh()
+        user = self._users.get(user_id)
+        return dict(user) if user else None
+
+    def find_by_login(self, login):
+        """A copy of the user whose username or email is ``login`` (case-insensitive)"""
+        self.refresh()
+        user_id = self._logins.get(str(login or '').lower())
+        return self.get(user_id) if user_id else None
+
+    def count(self):
+        self.refresh()
+        return len(self._users)
+
+    def all(self):
+        """Every user as ``{id: user}`` (copies); prefer page() for listings"""
+        self.refresh()
+        with self._read_lock:
+            return {user_id: dict(user) for user_id, user in self._users.items()}
+
+    def search_ids(self, query=None, role=None):
+        """Ids matching a prefix ``query`` and/or ``role``, in username order"""
+        self.refresh()
+        with self._read_lock:
+            if not query:
+                ids = [user_id for _, user_id in self._order]
+                if role:
+                    members = self._roles.get(role, set())
+                    ids = [user_id for user_id in ids if user_id in members]
+                return ids
+            query = query.strip().lower()
+            matched = set()
+            i = bisect.bisect_left(self._terms, (query, ''))
+            while i < len(self._terms) and self._terms[i][0].startswith(query):
+                matched.add(self._terms[i][1])
+                i += 1
+            if role:
+                matched &= self._roles.get(role, set())
+            if len(matched) * 16 > len(self._order):
+                # Broad match: filtering the ordered list beats sorting the matches
+                return [user_id for _, user_id in self._order if user_id in matched]
+            return sorted(matched, key=lambda user_id: sort_key(self._users[user_id]))
+
+    def page(self, page=1, per_page=50, query=None, role=None):
+        """One page of users in username order, optionally filtered by search prefix and role"""
+        page = max(1, page)
+        ids = self.search_ids(query, role)
+        with self._read_lock:
+            users = [dict(self._users[user_id]) for user_id in ids[(page - 1) * per_page:page * per_page]
+                     if user_id in self._users]
+        return {
+            'users': users,
+            'page': page,
+            'per_page': per_page,
+            'total': len(ids),
+            'pages': max(1, -(-len(ids) // per_page)),
+            'roles': sorted(role for role, members in self._roles.items() if role and members)
+        }
+
+    # Writes
+
+    def _append(self, changes):
+        with open(self.path, 'a') as f:
+            f.write(''.join(json.dumps(change, separators=(',', ':')) + '\n' for change in changes))
+
+    def _check_unique(self, user):
+        for field in ('username', 'email'):
+            owner = self._logins.get(str(user.get(field) or '').lower())
+            if user.get(field) and owner and owner != user['id']:
+                raise ValueError(f'{field.title()} {user[field]} is already taken')
+
+    def create(self, user):
+        """Add a user (``id`` defaults to the username); raises ValueError on a clash"""
+        self._ensure_store()
+        user = dict(user)
+        user.setdefault('id', user.get('username'))
+        user.setdefault('created_at', datetime.utcnow().isoformat())
+        user.setdefault('is_active', True)
+        if not user.get('id'):
+            raise ValueError('Username is required')
+        with self.lock:
+            self.refresh()
+            if user['id'] in self._users:
+                raise ValueError(f"User {user['id']} already exists")
+            self._check_unique(user)
+            self._append([{'put': user}])
+            self.refresh()
+        audit.record('user.create', 'user', user['id'], f"Created {user.get('role', 'user')} {user.get('username') or user['id']}")
+        return dict(user)
+
+    def update(self, user_id, updates):
+        """Apply field updates to one user; returns the updated copy or None if missing"""
+        self._ensure_store()
+        with self.lock:
+            self.refresh()
+            current = self._users.get(user_id)
+            if current is None:
+                return None
+            user = dict(current)
+            user.update(updates)
+            user['id'] = user_id
+            if user == current:
+                return dict(current)
+            self._check_unique(user)
+            user['updated_at'] = datetime.utcnow().isoformat()
+            self._append([{'put': user}])
+            self.refresh()
+            self.compact()
+        changes = {
+            key: ['***', '***'] if key in PRIVATE_FIELDS else [current.get(key), user.get(key)]
+            for key in updates if current.get(key) != user.get(key)
+        }
+        audit.record('user.update', 'user', user_id, f"Updated {', '.join(sorted(changes))}", changes)
+        return dict(user)
+
+    def put_many(self, users):
+        """Write several full user records at once (creating or replacing)"""
+        self._ensure_store()
+        with self.lock:
+            self.refresh()
+            changed = [dict(user) for user in users if self._users.get(user['id']) != user]
+            if changed:
+                self._append([{'put': user} for user in changed])
+                self.refresh()
+                self.compact()
+        return len(changed)
+
+    def delete(self, user_id):
+        self._ensure_store()
+        with self.lock:
+            self.refresh()
+            user = self._users.get(user_id)
+            if user is None:
+                return False
+            self._append([{'delete': user_id}])
+            self.refresh()
+            self.compact()
+        audit.record('user.delete', 'user', user_id, f"Deleted {user.get('username') or user_id}")
+        return True
+
+    def compact(self):
+        """Rewrite the log with only live users once it is mostly superseded; hold the lock"""
+        if self._lines - len(self._users) <= max(COMPACT_MIN_GARBAGE, len(self._users)):
+            return False
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            for user in self._users.values():
+                f.write(json.dumps({'put': user}, separators=(',', ':')) + '\n')
+        os.replace(tmp_path, self.path)
+        self.refresh()
+        return True
+
+
+_user_repository = None
+_user_repository_lock = threading.Lock()
+
+
+def get_user_repository():
+    """Get the process-wide user repository"""
+    global _user_repository
+    with _user_repository_lock:
+        if _user_repository is None:
+            _user_repository = UserRepository()
+        return _user_repository